@@ -0,0 +1,144 @@
+'''
+Checks that audio stays in step with the video. First a simulated drive: a WavSource whose clock
+runs clock_error_ppm fast, with jittery reads and the odd overrun, is put through the recorder's
+ring, drift correction and encoder as fast as they will go, and at every period the end of the
+audio track is compared with when its last frame was really captured. Then a real time run records
+clips from the synthetic camera with the same microphone and reads them back to see where each
+clip's audio starts and ends against its video, and what the audio threads cost.
+
+    python benchmarks/audio_benchmark.py --simulate-hours 1 --clock-error-ppm 100 --seconds 30
+'''
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from dashcam.sources.synthetic_source import SyntheticSource
+from dashcam.audio.audio_recorder import AudioRecorder
+from dashcam.audio.wav_source import WavSource
+from dashcam.dashcam import Dashcam
+import tempfile
+import argparse
+import json
+import time
+import av
+
+def microphone(args, simulated: bool) -> WavSource:
+    return WavSource(args.wav, period_frames=args.period_frames, clock_error_ppm=args.clock_error_ppm,
+                     jitter=args.jitter / 1000, simulated=simulated)
+
+def simulate(args, settings: dict) -> dict:
+    source = microphone(args, simulated=True)
+    recorder = AudioRecorder(source, settings, source.clock)
+    recorder._open_encoder()
+    source.start()
+    periods = int(args.simulate_hours * 3600 * source.sample_rate / source.period_frames)
+    overrun_every = int(args.overrun_every * source.sample_rate / source.period_frames) if args.overrun_every else 0
+
+    # An overrun is put right a window or two later, until then the track is out by the lost period
+    settling = 2 * settings['drift_window']
+    drifts = []
+    overrun_drifts = []
+    started = time.process_time()
+    for period in range(periods):
+        if overrun_every and period % overrun_every == overrun_every - 1:
+            # Lost before we got to it, like an ALSA overrun
+            source.read()
+            continue
+        recorder._capture_period()
+        recorder._encode_period(timeout=0)
+        # Where the track puts the end of what has been captured against when it really was
+        clock = recorder.audio_clock
+        drift = (clock.time_of(clock.frames) - source.captured_time(source.frames)) / 1000
+        settled = period >= settling and not (overrun_every and period % overrun_every < settling)
+        (drifts if settled else overrun_drifts).append(drift)
+    cpu = time.process_time() - started
+
+    seconds = source.frames / source.sample_rate
+    worst = max(drifts, key=abs)
+    bound = (settings['drift_tolerance'] + 2 * settings['drift_step']) * 1000
+    return {
+        'audio_seconds': round(seconds),
+        'uncorrected_drift_ms': round(args.clock_error_ppm * seconds / 1000, 1),
+        'final_drift_ms': round(drifts[-1], 2),
+        'max_drift_ms': round(worst, 2),
+        'max_drift_after_overrun_ms': round(max(overrun_drifts, key=abs), 2) if overrun_drifts else None,
+        'bound_ms': bound,
+        'in_sync': abs(worst) <= bound,
+        'packets': recorder.packets,
+        'encode_cpu_percent': round(100 * cpu / seconds, 3),
+        'clock': recorder.audio_clock.get_status(),
+    }
+
+def record(args, codec: str) -> dict:
+    os.chdir(tempfile.mkdtemp(prefix=f'dashcam-bench-{codec}-'))
+    source = SyntheticSource(resolution=(args.width, args.height), fps=args.fps)
+    dashcam = Dashcam(source, microphone=microphone(args, simulated=False))
+    dashcam.audiorecorder.stop()
+    dashcam.settings['audio']['codec'] = codec
+    time.sleep(0.5)
+    dashcam.audiorecorder.start()
+    dashcam.filestreamer.clip_duration = args.clip_duration
+    dashcam.start_recording()
+    time.sleep(args.seconds)
+    dashcam.stop_recording()
+    time.sleep(1.5)
+    status = dashcam.audiorecorder.get_status()
+    dashcam.audiorecorder.stop()
+    source.stop()
+
+    clips = []
+    for clip in sorted(dashcam.index.list(), key=lambda clip: clip['start_time']):
+        video = track_span(os.path.join(dashcam.index.directory, clip['name']), 'video')
+        audio = track_span(os.path.join(dashcam.index.directory, clip['name']), 'audio')
+        clips.append({
+            'name': clip['name'],
+            'video_seconds': round(video[1] - video[0], 3),
+            'audio_start_ms': round((audio[0] - video[0]) * 1000, 1),
+            'audio_end_ms': round((audio[1] - video[1]) * 1000, 1),
+        })
+    # The last clip is cut off when recording stops, only the clips that rotated show the end
+    ends = [clip['audio_end_ms'] for clip in clips[:-1]]
+    return {
+        'clips': clips,
+        'max_start_offset_ms': max(abs(clip['audio_start_ms']) for clip in clips),
+        'max_end_offset_ms': max(map(abs, ends)) if ends else None,
+        'audio_cpu_percent': status['cpu_percent'],
+        'recorder': status,
+    }, dashcam.settings['audio']
+
+def track_span(path: str, kind: str) -> tuple:
+    # Seconds from the first packet's start to the last packet's end
+    with av.open(path) as container:
+        stream = container.streams.get(**{kind: 0})[0]
+        packets = [packet for packet in container.demux(stream) if packet.pts is not None]
+        return (float(packets[0].pts * stream.time_base),
+                float((packets[-1].pts + packets[-1].duration) * stream.time_base))
+
+def run(args) -> dict:
+    result = {'config': vars(args)}
+    for codec in args.codecs:
+        result[codec], settings = record(args, codec)
+    # The simulation uses the settings Dashcam records with, and the first codec
+    result['simulated'] = simulate(args, dict(settings, codec=args.codecs[0]))
+    return result
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--wav', help="16-bit WAV to capture from, a tone without one")
+    parser.add_argument('--period-frames', type=int, default=1024)
+    parser.add_argument('--clock-error-ppm', type=float, default=100, help="How fast the microphone's clock runs")
+    parser.add_argument('--jitter', type=float, default=5, help="Most a read comes back late, ms")
+    parser.add_argument('--overrun-every', type=float, default=300, help="Seconds between lost periods in the simulation, 0 for none")
+    parser.add_argument('--simulate-hours', type=float, default=1)
+    parser.add_argument('--codecs', nargs='+', default=['aac', 'opus'])
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--fps', type=int, default=30)
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--clip-duration', type=float, default=5)
+    args = parser.parse_args()
+
+    # Each run records into ./recordings of its own temporary directory, out of the working tree
+    result = run(args)
+    print(json.dumps(result, indent=2))
+    sys.exit(0 if result['simulated']['in_sync'] else 1)
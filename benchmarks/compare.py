@@ -0,0 +1,51 @@
+'''
+Compares two latency_benchmark.py results and exits non-zero if anything regressed.
+
+    python benchmarks/compare.py base.json new.json --threshold 10
+'''
+import argparse
+import json
+import sys
+
+# Lower is better for all of these
+METRICS = (
+    ('capture_to_write', 'p50_ms'),
+    ('capture_to_write', 'p99_ms'),
+    ('capture_to_client', 'p50_ms'),
+    ('capture_to_client', 'p99_ms'),
+    ('process_cpu_percent',),
+    ('rss_kb', 'peak'),
+    ('recording', 'frames_dropped'),
+    ('recording', 'frames_late'),
+)
+
+def lookup(result: dict, path: tuple):
+    for key in path:
+        if not isinstance(result, dict) or key not in result:
+            return None
+        result = result[key]
+    return result
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('base')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=10, help="Percent increase that counts as a regression")
+    args = parser.parse_args()
+
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    print(f"{base.get('commit')} -> {new.get('commit')}")
+    regressed = False
+    for path in METRICS:
+        before, after = lookup(base, path), lookup(new, path)
+        if before is None or after is None:
+            continue
+        change = (after - before) / before * 100 if before else (0 if after == before else float('inf'))
+        flag = change > args.threshold
+        regressed = regressed or flag
+        print(f"{'.'.join(path):32} {before:>12} {after:>12} {change:+8.1f}% {'REGRESSION' if flag else ''}")
+    sys.exit(1 if regressed else 0)
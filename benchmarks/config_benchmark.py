@@ -0,0 +1,129 @@
+'''
+Changes the settings of a recording, streaming synthetic dashcam through update_settings, one
+change for each way a setting can be applied, and reports how long the call took and how long
+the change took to reach the recording: a bitrate straight away, a clip duration at the next
+rotation and a resolution by configuring the camera again, with the gap that left between clips.
+Saving the changes to the config file, an update that changes nothing and one that fails to
+validate are timed too.
+
+    python benchmarks/config_benchmark.py --clip-duration 6 --repeat 3
+'''
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from dashcam.sources.synthetic_source import SyntheticSource
+from dashcam.dashcam import Dashcam
+import statistics
+import tempfile
+import argparse
+import json
+import time
+
+def wait_for(condition, timeout: float) -> float:
+    # Seconds until condition held, None if it never did
+    started = time.monotonic()
+    while time.monotonic() - started < timeout:
+        if condition():
+            return time.monotonic() - started
+        time.sleep(0.005)
+    return None
+
+def update(dashcam, changes: dict) -> tuple:
+    started = time.perf_counter()
+    result, status_code = dashcam.update_settings(changes)
+    return time.perf_counter() - started, result, status_code
+
+def clip_gap(dashcam, before: set) -> float:
+    # Between the last of the clips named in before closing and the first one after them opening
+    clips = sorted(dashcam.index.list(camera=dashcam.settings['recording']['camera']), key=lambda clip: clip['start_time'])
+    closed = [clip for clip in clips if clip['name'] in before]
+    following = [clip for clip in clips if clip['name'] not in before]
+    if not closed or not following or closed[-1]['end_time'] is None:
+        return None
+    return following[0]['start_time'] - closed[-1]['end_time']
+
+def summarise(samples: list) -> dict:
+    samples = [sample for sample in samples if sample is not None]
+    if not samples:
+        return None
+    return {'median_ms': round(statistics.median(samples) * 1000, 2), 'max_ms': round(max(samples) * 1000, 2)}
+
+def run(args) -> dict:
+    source = SyntheticSource()
+    dashcam = Dashcam(source, config=os.path.abspath('dashcam.json'))
+    if dashcam.quality is not None:
+        # Its own bitrate and frame rate changes would be counted as ours
+        dashcam.quality.stop()
+    filestreamer = dashcam.filestreamer
+    filestreamer.clip_duration = args.clip_duration
+    dashcam.start_recording()
+    dashcam.start_streaming()
+    filestreamer.clip_opened.wait(10)
+
+    results = {path: {'call': [], 'effect': []} for path in ('live', 'rotation', 'reconfigure')}
+    persist, unchanged, invalid, gaps, downtime = [], [], [], [], []
+    bitrates = (6000000, 8000000)
+    durations = (args.clip_duration + 1, args.clip_duration)
+    resolutions = ((1280, 720), (1920, 1080))
+    for number in range(args.repeat):
+        bitrate = bitrates[number % 2]
+        seconds, result, _ = update(dashcam, {'recording': {'bitrate': bitrate}})
+        results['live']['call'].append(seconds)
+        results['live']['effect'].append(wait_for(lambda: filestreamer.encoder.bitrate == bitrate, 5))
+        persist.append(result['seconds']['persist'])
+
+        duration = durations[number % 2]
+        seconds, result, _ = update(dashcam, {'recording': {'clip_duration': duration}})
+        results['rotation']['call'].append(seconds)
+        results['rotation']['effect'].append(wait_for(lambda: filestreamer.clip_duration == duration, args.clip_duration * 3))
+        persist.append(result['seconds']['persist'])
+
+        resolution = resolutions[number % 2]
+        before = {clip['name'] for clip in dashcam.index.list()}
+        seconds, result, _ = update(dashcam, {'recording': {'resolution': resolution}})
+        results['reconfigure']['call'].append(seconds)
+        # The call returns once recording has been started again, the first clip opens after that
+        opened = wait_for(filestreamer.clip_opened.is_set, 10)
+        results['reconfigure']['effect'].append(seconds + opened if opened is not None and source.resolution == resolution else None)
+        downtime.append(result['seconds']['reconfigure'])
+        persist.append(result['seconds']['persist'])
+        time.sleep(1)
+        gaps.append(clip_gap(dashcam, before))
+
+        unchanged.append(update(dashcam, {'recording': {'bitrate': bitrate}})[0])
+        seconds, _, status_code = update(dashcam, {'recording': {'bitrate': 'fast', 'fps': 0}})
+        invalid.append(seconds if status_code == 400 else None)
+
+    dashcam.stop_streaming()
+    dashcam.stop_recording()
+    time.sleep(1.5)
+    source.stop()
+    with open('dashcam.json') as f:
+        saved = json.load(f)
+    return {
+        'config': vars(args),
+        'live_bitrate': {'call': summarise(results['live']['call']), 'in_effect': summarise(results['live']['effect'])},
+        'rotation_clip_duration': {'call': summarise(results['rotation']['call']), 'in_effect': summarise(results['rotation']['effect'])},
+        'reconfigure_resolution': {'call': summarise(results['reconfigure']['call']), 'camera_down': summarise(downtime),
+                                   'in_effect': summarise(results['reconfigure']['effect']), 'clip_gap': summarise(gaps)},
+        'persist': summarise(persist),
+        'unchanged': summarise(unchanged),
+        'invalid': summarise(invalid),
+        'saved': saved,
+        'saves': dashcam.config.saves,
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clip-duration', type=int, default=6, help="Short, so changes waiting for the next clip don't wait long")
+    parser.add_argument('--repeat', type=int, default=3, help="Times to make each change, going back and forth")
+    args = parser.parse_args()
+
+    # Dashcam records into ./recordings and saves ./dashcam.json, keep those out of the working tree
+    os.chdir(tempfile.mkdtemp(prefix='dashcam-bench-'))
+    result = run(args)
+    print(json.dumps(result, indent=2))
+    # Each change should have reached the recording, and cost no more than the way it was applied needs
+    applied = all(result[name]['in_effect'] is not None for name in ('live_bitrate', 'rotation_clip_duration', 'reconfigure_resolution'))
+    sys.exit(0 if applied and result['live_bitrate']['call']['max_ms'] < result['reconfigure_resolution']['call']['median_ms'] else 1)
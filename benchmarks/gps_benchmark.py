@@ -0,0 +1,121 @@
+'''
+Measures what GPS tracking costs: the time to parse and record each fix, track bytes per clip
+next to the video, and how long a location search takes as the number of clips grows.
+
+    python benchmarks/gps_benchmark.py --clips 2000 --write-nmea drive.nmea
+
+A generated drive can be saved with --write-nmea and played back on the dashcam with
+`src/main.py --synthetic --gps-replay drive.nmea`.
+'''
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from dashcam.storage.recording_index import RecordingIndex
+from dashcam.gps.gps_track import RECORD, HEADER
+from dashcam.gps.nmea_source import NmeaReplay
+from dashcam.gps.gps_reader import GpsReader
+from types import SimpleNamespace
+import tempfile
+import argparse
+import random
+import json
+import math
+import time
+
+def checksummed(body: str) -> str:
+    checksum = 0
+    for character in body.encode():
+        checksum ^= character
+    return f"${body}*{checksum:02X}\r\n"
+
+def coordinate(value: float, positive: str, negative: str, width: int) -> tuple:
+    degrees = int(abs(value))
+    return f"{degrees:0{width}d}{(abs(value) - degrees) * 60:07.4f}", positive if value >= 0 else negative
+
+def generate_drive(seconds: int, latitude: float, longitude: float) -> list:
+    # A loop around a few km, one GGA and RMC pair per second like most receivers
+    lines = []
+    for second in range(seconds):
+        angle = second / 600 * 2 * math.pi
+        fix_latitude = latitude + 0.02 * math.sin(angle)
+        fix_longitude = longitude + 0.03 * math.cos(angle)
+        stamp = time.strftime('%H%M%S', time.gmtime(second))
+        lat, ns = coordinate(fix_latitude, 'N', 'S', 2)
+        lon, ew = coordinate(fix_longitude, 'E', 'W', 3)
+        lines.append(checksummed(f"GPGGA,{stamp}.00,{lat},{ns},{lon},{ew},1,09,0.9,{40 + second % 7}.0,M,47.0,M,,"))
+        lines.append(checksummed(f"GPRMC,{stamp}.00,A,{lat},{ns},{lon},{ew},{25 + second % 10:.1f},{math.degrees(angle) % 360:.1f},010126,,,A"))
+    return lines
+
+def fix_cost(lines: list, directory: str) -> dict:
+    path = os.path.join(directory, 'drive.nmea')
+    with open(path, 'w') as f:
+        f.writelines(lines)
+    index = RecordingIndex(os.path.join(directory, 'fixes'))
+    overlay = SimpleNamespace(set_speed=lambda speed: None, set_coordinates=lambda latitude, longitude: None)
+    reader = GpsReader(NmeaReplay(path, interval=0, loop=False), index, overlay, {'index_interval': 30})
+    index.open_clip('dashcam_20260101-000000.mp4', time.time())
+    reader.set_clip(os.path.join(index.directory, 'dashcam_20260101-000000.mp4'))
+    reader.is_running = True
+    cpu = time.process_time()
+    reader._start()
+    cpu = time.process_time() - cpu
+    reader.set_clip(None)
+    status = reader.get_status()
+    return {
+        'fixes': status['fixes'],
+        'mean_fix_us': status['mean_fix_us'],
+        'max_fix_us': status['max_fix_us'],
+        'cpu_us_per_fix_including_parsing': round(cpu / status['fixes'] * 1e6, 1),
+    }
+
+def search_cost(clips: int, directory: str, latitude: float, longitude: float) -> dict:
+    index = RecordingIndex(os.path.join(directory, 'search'))
+    generator = random.Random(1)
+    for number in range(clips):
+        name = f"dashcam_{number:06d}.mp4"
+        index.open_clip(name, number * 180.0)
+        # Clips scattered over a country sized area, each covering a few km
+        clip_latitude = latitude + generator.uniform(-3, 3)
+        clip_longitude = longitude + generator.uniform(-3, 3)
+        index.set_track(name, clip_latitude, clip_latitude + 0.03, clip_longitude, clip_longitude + 0.04)
+
+    started = time.perf_counter()
+    searches = 200
+    found = 0
+    for _ in range(searches):
+        point_latitude = latitude + generator.uniform(-3, 3)
+        point_longitude = longitude + generator.uniform(-3, 3)
+        found += len(index.near(point_latitude - 0.001, point_latitude + 0.001, point_longitude - 0.001, point_longitude + 0.001))
+    elapsed = time.perf_counter() - started
+    return {'clips': clips, 'mean_search_ms': round(elapsed / searches * 1000, 3), 'mean_candidates': found / searches}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seconds', type=int, default=1800, help="Length of the generated drive")
+    parser.add_argument('--clips', type=int, default=2000, help="Clips in the search index")
+    parser.add_argument('--clip-duration', type=int, default=180)
+    parser.add_argument('--bitrate', type=int, default=10000000, help="Video bitrate to compare track size against")
+    parser.add_argument('--latitude', type=float, default=51.5)
+    parser.add_argument('--longitude', type=float, default=-0.12)
+    parser.add_argument('--write-nmea', help="Save the generated drive")
+    args = parser.parse_args()
+
+    lines = generate_drive(args.seconds, args.latitude, args.longitude)
+    if args.write_nmea:
+        with open(args.write_nmea, 'w') as f:
+            f.writelines(lines)
+
+    with tempfile.TemporaryDirectory(prefix='dashcam-gps-') as directory:
+        fixes = fix_cost(lines, directory)
+        search = search_cost(args.clips, directory, args.latitude, args.longitude)
+
+    track_bytes = HEADER.size + RECORD.size * args.clip_duration
+    video_bytes = args.bitrate // 8 * args.clip_duration
+    print(json.dumps({
+        'fix': fixes,
+        'fix_cpu_percent_at_1hz': round(fixes['cpu_us_per_fix_including_parsing'] / 1e4, 4),
+        'track_bytes_per_clip': track_bytes,
+        'track_to_video_ratio': round(track_bytes / video_bytes, 7),
+        'search': search,
+    }, indent=2))
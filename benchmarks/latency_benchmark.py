@@ -0,0 +1,204 @@
+'''
+End-to-end benchmark: runs Dashcam on a SyntheticSource, records several clips and streams MJPEG
+to a number of HTTP clients, then reports
+
+- capture-to-write latency (p50/p99) for recorded frames
+- capture-to-client latency (p50/p99) for streamed frames
+- dropped frames on the recording and streaming paths
+- CPU% per thread and RSS over the run
+
+    python benchmarks/latency_benchmark.py --clips 3 --clip-duration 10 --clients 4 --output result.json
+
+Results are JSON so runs from different commits can be compared with benchmarks/compare.py.
+'''
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from dashcam.sources.synthetic_source import SyntheticSource
+from dashcam.api.web_server import DashcamWebServer
+from dashcam.outputs.mp4_output import Mp4Output, TIMESCALE
+from dashcam.dashcam import Dashcam
+from threading import Event, Thread
+from waitress import create_server
+import http.client
+import subprocess
+import threading
+import tempfile
+import argparse
+import platform
+import json
+import time
+
+class LatencyMp4Output(Mp4Output):
+    # Records how long each frame waited between capture and being written out
+    latencies = []
+
+    def _write_fragment(self, next_decode_time) -> None:
+        captured = [self.first_timestamp + decode_time * 1000000 // TIMESCALE for _, _, _, decode_time in self.samples]
+        super()._write_fragment(next_decode_time)
+        written = time.monotonic_ns() // 1000
+        LatencyMp4Output.latencies.extend(written - timestamp for timestamp in captured)
+
+class StreamClient(Thread):
+    def __init__(self, number: int, port: int, stop_event: Event) -> None:
+        super().__init__(name=f"client-{number}", daemon=True)
+        self.port = port
+        self.stop_event = stop_event
+        self.frames = 0
+        self.latencies = []
+
+    def run(self) -> None:
+        connection = http.client.HTTPConnection('127.0.0.1', self.port)
+        connection.request('GET', '/stream.mjpg')
+        response = connection.getresponse()
+        while not self.stop_event.is_set():
+            length = None
+            while True:
+                line = response.readline()
+                if not line:
+                    return
+                if line.lower().startswith(b'content-length:'):
+                    length = int(line.split(b':')[1])
+                elif line == b'\r\n' and length is not None:
+                    break
+            frame = response.read(length)
+            response.readline()
+            received = time.monotonic_ns() // 1000
+            # The synthetic JPEG carries its capture timestamp in the comment segment
+            comment_length = int.from_bytes(frame[4:6], 'big')
+            self.latencies.append(received - int(frame[6:4 + comment_length]))
+            self.frames += 1
+        connection.close()
+
+class ResourceSampler(Thread):
+    def __init__(self, interval: float) -> None:
+        super().__init__(name="sampler", daemon=True)
+        self.interval = interval
+        self.stop_event = Event()
+        self.rss = []
+        self.threads = {}
+
+    def run(self) -> None:
+        while not self.stop_event.wait(self.interval):
+            self.rss.append(read_rss_kb())
+            # Threads come and go, keep the last CPU time seen for each one
+            for thread in threading.enumerate():
+                cpu = read_thread_cpu(thread.native_id)
+                if cpu is not None:
+                    self.threads[f"{thread.name}:{thread.native_id}"] = cpu
+
+def read_rss_kb() -> int:
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+def read_thread_cpu(native_id: int) -> float:
+    # utime + stime for one thread, in seconds
+    try:
+        with open(f'/proc/self/task/{native_id}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+    except (OSError, TypeError):
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+def percentiles(values: list) -> dict:
+    if not values:
+        return {'count': 0, 'p50_ms': None, 'p99_ms': None, 'max_ms': None}
+    values = sorted(values)
+    pick = lambda fraction: round(values[min(int(len(values) * fraction), len(values) - 1)] / 1000, 2)
+    return {'count': len(values), 'p50_ms': pick(0.5), 'p99_ms': pick(0.99), 'max_ms': round(values[-1] / 1000, 2)}
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(args) -> dict:
+    source = SyntheticSource(resolution=(args.width, args.height), fps=args.fps)
+    dashcam = Dashcam(source)
+    dashcam.filestreamer.clip_duration = args.clip_duration
+    settings = dashcam.settings['recording']
+    dashcam.filestreamer.output.output_factory = lambda path: LatencyMp4Output(path, settings['resolution'], settings['fps'])
+
+    server = create_server(DashcamWebServer(dashcam).app, host='127.0.0.1', port=0, threads=args.clients + 4)
+    Thread(target=server.run, name="waitress", daemon=True).start()
+
+    sampler = ResourceSampler(0.5)
+    sampler.start()
+    stop_clients = Event()
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+
+    dashcam.start_recording()
+    dashcam.start_streaming()
+    time.sleep(0.5)
+    clients = [StreamClient(i, server.effective_port, stop_clients) for i in range(args.clients)]
+    for client in clients:
+        client.start()
+
+    time.sleep(args.clips * args.clip_duration)
+    stop_clients.set()
+    dashcam.stop_streaming()
+    dashcam.stop_recording()
+    time.sleep(2)
+    sampler.stop_event.set()
+    sampler.join()
+    wall = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+
+    server.close()
+    source.stop()
+
+    clip_output = dashcam.filestreamer.output
+    streamed = dashcam.mjpegstreamer.encoder.frames_encoded
+    return {
+        'commit': git_commit(),
+        'platform': platform.platform(),
+        'config': vars(args),
+        'wall_seconds': round(wall, 2),
+        'process_cpu_percent': round(100 * cpu / wall, 1),
+        'capture_to_write': percentiles(LatencyMp4Output.latencies),
+        'capture_to_client': percentiles([latency for client in clients for latency in client.latencies]),
+        'recording': {
+            'frames_captured': source.frame_count,
+            'frames_late': source.frames_late,
+            'frames_encoded': clip_output.frames_received,
+            'frames_written': clip_output.frames_written,
+            'frames_dropped': clip_output.frames_dropped,
+            'ring_frames_dropped': dashcam.filestreamer.ring.frames_dropped,
+            'clips': len(dashcam.index.list()),
+        },
+        'streaming': {
+            'frames_encoded': streamed,
+            # Includes the frames encoded before the client connected
+            'clients': [{'frames': client.frames, 'missed': streamed - client.frames} for client in clients],
+        },
+        'threads_cpu_percent': {name: round(100 * seconds / wall, 1) for name, seconds in sorted(sampler.threads.items())},
+        'rss_kb': {'start': sampler.rss[0] if sampler.rss else None, 'peak': max(sampler.rss, default=None), 'end': sampler.rss[-1] if sampler.rss else None},
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--fps', type=int, default=30)
+    parser.add_argument('--clips', type=int, default=3)
+    parser.add_argument('--clip-duration', type=float, default=10)
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--output', help="Write the JSON result here as well as to stdout")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output) if args.output else None
+    # Dashcam records into ./recordings, keep that out of the working tree
+    os.chdir(tempfile.mkdtemp(prefix='dashcam-bench-'))
+    result = run(args)
+
+    text = json.dumps(result, indent=2)
+    print(text)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text)
@@ -0,0 +1,111 @@
+'''
+Checks what the /metrics instrumentation costs. Times each kind of update on its own, then runs
+Dashcam on a SyntheticSource at 30fps with stream clients connected and a scrape every second,
+counts every update the run made (the histograms count themselves) and reports the CPU they and
+the scrapes took as a share of one core. The budget is 1%.
+
+    python benchmarks/metrics_benchmark.py --seconds 20 --clients 2
+'''
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from dashcam.sources.synthetic_source import SyntheticSource
+from dashcam.metrics.metrics import MetricsRegistry
+from dashcam.dashcam import Dashcam
+from threading import Event, Thread
+import tempfile
+import argparse
+import json
+import time
+
+def per_call(function, calls: int = 200000) -> float:
+    # CPU seconds per call
+    started = time.process_time()
+    for _ in range(calls):
+        function()
+    return (time.process_time() - started) / calls
+
+def update_costs() -> dict:
+    metrics = MetricsRegistry()
+    counter = metrics.counter('benchmark_total', "Counter")
+    histogram = metrics.histogram('benchmark_seconds', "Histogram", (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1))
+    return {
+        'counter': per_call(lambda: counter.inc(1234)),
+        'histogram': per_call(lambda: histogram.observe(0.004)),
+        'clock': per_call(time.monotonic),
+    }
+
+def client(dashcam, stop_event: Event) -> None:
+    # Takes frames like a viewer on a slow link would, skipping whatever arrives while it is busy
+    for _ in dashcam.stream_frames():
+        if stop_event.wait(0.05):
+            break
+
+def run(args) -> dict:
+    costs = update_costs()
+    dashcam = Dashcam(SyntheticSource(resolution=(args.width, args.height), fps=args.fps))
+    dashcam.filestreamer.clip_duration = args.clip_duration
+    dashcam.start_recording()
+    dashcam.start_streaming()
+    time.sleep(0.5)
+
+    stop_event = Event()
+    clients = [Thread(target=client, args=(dashcam, stop_event), daemon=True) for _ in range(args.clients)]
+    for thread in clients:
+        thread.start()
+
+    scrapes = []
+    started = time.perf_counter()
+    while time.perf_counter() - started < args.seconds:
+        scrape_started = time.process_time()
+        dashcam.get_metrics()
+        scrapes.append(time.process_time() - scrape_started)
+        time.sleep(args.scrape_interval)
+    wall = time.perf_counter() - started
+    stop_event.set()
+    dashcam.stop_streaming()
+    dashcam.stop_recording()
+    time.sleep(1)
+
+    filestreamer = dashcam.filestreamer
+    mjpegstreamer = dashcam.mjpegstreamer
+    fragments = sum(filestreamer.write_seconds.counts)
+    rotations = sum(filestreamer.rotation_seconds.counts)
+    sent = sum(mjpegstreamer.stream_lag.counts)
+    # Per fragment a counter and a histogram, per rotation a histogram, per streamed frame two
+    # counters, a histogram and a clock read, and a clock read for every JPEG encoded
+    update_seconds = (fragments * (costs['counter'] + costs['histogram'] + 2 * costs['clock'])
+                      + rotations * (costs['histogram'] + 4 * costs['clock'])
+                      + sent * (2 * costs['counter'] + costs['histogram'] + costs['clock'])
+                      + mjpegstreamer.output.sequence * costs['clock'])
+    scrape_seconds = sum(scrapes)
+    overhead = 100 * (update_seconds + scrape_seconds) / wall
+    return {
+        'config': vars(args),
+        'update_ns': {name: round(seconds * 1e9) for name, seconds in costs.items()},
+        'wall_seconds': round(wall, 2),
+        'updates': {'fragments': fragments, 'rotations': rotations, 'frames_sent': sent, 'jpegs_encoded': mjpegstreamer.output.sequence},
+        'scrape_ms': {'mean': round(1000 * scrape_seconds / len(scrapes), 3), 'max': round(1000 * max(scrapes), 3), 'count': len(scrapes)},
+        'update_cpu_percent': round(100 * update_seconds / wall, 4),
+        'scrape_cpu_percent': round(100 * scrape_seconds / wall, 4),
+        'overhead_cpu_percent': round(overhead, 4),
+        'within_budget': overhead < 1,
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--fps', type=int, default=30)
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--clip-duration', type=float, default=5)
+    parser.add_argument('--clients', type=int, default=2)
+    parser.add_argument('--scrape-interval', type=float, default=1, help="Prometheus scrapes every 15s or more, 1s is the worst case")
+    args = parser.parse_args()
+
+    # Dashcam records into ./recordings, keep that out of the working tree
+    os.chdir(tempfile.mkdtemp(prefix='dashcam-bench-'))
+    result = run(args)
+    print(json.dumps(result, indent=2))
+    sys.exit(0 if result['within_budget'] else 1)
@@ -0,0 +1,87 @@
+'''
+Records from two synthetic cameras at once, the main one and a cabin camera, with encoder and card
+budgets too small for both to have what they ask for. Reports what the scheduler gave each camera,
+the frame rates and write rates they really managed against that, and how closely each cabin clip
+lines up with the main camera's clip it was indexed alongside.
+
+    python benchmarks/multicamera_benchmark.py --seconds 30 --clip-duration 5 --write-budget 1.2
+'''
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from dashcam.sources.synthetic_source import SyntheticSource
+from dashcam.dashcam import Dashcam
+import tempfile
+import argparse
+import json
+import time
+
+def run(args) -> dict:
+    os.chdir(tempfile.mkdtemp(prefix='dashcam-bench-'))
+    sources = {'front': SyntheticSource(), 'cabin': SyntheticSource()}
+    dashcam = Dashcam(sources['front'], cameras={'cabin': sources['cabin']})
+    if dashcam.quality is not None:
+        dashcam.quality.stop()
+    scheduler = dashcam.settings['scheduler']
+    scheduler['encoder_budget'] = int(args.encoder_budget)
+    scheduler['write_budget'] = int(args.write_budget * 1000000)
+    schedule, _ = dashcam.reschedule_cameras()
+    for camera in dashcam.cameras.values():
+        camera.filestreamer.clip_duration = args.clip_duration
+
+    frames = {name: source.frame_count for name, source in sources.items()}
+    dashcam.start_recording()
+    started = time.monotonic()
+    time.sleep(args.seconds)
+    elapsed = time.monotonic() - started
+    written = {name: camera.filestreamer.write_bytes.value for name, camera in dashcam.cameras.items()}
+    frames = {name: source.frame_count - frames[name] for name, source in sources.items()}
+    dashcam.stop_recording()
+    time.sleep(1.5)
+    for source in sources.values():
+        source.stop()
+
+    cameras = {}
+    for name, camera in dashcam.cameras.items():
+        allocated = schedule['cameras'][name]
+        cameras[name] = {
+            'requested': allocated['requested'],
+            'scheduled_fps': allocated['fps'],
+            'scheduled_bitrate': allocated['bitrate'],
+            'measured_fps': round(frames[name] / elapsed, 1),
+            'measured_bitrate': round(written[name] * 8 / elapsed),
+            'clips': len(dashcam.index.list(camera=name)),
+        }
+
+    # Every main camera clip against the cabin clips overlapping it
+    offsets = []
+    for clip in dashcam.index.list(camera='front'):
+        alongside = dashcam.index.alongside(clip['name'])
+        offsets += [other['offset'] for other in alongside if abs(other['offset']) < args.clip_duration / 2]
+    write_rate = sum(written.values()) / elapsed
+    return {
+        'config': vars(args),
+        'encoder_used': schedule['encoder_used'],
+        'write_used': schedule['write_used'],
+        'measured_write_rate': round(write_rate),
+        'within_write_budget': write_rate <= scheduler['write_budget'] * 1.05,
+        'cameras': cameras,
+        'aligned_clips': len(offsets),
+        # A cabin clip starts on its own next keyframe after the main camera's, at most a second later
+        'max_offset_seconds': max(map(abs, offsets)) if offsets else None,
+        'clips_aligned': bool(offsets) and max(map(abs, offsets)) <= 1.1,
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seconds', type=float, default=30)
+    parser.add_argument('--clip-duration', type=float, default=5)
+    parser.add_argument('--encoder-budget', type=float, default=245760, help="Macroblocks a second shared by both cameras")
+    parser.add_argument('--write-budget', type=float, default=1.2, help="MB a second shared by both cameras")
+    args = parser.parse_args()
+
+    # Records into ./recordings of a temporary directory, out of the working tree
+    result = run(args)
+    print(json.dumps(result, indent=2))
+    sys.exit(0 if result['clips_aligned'] and result['within_write_budget'] else 1)
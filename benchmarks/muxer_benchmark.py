@@ -0,0 +1,62 @@
+'''
+Compares the in-process Mp4Output against FfmpegOutput using synthetic H264 NAL units.
+
+    python benchmarks/muxer_benchmark.py --frames 900 --bitrate 10000000
+
+Reports input bytes/sec, CPU time and peak memory for each output as JSON.
+'''
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from dashcam.sources.synthetic_h264 import synthetic_frames
+from dashcam.outputs.mp4_output import Mp4Output
+from picamera2.outputs import FfmpegOutput
+import tempfile
+import argparse
+import resource
+import json
+import time
+
+def run(output, frames: int, args) -> dict:
+    generator = synthetic_frames(args.width, args.height, args.fps, args.bitrate, args.fps)
+    source = [next(generator) for _ in range(min(frames, args.fps * 2))]
+    input_bytes = 0
+
+    output.start()
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    for i in range(frames):
+        frame, keyframe = source[i % len(source)]
+        output.outputframe(frame, keyframe, i * 1000000 // args.fps)
+        input_bytes += len(frame)
+    output.stop()
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+
+    return {
+        'frames': frames,
+        'input_bytes': input_bytes,
+        'wall_seconds': round(wall, 3),
+        'bytes_per_second': round(input_bytes / wall),
+        'process_cpu_seconds': round(cpu, 3),
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'child_peak_rss_kb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frames', type=int, default=900)
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--fps', type=int, default=30)
+    parser.add_argument('--bitrate', type=int, default=10000000)
+    parser.add_argument('--directory', default=tempfile.gettempdir())
+    args = parser.parse_args()
+
+    # The native muxer runs first so its peak RSS isn't inflated by anything ffmpeg related,
+    # ffmpeg's own memory shows up in the child figures once the process has been reaped
+    results = {
+        'native': run(Mp4Output(os.path.join(args.directory, 'bench_native.mp4'), (args.width, args.height), args.fps), args.frames, args),
+        'ffmpeg': run(FfmpegOutput(os.path.join(args.directory, 'bench_ffmpeg.mp4')), args.frames, args),
+    }
+    print(json.dumps(results, indent=2))
@@ -0,0 +1,170 @@
+'''
+Runs the parking motion detector over a night of lores frames, as ParkingMonitor would at its check
+rate, and reports the motion it found against what happened, then parks a synthetic dashcam in a
+still scene and measures what idling costs against recording the same stretch.
+
+    python benchmarks/parking_benchmark.py --minutes 10 --walkers 95 330 --write-sequence night.npy
+    python benchmarks/parking_benchmark.py --sequence night.npy
+
+Without --sequence a night is generated at the lores resolution: a textured street getting darker,
+sensor noise that grows as it does, the exposure stepping every so often and someone walking past
+at each of the given times. A sequence is an .npy of 8-bit brightness frames, one per check.
+'''
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from dashcam.parking.motion_detector import MotionDetector, load_frames, write_frames
+from dashcam.sources.synthetic_source import SyntheticSource
+from dashcam.dashcam import Dashcam
+import numpy as np
+import tempfile
+import argparse
+import json
+import time
+
+WALK_SECONDS = 8
+
+def generate_night(minutes: float, fps: float, size: tuple, walkers: list, seed: int = 1):
+    width, height = size
+    generator = np.random.default_rng(seed)
+    street = np.clip(np.linspace(60, 160, width)[None, :] + generator.normal(0, 25, (height, width)), 0, 255)
+    exposure = 1.0
+    for number in range(int(minutes * 60 * fps)):
+        seconds = number / fps
+        if number and number % int(97 * fps) == 0:
+            exposure *= 1.1
+        light = (1.0 - 0.6 * seconds / (minutes * 60)) * exposure
+        frame = street * light + generator.normal(0, 2 + 4 * (1 - light), (height, width))
+        for start in walkers:
+            if start <= seconds < start + WALK_SECONDS:
+                # A dark figure crossing the frame, a sixteenth of it wide and a third of it tall
+                left = int((seconds - start) / WALK_SECONDS * width)
+                top = height // 2
+                frame[top:top + height // 3, left:left + width // 16] = 20
+        yield np.clip(frame, 0, 255).astype(np.uint8)
+
+def events(detections: list, fps: float, quiet: float) -> list:
+    # Frames that counted as motion, joined into clips the way quiet_seconds would join them
+    joined = []
+    for number in detections:
+        seconds = number / fps
+        if joined and seconds - joined[-1][1] <= quiet:
+            joined[-1][1] = seconds
+        else:
+            joined.append([seconds, seconds])
+    return [(round(start, 1), round(end, 1)) for start, end in joined]
+
+def detect(frames, settings: dict) -> tuple:
+    # Only the checks are timed, not generating or reading the frames
+    detector = MotionDetector(settings)
+    detections, cpu, checks = [], 0.0, 0
+    for number, frame in enumerate(frames):
+        started = time.thread_time()
+        if detector.check(frame):
+            detections.append(number)
+        cpu += time.thread_time() - started
+        checks += 1
+    return detections, cpu, checks, detector.peak_score
+
+def written_bytes(dashcam) -> int:
+    # Recorded clips are allocated ahead of what is in them, their writes are counted instead
+    parked = [os.path.join('recordings', name) for name in os.listdir('recordings') if name.startswith('parked_')]
+    return dashcam.filestreamer.write_bytes.value + sum(os.path.getsize(path) for path in parked)
+
+def idle(args, settings: dict) -> dict:
+    # The same synthetic camera recording and then parked, with nothing moving in front of it
+    os.chdir(tempfile.mkdtemp(prefix='dashcam-bench-'))
+    source = SyntheticSource()
+    make_array = source._make_array
+    still = {}
+
+    def lores_still(name: str):
+        if name != 'lores':
+            return make_array(name)
+        if name not in still:
+            still[name] = make_array(name)
+        return still[name]
+    source._make_array = lores_still
+    dashcam = Dashcam(source)
+    if dashcam.quality is not None:
+        dashcam.quality.stop()
+    dashcam.settings['parking'].update(settings)
+
+    measured = {}
+    for mode in ('recording', 'parked'):
+        if mode == 'recording':
+            dashcam.start_recording()
+        else:
+            dashcam.start_parking()
+        time.sleep(2)
+        written = written_bytes(dashcam)
+        frames, cpu, started = source.frame_count, time.process_time(), time.monotonic()
+        time.sleep(args.idle_seconds)
+        elapsed = time.monotonic() - started
+        now = written_bytes(dashcam)
+        measured[mode] = {
+            'camera_fps': round((source.frame_count - frames) / elapsed, 1),
+            'process_cpu_percent': round(100 * (time.process_time() - cpu) / elapsed, 2),
+            'write_bytes_per_second': round((now - written) / elapsed),
+        }
+    status = dashcam.parking.get_status()
+    measured['parked'].update({
+        'check_cpu_percent': status['cpu_percent'],
+        'check_ms': round(dashcam.parking.check_seconds.sum / max(dashcam.parking.checks.value, 1) * 1000, 3),
+        'parked_clips': status['clips'],
+    })
+    dashcam.stop_parking()
+    time.sleep(1)
+    dashcam.stop_recording()
+    time.sleep(1.5)
+    source.stop()
+    return measured
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sequence', help=".npy of brightness frames to run instead of a generated night")
+    parser.add_argument('--minutes', type=float, default=10)
+    parser.add_argument('--width', type=int, default=1280, help="Of the generated night, the lores resolution")
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--walkers', type=float, nargs='*', default=[95.0, 330.0], help="Seconds into the generated night")
+    parser.add_argument('--write-sequence', help="Save the generated night as an .npy")
+    parser.add_argument('--idle-seconds', type=float, default=10, help="Of recording and then of parking, 0 to skip")
+    args = parser.parse_args()
+
+    # Dashcam's default parking settings
+    settings = {
+        'fps': 2, 'downscale': 8, 'taps': 2, 'pixel_threshold': 12, 'motion_fraction': 0.01, 'motion_checks': 2,
+        'quiet_seconds': 15, 'cpu_budget': 0.02,
+    }
+    fps = settings['fps']
+    if args.sequence:
+        frames = load_frames(args.sequence)
+    else:
+        frames = generate_night(args.minutes, fps, (args.width, args.height), args.walkers)
+        if args.write_sequence:
+            frames = list(frames)
+            write_frames(args.write_sequence, frames)
+
+    detections, cpu, checks, peak = detect(frames, settings)
+    found = events(detections, fps, settings['quiet_seconds'])
+    expected = None if args.sequence else [(start, start + WALK_SECONDS) for start in args.walkers]
+    result = {
+        'checks': checks,
+        'sequence_seconds': round(checks / fps, 1),
+        'motion_events': found,
+        'expected': expected,
+        'peak_motion_fraction': round(peak, 4),
+        'us_per_check': round(cpu / checks * 1e6, 1),
+        'cpu_percent_of_core': round(100 * cpu / (checks / fps), 4),
+        'cpu_budget_percent': settings['cpu_budget'] * 100,
+    }
+    if expected is not None:
+        # Found is within a check of when someone was in view
+        hit = lambda event: any(start - 1 <= event[0] <= end + 1 for start, end in expected)
+        result['missed'] = [walk for walk in expected if not any(walk[0] - 1 <= event[0] <= walk[1] + 1 for event in found)]
+        result['false_events'] = [event for event in found if not hit(event)]
+    if args.idle_seconds:
+        result['idle'] = idle(args, settings)
+    print(json.dumps(result, indent=2))
+    sys.exit(0 if not result.get('missed') and not result.get('false_events') else 1)
@@ -0,0 +1,121 @@
+'''
+Drives the quality controller through a hot drive on a slow card. Dashcam runs on a SyntheticSource
+with a writer that can only manage a set number of bytes a second and a temperature that climbs
+and then falls back, and the run reports every level change, when it reached a clip, and that no
+frame was lost on the way.
+
+    python benchmarks/quality_benchmark.py --seconds 60 --card-rate 0.9 --peak-temperature 82
+'''
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from dashcam.quality.quality_controller import QualityController
+from dashcam.sources.synthetic_source import SyntheticSource
+from dashcam.outputs.mp4_output import Mp4Output
+from dashcam.dashcam import Dashcam
+import tempfile
+import argparse
+import json
+import time
+
+class SlowMp4Output(Mp4Output):
+    # Stands in for an SD card that can only take rate bytes a second, for the first slow_seconds of the run
+    rate = None
+    slow_until = 0
+
+    def _write(self, data) -> None:
+        super()._write(data)
+        if time.monotonic() < SlowMp4Output.slow_until:
+            time.sleep(len(data) / SlowMp4Output.rate)
+
+class Drive():
+    # Temperature climbing from ambient to a peak over the first third of the run and back over the last third
+    def __init__(self, seconds: float, ambient: float, peak: float) -> None:
+        self.started = time.monotonic()
+        self.seconds = seconds
+        self.ambient = ambient
+        self.peak = peak
+
+    def temperature(self) -> float:
+        position = (time.monotonic() - self.started) / self.seconds
+        if position < 1 / 3:
+            return self.ambient + (self.peak - self.ambient) * position * 3
+        if position < 2 / 3:
+            return self.peak
+        return max(self.peak - (self.peak - self.ambient) * (position - 2 / 3) * 3, self.ambient)
+
+def run(args) -> dict:
+    source = SyntheticSource(resolution=(args.width, args.height), fps=args.fps)
+    dashcam = Dashcam(source)
+    recording = dashcam.settings['recording']
+    recording['bitrate'] = int(args.bitrate * 1000000)
+    dashcam.filestreamer.clip_duration = args.clip_duration
+    dashcam.filestreamer.encoder.bitrate = recording['bitrate']
+    filestreamer = dashcam.filestreamer
+
+    def create_output(path: str):
+        # Picks up whatever bitrate and fps the controller has set for the next clip, like FileStreamer does
+        output = SlowMp4Output(path, filestreamer.settings['resolution'], filestreamer.settings['fps'])
+        output.on_fragment = filestreamer._fragment_written
+        return output
+
+    filestreamer.output.output_factory = create_output
+    SlowMp4Output.rate = args.card_rate * 1000000
+    SlowMp4Output.slow_until = time.monotonic() + args.seconds * args.slow_share
+
+    # Swap in a controller that reads the simulated drive instead of the SoC
+    dashcam.quality.stop()
+    drive = Drive(args.seconds, args.ambient_temperature, args.peak_temperature)
+    settings = dict(dashcam.settings['quality'], up_after=args.up_after)
+    dashcam.quality = QualityController(dashcam, settings, read_temperature=drive.temperature, read_throttled=lambda bit: 0)
+    time.sleep(1)
+    dashcam.quality.start()
+
+    dashcam.start_recording()
+    dashcam.start_streaming()
+    timeline = []
+    started = time.monotonic()
+    wall_started = time.time()
+    while time.monotonic() - started < args.seconds:
+        time.sleep(1)
+        status = dashcam.quality.get_status()
+        timeline.append({'second': round(time.monotonic() - started), 'level': status['level'], **status['signals']})
+    dashcam.stop_streaming()
+    dashcam.stop_recording()
+    time.sleep(2)
+    dashcam.quality.stop()
+    source.stop()
+
+    clips = sorted(dashcam.index.list(), key=lambda clip: clip['start_time'])
+    clip_output = dashcam.filestreamer.output
+    return {
+        'config': vars(args),
+        'changes': [dict(change, time=round(change['time'] - wall_started, 1)) for change in dashcam.quality.get_status()['changes']],
+        'final_level': dashcam.quality.level,
+        'clips': [{'name': clip['name'], 'duration': clip['duration'], 'megabytes': round(clip['size'] / 1e6, 2)} for clip in clips],
+        'frames_captured': source.frame_count,
+        'frames_encoded': clip_output.frames_received,
+        'frames_written': clip_output.frames_written,
+        'frames_dropped': clip_output.frames_dropped,
+        'timeline': timeline,
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--fps', type=int, default=30)
+    parser.add_argument('--bitrate', type=float, default=10, help="Mbps at full quality")
+    parser.add_argument('--seconds', type=float, default=60)
+    parser.add_argument('--clip-duration', type=float, default=20)
+    parser.add_argument('--card-rate', type=float, default=0.9, help="MB/s the simulated card can write")
+    parser.add_argument('--slow-share', type=float, default=0.3, help="Share of the run the card is slow for")
+    parser.add_argument('--ambient-temperature', type=float, default=55)
+    parser.add_argument('--peak-temperature', type=float, default=82)
+    parser.add_argument('--up-after', type=int, default=5, help="Calm checks before stepping back up, shorter than the default so a run sees it")
+    args = parser.parse_args()
+
+    # Dashcam records into ./recordings, keep that out of the working tree
+    os.chdir(tempfile.mkdtemp(prefix='dashcam-bench-'))
+    print(json.dumps(run(args), indent=2))
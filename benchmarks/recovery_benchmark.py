@@ -0,0 +1,173 @@
+'''
+Simulates power cuts during recording: writes clips with the native muxer, cuts each one off at
+a random byte (some before their first fragment is complete) and leaves them open in the index
+like a crash would. Then reports
+
+- how long Dashcam takes to start and open its first clip with those clips waiting to be recovered,
+  against a clean start
+- how long the background recovery takes and the share of frames it gets back, against every frame
+  in a fragment that was completely on disk when the power went
+- what syncing every fragment costs the writer, run with --directory on the SD card for real numbers
+
+    python benchmarks/recovery_benchmark.py --clips 8 --clip-duration 20 --directory /home/pi/bench
+'''
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from dashcam.outputs.fragment_index import read_fragment_index, scan_fragments, parse_moof
+from dashcam.storage.recording_index import RecordingIndex
+from dashcam.sources.synthetic_source import SyntheticSource
+from dashcam.sources.synthetic_h264 import synthetic_frames
+from dashcam.outputs.mp4_output import Mp4Output
+from dashcam.dashcam import Dashcam
+import statistics
+import tempfile
+import argparse
+import random
+import struct
+import json
+import time
+
+def write_clip(path: str, args, sync_fragments: int = 0) -> list:
+    # Returns the time each fragment took to write
+    output = Mp4Output(path, (args.width, args.height), args.fps, sync_fragments)
+    output.start()
+    frames = synthetic_frames(args.width, args.height, args.fps, args.bitrate, args.fps)
+    timings = []
+    for number in range(args.clip_duration * args.fps):
+        frame, keyframe = next(frames)
+        started = time.perf_counter()
+        output.outputframe(frame, keyframe, number * 1000000 // args.fps)
+        if keyframe and number:
+            timings.append(time.perf_counter() - started)
+    output.stop()
+    return timings
+
+def fragment_frames(path: str) -> list:
+    # (end offset, frames) of every fragment in a whole clip
+    fragments = []
+    with open(path, 'rb') as f:
+        for _, _, offset, size in scan_fragments(path)[1]:
+            f.seek(offset)
+            moof_size = struct.unpack('>I', f.read(4))[0]
+            f.seek(offset)
+            moof = f.read(moof_size)
+            fragments.append((offset + size, parse_moof(moof)[2]))
+    return fragments
+
+def cut_clips(directory: str, args, generator: random.Random) -> dict:
+    # Writes the clips and cuts them short, returning the frames that were safely on disk in each
+    index = RecordingIndex(directory)
+    expected = {}
+    for number in range(args.clips):
+        name = f"dashcam_20260101-{number:06d}.mp4"
+        path = os.path.join(directory, name)
+        write_clip(path, args)
+        fragments = fragment_frames(path)
+        size = os.path.getsize(path)
+        init_size = read_fragment_index(path)[0]
+        if generator.random() < args.early_cut:
+            cut = generator.randrange(0, fragments[0][0])
+        else:
+            cut = generator.randrange(init_size, size)
+        os.truncate(path, cut)
+        expected[name] = sum(frames for end, frames in fragments if end <= cut)
+        index.open_clip(name, number * args.clip_duration)
+    index.close()
+    return expected
+
+def start_dashcam(args) -> tuple:
+    # Seconds until Dashcam is constructed and until its first clip is open
+    started = time.perf_counter()
+    dashcam = Dashcam(SyntheticSource(resolution=(args.width, args.height), fps=args.fps))
+    constructed = time.perf_counter() - started
+    dashcam.start_recording()
+    while dashcam.filestreamer.clip_start is None:
+        time.sleep(0.001)
+    return dashcam, constructed, time.perf_counter() - started
+
+def stop_dashcam(dashcam) -> None:
+    dashcam.stop_recording()
+    time.sleep(0.5)
+    dashcam.storagemanager.stop()
+    dashcam.source.stop()
+
+def run(args) -> dict:
+    generator = random.Random(args.seed)
+    base = os.path.abspath(args.directory) if args.directory else tempfile.mkdtemp(prefix='dashcam-recovery-')
+
+    clean = os.path.join(base, 'clean')
+    os.makedirs(clean)
+    os.chdir(clean)
+    dashcam, clean_constructed, clean_first_clip = start_dashcam(args)
+    stop_dashcam(dashcam)
+
+    crashed = os.path.join(base, 'crashed')
+    os.makedirs(os.path.join(crashed, 'recordings'))
+    expected = cut_clips(os.path.join(crashed, 'recordings'), args, generator)
+    os.chdir(crashed)
+    dashcam, constructed, first_clip = start_dashcam(args)
+    recovery_running_at_first_clip = dashcam.recovery.is_running
+    while dashcam.recovery.is_running:
+        time.sleep(0.01)
+    stop_dashcam(dashcam)
+    status = dashcam.recovery.get_status()
+
+    # Every kept clip has to be whole again, fragment index included
+    whole = 0
+    for name in expected:
+        path = os.path.join(crashed, 'recordings', name)
+        if os.path.exists(path):
+            fragments = scan_fragments(path)[1]
+            indexed = read_fragment_index(path)[1]
+            whole += fragments[-1][2] + fragments[-1][3] == os.path.getsize(path) and indexed == fragments
+
+    unsynced = []
+    synced = []
+    for _ in range(args.sync_clips):
+        unsynced += write_clip(os.path.join(base, 'unsynced.mp4'), args, 0)
+        synced += write_clip(os.path.join(base, 'synced.mp4'), args, 1)
+
+    return {
+        'config': vars(args),
+        'startup': {
+            'clean_construct_seconds': round(clean_constructed, 3),
+            'clean_first_clip_seconds': round(clean_first_clip, 3),
+            'construct_seconds': round(constructed, 3),
+            'first_clip_seconds': round(first_clip, 3),
+            'recovery_still_running_at_first_clip': recovery_running_at_first_clip,
+        },
+        'recovery': {
+            'seconds': status['seconds'],
+            'clips': status['clips'],
+            'recovered_clips': status['recovered_clips'],
+            'removed_clips': status['removed_clips'],
+            'clips_with_nothing_complete': sum(1 for frames in expected.values() if frames == 0),
+            'whole_after_recovery': whole,
+            'truncated_bytes': status['truncated_bytes'],
+            'frames_on_disk': sum(expected.values()),
+            'frames_recovered': status['recovered_frames'],
+            'recovered_frame_rate': round(status['recovered_frames'] / max(sum(expected.values()), 1), 4),
+        },
+        'fragment_write_ms': {
+            'unsynced_mean': round(statistics.mean(unsynced) * 1000, 3),
+            'synced_mean': round(statistics.mean(synced) * 1000, 3),
+            'synced_max': round(max(synced) * 1000, 3),
+        },
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--fps', type=int, default=30)
+    parser.add_argument('--bitrate', type=int, default=10000000)
+    parser.add_argument('--clips', type=int, default=8, help="Clips cut off by the simulated power loss")
+    parser.add_argument('--clip-duration', type=int, default=20)
+    parser.add_argument('--early-cut', type=float, default=0.2, help="Share of clips cut before their first fragment is complete")
+    parser.add_argument('--sync-clips', type=int, default=1, help="Clips written with and without syncing to time the writer")
+    parser.add_argument('--directory', help="Where to write, a fresh temporary directory by default")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    print(json.dumps(run(args), indent=2))
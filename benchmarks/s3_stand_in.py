@@ -0,0 +1,166 @@
+'''
+A small S3 compatible server for trying the uploader without a real bucket. It checks request
+signatures, supports the multipart calls the uploader makes plus GET for reading objects back,
+and can drop a share of part uploads part way through to exercise retries and resuming.
+
+    python benchmarks/s3_stand_in.py --port 9000 --directory /tmp/s3 --fail-rate 0.1
+
+Point the dashcam's upload settings at http://127.0.0.1:9000 with access key and secret key
+'dashcam'. Anything real (MinIO, Garage) works the same way.
+'''
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qsl, quote
+from xml.etree import ElementTree
+import argparse
+import hashlib
+import random
+import shutil
+import hmac
+import uuid
+import os
+
+class S3StandIn(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, directory: str, access_key: str = 'dashcam', secret_key: str = 'dashcam', fail_rate: float = 0) -> None:
+        super().__init__(address, S3Handler)
+        self.directory = directory
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.fail_rate = fail_rate
+        self.random = random.Random(1)
+        self.parts_received = 0
+        self.parts_dropped = 0
+        self.bytes_received = 0
+        os.makedirs(os.path.join(directory, 'uploads'), exist_ok=True)
+
+class S3Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        self._handle()
+
+    def do_PUT(self):
+        self._handle()
+
+    def do_GET(self):
+        self._handle()
+
+    def do_DELETE(self):
+        self._handle()
+
+    def _handle(self):
+        url = urlsplit(self.path)
+        query = dict(parse_qsl(url.query, keep_blank_values=True))
+        key = url.path.lstrip('/')
+        server = self.server
+
+        if not self._signature_valid(url):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            return self._reply(403, error=('SignatureDoesNotMatch', 'Bad signature'))
+
+        if self.command == 'PUT' and 'partNumber' in query:
+            length = int(self.headers['Content-Length'])
+            upload = os.path.join(server.directory, 'uploads', query['uploadId'])
+            if not os.path.isdir(upload):
+                self.rfile.read(length)
+                return self._reply(404, error=('NoSuchUpload', 'Unknown upload'))
+            if server.random.random() < server.fail_rate:
+                # Read some of the part then hang up, like a connection dropping mid transfer
+                self.rfile.read(length // 2)
+                server.parts_dropped += 1
+                self.close_connection = True
+                return
+            data = self.rfile.read(length)
+            with open(os.path.join(upload, f"{int(query['partNumber']):05d}"), 'wb') as f:
+                f.write(data)
+            server.parts_received += 1
+            server.bytes_received += len(data)
+            return self._reply(200, headers={'ETag': f'"{hashlib.md5(data).hexdigest()}"'})
+
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.command == 'POST' and 'uploads' in query:
+            upload_id = uuid.uuid4().hex
+            os.makedirs(os.path.join(server.directory, 'uploads', upload_id))
+            return self._reply(200, f"<InitiateMultipartUploadResult><Key>{key}</Key><UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>".encode())
+
+        if self.command == 'POST' and 'uploadId' in query:
+            upload = os.path.join(server.directory, 'uploads', query['uploadId'])
+            if not os.path.isdir(upload):
+                return self._reply(404, error=('NoSuchUpload', 'Unknown upload'))
+            target = os.path.join(server.directory, key)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, 'wb') as output:
+                for part in ElementTree.fromstring(body).iter('Part'):
+                    part_path = os.path.join(upload, f"{int(part.findtext('PartNumber')):05d}")
+                    with open(part_path, 'rb') as f:
+                        data = f.read()
+                    if f'"{hashlib.md5(data).hexdigest()}"' != part.findtext('ETag'):
+                        return self._reply(400, error=('InvalidPart', part.findtext('PartNumber')))
+                    output.write(data)
+            shutil.rmtree(upload)
+            return self._reply(200, f"<CompleteMultipartUploadResult><Key>{key}</Key></CompleteMultipartUploadResult>".encode())
+
+        if self.command == 'DELETE' and 'uploadId' in query:
+            upload = os.path.join(server.directory, 'uploads', query['uploadId'])
+            if not os.path.isdir(upload):
+                return self._reply(404, error=('NoSuchUpload', 'Unknown upload'))
+            shutil.rmtree(upload)
+            return self._reply(204)
+
+        if self.command == 'GET':
+            path = os.path.join(server.directory, key)
+            if not os.path.isfile(path):
+                return self._reply(404, error=('NoSuchKey', key))
+            with open(path, 'rb') as f:
+                return self._reply(200, f.read())
+
+        return self._reply(400, error=('InvalidRequest', self.command))
+
+    def _signature_valid(self, url) -> bool:
+        # Recomputes the AWS Signature V4 from what arrived on the wire
+        try:
+            authorization = self.headers['Authorization']
+            fields = dict(item.strip().split('=', 1) for item in authorization.split(' ', 1)[1].split(','))
+            access_key, date, region, service, _ = fields['Credential'].split('/')
+        except (AttributeError, ValueError, KeyError):
+            return False
+        if access_key != self.server.access_key:
+            return False
+        signed_headers = fields['SignedHeaders'].split(';')
+        query = sorted(parse_qsl(url.query, keep_blank_values=True))
+        canonical_request = '\n'.join([
+            self.command,
+            quote(url.path, safe='/-_.~%'),
+            '&'.join(f"{quote(k, safe='-_.~')}={quote(v, safe='-_.~')}" for k, v in query),
+            ''.join(f"{header}:{self.headers[header].strip()}\n" for header in signed_headers),
+            fields['SignedHeaders'],
+            self.headers['x-amz-content-sha256'],
+        ])
+        scope = f"{date}/{region}/{service}/aws4_request"
+        string_to_sign = '\n'.join(['AWS4-HMAC-SHA256', self.headers['x-amz-date'], scope, hashlib.sha256(canonical_request.encode()).hexdigest()])
+        key = f"AWS4{self.server.secret_key}".encode()
+        for part in (date, region, service, 'aws4_request'):
+            key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+        return hmac.compare_digest(hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest(), fields['Signature'])
+
+    def _reply(self, status: int, body: bytes = b'', headers: dict = None, error: tuple = None):
+        if error is not None:
+            body = f"<Error><Code>{error[0]}</Code><Message>{error[1]}</Message></Error>".encode()
+        self.send_response(status)
+        for header, value in (headers or {}).items():
+            self.send_header(header, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--directory', default='s3')
+    parser.add_argument('--fail-rate', type=float, default=0, help="Share of part uploads to drop part way through")
+    args = parser.parse_args()
+    S3StandIn(('0.0.0.0', args.port), args.directory, fail_rate=args.fail_rate).serve_forever()
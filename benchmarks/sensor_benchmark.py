@@ -0,0 +1,83 @@
+'''
+Runs the crash detector over an accelerometer trace, as SensorMonitor would, and reports what it
+detected and what it costs against the sensor CPU budget.
+
+    python benchmarks/sensor_benchmark.py --minutes 10 --rate 200 --write-trace drive.bin
+    python benchmarks/sensor_benchmark.py --trace drive.csv
+
+Without --trace a drive is generated: road vibration, a pothole every few seconds and impacts at
+the given times. A generated drive can be saved with --write-trace and replayed on the dashcam
+with `src/main.py --synthetic --imu-replay drive.bin`.
+'''
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from dashcam.sensors.replay_imu_source import load_trace, write_trace
+from dashcam.sensors.crash_detector import detect_trace
+import numpy as np
+import argparse
+import json
+import time
+
+def generate_drive(minutes: float, rate: int, impacts: list, seed: int = 1):
+    generator = np.random.default_rng(seed)
+    count = int(minutes * 60 * rate)
+    samples = np.zeros((count, 4))
+    samples[:, 0] = np.arange(count) / rate
+    samples[:, 1:] = generator.normal(0, 0.05, (count, 3))
+    samples[:, 3] += 1.0  # gravity
+    # Potholes, a short sharp vertical jolt well under an impact
+    for start in range(int(rate * 2.5), count, int(rate * 4.7)):
+        samples[start:start + rate // 50, 3] += 1.2
+    # Impacts, a few g along the direction of travel for around 80ms
+    pulse = int(rate * 0.08)
+    for impact in impacts:
+        start = int(impact * rate)
+        samples[start:start + pulse, 1] -= 6 * np.sin(np.linspace(0, np.pi, pulse))
+    return samples
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--trace', help="CSV or binary trace to run instead of a generated drive")
+    parser.add_argument('--minutes', type=float, default=10)
+    parser.add_argument('--rate', type=int, default=200)
+    parser.add_argument('--impacts', type=float, nargs='*', default=[95.0, 410.0], help="Seconds into the generated drive")
+    parser.add_argument('--batch', type=float, default=0.05, help="Seconds of samples per detection pass")
+    parser.add_argument('--write-trace', help="Save the generated drive, .csv or binary")
+    args = parser.parse_args()
+
+    if args.trace:
+        samples = load_trace(args.trace)
+        rate = round((len(samples) - 1) / (samples[-1, 0] - samples[0, 0]))
+    else:
+        samples = generate_drive(args.minutes, args.rate, args.impacts)
+        rate = args.rate
+    if args.write_trace:
+        if args.write_trace.endswith('.csv'):
+            np.savetxt(args.write_trace, samples, delimiter=',', fmt='%.5f', header='t,x,y,z', comments='')
+        else:
+            write_trace(args.write_trace, samples)
+
+    # Dashcam's default sensor settings
+    settings = {
+        'history': 5, 'smoothing': 0.02, 'peak_g': 3.0, 'jerk': 200, 'cooldown': 10, 'cpu_budget': 0.03,
+    }
+    batch = max(int(args.batch * rate), 1)
+    started = time.process_time()
+    detections = detect_trace(samples, settings, rate, batch)
+    cpu = time.process_time() - started
+    seconds = samples[-1, 0] - samples[0, 0]
+
+    print(json.dumps({
+        'samples': len(samples),
+        'sample_rate': rate,
+        'trace_seconds': round(seconds, 1),
+        'batch_samples': batch,
+        'detections': [round(t - samples[0, 0], 2) for t in detections],
+        'expected': None if args.trace else args.impacts,
+        'cpu_seconds': round(cpu, 3),
+        'us_per_sample': round(cpu / len(samples) * 1e6, 2),
+        'cpu_percent_of_core': round(100 * cpu / seconds, 3),
+        'cpu_budget_percent': settings['cpu_budget'] * 100,
+    }, indent=2))
@@ -0,0 +1,133 @@
+'''
+Backs a batch of generated clips up to a local S3 stand-in through the Uploader, cutting the
+power part way through (the uploader and index are dropped without finishing) and starting again
+from the checkpoints. Reports throughput against the shaped rate, how much was sent twice after
+the restart and whether every object came back byte for byte.
+
+    python benchmarks/upload_benchmark.py --clips 6 --clip-size 24 --rate 20 --fail-rate 0.05
+
+--endpoint runs against a real store instead (MinIO, Garage), using the given bucket and keys.
+'''
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from dashcam.storage.recording_index import RecordingIndex
+from dashcam.upload.s3_target import S3Target
+from dashcam.upload.uploader import Uploader
+from s3_stand_in import S3StandIn
+from threading import Thread
+import tempfile
+import argparse
+import hashlib
+import json
+import time
+
+def create_clips(directory: str, clips: int, clip_size: int) -> dict:
+    index = RecordingIndex(directory)
+    digests = {}
+    for number in range(clips):
+        name = f"dashcam_20260101-{number:06d}.mp4"
+        data = os.urandom(clip_size)
+        with open(os.path.join(directory, name), 'wb') as f:
+            f.write(data)
+        index.open_clip(name, number * 180.0)
+        index.close_clip(name, number * 180.0 + 180, clip_size, 180)
+        digests[name] = hashlib.sha256(data).hexdigest()
+    index.close()
+    return digests
+
+def run_until(uploader: Uploader, index: RecordingIndex, done) -> float:
+    started = time.perf_counter()
+    uploader.start()
+    while not done(index):
+        time.sleep(0.05)
+    uploader.stop()
+    return time.perf_counter() - started
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clips', type=int, default=6)
+    parser.add_argument('--clip-size', type=int, default=24, help="MB per clip")
+    parser.add_argument('--part-size', type=int, default=5, help="MB per part, S3 needs at least 5")
+    parser.add_argument('--connections', type=int, default=2)
+    parser.add_argument('--rate', type=float, default=20, help="MB/s the uploader is shaped to")
+    parser.add_argument('--fail-rate', type=float, default=0.05, help="Share of parts the stand-in drops part way through")
+    parser.add_argument('--cut-after', type=float, default=0.4, help="Share of the batch sent before the power is cut")
+    parser.add_argument('--endpoint', help="Use a real S3 compatible store instead of the stand-in")
+    parser.add_argument('--bucket', default='dashcam')
+    parser.add_argument('--access-key', default='dashcam')
+    parser.add_argument('--secret-key', default='dashcam')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='dashcam-upload-') as directory:
+        recordings = os.path.join(directory, 'recordings')
+        os.makedirs(recordings)
+        clip_size = args.clip_size * 1000000
+        digests = create_clips(recordings, args.clips, clip_size)
+
+        stand_in = None
+        endpoint = args.endpoint
+        if endpoint is None:
+            stand_in = S3StandIn(('127.0.0.1', 0), os.path.join(directory, 's3'), args.access_key, args.secret_key, args.fail_rate)
+            Thread(target=stand_in.serve_forever, daemon=True).start()
+            endpoint = f"http://127.0.0.1:{stand_in.server_address[1]}"
+
+        settings = {
+            'endpoint': endpoint, 'bucket': args.bucket, 'prefix': 'benchmark/', 'region': 'us-east-1',
+            'access_key': args.access_key, 'secret_key': args.secret_key,
+            'part_size': args.part_size * 1000000, 'connections': args.connections,
+            'rate': int(args.rate * 1000000), 'streaming_rate': int(args.rate * 1000000),
+            'timeout': 30, 'retries': 5, 'retry_interval': 1, 'check_interval': 0.2,
+        }
+        total = args.clips * clip_size
+        parts_per_clip = -(-clip_size // settings['part_size'])
+
+        def parts_sent(index: RecordingIndex) -> int:
+            totals = index.upload_totals()
+            in_progress = sum(len(index.get_upload(name)[2]) for name, in index.connection.execute('SELECT name FROM uploads'))
+            return totals['uploaded_clips'] * parts_per_clip + in_progress
+
+        # First boot, the power goes part way through the batch
+        index = RecordingIndex(recordings)
+        uploader = Uploader(index, S3Target(settings), settings, lambda: False)
+        cut_at = int(args.clips * parts_per_clip * args.cut_after)
+        first_seconds = run_until(uploader, index, lambda index: parts_sent(index) >= cut_at)
+        sent_before_cut = parts_sent(index)
+        received_before_cut = stand_in.parts_received if stand_in else None
+        index.close()
+
+        # Second boot, picks the checkpoints back up
+        index = RecordingIndex(recordings)
+        uploader = Uploader(index, S3Target(settings), settings, lambda: False)
+        resumed_from = parts_sent(index)
+        second_seconds = run_until(uploader, index, lambda index: index.upload_totals()['pending_clips'] == 0)
+        status = uploader.get_status()
+
+        # Objects are only read back from the stand-in, a real store only reports what the uploader saw
+        matching = status['uploaded_clips']
+        if stand_in is not None:
+            matching = 0
+            for name, digest in digests.items():
+                path = os.path.join(stand_in.directory, args.bucket, 'benchmark', name)
+                if os.path.exists(path):
+                    with open(path, 'rb') as f:
+                        matching += hashlib.sha256(f.read()).hexdigest() == digest
+        index.close()
+
+        results = {
+            'clips': args.clips,
+            'megabytes': total / 1e6,
+            'rate_mb_s': args.rate,
+            'throughput_mb_s': round(total / 1e6 / (first_seconds + second_seconds), 2),
+            'parts_before_cut': sent_before_cut,
+            'parts_resumed_from_checkpoint': resumed_from,
+            'parts_lost_in_cut': (received_before_cut - sent_before_cut) if stand_in else None,
+            'parts_dropped_by_store': stand_in.parts_dropped if stand_in else None,
+            'throttled_seconds': status['throttled_seconds'],
+            'failures': status['failures'],
+            'objects_matching': f"{matching}/{args.clips}",
+        }
+        if stand_in is not None:
+            stand_in.shutdown()
+    print(json.dumps(results, indent=4))
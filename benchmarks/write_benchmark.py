@@ -0,0 +1,147 @@
+'''
+Writes the same 10Mbps stream in real time twice, once straight to the file from the encoder
+thread as the muxer used to and once through the ClipWriter's pool of aligned blocks, each syncing
+every fragment. For both it reports the size and alignment of every write the card saw, how long
+the encoder thread was held per fragment, the stalls waiting on the card, how many bytes reached
+the card for every byte of clip and how many extents the finished clip ended up in. --card-rate
+slows every write down to that many MB a second, like a worn card.
+
+    python benchmarks/write_benchmark.py --seconds 20 --card-rate 3 --directory /home/pi/bench
+'''
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from dashcam.outputs.clip_writer import BufferPool, ClipWriter
+from dashcam.sources.synthetic_h264 import synthetic_frames
+from dashcam.outputs.mp4_output import Mp4Output
+import dashcam.outputs.mp4_output as mp4_output
+import subprocess
+import statistics
+import tempfile
+import argparse
+import json
+import time
+import io
+
+CARD_RATE = None
+
+class CountingFile(io.FileIO):
+    # What the muxer's buffered file hands the kernel, slowed to the card's rate
+    writes = []
+
+    def write(self, data) -> int:
+        started = time.perf_counter()
+        position = self.tell()
+        written = super().write(data)
+        if CARD_RATE:
+            time.sleep(written / CARD_RATE)
+        CountingFile.writes.append((position, written, time.perf_counter() - started))
+        return written
+
+class DirectMp4Output(Mp4Output):
+    def start(self) -> None:
+        super().start()
+        self.file.close()
+        self.file = io.BufferedWriter(CountingFile(self.path, 'w'))
+
+class SlowClipWriter(ClipWriter):
+    writes = []
+
+    def _write(self, buffer, offset: int, length: int) -> None:
+        started = time.perf_counter()
+        super()._write(buffer, offset, length)
+        if CARD_RATE:
+            time.sleep(length / CARD_RATE)
+        SlowClipWriter.writes.append((offset, length, time.perf_counter() - started))
+
+def record(output, args) -> list:
+    # Returns how long the encoder thread spent in each fragment's outputframe
+    output.start()
+    frames = synthetic_frames(args.width, args.height, args.fps, int(args.bitrate * 1000000), args.fps)
+    holds = []
+    started = time.monotonic()
+    for number in range(int(args.seconds * args.fps)):
+        frame, keyframe = next(frames)
+        delay = started + number / args.fps - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        began = time.perf_counter()
+        output.outputframe(frame, keyframe, number * 1000000 // args.fps)
+        if keyframe and number:
+            holds.append(time.perf_counter() - began)
+    output.stop()
+    return holds
+
+def extents(path: str) -> int:
+    try:
+        result = subprocess.run(['filefrag', path], capture_output=True, text=True, check=True)
+        return int(result.stdout.rsplit(':', 1)[1].split()[0])
+    except (OSError, subprocess.CalledProcessError, ValueError, IndexError):
+        return None
+
+def summarise(writes: list, holds: list, stalls: list, path: str, block: int) -> dict:
+    sizes = sorted(size for _, size, _ in writes)
+    times = sorted(seconds for _, _, seconds in writes)
+    size = os.path.getsize(path)
+    return {
+        'writes': len(writes),
+        'write_size_bytes': {'p10': sizes[len(sizes) // 10], 'median': int(statistics.median(sizes)), 'max': sizes[-1]},
+        'aligned_writes': round(sum(1 for offset, _, _ in writes if offset % block == 0) / len(writes), 3),
+        'write_ms': {'median': round(statistics.median(times) * 1000, 3), 'max': round(times[-1] * 1000, 1)},
+        'encoder_hold_ms': {'median': round(statistics.median(holds) * 1000, 2),
+                            'p99': round(sorted(holds)[int(len(holds) * 0.99)] * 1000, 2),
+                            'max': round(max(holds) * 1000, 1)},
+        'stalls': sum(1 for stall in stalls if stall > 0.001),
+        'stall_ms_total': round(sum(stalls) * 1000, 1),
+        'bytes_to_card_per_clip_byte': round(sum(size for _, size, _ in writes) / size, 3),
+        'extents': extents(path),
+        'clip_bytes': size,
+    }
+
+def run(args) -> dict:
+    global CARD_RATE
+    CARD_RATE = args.card_rate * 1000000 if args.card_rate else None
+    directory = args.directory or tempfile.mkdtemp(prefix='dashcam-bench-')
+    os.makedirs(directory, exist_ok=True)
+    block = args.block_kb * 1024
+    resolution = (args.width, args.height)
+
+    direct_path = os.path.join(directory, 'bench_direct.mp4')
+    holds = record(DirectMp4Output(direct_path, resolution, args.fps, args.sync_fragments), args)
+    direct = summarise(CountingFile.writes, holds, [], direct_path, block)
+
+    pooled_path = os.path.join(directory, 'bench_pooled.mp4')
+    pool = BufferPool(args.buffers, block)
+    preallocate = int(args.bitrate * 1000000 / 8 * args.seconds * 1.1)
+    mp4_output.ClipWriter = SlowClipWriter
+    output = Mp4Output(pooled_path, resolution, args.fps, args.sync_fragments, None, pool, preallocate)
+    stalls = []
+    output.on_stall = stalls.append
+    holds = record(output, args)
+    pooled = dict(summarise(SlowClipWriter.writes, holds, stalls, pooled_path, block), buffers_peak=pool.peak)
+
+    for path in (direct_path, pooled_path):
+        for name in (path, path + '.idx'):
+            if os.path.exists(name):
+                os.remove(name)
+    return {'config': vars(args), 'direct': direct, 'pooled': pooled}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--fps', type=int, default=30)
+    parser.add_argument('--bitrate', type=float, default=10, help="Mbps")
+    parser.add_argument('--sync-fragments', type=int, default=1)
+    parser.add_argument('--block-kb', type=int, default=256)
+    parser.add_argument('--buffers', type=int, default=16)
+    parser.add_argument('--card-rate', type=float, default=0, help="MB a second the card takes, 0 for as fast as it goes")
+    parser.add_argument('--directory', help="Where to write, the SD card for real numbers")
+    args = parser.parse_args()
+
+    result = run(args)
+    print(json.dumps(result, indent=2))
+    # The point of the pool: the encoder thread is never held up the way writing straight through holds it
+    sys.exit(0 if result['pooled']['encoder_hold_ms']['max'] <= result['direct']['encoder_hold_ms']['max'] else 1)
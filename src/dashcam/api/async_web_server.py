@@ -0,0 +1,178 @@
+from aiohttp import web
+import asyncio
+import json
+
+def number(query, key: str, kind=float, default=None):
+    # Like Flask's request.args.get(key, default, type=kind), a value that doesn't parse is left out
+    try:
+        return kind(query[key]) if key in query else default
+    except ValueError:
+        return default
+
+async def json_object(request) -> dict:
+    # The same as the Flask server's: no body or one that doesn't parse is empty, one that isn't an object is a bad request
+    if not request.can_read_body:
+        return {}
+    try:
+        data = await request.json()
+    except ValueError:
+        return {}
+    if data is not None and not isinstance(data, dict):
+        raise web.HTTPBadRequest(text=json.dumps({"message": "The body should be a JSON object"}), content_type='application/json')
+    return data or {}
+
+class AsyncDashcamWebServer():
+    '''
+    The same API as DashcamWebServer served from a single asyncio loop. Streams and downloads are
+    coroutines rather than worker threads, so any number of them can be open without starving the
+    control endpoints. Dashcam calls run in the default executor to keep the loop responsive.
+    '''
+    def __init__(self, dashcam) -> None:
+        self.app = web.Application()
+        self.dashcam = dashcam
+        self.setup_routes()
+
+    def setup_routes(self):
+        self.app.add_routes([
+            web.post('/start_recording', self.control(self.dashcam.start_recording)),
+            web.post('/stop_recording', self.control(self.dashcam.stop_recording)),
+            web.post('/start_streaming', self.control(self.dashcam.start_streaming)),
+            web.post('/stop_streaming', self.control(self.dashcam.stop_streaming)),
+            web.get('/storage', self.control(self.dashcam.get_storage_status)),
+            web.get('/camera', self.control(self.dashcam.get_camera_status)),
+            web.get('/cameras', self.control(self.dashcam.get_cameras_status)),
+            web.get('/overlay', self.control(self.dashcam.get_overlay_stats)),
+            web.get('/sensors', self.control(self.dashcam.get_sensor_status)),
+            web.get('/gps', self.control(self.dashcam.get_gps_status)),
+            web.get('/audio', self.control(self.dashcam.get_audio_status)),
+            web.get('/quality', self.control(self.dashcam.get_quality_status)),
+            web.get('/parking', self.control(self.dashcam.get_parking_status)),
+            web.post('/parking/start', self.control(self.dashcam.start_parking)),
+            web.post('/parking/stop', self.control(self.dashcam.stop_parking)),
+            web.get('/uploads', self.control(self.dashcam.get_upload_status)),
+            web.get('/settings', self.control(self.dashcam.get_settings)),
+            web.post('/settings', self.update_settings),
+            web.get('/metrics', self.get_metrics),
+            web.post('/save_event', self.save_event),
+            web.get('/recordings', self.get_recordings),
+            web.get('/recordings/near', self.get_recordings_near),
+            web.get('/recordings/{name}', self.get_recording),
+            web.get('/recordings/{name}/alongside', self.get_recordings_alongside),
+            web.get('/recordings/{name}/track', self.get_track),
+            web.get('/recordings/{name}/thumb', self.get_thumbnail),
+            web.post('/recordings/{name}/lock', self.lock_recording),
+            web.post('/recordings/{name}/unlock', self.unlock_recording),
+            web.post('/export', self.export_recording),
+            web.get('/exports/{name}', self.get_export),
+            web.get('/stream.mjpg', self.stream),
+        ])
+
+    def control(self, method):
+        async def handler(request):
+            result, status_code = await asyncio.to_thread(method)
+            return web.json_response(result, status=status_code)
+        return handler
+
+    async def get_metrics(self, request):
+        # A few gauges read sysfs and statvfs, keep those off the loop
+        text = await asyncio.to_thread(self.dashcam.get_metrics)
+        return web.Response(text=text, content_type='text/plain')
+
+    async def save_event(self, request):
+        data = await json_object(request)
+        result, status_code = await asyncio.to_thread(self.dashcam.save_event, data.get('pre_seconds'), data.get('post_seconds'))
+        return web.json_response(result, status=status_code)
+
+    async def update_settings(self, request):
+        data = await json_object(request)
+        result, status_code = await asyncio.to_thread(self.dashcam.update_settings, data)
+        return web.json_response(result, status=status_code)
+
+    async def get_recordings(self, request):
+        result, status_code = await asyncio.to_thread(
+            self.dashcam.get_recordings, number(request.query, 'start'), number(request.query, 'end'), request.query.get('camera'))
+        return web.json_response(result, status=status_code)
+
+    async def get_recordings_near(self, request):
+        query = request.query
+        latitude, longitude = number(query, 'lat'), number(query, 'lon')
+        if latitude is None or longitude is None:
+            return web.json_response({"message": "lat and lon are needed"}, status=400)
+        result, status_code = await asyncio.to_thread(
+            self.dashcam.get_recordings_near, latitude, longitude, number(query, 'radius', default=100),
+            number(query, 'start'), number(query, 'end'))
+        return web.json_response(result, status=status_code)
+
+    async def get_recordings_alongside(self, request):
+        result, status_code = await asyncio.to_thread(self.dashcam.get_recordings_alongside, request.match_info['name'])
+        return web.json_response(result, status=status_code)
+
+    async def get_track(self, request):
+        result, status_code = await asyncio.to_thread(self.dashcam.get_track, request.match_info['name'])
+        return web.json_response(result, status=status_code)
+
+    async def get_recording(self, request):
+        path = await asyncio.to_thread(self.dashcam.get_recording_path, request.match_info['name'])
+        if path is None:
+            return web.json_response({"message": "Recording not found"}, status=404)
+        # FileResponse answers Range/If-Range with 206s and sends the body with os.sendfile
+        return web.FileResponse(path, chunk_size=256 * 1024)
+
+    async def lock_recording(self, request):
+        result, status_code = await asyncio.to_thread(self.dashcam.lock_recording, request.match_info['name'], True)
+        return web.json_response(result, status=status_code)
+
+    async def unlock_recording(self, request):
+        result, status_code = await asyncio.to_thread(self.dashcam.lock_recording, request.match_info['name'], False)
+        return web.json_response(result, status=status_code)
+
+    async def get_thumbnail(self, request):
+        index = number(request.query, 'index', int, 0)
+        thumbnail = await asyncio.to_thread(self.dashcam.get_thumbnail, request.match_info['name'], index)
+        if thumbnail is None:
+            return web.json_response({"message": "Thumbnail not found"}, status=404)
+        frame, etag, last_modified = thumbnail
+
+        if request.if_none_match is not None:
+            not_modified = any(tag.value in (etag, '*') for tag in request.if_none_match)
+        else:
+            not_modified = request.if_modified_since is not None and int(last_modified) <= request.if_modified_since.timestamp()
+        response = web.Response(status=304) if not_modified else web.Response(body=frame, content_type='image/jpeg')
+        response.etag = etag
+        response.last_modified = last_modified
+        return response
+
+    async def export_recording(self, request):
+        data = await json_object(request)
+        result, status_code = await asyncio.to_thread(self.dashcam.export_recording, data.get('name'), data.get('start'), data.get('end'), data.get('camera'))
+        return web.json_response(result, status=status_code)
+
+    async def get_export(self, request):
+        path = await asyncio.to_thread(self.dashcam.get_export_path, request.match_info['name'])
+        if path is None:
+            return web.json_response({"message": "Export not found"}, status=404)
+        return web.FileResponse(path, chunk_size=256 * 1024, headers={'Content-Disposition': f'attachment; filename="{request.match_info["name"]}"'})
+
+    async def stream(self, request):
+        frames = self.dashcam.stream_frames_async(request.query.get('camera'))
+        if frames is None:
+            return web.json_response({"message": "Not streaming"}, status=400)
+
+        response = web.StreamResponse(headers={
+            'Content-Type': 'multipart/x-mixed-replace; boundary=FRAME',
+            'Cache-Control': 'no-cache',
+        })
+        await response.prepare(request)
+        try:
+            async for frame in frames:
+                # write() waits for the client to drain, anything encoded meanwhile is skipped
+                await response.write(b'--FRAME\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n' % len(frame) + frame + b'\r\n')
+        except ConnectionResetError:
+            pass
+        finally:
+            await frames.aclose()
+        return response
+
+    def start_server(self):
+        settings = self.dashcam.settings['api']
+        web.run_app(self.app, host=settings['host'], port=settings['port'], handle_signals=False, print=None)
@@ -1,5 +1,29 @@
-from flask import Flask, jsonify
+from flask import Flask, Response, abort, jsonify, make_response, request, send_file
 from waitress import serve
+import socket
+
+# Each MJPEG viewer holds a worker thread for as long as it is connected. Waitress would queue up to
+# 16MB for a viewer that can't keep up and the kernel megabytes more, seconds of stale video. With
+# both kept small the stream is held back instead and skips to the latest frame, still plenty for a
+# clip download over wifi
+SERVER_OPTIONS = {'threads': 16, 'outbuf_high_watermark': 256 * 1024}
+SEND_BUFFER = 256 * 1024
+
+def listen(host: str, port: int) -> socket.socket:
+    # Connections take their send buffer from the socket they were accepted on
+    listener = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER)
+    listener.bind((host, port))
+    return listener
+
+def json_object() -> dict:
+    # The request's JSON body. Like get_json(silent=True) no body, or one that doesn't parse, counts as
+    # empty, but anything other than an object is a bad request rather than an error further on
+    data = request.get_json(silent=True)
+    if data is not None and not isinstance(data, dict):
+        abort(make_response(jsonify({"message": "The body should be a JSON object"}), 400))
+    return data or {}
 
 class DashcamWebServer():
     def __init__(self, dashcam) -> None:
@@ -18,6 +42,156 @@ class DashcamWebServer():
             result, status_code = self.dashcam.stop_recording()
             return jsonify(result), status_code
         
+        @self.app.route('/save_event', methods=['POST'])
+        def save_event():
+            data = json_object()
+            result, status_code = self.dashcam.save_event(data.get('pre_seconds'), data.get('post_seconds'))
+            return jsonify(result), status_code
+
+        @self.app.route('/recordings', methods=['GET'])
+        def get_recordings():
+            start_time = request.args.get('start', type=float)
+            end_time = request.args.get('end', type=float)
+            result, status_code = self.dashcam.get_recordings(start_time, end_time, request.args.get('camera'))
+            return jsonify(result), status_code
+
+        @self.app.route('/recordings/near', methods=['GET'])
+        def get_recordings_near():
+            latitude = request.args.get('lat', type=float)
+            longitude = request.args.get('lon', type=float)
+            if latitude is None or longitude is None:
+                return jsonify({"message": "lat and lon are needed"}), 400
+            result, status_code = self.dashcam.get_recordings_near(
+                latitude, longitude, request.args.get('radius', 100, type=float),
+                request.args.get('start', type=float), request.args.get('end', type=float))
+            return jsonify(result), status_code
+
+        @self.app.route('/recordings/<name>', methods=['GET'])
+        def get_recording(name):
+            path = self.dashcam.get_recording_path(name)
+            if path is None:
+                return jsonify({"message": "Recording not found"}), 404
+            return send_file(path, conditional=True)
+
+        @self.app.route('/recordings/<name>/lock', methods=['POST'])
+        def lock_recording(name):
+            result, status_code = self.dashcam.lock_recording(name, True)
+            return jsonify(result), status_code
+
+        @self.app.route('/recordings/<name>/unlock', methods=['POST'])
+        def unlock_recording(name):
+            result, status_code = self.dashcam.lock_recording(name, False)
+            return jsonify(result), status_code
+
+        @self.app.route('/recordings/<name>/alongside', methods=['GET'])
+        def get_recordings_alongside(name):
+            result, status_code = self.dashcam.get_recordings_alongside(name)
+            return jsonify(result), status_code
+
+        @self.app.route('/recordings/<name>/track', methods=['GET'])
+        def get_track(name):
+            result, status_code = self.dashcam.get_track(name)
+            return jsonify(result), status_code
+
+        @self.app.route('/recordings/<name>/thumb', methods=['GET'])
+        def get_thumbnail(name):
+            thumbnail = self.dashcam.get_thumbnail(name, request.args.get('index', 0, type=int))
+            if thumbnail is None:
+                return jsonify({"message": "Thumbnail not found"}), 404
+            frame, etag, last_modified = thumbnail
+            response = Response(frame, mimetype='image/jpeg')
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            # Answers If-None-Match/If-Modified-Since with a 304 and no body
+            return response.make_conditional(request)
+
+        @self.app.route('/export', methods=['POST'])
+        def export_recording():
+            data = json_object()
+            result, status_code = self.dashcam.export_recording(data.get('name'), data.get('start'), data.get('end'), data.get('camera'))
+            return jsonify(result), status_code
+
+        @self.app.route('/exports/<name>', methods=['GET'])
+        def get_export(name):
+            path = self.dashcam.get_export_path(name)
+            if path is None:
+                return jsonify({"message": "Export not found"}), 404
+            return send_file(path, conditional=True, as_attachment=True)
+
+        @self.app.route('/storage', methods=['GET'])
+        def get_storage_status():
+            result, status_code = self.dashcam.get_storage_status()
+            return jsonify(result), status_code
+
+        @self.app.route('/camera', methods=['GET'])
+        def get_camera_status():
+            result, status_code = self.dashcam.get_camera_status()
+            return jsonify(result), status_code
+
+        @self.app.route('/cameras', methods=['GET'])
+        def get_cameras_status():
+            result, status_code = self.dashcam.get_cameras_status()
+            return jsonify(result), status_code
+
+        @self.app.route('/sensors', methods=['GET'])
+        def get_sensor_status():
+            result, status_code = self.dashcam.get_sensor_status()
+            return jsonify(result), status_code
+
+        @self.app.route('/uploads', methods=['GET'])
+        def get_upload_status():
+            result, status_code = self.dashcam.get_upload_status()
+            return jsonify(result), status_code
+
+        @self.app.route('/quality', methods=['GET'])
+        def get_quality_status():
+            result, status_code = self.dashcam.get_quality_status()
+            return jsonify(result), status_code
+
+        @self.app.route('/parking', methods=['GET'])
+        def get_parking_status():
+            result, status_code = self.dashcam.get_parking_status()
+            return jsonify(result), status_code
+
+        @self.app.route('/parking/start', methods=['POST'])
+        def start_parking():
+            result, status_code = self.dashcam.start_parking()
+            return jsonify(result), status_code
+
+        @self.app.route('/parking/stop', methods=['POST'])
+        def stop_parking():
+            result, status_code = self.dashcam.stop_parking()
+            return jsonify(result), status_code
+
+        @self.app.route('/settings', methods=['GET'])
+        def get_settings():
+            result, status_code = self.dashcam.get_settings()
+            return jsonify(result), status_code
+
+        @self.app.route('/settings', methods=['POST'])
+        def update_settings():
+            result, status_code = self.dashcam.update_settings(json_object())
+            return jsonify(result), status_code
+
+        @self.app.route('/gps', methods=['GET'])
+        def get_gps_status():
+            result, status_code = self.dashcam.get_gps_status()
+            return jsonify(result), status_code
+
+        @self.app.route('/audio', methods=['GET'])
+        def get_audio_status():
+            result, status_code = self.dashcam.get_audio_status()
+            return jsonify(result), status_code
+
+        @self.app.route('/overlay', methods=['GET'])
+        def get_overlay_stats():
+            result, status_code = self.dashcam.get_overlay_stats()
+            return jsonify(result), status_code
+
+        @self.app.route('/metrics', methods=['GET'])
+        def get_metrics():
+            return Response(self.dashcam.get_metrics(), mimetype='text/plain; version=0.0.4')
+
         @self.app.route('/start_streaming', methods=['POST'])
         def start_streaming():
             result, status_code = self.dashcam.start_streaming()
@@ -28,5 +202,20 @@ class DashcamWebServer():
             result, status_code = self.dashcam.stop_streaming()
             return jsonify(result), status_code
 
+        @self.app.route('/stream.mjpg', methods=['GET'])
+        def stream():
+            frames = self.dashcam.stream_frames(request.args.get('camera'))
+            if frames is None:
+                return jsonify({"message": "Not streaming"}), 400
+
+            def generate():
+                for frame in frames:
+                    yield b'--FRAME\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n' % len(frame)
+                    yield frame
+                    yield b'\r\n'
+
+            return Response(generate(), mimetype='multipart/x-mixed-replace; boundary=FRAME')
+
     def start_server(self):
-        serve(self.app, host="0.0.0.0", port=5000)
\ No newline at end of file
+        settings = self.dashcam.settings['api']
+        serve(self.app, sockets=[listen(settings['host'], settings['port'])], **SERVER_OPTIONS)
\ No newline at end of file
@@ -0,0 +1,34 @@
+from dashcam.audio.audio_source import AudioSource
+import alsaaudio
+
+class AlsaSource(AudioSource):
+    '''
+    A USB or I2S microphone through ALSA, read with blocking period sized reads.
+    '''
+    def __init__(self, device: str, sample_rate: int, channels: int, period_frames: int, periods: int = 4) -> None:
+        super().__init__(sample_rate, channels, period_frames)
+        self.device = device
+        self.periods = periods
+        self.pcm = None
+        self.overruns = 0
+
+    def start(self) -> None:
+        self.pcm = alsaaudio.PCM(alsaaudio.PCM_CAPTURE, alsaaudio.PCM_NORMAL, device=self.device,
+                                 channels=self.channels, rate=self.sample_rate, format=alsaaudio.PCM_FORMAT_S16_LE,
+                                 periodsize=self.period_frames, periods=self.periods)
+
+    def stop(self) -> None:
+        if self.pcm is not None:
+            self.pcm.close()
+            self.pcm = None
+
+    def read(self):
+        if self.pcm is None:
+            return None
+        length, data = self.pcm.read()
+        if length < 0:
+            # -EPIPE, the capture buffer filled before we got to it. pyalsaaudio has already restarted
+            # the stream, the missing time shows up in the next period's timestamp
+            self.overruns += 1
+            return b''
+        return data
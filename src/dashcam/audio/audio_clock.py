@@ -0,0 +1,74 @@
+class AudioClock():
+    '''
+    Keeps the audio track on the camera's clock. A microphone's sample clock runs a little fast or
+    slow against the camera's (tens of ppm is usual), so counting samples alone drifts by a good
+    fraction of a second over a long drive. Each period's capture time is compared with where the
+    samples counted so far put it. Reads only ever come back late, so the difference from the
+    earliest read in a window of periods is the drift, and once that is past the tolerance a few
+    frames are repeated or skipped to pull it back. A gap, periods lost to an overrun, is filled with
+    silence in one go. A single late read never moves anything, it is outvoted by the rest of its window.
+    '''
+    def __init__(self, sample_rate: int, tolerance: float, step: float, window: int, gap: float) -> None:
+        self.sample_rate = sample_rate
+        self.tolerance = tolerance
+        self.step = max(int(step * sample_rate), 1)
+        self.window = window
+        self.gap = gap
+        self.origin = None
+        # Frames on the track so far, corrections included
+        self.frames = 0
+        self.window_error = None
+        self.window_periods = 0
+
+        self.drift = 0.0
+        self.max_drift = 0.0
+        self.inserted = 0
+        self.skipped = 0
+        self.gaps = 0
+
+    def time_of(self, frames: int) -> int:
+        # Camera clock microseconds of a frame on the track
+        return self.origin + frames * 1000000 // self.sample_rate
+
+    def place(self, captured: int, frames: int) -> int:
+        # captured is the camera clock time of the period's first frame in microseconds. Returns how
+        # many frames go in front of the period, or when negative how many to skip from its start
+        if self.origin is None:
+            self.origin = captured
+            self.frames = frames
+            return 0
+
+        # Positive when the track has got ahead of the capture and would play late
+        error = (self.time_of(self.frames) - captured) / 1000000
+        self.window_error = error if self.window_error is None else max(self.window_error, error)
+        self.window_periods += 1
+        correction = 0
+        if self.window_periods >= self.window:
+            self.drift = self.window_error
+            self.max_drift = max(self.max_drift, abs(self.drift))
+            if abs(self.drift) >= self.gap:
+                # Not drift, time went missing (or the clock stepped). Line straight back up
+                correction = max(round(-self.drift * self.sample_rate), -frames)
+                self.gaps += 1
+            elif self.drift > self.tolerance:
+                correction = -min(self.step, round(self.drift * self.sample_rate), frames)
+            elif self.drift < -self.tolerance:
+                correction = min(self.step, round(-self.drift * self.sample_rate))
+            self.window_error = None
+            self.window_periods = 0
+
+        if correction > 0:
+            self.inserted += correction
+        else:
+            self.skipped -= correction
+        self.frames += frames + correction
+        return correction
+
+    def get_status(self) -> dict:
+        return {
+            "drift_ms": round(self.drift * 1000, 2),
+            "max_drift_ms": round(self.max_drift * 1000, 2),
+            "inserted_frames": self.inserted,
+            "skipped_frames": self.skipped,
+            "gaps": self.gaps,
+        }
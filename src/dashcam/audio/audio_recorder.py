@@ -0,0 +1,209 @@
+from dashcam.audio.audio_clock import AudioClock
+from dashcam.audio.pcm_ring import PcmRing
+from threading import Event, Lock, Thread
+import numpy as np
+import time
+import av
+
+# Encoder name in FFmpeg for each codec we can put in a clip
+ENCODERS = {
+    'aac': 'aac',
+    'opus': 'libopus',
+}
+
+class AudioRecorder():
+    '''
+    Captures from the microphone on one thread and encodes to AAC or Opus on another, handing the
+    packets to whatever is recording. The two threads are joined by a PcmRing so a slow encode never
+    holds up capture and how far audio can lag is bounded by the ring. Each period is stamped with
+    the camera's clock as it is read, and AudioClock keeps the track in step with the video.
+    '''
+    def __init__(self, source, settings: dict, clock) -> None:
+        self.source = source
+        self.settings = settings
+        self.clock = clock
+        self.stop_event = Event()
+        self.is_running = False
+        self.frame_bytes = 2 * source.channels
+        self.ring = PcmRing(settings['ring_periods'], source.period_frames * self.frame_bytes)
+        self.audio_clock = None
+        self.encoder = None
+        self.planar = False
+        self.staging = None
+        self.staged = 0
+        self.encoded_frames = 0
+        # What Mp4Output needs to describe the track, set once the encoder is open
+        self.track = None
+        # Each output with the function that turns a camera clock time into its timestamps
+        self.outputs = {}
+        self.outputs_lock = Lock()
+
+        self.periods = 0
+        self.packets = 0
+        self.bytes_encoded = 0
+        self.started = None
+        self.cpu_seconds = {"capture": 0.0, "encode": 0.0}
+
+    def start(self):
+        if self.is_running:
+            return {"message": "Already running"}, 400
+        # Opened here rather than on the encode thread so the track is known before the first clip opens
+        self._open_encoder()
+        self.ring.reset()
+        self.stop_event.clear()
+        self.is_running = True
+        self.started = time.monotonic()
+        Thread(target=self._capture, name="AudioCapture", daemon=True).start()
+        Thread(target=self._encode, name="AudioEncoder", daemon=True).start()
+        return {"message": "Started audio"}, 200
+
+    def stop(self):
+        if not self.is_running:
+            return {"message": "Not running"}, 400
+        self.stop_event.set()
+        self.is_running = False
+        return {"message": "Stopped audio"}, 200
+
+    def add_output(self, output, to_output_time) -> None:
+        # to_output_time returns None while the output can't place audio yet, those packets are skipped
+        with self.outputs_lock:
+            self.outputs[output] = to_output_time
+
+    def remove_output(self, output) -> None:
+        with self.outputs_lock:
+            self.outputs.pop(output, None)
+
+    def get_status(self) -> dict:
+        elapsed = time.monotonic() - self.started if self.started is not None else 0
+        cpu = sum(self.cpu_seconds.values())
+        return dict({
+            "running": self.is_running,
+            "codec": self.settings['codec'],
+            "sample_rate": self.source.sample_rate,
+            "channels": self.source.channels,
+            "periods": self.periods,
+            "packets": self.packets,
+            "bitrate": round(self.bytes_encoded * 8 / (self.encoded_frames / self.source.sample_rate)) if self.encoded_frames else None,
+            "ring_periods": len(self.ring),
+            "ring_peak": self.ring.peak,
+            "ring_dropped": self.ring.dropped,
+            "cpu_percent": round(100 * cpu / elapsed, 2) if elapsed else None,
+            "cpu_seconds": {name: round(seconds, 3) for name, seconds in self.cpu_seconds.items()},
+        }, **(self.audio_clock.get_status() if self.audio_clock is not None else {}))
+
+    def _open_encoder(self) -> None:
+        settings = self.settings
+        rate, channels = self.source.sample_rate, self.source.channels
+        encoder = av.CodecContext.create(ENCODERS[settings['codec']], 'w')
+        encoder.sample_rate = rate
+        encoder.layout = 'mono' if channels == 1 else 'stereo'
+        # FFmpeg's AAC encoder only takes planar float, libopus takes our 16-bit samples as they are
+        self.planar = 's16' not in [audio_format.name for audio_format in encoder.codec.audio_formats]
+        encoder.format = 'fltp' if self.planar else 's16'
+        encoder.bit_rate = settings['bitrate']
+        encoder.open()
+        self.encoder = encoder
+        frame_size = encoder.frame_size or self.source.period_frames
+        self.staging = np.zeros((channels, frame_size), dtype=np.float32) if self.planar else np.zeros((1, frame_size * channels), dtype='<i2')
+        self.staged = 0
+        self.encoded_frames = 0
+        self.audio_clock = AudioClock(rate, settings['drift_tolerance'], settings['drift_step'], settings['drift_window'], settings['gap'])
+        self.track = {
+            "codec": settings['codec'],
+            "sample_rate": rate,
+            "channels": channels,
+            "frame_size": frame_size,
+            "bitrate": settings['bitrate'],
+            "extradata": bytes(encoder.extradata or b''),
+        }
+
+    def _capture(self) -> None:
+        self.source.start()
+        print("Started AudioCapture")
+        cpu = time.thread_time()
+        try:
+            while not self.stop_event.is_set():
+                if not self._capture_period():
+                    break
+                self.cpu_seconds['capture'] = time.thread_time() - cpu
+        finally:
+            self.source.stop()
+            self.ring.close()
+        print("AudioCapture stopped")
+
+    def _capture_period(self) -> bool:
+        data = self.source.read()
+        if data is None:
+            return False
+        if data:
+            # Stamped as it comes back, a read can only ever return late so the first frame was captured no later than this
+            captured = self.clock() - (len(data) // self.frame_bytes) * 1000000 // self.source.sample_rate
+            self.ring.put(data, captured)
+            self.periods += 1
+        return True
+
+    def _encode(self) -> None:
+        print("Started AudioEncoder")
+        cpu = time.thread_time()
+        while self._encode_period():
+            self.cpu_seconds['encode'] = time.thread_time() - cpu
+        for packet in self.encoder.encode(None):
+            self._deliver(packet)
+        print("AudioEncoder stopped")
+
+    def _encode_period(self, timeout: float = None) -> bool:
+        period = self.ring.get(timeout)
+        if period is None:
+            return False
+        data, captured = period
+        samples = np.frombuffer(data, dtype='<i2').reshape(-1, self.source.channels)
+        correction = self.audio_clock.place(captured, len(samples))
+        if correction > self.audio_clock.step:
+            # Lost to an overrun, silence stands in for it
+            self._stage(np.zeros((correction, self.source.channels), dtype='<i2'))
+        elif correction > 0:
+            # A handful of repeated frames is much harder to hear than the same length of silence
+            self._stage(samples[:correction])
+        self._stage(samples[max(-correction, 0):])
+        self.ring.release()
+        return True
+
+    def _stage(self, samples) -> None:
+        # Fills the encoder's fixed size frame, encoding each time it is full
+        frame_size = self.track['frame_size']
+        position = 0
+        while position < len(samples):
+            count = min(len(samples) - position, frame_size - self.staged)
+            chunk = samples[position:position + count]
+            if self.planar:
+                self.staging[:, self.staged:self.staged + count] = chunk.T
+                self.staging[:, self.staged:self.staged + count] *= 1 / 32768
+            else:
+                channels = self.source.channels
+                self.staging[0, self.staged * channels:(self.staged + count) * channels] = chunk.reshape(-1)
+            self.staged += count
+            position += count
+            if self.staged == frame_size:
+                self._encode_frame()
+
+    def _encode_frame(self) -> None:
+        frame = av.AudioFrame.from_ndarray(self.staging, format='fltp' if self.planar else 's16', layout=self.encoder.layout.name)
+        frame.sample_rate = self.source.sample_rate
+        frame.pts = self.encoded_frames
+        self.encoded_frames += self.staged
+        self.staged = 0
+        for packet in self.encoder.encode(frame):
+            self._deliver(packet)
+
+    def _deliver(self, packet) -> None:
+        data = bytes(packet)
+        self.packets += 1
+        self.bytes_encoded += len(data)
+        # Packet times count frames along the track, AAC's first one starts a frame early with the encoder's priming
+        captured = self.audio_clock.time_of(packet.pts)
+        with self.outputs_lock:
+            outputs = list(self.outputs.items())
+        for output, to_output_time in outputs:
+            timestamp = to_output_time(captured)
+            if timestamp is not None:
+                output.outputframe(data, True, timestamp, None, True)
@@ -0,0 +1,19 @@
+class AudioSource():
+    '''
+    Everything the dashcam needs from a microphone. Audio is 16-bit interleaved PCM read one period
+    at a time, each read blocking until the next period has been captured.
+    '''
+    def __init__(self, sample_rate: int, channels: int, period_frames: int) -> None:
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.period_frames = period_frames
+
+    def start(self) -> None:
+        raise NotImplementedError
+
+    def stop(self) -> None:
+        raise NotImplementedError
+
+    def read(self):
+        # The next period as bytes, empty if it was lost to an overrun, None once there is nothing more
+        raise NotImplementedError
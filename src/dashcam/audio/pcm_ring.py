@@ -0,0 +1,67 @@
+from threading import Condition
+
+class PcmRing():
+    '''
+    A fixed number of capture periods in one preallocated bytearray, passed from the capture thread
+    to the encoder. Its size bounds how far the encoder can fall behind: once it is full new periods
+    are dropped rather than waited for, and the gap they leave shows up in the timestamps of the
+    periods after it. A period handed out by get() stays valid until release().
+    '''
+    def __init__(self, periods: int, period_bytes: int) -> None:
+        self.period_bytes = period_bytes
+        self.buffer = bytearray(periods * period_bytes)
+        self.view = memoryview(self.buffer)
+        self.lengths = [0] * periods
+        self.timestamps = [0] * periods
+        # Both count up forever, the slot is the count modulo the number of periods
+        self.head = 0
+        self.tail = 0
+        self.closed = False
+        self.dropped = 0
+        self.peak = 0
+        self.condition = Condition()
+
+    def __len__(self) -> int:
+        return self.head - self.tail
+
+    def reset(self) -> None:
+        with self.condition:
+            self.head = self.tail = 0
+            self.closed = False
+
+    def close(self) -> None:
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def put(self, data, timestamp: int) -> bool:
+        with self.condition:
+            if self.head - self.tail >= len(self.lengths):
+                self.dropped += 1
+                return False
+            slot = self.head % len(self.lengths)
+        # Only this thread writes and the reader won't look at the slot until head moves past it
+        length = min(len(data), self.period_bytes)
+        start = slot * self.period_bytes
+        self.buffer[start:start + length] = memoryview(data)[:length]
+        self.lengths[slot] = length
+        self.timestamps[slot] = timestamp
+        with self.condition:
+            self.head += 1
+            self.peak = max(self.peak, self.head - self.tail)
+            self.condition.notify()
+        return True
+
+    def get(self, timeout: float = None):
+        # (period, timestamp) of the oldest period, or None on a timeout or once closed and empty
+        with self.condition:
+            self.condition.wait_for(lambda: self.head > self.tail or self.closed, timeout)
+            if self.head == self.tail:
+                return None
+            slot = self.tail % len(self.lengths)
+        start = slot * self.period_bytes
+        return self.view[start:start + self.lengths[slot]], self.timestamps[slot]
+
+    def release(self) -> None:
+        with self.condition:
+            self.tail += 1
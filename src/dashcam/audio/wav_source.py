@@ -0,0 +1,80 @@
+from dashcam.audio.audio_source import AudioSource
+from threading import Event
+import numpy as np
+import random
+import wave
+import time
+
+class WavSource(AudioSource):
+    '''
+    Stands in for a microphone: plays a 16-bit WAV file (or a tone without one) a period at a time,
+    looping at the end. clock_error_ppm runs its sample clock fast or slow against the system clock
+    like a cheap microphone's crystal, and jitter delays each read by up to that many seconds like
+    a busy scheduler. With simulated set nothing sleeps, it keeps its own clock (read through
+    clock()) and moves it on by however long each period would have taken, so hours of capture can
+    be run through in seconds.
+    '''
+    def __init__(self, path: str = None, sample_rate: int = 48000, channels: int = 1, period_frames: int = 1024,
+                 clock_error_ppm: float = 0, jitter: float = 0, simulated: bool = False, seed: int = 0) -> None:
+        self.wav = None
+        if path is not None:
+            self.wav = wave.open(path, 'rb')
+            if self.wav.getsampwidth() != 2 or not self.wav.getnframes():
+                raise ValueError(f"{path} is not 16-bit PCM")
+            sample_rate, channels = self.wav.getframerate(), self.wav.getnchannels()
+        super().__init__(sample_rate, channels, period_frames)
+        self.rate = sample_rate * (1 + clock_error_ppm / 1000000)
+        self.jitter = jitter
+        self.simulated = simulated
+        self.random = random.Random(seed)
+        self.stop_event = Event()
+        self.started = None
+        self.now = 0.0
+        self.frames = 0
+        self.tone = None
+
+    def start(self) -> None:
+        self.stop_event.clear()
+        self.started = 0.0 if self.simulated else time.monotonic()
+        self.now = self.started
+        self.frames = 0
+        if self.wav is None:
+            # A quiet 440Hz tone, a whole number of cycles long so it loops without a click
+            cycle = self.sample_rate // 40
+            tone = (np.sin(np.arange(cycle) * 2 * np.pi * 440 / self.sample_rate) * 3000).astype('<i2')
+            self.tone = np.repeat(tone, self.channels).tobytes()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+
+    def clock(self) -> int:
+        # Microseconds, on the same clock as the synthetic camera unless simulated
+        return int((self.now if self.simulated else time.monotonic()) * 1000000)
+
+    def captured_time(self, frames: int) -> int:
+        # When the frames'th frame since start was really captured, in clock() microseconds
+        return int((self.started + frames / self.rate) * 1000000)
+
+    def read(self):
+        if self.started is None or self.stop_event.is_set():
+            return None
+        self.frames += self.period_frames
+        due = self.started + self.frames / self.rate + self.random.uniform(0, self.jitter)
+        if self.simulated:
+            # Reads can come back late but never out of order
+            self.now = max(self.now, due)
+        elif self.stop_event.wait(max(due - time.monotonic(), 0)):
+            return None
+        return self._next_period()
+
+    def _next_period(self) -> bytes:
+        frame_bytes = 2 * self.channels
+        if self.wav is None:
+            size = self.period_frames * frame_bytes
+            offset = (self.frames - self.period_frames) * frame_bytes % len(self.tone)
+            return (self.tone * (size // len(self.tone) + 2))[offset:offset + size]
+        data = self.wav.readframes(self.period_frames)
+        while len(data) < self.period_frames * frame_bytes:
+            self.wav.rewind()
+            data += self.wav.readframes(self.period_frames - len(data) // frame_bytes)
+        return data
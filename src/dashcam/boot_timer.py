@@ -0,0 +1,65 @@
+from threading import Lock
+import time
+import os
+
+class BootTimer():
+    '''
+    Times each stage of starting up so the seconds between ignition and the first clip can be
+    accounted for. Stages marked in turn are timed from the previous mark, work running alongside
+    them (the camera coming up) is added with its own duration.
+    '''
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.last = self.started
+        self.stages = []
+        self.lock = Lock()
+        self.interpreter = self._process_age()
+
+    def mark(self, stage: str) -> float:
+        now = time.perf_counter()
+        with self.lock:
+            elapsed, self.last = now - self.last, now
+            self.stages.append((stage, elapsed, False))
+        return elapsed
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self.lock:
+            self.stages.append((stage, seconds, True))
+
+    def get_status(self) -> dict:
+        with self.lock:
+            stages = list(self.stages)
+        return {
+            "interpreter_seconds": self.interpreter,
+            "stages": [{"stage": stage, "seconds": round(seconds, 3), "parallel": parallel} for stage, seconds, parallel in stages],
+            "total_seconds": round(self.last - self.started + (self.interpreter or 0), 3),
+            "system_uptime": self._uptime(),
+        }
+
+    def report(self) -> None:
+        status = self.get_status()
+        lines = []
+        if status['interpreter_seconds'] is not None:
+            lines.append(f"  {'python startup':<24}{status['interpreter_seconds']:7.3f}s")
+        for stage in status['stages']:
+            lines.append(f"  {stage['stage']:<24}{stage['seconds']:7.3f}s{' (in parallel)' if stage['parallel'] else ''}")
+        uptime = f", {status['system_uptime']:.1f}s after the system booted" if status['system_uptime'] is not None else ""
+        print(f"Boot took {status['total_seconds']:.3f}s{uptime}\n" + "\n".join(lines))
+
+    def _process_age(self) -> float:
+        # How long the interpreter spent starting before we got here, from the process start time in /proc
+        uptime = self._uptime()
+        try:
+            with open('/proc/self/stat') as f:
+                # The command name can hold spaces, the fields we want come after its closing bracket
+                start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        except (OSError, IndexError, ValueError):
+            return None
+        if uptime is None:
+            return None
+        return round(max(uptime - start_ticks / os.sysconf('SC_CLK_TCK'), 0), 3)
+
+    def _uptime(self) -> float:
+        if not hasattr(time, 'CLOCK_BOOTTIME'):
+            return None
+        return round(time.clock_gettime(time.CLOCK_BOOTTIME), 3)
@@ -0,0 +1,44 @@
+from dashcam.thumbnails.thumbnailer import Thumbnailer
+from dashcam.streamers.mjpeg_streamer import MJPEGStreamer
+from dashcam.streamers.file_streamer import FileStreamer
+from dashcam.overlay.overlay import Overlay
+
+class Camera():
+    '''
+    One camera and everything recording and streaming from it, each with the settings it was given.
+    The main camera is the one the GPS track and audio go with and whose clips keep the plain
+    dashcam_ names, any others record alongside it into the same directory and index with their
+    name after the time, cutting their clips whenever the main camera cuts one.
+    '''
+    def __init__(self, dashcam, name: str, source, recording: dict, streaming: dict, main: bool) -> None:
+        self.name = name
+        self.source = source
+        self.recording = recording
+        self.streaming = streaming
+        self.main = main
+
+        self.overlay = Overlay(source, dashcam.settings['overlay'])
+        if dashcam.settings['overlay']['enabled']:
+            source.pre_callback = self.overlay.apply
+        self.filestreamer = FileStreamer(dashcam, recording, self)
+        self.mjpegstreamer = MJPEGStreamer(dashcam, streaming, self)
+        self.thumbnailer = Thumbnailer(self.mjpegstreamer, recording)
+
+    def follow(self, camera) -> None:
+        # This camera's clips are cut when camera's are, so the clips from both cover the same time
+        self.filestreamer.following = True
+        camera.filestreamer.followers.append(self.filestreamer)
+
+    def get_status(self) -> dict:
+        streamer = self.filestreamer
+        return {
+            "main": self.main,
+            "recording": streamer.is_streaming,
+            "streaming": self.mjpegstreamer.is_streaming,
+            "resolution": self.recording['resolution'],
+            "fps": streamer.settings['fps'],
+            "bitrate": streamer.settings['bitrate'],
+            "clip": streamer.clip_name,
+            "frames": getattr(self.source, 'frame_count', None),
+            "bytes_written": streamer.write_bytes.value,
+        }
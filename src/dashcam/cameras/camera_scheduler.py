@@ -0,0 +1,74 @@
+import math
+
+class CameraScheduler():
+    '''
+    Shares the H264 encoder and the card between the cameras. Each camera asks for its resolution
+    at its frame rate and bitrate. While the total fits both budgets every camera gets what it asked
+    for, past them each gets a share in proportion to its weight and whatever a camera leaves of its
+    share goes to the others. The encoder is limited by macroblocks a second, so its budget is met by
+    lowering frame rates; the card by bytes a second, met by lowering bitrates.
+    '''
+    def __init__(self, settings: dict) -> None:
+        self.settings = settings
+        # Each camera's weight, recording settings and what they asked for before any allocation
+        self.cameras = {}
+        self.allocation = {}
+
+    def add_camera(self, name: str, weight: float, recording: dict) -> None:
+        requested = {key: recording[key] for key in ('resolution', 'fps', 'bitrate')}
+        self.cameras[name] = (weight, recording, requested)
+
+    def request(self, name: str, **changes) -> None:
+        # A camera asking for a different frame rate or bitrate, given out at the next allocate()
+        self.cameras[name][2].update(changes)
+
+    def allocate(self) -> dict:
+        # Writes each camera's fps and bitrate into its recording settings before anything is started with them
+        weights = {name: weight for name, (weight, _, _) in self.cameras.items()}
+        blocks = {name: macroblocks(requested['resolution']) for name, (_, _, requested) in self.cameras.items()}
+        encoder = fair_shares(self.settings['encoder_budget'],
+                              {name: blocks[name] * requested['fps'] for name, (_, _, requested) in self.cameras.items()}, weights)
+        card = fair_shares(self.settings['write_budget'],
+                           {name: requested['bitrate'] / 8 for name, (_, _, requested) in self.cameras.items()}, weights)
+
+        self.allocation = {}
+        for name, (_, recording, requested) in self.cameras.items():
+            fps = min(max(int(encoder[name] // blocks[name]), self.settings['min_fps']), requested['fps'])
+            bitrate = min(int(card[name] * 8), requested['bitrate'])
+            recording.update(fps=fps, bitrate=bitrate)
+            self.allocation[name] = {"fps": fps, "bitrate": bitrate}
+            if (fps, bitrate) != (requested['fps'], requested['bitrate']):
+                print(f"Camera {name} scheduled at {fps}fps {bitrate / 1e6:.1f}Mbps, asked for {requested['fps']}fps {requested['bitrate'] / 1e6:.1f}Mbps")
+        return self.allocation
+
+    def get_status(self) -> dict:
+        encoder = sum(macroblocks(self.cameras[name][2]['resolution']) * allocated['fps'] for name, allocated in self.allocation.items())
+        card = sum(allocated['bitrate'] / 8 for allocated in self.allocation.values())
+        return {
+            "encoder_budget": self.settings['encoder_budget'],
+            "encoder_used": round(encoder / self.settings['encoder_budget'], 3),
+            "write_budget": self.settings['write_budget'],
+            "write_used": round(card / self.settings['write_budget'], 3),
+            "cameras": {name: dict(allocated, weight=self.cameras[name][0], requested=self.cameras[name][2])
+                        for name, allocated in self.allocation.items()},
+        }
+
+def macroblocks(resolution: tuple) -> int:
+    # 16x16 blocks per frame, what an H264 encoder's throughput is measured in
+    width, height = resolution
+    return math.ceil(width / 16) * math.ceil(height / 16)
+
+def fair_shares(budget: float, demands: dict, weights: dict) -> dict:
+    # Weighted max-min shares: nobody gets more than they asked for, the rest is split by weight
+    shares = {}
+    remaining = dict(demands)
+    while remaining:
+        left = budget - sum(shares.values())
+        weight = sum(weights[name] for name in remaining)
+        satisfied = [name for name, demand in remaining.items() if demand <= left * weights[name] / weight]
+        if not satisfied:
+            shares.update({name: left * weights[name] / weight for name in remaining})
+            break
+        for name in satisfied:
+            shares[name] = remaining.pop(name)
+    return shares
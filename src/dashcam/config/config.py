@@ -0,0 +1,295 @@
+from dashcam.sources.frame_source import BYTES_PER_PIXEL
+from dashcam.outputs.clip_writer import sync_directory
+import json
+import copy
+import os
+
+# Limits on top of every value having its default's type. Numbers are (lowest, highest), anything
+# else is the values allowed. Tuples and lists are checked element by element
+LIMITS = {
+    ('recording', 'resolution'): (64, 4096),
+    ('recording', 'fps'): (1, 120),
+    ('recording', 'bitrate'): (100000, 25000000),
+    ('recording', 'format'): tuple(BYTES_PER_PIXEL),
+    ('recording', 'buffer_count'): (2, 16),
+    ('recording', 'extension'): ('mp4', 'h264'),
+    ('recording', 'muxer'): ('native', 'ffmpeg'),
+    ('recording', 'sync_fragments'): (0, 60),
+    ('recording', 'write_buffers'): (0, 256),
+    ('recording', 'preallocate'): (0, 4),
+    ('recording', 'clip_duration'): (5, 3600),
+    ('streaming', 'resolution'): (64, 4096),
+    ('streaming', 'fps'): (1, 60),
+    ('streaming', 'bitrate'): (100000, 25000000),
+    ('overlay', 'fields'): ('timestamp', 'speed', 'coordinates'),
+    ('api', 'server'): ('flask', 'async'),
+    ('api', 'port'): (1, 65535),
+    ('audio', 'codec'): ('aac', 'opus'),
+    ('upload', 'target'): ('s3', 'directory'),
+    ('parking', 'fps'): (1, 30),
+    ('parking', 'downscale'): (1, 64),
+    ('parking', 'taps'): (1, 8),
+    ('parking', 'motion_fraction'): (0, 1),
+    # Shares are split in proportion to weight, a camera can't have none of the total
+    ('scheduler', 'weight'): (0.01, 100),
+    ('cameras', '*', 'weight'): (0.01, 100),
+}
+
+# Lists that can't be left empty, anything using them picks an item out of them
+NOT_EMPTY = {('quality', 'levels')}
+
+# Sections of entries under names of their own (one per camera), each checked against the first entry
+# in the defaults. Limits on their settings are given with '*' in place of the name
+MAPPINGS = {('cameras',)}
+
+# Left out of anything handed back over the API
+SECRETS = {('upload', 'access_key'), ('upload', 'secret_key')}
+# What a secret that is set reads as over the API, sent back it leaves the secret as it was
+MASK = '********'
+
+# How a change takes effect, cheapest first: 'live' straight away, 'rotation' with the next clip,
+# 'reconfigure' by stopping the camera and configuring it again. Anything not here ('enabled' flags,
+# devices, directories, buffers sized at start) is saved and takes effect when the dashcam restarts.
+# A section's string covers each of its settings
+APPLY = {
+    'recording': {
+        'bitrate': 'live', 'event_pre_seconds': 'live', 'event_post_seconds': 'live', 'thumbnail_interval': 'live',
+        'fps': 'rotation', 'clip_duration': 'rotation', 'sync_fragments': 'rotation', 'preallocate': 'rotation', 'muxer': 'rotation',
+        'resolution': 'reconfigure', 'format': 'reconfigure', 'buffer_count': 'reconfigure', 'exposure_timeout': 'reconfigure',
+    },
+    'streaming': {'bitrate': 'live', 'resolution': 'reconfigure'},
+    'scheduler': 'rotation',
+    'overlay': {'fields': 'live', 'position': 'live', 'scale': 'live'},
+    'sensors': {'peak_g': 'live', 'jerk': 'live', 'cooldown': 'live', 'cpu_budget': 'live', 'max_poll_interval': 'live', 'lock_post_seconds': 'live'},
+    'gps': {'index_interval': 'live'},
+    'quality': 'live',
+    'storage': 'live',
+    'parking': 'live',
+    'upload': {'rate': 'live', 'streaming_rate': 'live', 'retries': 'live', 'retry_interval': 'live', 'check_interval': 'live'},
+}
+
+def apply_mode(path: tuple) -> str:
+    section = APPLY.get(path[0], {})
+    if len(path) != 2 or path[1] == 'enabled':
+        return 'restart'
+    if isinstance(section, str):
+        return section
+    return section.get(path[1], 'restart')
+
+def merge(values: dict, changes: dict) -> dict:
+    # A copy of values with changes laid over it, sections merged rather than replaced
+    merged = copy.deepcopy(values)
+    for key, value in changes.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge(merged[key], value)
+        else:
+            merged[key] = copy.deepcopy(value)
+    return merged
+
+def diff(old: dict, new: dict, path: tuple = ()) -> list:
+    # (path, old, new) for every setting that differs, nothing for sections that are the same throughout
+    changes = []
+    for key, value in new.items():
+        if isinstance(value, dict) and isinstance(old.get(key), dict):
+            changes += diff(old[key], value, path + (key,))
+        elif old.get(key) != value:
+            changes.append((path + (key,), old.get(key), value))
+    return changes
+
+def validate(values: dict, defaults: dict, path: tuple = ()) -> list:
+    # Checks values against the defaults' shape and types and LIMITS, returns what is wrong with them.
+    # Lists from JSON where the default is a tuple are turned into tuples on the way
+    errors = []
+    for key, value in values.items():
+        name = '.'.join(path + (str(key),))
+        default = _default(defaults, path, key)
+        if default is None:
+            errors.append(f"{name} is not a setting")
+            continue
+        if isinstance(default, dict):
+            if not isinstance(value, dict):
+                errors.append(f"{name} should be a section")
+            else:
+                errors += validate(value, default, path + (key,))
+            continue
+        if isinstance(default, tuple) and isinstance(value, list):
+            value = values[key] = tuple(value)
+        error = _check(value, default, _limits(path + (key,)))
+        if error is None and path + (key,) in NOT_EMPTY and not value:
+            error = "can't be empty"
+        if error is not None:
+            errors.append(f"{name} {error}")
+    return errors
+
+def valid(values: dict, defaults: dict, path: tuple = ()) -> tuple:
+    # values without the settings validate rejects, and what was wrong with them. A section with
+    # something wrong in it keeps the rest of its settings
+    kept, errors = {}, []
+    for key, value in values.items():
+        item = {key: value}
+        found = validate(item, defaults, path)
+        default = _default(defaults, path, key)
+        if not found:
+            kept[key] = item[key]
+        elif isinstance(value, dict) and isinstance(default, dict):
+            kept[key], section_errors = valid(value, default, path + (key,))
+            errors += section_errors
+        else:
+            errors += found
+    return kept, errors
+
+def _default(defaults: dict, path: tuple, key):
+    # What a setting is checked against, None if there is no such setting
+    if path in MAPPINGS and key not in defaults:
+        return next(iter(defaults.values()))
+    return defaults.get(key)
+
+def _limits(path: tuple):
+    for mapping in MAPPINGS:
+        if path[:len(mapping)] == mapping and len(path) > len(mapping) + 1:
+            path = mapping + ('*',) + path[len(mapping) + 1:]
+    return LIMITS.get(path)
+
+def _check(value, default, limits) -> str:
+    if isinstance(default, (tuple, list)):
+        if type(value) is not type(default):
+            return f"should be a {type(default).__name__}"
+        if isinstance(default, tuple) and len(value) != len(default):
+            return f"should have {len(default)} values"
+        if isinstance(default, tuple):
+            pairs = zip(value, default)
+        else:
+            # Every item in a list is like the first one in its default, an empty default takes anything
+            pairs = [(item, default[0]) for item in value] if default else []
+        for item, item_default in pairs:
+            error = _check(item, item_default, limits)
+            if error is not None:
+                return error
+        return None
+    if isinstance(default, dict):
+        if not isinstance(value, dict) or value.keys() != default.keys():
+            return f"should have {', '.join(default)}"
+        errors = [_check(value[key], default[key], None) for key in default]
+        return next((error for error in errors if error is not None), None)
+    # A float setting takes a whole number, an int setting doesn't take a fraction, and neither takes a bool
+    if isinstance(default, float) and isinstance(value, int) and not isinstance(value, bool):
+        value = float(value)
+    if type(value) is not type(default):
+        return f"should be {type(default).__name__}, not {type(value).__name__}"
+    if limits is None:
+        return None
+    if isinstance(value, (int, float)) and len(limits) == 2 and all(isinstance(limit, (int, float)) for limit in limits):
+        if not limits[0] <= value <= limits[1]:
+            return f"should be between {limits[0]} and {limits[1]}"
+    elif value not in limits:
+        return f"should be one of {', '.join(map(str, limits))}"
+    return None
+
+class Config():
+    '''
+    Dashcam's settings: its defaults with whatever has been changed laid over them. Only the changes
+    are saved, as JSON, so a default that changes in a later version still reaches anyone who never
+    set it. Saving writes a new file and renames it over the old one, a power cut leaves one or the
+    other. Updates are validated as a whole before anything is applied, and come back as the smallest
+    list of settings that actually changed.
+    '''
+    def __init__(self, defaults: dict, path: str = None) -> None:
+        self.defaults = copy.deepcopy(defaults)
+        self.path = path
+        self.values = copy.deepcopy(defaults)
+        self.saves = 0
+        self.load_errors = []
+        self.unreadable = False
+
+    def load(self) -> dict:
+        # Reads the saved changes over the defaults. Settings that can't be used are left out and listed in
+        # load_errors, the rest are kept. A file that can't be read at all raises ValueError and is never
+        # saved over, it still holds everything that was set
+        self.load_errors = []
+        if self.path is None or not os.path.exists(self.path):
+            return self.values
+        try:
+            with open(self.path) as f:
+                changes = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            self.unreadable = True
+            raise ValueError(f"{self.path} can't be read: {e}")
+        if not isinstance(changes, dict):
+            self.unreadable = True
+            raise ValueError(f"{self.path} isn't a JSON object")
+        changes, self.load_errors = valid(changes, self.defaults)
+        self.values = self.updated(changes)
+        return self.values
+
+    def updated(self, changes: dict) -> dict:
+        # The settings with changes made, checked, without taking them on
+        if not isinstance(changes, dict):
+            raise ValueError("Settings should be a JSON object")
+        changes = _unmasked(changes)
+        errors = validate(changes, self.defaults)
+        if errors:
+            raise ValueError('; '.join(errors))
+        return _complete(merge(self.values, changes), self.defaults)
+
+    def diff(self, values: dict) -> list:
+        return diff(self.values, values)
+
+    def set(self, values: dict) -> bool:
+        # Takes on values and saves them, False if they can't be saved over a file that failed to load
+        self.values = values
+        if self.path is None:
+            return True
+        if self.unreadable:
+            print(f"Not saving settings over {self.path}, it couldn't be read")
+            return False
+        self.save()
+        return True
+
+    def save(self) -> None:
+        changes = _changed(self.defaults, self.values)
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(changes, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.path)
+        sync_directory(self.path)
+        self.saves += 1
+
+    def public(self) -> dict:
+        # The settings with secrets blanked out, for the API
+        values = copy.deepcopy(self.values)
+        for section, key in SECRETS:
+            if values[section][key]:
+                values[section][key] = MASK
+        return values
+
+def _unmasked(changes: dict) -> dict:
+    # changes without secrets that are only the mask, from settings read over the API and posted back
+    masked = [(section, key) for section, key in SECRETS if isinstance(changes.get(section), dict) and changes[section].get(key) == MASK]
+    if not masked:
+        return changes
+    changes = dict(changes)
+    for section, key in masked:
+        changes[section] = {name: value for name, value in changes[section].items() if name != key}
+    return changes
+
+def _complete(values: dict, defaults: dict) -> dict:
+    # A new entry in a mapping takes whatever it leaves out from the first entry in the defaults
+    for mapping in MAPPINGS:
+        entries, default = values, defaults
+        for key in mapping:
+            entries, default = entries[key], default[key]
+        for name, entry in entries.items():
+            entries[name] = merge(next(iter(default.values())), entry)
+    return values
+
+def _changed(defaults: dict, values: dict) -> dict:
+    # Just the settings that differ from the defaults, in sections the way they are given
+    changes = {}
+    for path, _, value in diff(defaults, values):
+        section = changes
+        for key in path[:-1]:
+            section = section.setdefault(key, {})
+        section[path[-1]] = value
+    return changes
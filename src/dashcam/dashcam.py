@@ -1,69 +1,739 @@
-from dashcam.streamers.mjpeg_streamer import MJPEGStreamer
-from dashcam.streamers.file_streamer import FileStreamer
-from libcamera import Transform
-from picamera2 import Picamera2
+from dashcam.gps.gps_track import read_track, distances, degrees_around, COORDINATE_SCALE
+from dashcam.metrics.metrics import MetricsRegistry, read_cpu_temperature, read_throttled
+from dashcam.quality.quality_controller import QualityController
+from dashcam.thumbnails.thumbnailer import read_thumbnail, THUMBNAIL_EXTENSION
+from dashcam.cameras.camera_scheduler import CameraScheduler
+from dashcam.storage.storage_manager import StorageManager
+from dashcam.parking.parking_monitor import ParkingMonitor
+from dashcam.storage.recording_index import RecordingIndex
+from dashcam.storage.clip_recovery import ClipRecovery
+from dashcam.export.clip_exporter import ClipExporter
+from dashcam.config.config import Config, apply_mode
+from dashcam.sources.frame_source import FrameSource
+from dashcam.audio.audio_source import AudioSource
+from dashcam.sensors.imu_source import ImuSource
+from dashcam.cameras.camera import Camera
+from dashcam.boot_timer import BootTimer
+from threading import Thread
 import time
+import zlib
+import copy
+import os
+
+# Seconds a reconfigure waits for stream clients and thumbnail grabs to let go of the MJPEG encoder
+ENCODER_RELEASE_TIMEOUT = 5
 
 class Dashcam():
-    def __init__(self) -> None:
+    def __init__(self, source: FrameSource = None, imu: ImuSource = None, nmea=None, boot_timer: BootTimer = None,
+                 microphone: AudioSource = None, cameras: dict = None, config: str = None) -> None:
         self.settings = {
             'recording': {
+                'camera': 'front', # the main camera's name, in the index and on its metrics
                 'resolution': (1920, 1080),
                 'fps': 30,
                 'bitrate': 10000000, # 10Mbps
+                'format': 'YUV420', # what the encoder takes natively, 'RGB888' doubles the buffer size
+                'exposure_timeout': 2, # longest to wait for auto exposure to settle before recording starts
+                'buffer_count': 4, # camera buffers shared by main and lores, each set is ~4.5MB with 1080p YUV420 main and 720p lores
                 'extension': 'mp4',
+                'muxer': 'native', # 'native' writes fragmented MP4 in-process, 'ffmpeg' pipes through an ffmpeg process
+                'sync_fragments': 1, # fragments (one per second) between flushes to the card with the native muxer, 0 leaves it to the kernel
+                'write_block': 256 * 1024, # the native muxer writes whole blocks of this at offsets aligned to it, a multiple of the card's page
+                'write_buffers': 16, # blocks in the write pool, ~3s at 10Mbps before the encoder thread waits on the card. 0 writes straight through
+                'preallocate': 1.1, # clips are allocated this many times their expected size as they open, 0 for none
                 'directory': 'recordings',
                 'clip_duration': 3 * 60, # 3 minutes per clip
+                'pre_event_buffer': 16 * 1024 * 1024, # 16MB, around 12 seconds at 10Mbps
+                'event_pre_seconds': 10,
+                'event_post_seconds': 20,
+                'export_directory': 'recordings/exports',
+                'max_exports': 5, # older exports are removed as new ones are made
+                'thumbnail_interval': 30, # seconds between thumbnails kept with each clip, 0 for none
             },
             'streaming': {
                 'resolution': (1280, 720),
                 'fps': 15,
                 'bitrate': 5000000, # 5Mbps
+            },
+            # Cameras recording alongside the main one, each on top of the main camera's 'recording' and
+            # 'streaming' settings. One is always on when Dashcam is given a source for it
+            'cameras': {
+                'cabin': {
+                    'enabled': False,
+                    'camera_num': 1, # which camera libcamera opens
+                    'weight': 0.5, # share of the encoder and the card against the main camera's
+                    'recording': {
+                        'resolution': (1280, 720),
+                        'fps': 15,
+                        'bitrate': 3000000, # 3Mbps
+                        'pre_event_buffer': 4 * 1024 * 1024, # 4MB, around 10 seconds at 3Mbps
+                    },
+                    'streaming': {
+                        'resolution': (640, 360),
+                        'fps': 10,
+                        'bitrate': 2000000, # 2Mbps
+                    },
+                },
+            },
+            'scheduler': {
+                'weight': 1.0, # the main camera's share
+                'encoder_budget': 245760, # macroblocks a second the Pi's H264 encoder keeps up with, 1080p30
+                'write_budget': 4 * 1024 * 1024, # bytes a second the card sustains for clips from every camera
+                'min_fps': 5, # no camera is scheduled below this
+            },
+            'overlay': {
+                'enabled': True,
+                'fields': ['timestamp', 'speed', 'coordinates'],
+                'position': (20, 20), # top left corner of the text, in main stream pixels
+                'scale': 1,
+            },
+            'api': {
+                'server': 'flask', # 'async' serves everything from one asyncio loop, needs aiohttp
+                'host': '0.0.0.0',
+                'port': 5000,
+            },
+            'sensors': {
+                'enabled': False, # always on when Dashcam is given an ImuSource
+                'i2c_bus': 1, # where the MPU-6050 is
+                'i2c_address': 0x68,
+                'sample_rate': 200, # Hz
+                'poll_interval': 0.05, # seconds between FIFO reads, 10 samples at 200Hz
+                'max_poll_interval': 0.4, # the MPU-6050 FIFO holds ~0.85s at 200Hz
+                'cpu_budget': 0.03, # fraction of one core the sensor thread may use
+                'history': 5, # seconds of samples kept in the ring
+                'smoothing': 0.02, # seconds averaged before testing, filters out single sample spikes
+                'peak_g': 3.0, # acceleration beyond gravity that counts as an impact
+                'jerk': 200, # g per second
+                'cooldown': 10, # seconds before another detection counts
+                'lock_post_seconds': 20, # clips opened this long after an impact are locked too
+            },
+            'gps': {
+                'enabled': False, # always on when Dashcam is given an NMEA source
+                'device': '/dev/serial0',
+                'baudrate': 9600,
+                'index_interval': 30, # fixes between bounding box updates for the clip being recorded
+            },
+            'audio': {
+                'enabled': False, # always on when Dashcam is given an AudioSource
+                'device': 'default', # ALSA capture device
+                'sample_rate': 48000,
+                'channels': 1,
+                'period_frames': 1024, # ~21ms a read at 48kHz
+                'codec': 'aac', # or 'opus'
+                'bitrate': 64000,
+                'ring_periods': 16, # periods waiting for the encoder, ~340ms at 1024 frames, beyond that capture drops them
+                'drift_tolerance': 0.01, # seconds audio may wander from the camera's clock before it is pulled back
+                'drift_step': 0.001, # seconds repeated or skipped in one correction, too short to hear
+                'drift_window': 50, # periods the drift is measured over, about a second
+                'gap': 0.02, # seconds out at once (periods lost to an overrun) that are lined back up in one go rather than stepped
+            },
+            'quality': {
+                'enabled': True,
+                'interval': 1, # seconds between checks
+                # Each level scales the recording bitrate and fps, stream_skip is JPEGs skipped between each one streamed.
+                # Lower fps also means longer between keyframes as the encoder's keyframe interval is counted in frames
+                'levels': [
+                    {'bitrate': 1.0, 'fps': 1.0, 'stream_skip': 0},
+                    {'bitrate': 0.8, 'fps': 1.0, 'stream_skip': 1},
+                    {'bitrate': 0.6, 'fps': 0.84, 'stream_skip': 1},
+                    {'bitrate': 0.4, 'fps': 0.67, 'stream_skip': 2},
+                ],
+                'temperature_high': 75, # C, the Pi starts soft throttling at 80
+                'temperature_low': 65,
+                'write_seconds_high': 0.5, # mean time to write a fragment, each holds about a second of video
+                'write_seconds_low': 0.1,
+                'queue_frames_high': 10, # frames waiting on the encoder
+                'queue_frames_low': 2,
+                'down_after': 2, # checks over any high mark before stepping down
+                'up_after': 60, # checks under every low mark before stepping back up
+            },
+            'parking': {
+                'enabled': True, # parking mode can be started, it only runs once it is
+                'fps': 2, # lores frames checked for motion a second
+                'min_fps': 0.5, # slowest it checks when the checks cost more than cpu_budget
+                'cpu_budget': 0.02, # fraction of one core the checks may use
+                'downscale': 8, # lores pixels along each side of a block, 160x90 blocks at 720p
+                'taps': 2, # pixels summed along each side of a block, 4 of its 64
+                'pixel_threshold': 12, # brightness levels a block has to move between checks to count as changed
+                'motion_fraction': 0.01, # share of blocks that have to change
+                'motion_checks': 2, # checks running over motion_fraction before it counts, a single one is usually noise
+                'quiet_seconds': 15, # a parked clip ends this long after the last motion
+                'pre_roll': 5, # seconds before the motion in each clip, has to fit in pre_event_buffer at recording_bitrate
+                'recording_fps': 10, # the camera and encoder while parked
+                'recording_bitrate': 4000000, # 4Mbps
+            },
+            'storage': {
+                'min_free_bytes': 1024 * 1024 * 1024, # 1GB
+                'max_used_bytes': 0, # 0 to only keep free space above min_free_bytes
+                'batch_size': 5,
+                'delete_interval': 0.5, # seconds between deletions
+                'check_interval': 30,
+                'evict_uploaded_first': True, # clips that are backed up go before ones that aren't
+            },
+            'upload': {
+                'enabled': False,
+                'target': 's3', # or 'directory' for a mounted NAS share
+                'endpoint': 'http://nas.local:9000',
+                'bucket': 'dashcam',
+                'prefix': '', # put in front of every clip name in the bucket
+                'region': 'us-east-1',
+                'access_key': '',
+                'secret_key': '',
+                'directory': '/mnt/nas/dashcam', # for the 'directory' target
+                'part_size': 8 * 1024 * 1024, # each part is read into memory, one per connection
+                'connections': 2,
+                'rate': 1024 * 1024, # bytes per second, 0 for unlimited
+                'streaming_rate': 256 * 1024, # while anyone is watching an MJPEG stream
+                'timeout': 30,
+                'retries': 3, # per part, before the clip is retried later
+                'retry_interval': 60,
+                'check_interval': 30, # seconds between looking for clips when everything is uploaded
             }
         }
-        self.picam2 = None
-        self.filestreamer = FileStreamer(self, self.settings['recording'])
-        self.mjpegstreamer = MJPEGStreamer(self, self.settings['streaming'])
+        # The settings above are the defaults, whatever has been changed since is kept in the config file
+        self.config = Config(self.settings, config)
+        try:
+            self.settings = copy.deepcopy(self.config.load())
+        except ValueError as e:
+            print(f"Ignoring saved settings: {e}")
+        for error in self.config.load_errors:
+            print(f"Ignoring saved setting: {error}")
+        self.boot_timer = boot_timer or BootTimer()
+        self.boot_timer.mark('settings')
+        self.metrics = MetricsRegistry()
+        self.apply_seconds = {path: self.metrics.histogram('dashcam_settings_apply_seconds', "Time taken to apply a settings update, by how it was applied",
+                                                           (0.0001, 0.001, 0.01, 0.1, 0.5, 1, 2.5, 5, 10), {'path': path})
+                              for path in ('live', 'rotation', 'reconfigure', 'persist')}
+
+        # Every camera's settings are settled before any of them is configured, the encoder and the card are shared
+        recording = self.settings['recording']
+        self.scheduler = CameraScheduler(self.settings['scheduler'])
+        self.scheduler.add_camera(recording['camera'], self.settings['scheduler']['weight'], recording)
+        self.extra_cameras = {}
+        for name in cameras or {}:
+            if name not in self.settings['cameras']:
+                # A camera given a source without settings of its own starts from the first camera's defaults
+                self.settings['cameras'][name] = copy.deepcopy(next(iter(self.config.defaults['cameras'].values())))
+        for name, settings in self.settings['cameras'].items():
+            if settings['enabled'] or name in (cameras or {}):
+                self.extra_cameras[name] = (dict(recording, camera=name, **settings['recording']),
+                                            dict(self.settings['streaming'], **settings['streaming']))
+                self.scheduler.add_camera(name, settings['weight'], self.extra_cameras[name][0])
+        self.scheduler.allocate()
+
+        # The camera is the slowest thing to bring up (picamera2 import, configuring, exposure
+        # settling), everything that doesn't need it gets going alongside
+        self.source = source
+        self.sources = dict(cameras or {})
+        self.camera_error = None
+        camera = Thread(target=self._start_camera, name="CameraInit")
+        camera.start()
+
+        self.index = RecordingIndex(recording['directory'], recording['camera'])
+        # Has to see which clips were left open before recording opens any new ones
+        self.recovery = ClipRecovery(self.index)
+        self.storagemanager = StorageManager(self.index, self.settings['storage'])
+        self.exporter = ClipExporter(recording['directory'], recording['export_directory'], recording['max_exports'])
+        self.boot_timer.mark('index')
+
+        self.sensormonitor = None
+        if imu is None and self.settings['sensors']['enabled']:
+            # smbus2 is only needed with a real IMU attached
+            from dashcam.sensors.mpu6050_source import Mpu6050Source
+            sensors = self.settings['sensors']
+            imu = Mpu6050Source(sensors['sample_rate'], sensors['i2c_bus'], sensors['i2c_address'])
+        if imu is not None:
+            from dashcam.sensors.sensor_monitor import SensorMonitor
+            self.sensormonitor = SensorMonitor(imu, self.settings['sensors'], self.auto_lock)
+
+        self.uploader = None
+        if self.settings['upload']['enabled']:
+            from dashcam.upload.uploader import Uploader
+            # Throttled while a phone is watching one of the streams, not merely while they are running
+            self.uploader = Uploader(self.index, self._create_upload_target(), self.settings['upload'],
+                                     lambda: any(camera.mjpegstreamer.clients for camera in self.cameras.values()))
+        self.boot_timer.mark('components')
+
+        camera.join()
+        self.boot_timer.mark('waiting for camera')
+        if self.camera_error is not None:
+            raise self.camera_error
+
+        main = Camera(self, recording['camera'], self.source, recording, self.settings['streaming'], True)
+        self.cameras = {main.name: main}
+        for name, (camera_recording, camera_streaming) in self.extra_cameras.items():
+            self.cameras[name] = Camera(self, name, self.sources[name], camera_recording, camera_streaming, False)
+            self.cameras[name].follow(main)
+        # The main camera's parts, which is all there is with one camera
+        self.overlay = main.overlay
+        self.filestreamer = main.filestreamer
+        self.mjpegstreamer = main.mjpegstreamer
+        self.thumbnailer = main.thumbnailer
 
         print(self.filestreamer.is_streaming)
 
-        self.initialise_camera()
+        self.quality = None
+        if self.settings['quality']['enabled']:
+            self.quality = QualityController(self, self.settings['quality'])
 
-    def initialise_camera(self) -> None:
-        if self.picam2 is None:
-            self.picam2 = Picamera2()
-            video_config = self.picam2.create_video_configuration(
-                main={"size": self.settings['recording']['resolution'], "format": "RGB888"},
-                lores={"size": self.settings['streaming']['resolution'], "format": "YUV420"},
-                transform=Transform(vflip=True, hflip=True),
-            )
+        self.parking = None
+        if self.settings['parking']['enabled']:
+            self.parking = ParkingMonitor(self, self.settings['parking'])
 
-            try:
-                self.picam2.configure(video_config)
-                self.picam2.start_preview()
-                self.picam2.start()
+        self.gpsreader = None
+        if nmea is None and self.settings['gps']['enabled']:
+            from dashcam.gps.nmea_source import NmeaSerial
+            nmea = NmeaSerial(self.settings['gps']['device'], self.settings['gps']['baudrate'])
+        if nmea is not None:
+            from dashcam.gps.gps_reader import GpsReader
+            self.gpsreader = GpsReader(nmea, self.index, self.overlay, self.settings['gps'])
+
+        self.audiorecorder = None
+        if microphone is None and self.settings['audio']['enabled']:
+            # pyalsaaudio is only needed with a microphone attached
+            from dashcam.audio.alsa_source import AlsaSource
+            audio = self.settings['audio']
+            microphone = AlsaSource(audio['device'], audio['sample_rate'], audio['channels'], audio['period_frames'])
+        if microphone is not None:
+            from dashcam.audio.audio_recorder import AudioRecorder
+            # Periods are stamped on the camera's clock so the two tracks line up
+            self.audiorecorder = AudioRecorder(microphone, self.settings['audio'], self.source.sensor_time)
 
-                # start_recording will start the filestreamer encoder, we don't need to do it manually
-                self.picam2.start_encoder(self.mjpegstreamer.encoder)
+        self._register_metrics()
+        self.recovery.start()
+        self.storagemanager.start()
+        if self.sensormonitor is not None:
+            self.sensormonitor.start()
+        if self.gpsreader is not None:
+            self.gpsreader.start()
+        if self.audiorecorder is not None:
+            self.audiorecorder.start()
+        if self.uploader is not None:
+            self.uploader.start()
+        if self.quality is not None:
+            self.quality.start()
+        self.boot_timer.mark('streamers')
 
-                time.sleep(2)  # Allow auto focus and exposure to settle
-            except Exception as e:
-                raise Exception(f"Error initializing camera: {str(e)}")
+    def _register_metrics(self) -> None:
+        # The streamers register their own, these are read from elsewhere when /metrics is scraped
+        metrics = self.metrics
+        metrics.counter_callback('process_cpu_seconds_total', "CPU time used by the dashcam process", time.process_time)
+        for camera in self.cameras.values():
+            labels = {'camera': camera.name}
+            metrics.counter_callback('dashcam_camera_frames_total', "Frames produced by the camera", lambda camera=camera: getattr(camera.source, 'frame_count', None), labels)
+            metrics.gauge_callback('dashcam_recording', "1 while recording", lambda camera=camera: camera.filestreamer.is_streaming, labels)
+        metrics.gauge_callback('dashcam_cpu_temperature_celsius', "SoC temperature", read_cpu_temperature)
+        metrics.gauge_callback('dashcam_throttled_flags', "Firmware throttling bits, as vcgencmd get_throttled reports them", read_throttled)
+        metrics.gauge_callback('dashcam_throttled', "1 while the firmware is throttling the CPU", lambda: read_throttled(2))
+        metrics.gauge_callback('dashcam_under_voltage', "1 while the supply is under voltage", lambda: read_throttled(0))
+        metrics.gauge_callback('dashcam_quality_level', "Quality level, 0 is full quality", lambda: self.quality.level if self.quality is not None else None)
+        metrics.gauge_callback('dashcam_audio_drift_seconds', "How far the audio track is from the camera's clock", lambda: self.audiorecorder.audio_clock.drift if self.audiorecorder is not None else None)
+        metrics.counter_callback('dashcam_audio_dropped_periods_total', "Audio periods dropped with the encoder too far behind", lambda: self.audiorecorder.ring.dropped if self.audiorecorder is not None else None)
+        metrics.gauge_callback('dashcam_storage_used_bytes', "Bytes of clips in the recordings directory", lambda: self.index.total_size)
+        metrics.gauge_callback('dashcam_storage_free_bytes', "Free bytes on the recordings filesystem", self.storagemanager._free_bytes)
+
+    def get_metrics(self) -> str:
+        return self.metrics.render()
+
+    def _start_camera(self) -> None:
+        started = time.perf_counter()
+        try:
+            if self.source is None:
+                # Only pull in picamera2 when we're actually driving the Pi camera
+                from dashcam.sources.camera_source import CameraSource
+                self.source = CameraSource()
+            self.initialise_camera()
+            for name, (recording, streaming) in self.extra_cameras.items():
+                if name not in self.sources:
+                    from dashcam.sources.camera_source import CameraSource
+                    self.sources[name] = CameraSource(self.settings['cameras'][name]['camera_num'])
+                self._initialise_source(self.sources[name], recording, streaming)
+        except Exception as e:
+            self.camera_error = e
+        self.boot_timer.add('camera', time.perf_counter() - started)
+
+    def _create_upload_target(self):
+        if self.settings['upload']['target'] == 'directory':
+            from dashcam.upload.directory_target import DirectoryTarget
+            return DirectoryTarget(self.settings['upload'])
+        from dashcam.upload.s3_target import S3Target
+        return S3Target(self.settings['upload'])
+
+    def initialise_camera(self) -> None:
+        self._initialise_source(self.source, self.settings['recording'], self.settings['streaming'])
+
+    def _initialise_source(self, source: FrameSource, recording: dict, streaming: dict) -> None:
+        try:
+            source.configure(recording, streaming)
+            memory = source.get_buffer_memory()
+            print(f"Camera {recording['camera']} buffers: {memory['buffer_count']} x {sum(memory['per_frame_bytes'].values()) / 1e6:.1f}MB = {memory['total_bytes'] / 1e6:.1f}MB")
+            # The streamers start and stop their own encoders
+            source.start()
+        except Exception as e:
+            raise Exception(f"Error initializing camera {recording['camera']}: {str(e)}")
 
     def start_recording(self):
-        return self.filestreamer.start()
+        # The main camera first, the others cut their clips when it does
+        result = self.filestreamer.start()
+        for camera in list(self.cameras.values())[1:]:
+            camera.filestreamer.start()
+        return result
 
     def stop_recording(self):
+        for camera in list(self.cameras.values())[1:]:
+            camera.filestreamer.stop()
         return self.filestreamer.stop()
 
+    def save_event(self, pre_seconds: float = None, post_seconds: float = None):
+        if pre_seconds is None:
+            pre_seconds = self.settings['recording']['event_pre_seconds']
+        if post_seconds is None:
+            post_seconds = self.settings['recording']['event_post_seconds']
+        result, status_code = self.filestreamer.save_event(pre_seconds, post_seconds)
+        if status_code == 200 and len(self.cameras) > 1:
+            # Each other camera saves the same stretch from its own ring
+            others = [camera.filestreamer.save_event(pre_seconds, post_seconds)[0] for camera in list(self.cameras.values())[1:]]
+            result = dict(result, files=[result['file']] + [other['file'] for other in others if 'file' in other])
+        return result, status_code
+
+    def get_recordings(self, start_time: float = None, end_time: float = None, camera: str = None):
+        if start_time is not None or end_time is not None:
+            recordings = self.index.between(start_time or 0, end_time or time.time(), camera)
+        else:
+            recordings = self.index.list(camera=camera)
+        return {"recordings": recordings}, 200
+
+    def get_recordings_alongside(self, name: str):
+        recordings = self.index.alongside(name)
+        if recordings is None:
+            return {"message": "Recording not found"}, 404
+        return {"recording": self.index.get(name), "alongside": recordings}, 200
+
+    def lock_recording(self, name: str, locked: bool = True):
+        # Read-only on disk as well as in the index, so the lock survives an index rebuild
+        path = os.path.join(self.index.directory, name)
+        if not self.index.set_locked(name, locked):
+            return {"message": "Recording not found"}, 404
+        if os.path.exists(path):
+            os.chmod(path, 0o444 if locked else 0o644)
+        return {"message": f"{'Locked' if locked else 'Unlocked'} {name}"}, 200
+
+    def auto_lock(self, timestamp: float) -> None:
+        locked = []
+        for camera in self.cameras.values():
+            locked += camera.filestreamer.lock_recent(self.settings['sensors']['lock_post_seconds'])
+        print(f"Impact detected at {time.strftime('%H:%M:%S', time.localtime(timestamp))}, locked {', '.join(locked) or 'nothing'}")
+
+    def get_sensor_status(self):
+        if self.sensormonitor is None:
+            return {"message": "Sensors are disabled"}, 400
+        return self.sensormonitor.get_status(), 200
+
+    def get_upload_status(self):
+        if self.uploader is None:
+            return dict(self.index.upload_totals(), running=False), 200
+        return self.uploader.get_status(), 200
+
+    def get_quality_status(self):
+        if self.quality is None:
+            return {"message": "Quality control is disabled"}, 400
+        return self.quality.get_status(), 200
+
+    def start_parking(self):
+        if self.parking is None:
+            return {"message": "Parking mode is disabled"}, 400
+        return self.parking.start()
+
+    def stop_parking(self):
+        if self.parking is None:
+            return {"message": "Parking mode is disabled"}, 400
+        return self.parking.stop()
+
+    def get_parking_status(self):
+        if self.parking is None:
+            return {"message": "Parking mode is disabled"}, 400
+        return self.parking.get_status(), 200
+
+    def get_audio_status(self):
+        if self.audiorecorder is None:
+            return {"message": "Audio is disabled"}, 400
+        return self.audiorecorder.get_status(), 200
+
+    def get_gps_status(self):
+        if self.gpsreader is None:
+            return {"message": "GPS is disabled"}, 400
+        return self.gpsreader.get_status(), 200
+
+    def get_recordings_near(self, latitude: float, longitude: float, radius: float = 100,
+                            start_time: float = None, end_time: float = None):
+        # The index narrows it down to clips whose bounding box comes within radius metres,
+        # only their tracks are read to find how close each one really came and when
+        latitude_degrees, longitude_degrees = degrees_around(latitude, radius)
+        candidates = self.index.near(latitude - latitude_degrees, latitude + latitude_degrees,
+                                     longitude - longitude_degrees, longitude + longitude_degrees, start_time, end_time)
+        recordings = []
+        for clip in candidates:
+            track = read_track(os.path.join(self.index.directory, clip['name']))
+            if track is None or not len(track):
+                continue
+            distance = distances(track, latitude, longitude)
+            if start_time is not None or end_time is not None:
+                distance[(track['time'] < (start_time or 0)) | (track['time'] > (end_time or time.time()))] = float('inf')
+            closest = int(distance.argmin())
+            if distance[closest] <= radius:
+                recordings.append(dict(clip, distance=round(float(distance[closest]), 1), closest_time=float(track['time'][closest])))
+        return {"recordings": recordings, "candidates": len(candidates)}, 200
+
+    def get_track(self, name: str):
+        path = self.get_recording_path(name)
+        track = read_track(path) if path is not None else None
+        if track is None:
+            return {"message": "No track for that recording"}, 404
+        # GeoJSON, so it drops straight onto a map
+        return {
+            "type": "Feature",
+            "geometry": {
+                "type": "LineString",
+                "coordinates": [[longitude / COORDINATE_SCALE, latitude / COORDINATE_SCALE] for latitude, longitude in zip(track['latitude'].tolist(), track['longitude'].tolist())],
+            },
+            "properties": {
+                "name": name,
+                "times": track['time'].tolist(),
+                "speeds": [round(speed, 2) for speed in track['speed'].tolist()],
+            },
+        }, 200
+
+    def get_recording_path(self, name: str) -> str:
+        # Only hand out files the index knows about, which also rules out any path tricks in name
+        if self.index.get(name) is None:
+            return None
+        path = os.path.join(self.index.directory, name)
+        return path if os.path.exists(path) else None
+
+    def get_thumbnail(self, name: str, index: int = 0):
+        # Returns (jpeg, etag, last modified) for the index'th thumbnail of a clip, or None
+        path = self.get_recording_path(name)
+        frame = read_thumbnail(path, index) if path is not None else None
+        if frame is None:
+            return None
+        # Thumbnails are only ever appended, once written one never changes
+        etag = f"{os.path.splitext(name)[0]}-{index}-{zlib.crc32(frame):08x}"
+        return frame, etag, os.path.getmtime(path + THUMBNAIL_EXTENSION)
+
+    def export_recording(self, name: str = None, start_time: float = None, end_time: float = None, camera: str = None):
+        # With a name, start and end are seconds into that clip. Without one they are wall clock
+        # times and every continuous clip they touch from one camera (the main one by default) is joined into one export
+        if name is not None:
+            clip = self.index.get(name)
+            if clip is None:
+                return {"message": "Recording not found"}, 404
+            segments = [(name, start_time or 0, end_time if end_time is not None else float('inf'))]
+        else:
+            if start_time is None or end_time is None:
+                return {"message": "A recording name or a start and end time is needed"}, 400
+            # Event clips repeat footage that is already in the continuous clips
+            clips = [clip for clip in self.index.between(start_time, end_time, camera or self.settings['recording']['camera'])
+                     if clip['name'].startswith('dashcam_')]
+            segments = [(clip['name'], start_time - clip['start_time'], end_time - clip['start_time']) for clip in clips]
+        if not segments:
+            return {"message": "Nothing recorded in that range"}, 404
+
+        try:
+            result = self.exporter.export(segments)
+        except (ValueError, OSError) as e:
+            return {"message": f"Export failed: {e}"}, 400
+        print(f"Exported {result['file']} ({result['duration']:.1f}s in {result['export_seconds']}s)")
+        return result, 200
+
+    def get_export_path(self, name: str) -> str:
+        return self.exporter.get_path(name)
+
+    def get_storage_status(self):
+        return dict(self.storagemanager.get_status(), recovery=self.recovery.get_status()), 200
+
+    def get_camera_status(self):
+        return {
+            "format": self.settings['recording']['format'],
+            "buffers": self.source.get_buffer_memory(),
+            "thumbnails": self.thumbnailer.get_stats(),
+        }, 200
+
+    def reschedule_cameras(self):
+        # After a budget or a weight changes, each camera's next clip is recorded at its new share
+        allocation = self.scheduler.allocate()
+        for name, camera in self.cameras.items():
+            camera.filestreamer.queue_settings(allocation[name])
+        return self.scheduler.get_status(), 200
+
+    def get_cameras_status(self):
+        return dict(self.scheduler.get_status(), cameras={name: camera.get_status() for name, camera in self.cameras.items()}), 200
+
+    def get_overlay_stats(self):
+        return self.overlay.get_stats(), 200
+
     def start_streaming(self):
-        return self.mjpegstreamer.start()
+        result = self.mjpegstreamer.start()
+        for camera in list(self.cameras.values())[1:]:
+            camera.mjpegstreamer.start()
+        return result
 
     def stop_streaming(self):
+        for camera in list(self.cameras.values())[1:]:
+            camera.mjpegstreamer.stop()
         return self.mjpegstreamer.stop()
     
+    def stream_frames(self, camera: str = None):
+        streamer = self._streamer(camera)
+        if streamer is None or not streamer.is_streaming:
+            return None
+        return streamer.frames()
+
+    def stream_frames_async(self, camera: str = None):
+        streamer = self._streamer(camera)
+        if streamer is None or not streamer.is_streaming:
+            return None
+        return streamer.frames_async()
+
+    def _streamer(self, camera: str):
+        if camera is None:
+            return self.mjpegstreamer
+        return self.cameras[camera].mjpegstreamer if camera in self.cameras else None
+
+    def get_settings(self):
+        return self.config.public(), 200
+
+    def update_settings(self, changes: dict):
+        # The whole update is checked before any of it is used. Each setting that actually changed is then
+        # applied the cheapest way it can be: live, with the next clip, or by configuring the camera again.
+        # Anything else is saved for the next start
+        try:
+            values = self.config.updated(changes)
+        except ValueError as e:
+            return {"message": str(e)}, 400
+        changed = self.config.diff(values)
+        if not changed:
+            return {"message": "Nothing changed", "changes": []}, 200
+
+        modes = {path: apply_mode(path) for path, _, _ in changed}
+        seconds = {}
+        failed = None
+        for mode, apply in (('live', self._apply_live), ('rotation', self._apply_rotation), ('reconfigure', self._apply_reconfigure)):
+            changes = {path: new for path, _, new in changed if modes[path] == mode}
+            if not changes:
+                continue
+            started = time.perf_counter()
+            for (section, key), value in changes.items():
+                # In place, components hold on to their section of the settings
+                self.settings[section][key] = value
+            try:
+                apply(changes)
+            except TimeoutError as e:
+                # None of this mode was applied, its settings go back to what is still running and aren't saved
+                failed = str(e)
+                for (section, key), old, _ in changed:
+                    if modes[(section, key)] == mode:
+                        self.settings[section][key] = values[section][key] = old
+                changed = [change for change in changed if modes[change[0]] != mode]
+                modes = {path: modes[path] for path, _, _ in changed}
+            seconds[mode] = time.perf_counter() - started
+        started = time.perf_counter()
+        saved = self.config.set(values)
+        seconds['persist'] = time.perf_counter() - started
+        for mode, taken in seconds.items():
+            self.apply_seconds[mode].observe(taken)
+
+        restart = [path for path in modes if modes[path] == 'restart']
+        print(f"Settings changed: {', '.join('.'.join(path) for path in modes)}")
+        message = "Settings updated" if not restart else "Settings updated, some take effect after a restart"
+        if failed is not None:
+            message = f"{failed}, only the other settings were updated"
+        if not saved:
+            message += f", not saved as {self.config.path} couldn't be read"
+        return {
+            "message": message,
+            "changes": [{"setting": '.'.join(path), "from": old, "to": new, "applied": modes[path]} for path, old, new in changed],
+            "seconds": {mode: round(taken, 4) for mode, taken in seconds.items()},
+        }, 200 if failed is None else 503
+
+    def _apply_live(self, changes: dict) -> None:
+        # Everything else here is read from the settings each time it is used
+        if ('recording', 'bitrate') in changes:
+            self.scheduler.request(self.settings['recording']['camera'], bitrate=changes[('recording', 'bitrate')])
+            self._allocate(live=True)
+        if ('streaming', 'bitrate') in changes:
+            self.source.set_bitrate(self.mjpegstreamer.encoder, changes[('streaming', 'bitrate')])
+        if ('quality', 'levels') in changes and self.quality is not None:
+            self.quality.levels_changed()
+            self._allocate()
+
+    def _apply_rotation(self, changes: dict) -> None:
+        recording = {key: value for (section, key), value in changes.items() if section == 'recording'}
+        if 'fps' in recording:
+            self.scheduler.request(self.settings['recording']['camera'], fps=recording.pop('fps'))
+        if recording:
+            self.filestreamer.queue_settings(recording)
+        if ('recording', 'fps') in changes or any(section == 'scheduler' for section, _ in changes):
+            # The frame rate every camera gets depends on what the others ask for
+            self._allocate()
+
+    def _allocate(self, live: bool = False) -> None:
+        # Each camera's share goes to its next clip, or with live the main camera's bitrate straight away
+        allocation = self.scheduler.allocate()
+        for name, camera in self.cameras.items():
+            allocated = allocation[name]
+            if camera.main and self.quality is not None:
+                # The main camera's share is what the top quality level records at, the current level scales it
+                level = self.quality.current_settings()
+                allocated = {key: level[key] for key in ('fps', 'bitrate')}
+            if camera.main and self.parking is not None and self.parking.is_running:
+                # Parking runs the camera at its own frame rate and bitrate, these are what it puts back
+                self.parking.restore.update(allocated)
+                continue
+            changes = {key: value for key, value in allocated.items() if camera.filestreamer.settings[key] != value}
+            if camera.main and live and 'bitrate' in changes:
+                camera.filestreamer.set_bitrate(changes.pop('bitrate'))
+            if changes:
+                camera.filestreamer.queue_settings(changes)
+
+    def _apply_reconfigure(self, changes: dict) -> None:
+        # The main camera's streams change size or format, everything using it stops while it is configured again
+        parked = self.parking is not None and self.parking.is_running
+        if parked:
+            self.parking.stop()
+            self.parking.thread.join()
+        recording, streaming = self.filestreamer.is_streaming, self.mjpegstreamer.is_streaming
+        if recording:
+            self.stop_recording()
+        if streaming:
+            self.stop_streaming()
+        # Every encoder on the camera has to be stopped before it is, and the last clips closed
+        for camera in self.cameras.values():
+            for streamer in (camera.filestreamer, camera.mjpegstreamer):
+                if streamer.thread is not None:
+                    streamer.thread.join()
+        if not self.mjpegstreamer.wait_for_encoder(ENCODER_RELEASE_TIMEOUT):
+            # A stuck stream client or thumbnail grab, the camera goes back to what it was doing unchanged
+            self._resume(recording, streaming, parked)
+            raise TimeoutError("The camera's MJPEG encoder is still in use, it wasn't configured again")
+        self.source.stop()
+        self.initialise_camera()
+        # The streamer has its own copy of the recording settings, it is stopped so they change straight away
+        self.filestreamer.queue_settings({key: value for (section, key), value in changes.items() if section == 'recording'})
+        # Shares of the card and the encoder depend on the frame size, the new one is shared out before recording again
+        self.scheduler.request(self.settings['recording']['camera'], resolution=self.settings['recording']['resolution'])
+        self._allocate()
+        self._resume(recording, streaming, parked)
+
+    def _resume(self, recording: bool, streaming: bool, parked: bool) -> None:
+        if recording:
+            self.start_recording()
+        if streaming:
+            self.start_streaming()
+        if parked:
+            self.parking.start()
+
     def set_recording_settings(self, settings: dict):
-        return self.filestreamer.set_settings(settings)
+        return self.update_settings({'recording': settings})
 
     def set_streaming_settings(self, settings: dict):
-        return self.mjpegstreamer.set_settings(settings)
\ No newline at end of file
+        return self.update_settings({'streaming': settings})
@@ -0,0 +1,179 @@
+from dashcam.outputs.fragment_index import read_fragment_index, scan_fragments, child_boxes
+from dashcam.outputs.mp4_output import TIMESCALE
+import struct
+import time
+import os
+
+class ClipExporter():
+    '''
+    Cuts and joins recorded clips without decoding anything. Clips are fragmented MP4 with one
+    fragment per GOP, so an export is the init segment followed by the fragments covering the
+    requested time, with their sequence numbers and decode times rewritten to run on from each
+    other. The fragment index next to each clip means only the exported bytes are ever read.
+    An audio track moves with the video, by the same time in its own timescale.
+    '''
+    def __init__(self, directory: str, export_directory: str, max_exports: int) -> None:
+        self.directory = directory
+        self.export_directory = export_directory
+        self.max_exports = max_exports
+        self.exports = 0
+        self.last_export = None
+
+        if not os.path.exists(export_directory):
+            os.makedirs(export_directory)
+
+    def export(self, segments: list) -> dict:
+        # segments is [(clip name, start seconds, end seconds), ...] in playback order, times are
+        # relative to the start of each clip. Cuts are widened out to the surrounding keyframes
+        started = time.perf_counter()
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        file_name = f"export_{stamp}.mp4"
+        path = os.path.join(self.export_directory, file_name)
+        copy = 1
+        while os.path.exists(path):
+            copy += 1
+            file_name = f"export_{stamp}-{copy}.mp4"
+            path = os.path.join(self.export_directory, file_name)
+
+        plan = []
+        init = None
+        for name, start, end in segments:
+            clip_path = os.path.join(self.directory, name)
+            fragments = read_fragment_index(clip_path) or scan_fragments(clip_path)
+            if fragments is None:
+                raise ValueError(f"{name} is not a fragmented MP4 clip")
+            init_size, entries = fragments
+            with open(clip_path, 'rb') as f:
+                clip_init = f.read(init_size)
+            # Joined clips have to share one sample description, which they do unless the
+            # recording settings changed between them
+            if init is not None and clip_init != init:
+                raise ValueError(f"{name} was recorded with different settings")
+            init = clip_init
+            plan.append((clip_path, select_fragments(entries, start * TIMESCALE, end * TIMESCALE)))
+
+        if not any(selected for _, selected in plan):
+            raise ValueError("Nothing recorded in that range")
+
+        timescales = track_timescales(init)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        sequence = 0
+        decode_time = 0
+        try:
+            write_all(fd, init)
+            for clip_path, selected in plan:
+                source = os.open(clip_path, os.O_RDONLY)
+                try:
+                    base = selected[0][0] if selected else 0
+                    for fragment_time, duration, offset, size in selected:
+                        sequence += 1
+                        copy_fragment(source, fd, offset, size, sequence, decode_time + fragment_time - base, timescales)
+                    if selected:
+                        decode_time += selected[-1][0] + selected[-1][1] - base
+                finally:
+                    os.close(source)
+        except BaseException:
+            os.close(fd)
+            os.remove(path)
+            raise
+        os.close(fd)
+
+        self.exports += 1
+        self.last_export = file_name
+        self._prune()
+        return {
+            "file": file_name,
+            "fragments": sequence,
+            "duration": decode_time / TIMESCALE,
+            "size": os.path.getsize(path),
+            "export_seconds": round(time.perf_counter() - started, 3),
+        }
+
+    def get_path(self, name: str) -> str:
+        path = os.path.join(self.export_directory, os.path.basename(name))
+        return path if name.startswith('export_') and os.path.exists(path) else None
+
+    def _prune(self) -> None:
+        # Exports are meant to be downloaded and shared, only the most recent few are kept around
+        exports = sorted((entry for entry in os.listdir(self.export_directory) if entry.startswith('export_')), key=self._age)
+        for name in exports[:-self.max_exports]:
+            os.remove(os.path.join(self.export_directory, name))
+
+    def _age(self, name: str) -> tuple:
+        # Oldest first, by when it was written and then by name. Exports made in the same second are
+        # export_YYYYmmdd-HHMMSS.mp4, then -2.mp4, -3.mp4 and so on, which by text would put -10 before -2
+        parts = os.path.splitext(name)[0][len('export_'):].split('-')
+        copy = int(parts[2]) if len(parts) > 2 and parts[2].isdigit() else 1
+        modified = os.stat(os.path.join(self.export_directory, name)).st_mtime
+        return modified, '-'.join(parts[:2]), copy
+
+def select_fragments(entries: list, start: float, end: float) -> list:
+    # From the fragment holding start, which begins on the keyframe at or before it, up to the one holding end.
+    # Nothing if the range starts after the clip ends
+    if not entries or start >= entries[-1][0] + entries[-1][1]:
+        return []
+    first = 0
+    for i, (decode_time, _, _, _) in enumerate(entries):
+        if decode_time > start:
+            break
+        first = i
+    return [entry for entry in entries[first:] if entry[0] < end]
+
+def track_timescales(init: bytes) -> dict:
+    # {track id: timescale} from the moov box of an init segment
+    timescales = {}
+    for kind, position, size in child_boxes(init, 0, len(init)):
+        if kind != b'moov':
+            continue
+        for kind, trak, trak_size in child_boxes(init, position + 8, position + size):
+            if kind != b'trak':
+                continue
+            track_id = timescale = None
+            for kind, child, child_size in child_boxes(init, trak + 8, trak + trak_size):
+                if kind == b'tkhd':
+                    track_id = struct.unpack_from('>I', init, child + (28 if init[child + 8] == 1 else 20))[0]
+                elif kind == b'mdia':
+                    for kind, mdhd, _ in child_boxes(init, child + 8, child + child_size):
+                        if kind == b'mdhd':
+                            timescale = struct.unpack_from('>I', init, mdhd + (28 if init[mdhd + 8] == 1 else 20))[0]
+            timescales[track_id] = timescale
+    return timescales
+
+def copy_fragment(source: int, destination: int, offset: int, size: int, sequence: int, decode_time: int, timescales: dict = None) -> None:
+    # The video track comes first in each fragment, the other tracks move by as much as it did
+    moof_size = struct.unpack('>I', os.pread(source, 4, offset))[0]
+    moof = bytearray(os.pread(source, moof_size, offset))
+    shift = None
+    for kind, position, box_size in child_boxes(moof, 8, len(moof)):
+        if kind == b'mfhd':
+            struct.pack_into('>I', moof, position + 12, sequence)
+        elif kind == b'traf':
+            track_id = None
+            for kind, child, _ in child_boxes(moof, position + 8, position + box_size):
+                if kind == b'tfhd':
+                    track_id = struct.unpack_from('>I', moof, child + 12)[0]
+                elif kind == b'tfdt':
+                    layout = '>Q' if moof[child + 8] == 1 else '>I'
+                    original = struct.unpack_from(layout, moof, child + 12)[0]
+                    if shift is None:
+                        shift = decode_time - original
+                        struct.pack_into(layout, moof, child + 12, decode_time)
+                    else:
+                        timescale = (timescales or {}).get(track_id) or TIMESCALE
+                        struct.pack_into(layout, moof, child + 12, max(original + shift * timescale // TIMESCALE, 0))
+    write_all(destination, moof)
+
+    # The media data goes file to file inside the kernel, it never comes through Python
+    offset += moof_size
+    remaining = size - moof_size
+    while remaining > 0:
+        sent = os.sendfile(destination, source, offset, remaining)
+        if sent == 0:
+            raise ValueError("Clip ended in the middle of a fragment")
+        offset += sent
+        remaining -= sent
+
+def write_all(fd: int, data) -> None:
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
@@ -0,0 +1,158 @@
+from dashcam.gps.nmea import parse_sentence, parse_coordinate, parse_float, KNOTS_TO_MS
+from dashcam.gps.gps_track import GpsTrack, TRACK_EXTENSION
+from threading import Event, Lock, Thread
+import time
+import os
+
+# Seconds before the port is opened again after the receiver goes away, doubling while it stays away
+REOPEN_INTERVAL = 1
+MAX_REOPEN_INTERVAL = 30
+
+class GpsReader():
+    '''
+    Reads NMEA from the receiver on its own thread. Each fix updates the overlay and is appended
+    to the track of the clip being recorded, and the clip's bounding box is kept up to date in
+    the recording index so location searches never have to open a track file they don't need.
+    If the receiver goes away (unplugged, a UART error) the port is opened again once it is back.
+    '''
+    def __init__(self, nmea, index, overlay, settings: dict) -> None:
+        self.nmea = nmea
+        self.index = index
+        self.overlay = overlay
+        self.settings = settings
+        self.lock = Lock()
+        self.stop_event = Event()
+        self.is_running = False
+        self.track = None
+        self.clip_name = None
+        self.clip_path = None
+        # GGA carries what RMC doesn't, kept until the RMC that completes the fix
+        self.quality = 0
+        self.satellites = 0
+        self.altitude = 0.0
+
+        self.sentences = 0
+        self.bad_sentences = 0
+        self.reopens = 0
+        self.fixes = 0
+        self.last_fix = None
+        self.fix_seconds = 0.0
+        self.max_fix_seconds = 0.0
+
+    def start(self):
+        if self.is_running:
+            return {"message": "Already running"}, 400
+        self.stop_event.clear()
+        self.is_running = True
+        Thread(target=self._start, name=type(self).__name__, daemon=True).start()
+        return {"message": "Started GPS"}, 200
+
+    def stop(self):
+        if not self.is_running:
+            return {"message": "Not running"}, 400
+        self.is_running = False
+        self.stop_event.set()
+        self.nmea.close()
+        self.set_clip(None)
+        return {"message": "Stopped GPS"}, 200
+
+    def set_clip(self, path: str) -> None:
+        # Called as each clip opens, and with None when recording stops
+        with self.lock:
+            self._finish_track()
+            self.clip_path = path
+            self.clip_name = os.path.basename(path) if path is not None else None
+
+    def get_status(self) -> dict:
+        return {
+            "running": self.is_running,
+            "sentences": self.sentences,
+            "bad_sentences": self.bad_sentences,
+            "reopens": self.reopens,
+            "fixes": self.fixes,
+            "last_fix": self.last_fix,
+            "mean_fix_us": round(self.fix_seconds / self.fixes * 1e6, 1) if self.fixes else None,
+            "max_fix_us": round(self.max_fix_seconds * 1e6, 1),
+        }
+
+    def _start(self) -> None:
+        print("Started GpsReader")
+        while self.is_running:
+            try:
+                line = self.nmea.readline()
+            except OSError as e:
+                print(f"GPS read failed: {e}")
+                line = b''
+            if not line:
+                if self._reopen():
+                    continue
+                break
+            started = time.perf_counter()
+            fields = parse_sentence(line)
+            if fields is None:
+                self.bad_sentences += 1
+                continue
+            self.sentences += 1
+            try:
+                if fields[0] == 'GGA':
+                    self.quality = int(fields[6] or 0)
+                    self.satellites = int(fields[7] or 0)
+                    self.altitude = parse_float(fields[9], self.altitude)
+                elif fields[0] == 'RMC' and fields[2] == 'A':
+                    self._fix(fields)
+                    elapsed = time.perf_counter() - started
+                    self.fix_seconds += elapsed
+                    self.max_fix_seconds = max(self.max_fix_seconds, elapsed)
+            except (IndexError, ValueError, TypeError):
+                self.bad_sentences += 1
+        print("GpsReader stopped")
+
+    def _reopen(self) -> bool:
+        # Keeps trying the port, further apart each time, until it opens. False once stopped, or
+        # when the source has nothing more to give (the end of a replay that doesn't loop)
+        interval = REOPEN_INTERVAL
+        while not self.stop_event.wait(interval):
+            self.reopens += 1
+            try:
+                reopened = self.nmea.reopen()
+            except OSError as e:
+                print(f"Couldn't reopen GPS: {e}")
+                interval = min(interval * 2, MAX_REOPEN_INTERVAL)
+                continue
+            if self.stop_event.is_set():
+                self.nmea.close()
+            return reopened and self.is_running
+        return False
+
+    def _fix(self, fields: list) -> None:
+        timestamp = time.time()
+        latitude = parse_coordinate(fields[3], fields[4])
+        longitude = parse_coordinate(fields[5], fields[6])
+        speed = parse_float(fields[7], 0.0) * KNOTS_TO_MS
+        course = parse_float(fields[8], 0.0)
+        if latitude is None or longitude is None:
+            # An active fix with the position left blank, nothing worth recording
+            raise ValueError("RMC without a position")
+
+        self.overlay.set_speed(speed * 3.6)
+        self.overlay.set_coordinates(latitude, longitude)
+        self.fixes += 1
+        self.last_fix = {"time": timestamp, "latitude": latitude, "longitude": longitude, "speed": speed,
+                         "course": course, "altitude": self.altitude, "satellites": self.satellites}
+
+        with self.lock:
+            if self.clip_path is None:
+                return
+            if self.track is None:
+                self.track = GpsTrack(self.clip_path + TRACK_EXTENSION)
+            self.track.add(timestamp, latitude, longitude, speed, course, self.altitude, self.quality, self.satellites)
+            # The clip being recorded shows up in searches without waiting for it to finish
+            if self.track.fixes % self.settings['index_interval'] == 1:
+                self.index.set_track(self.clip_name, *self.track.bounds)
+
+    def _finish_track(self) -> None:
+        if self.track is None:
+            return
+        self.track.close()
+        self.index.set_track(self.clip_name, *self.track.bounds)
+        self.track = None
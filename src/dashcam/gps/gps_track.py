@@ -0,0 +1,78 @@
+import numpy as np
+import struct
+
+TRACK_EXTENSION = '.gps'
+TRACK_MAGIC = b'DGPS'
+TRACK_VERSION = 1
+
+HEADER = struct.Struct('<4sH')
+# wall clock time, latitude and longitude in 1e-7 degrees, speed m/s, course and altitude, fix quality, satellites
+RECORD = struct.Struct('<diifffBB')
+RECORD_DTYPE = np.dtype([
+    ('time', '<f8'), ('latitude', '<i4'), ('longitude', '<i4'),
+    ('speed', '<f4'), ('course', '<f4'), ('altitude', '<f4'), ('quality', 'u1'), ('satellites', 'u1'),
+])
+COORDINATE_SCALE = 1e7
+
+EARTH_RADIUS = 6371000
+
+class GpsTrack():
+    '''
+    The fixes recorded during one clip, appended to <clip>.gps as fixed size records. Keeps a
+    running bounding box so the recording index can be updated without reading the file back.
+    '''
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(TRACK_MAGIC, TRACK_VERSION))
+        self.fixes = 0
+        self.bounds = None  # (min latitude, max latitude, min longitude, max longitude)
+
+    def add(self, timestamp: float, latitude: float, longitude: float, speed: float, course: float,
+            altitude: float, quality: int, satellites: int) -> None:
+        self.file.write(RECORD.pack(timestamp, round(latitude * COORDINATE_SCALE), round(longitude * COORDINATE_SCALE),
+                                    speed, course, altitude, quality, satellites))
+        # One record a second, flushing keeps the track in step with the clip if we lose power
+        self.file.flush()
+        self.fixes += 1
+        if self.bounds is None:
+            self.bounds = (latitude, latitude, longitude, longitude)
+        else:
+            min_latitude, max_latitude, min_longitude, max_longitude = self.bounds
+            self.bounds = (min(min_latitude, latitude), max(max_latitude, latitude),
+                           min(min_longitude, longitude), max(max_longitude, longitude))
+
+    def close(self) -> None:
+        self.file.close()
+
+def read_track(path: str):
+    # Structured array of every fix in the track kept for the clip at path, or None
+    try:
+        with open(path + TRACK_EXTENSION, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    if len(data) < HEADER.size or HEADER.unpack_from(data) != (TRACK_MAGIC, TRACK_VERSION):
+        return None
+    count = (len(data) - HEADER.size) // RECORD.size
+    return np.frombuffer(data, dtype=RECORD_DTYPE, count=count, offset=HEADER.size)
+
+def track_bounds(track) -> tuple:
+    latitude = track['latitude'] / COORDINATE_SCALE
+    longitude = track['longitude'] / COORDINATE_SCALE
+    return latitude.min(), latitude.max(), longitude.min(), longitude.max()
+
+def distances(track, latitude: float, longitude: float):
+    # Metres from every fix in the track to a point, haversine over the whole array at once
+    track_latitude = np.radians(track['latitude'] / COORDINATE_SCALE)
+    track_longitude = np.radians(track['longitude'] / COORDINATE_SCALE)
+    latitude, longitude = np.radians(latitude), np.radians(longitude)
+    a = (np.sin((track_latitude - latitude) / 2) ** 2 +
+         np.cos(latitude) * np.cos(track_latitude) * np.sin((track_longitude - longitude) / 2) ** 2)
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+def degrees_around(latitude: float, metres: float) -> tuple:
+    # How many degrees of latitude and longitude metres covers at latitude, for bounding box searches
+    latitude_degrees = np.degrees(metres / EARTH_RADIUS)
+    longitude_degrees = latitude_degrees / max(np.cos(np.radians(latitude)), 1e-6)
+    return float(latitude_degrees), float(min(longitude_degrees, 180))
@@ -0,0 +1,35 @@
+KNOTS_TO_MS = 0.514444
+
+def parse_sentence(line) -> list:
+    # Fields of a checksummed NMEA sentence, without the leading talker id ('GPRMC' -> 'RMC'), or None
+    if isinstance(line, bytes):
+        line = line.decode('ascii', 'replace')
+    line = line.strip()
+    if not line.startswith('$') or len(line) < 4 or line[-3] != '*':
+        return None
+    body = line[1:-3]
+    checksum = 0
+    for character in body.encode('ascii', 'replace'):
+        checksum ^= character
+    try:
+        if checksum != int(line[-2:], 16):
+            return None
+    except ValueError:
+        return None
+    fields = body.split(',')
+    fields[0] = fields[0][2:]
+    return fields
+
+def parse_coordinate(value: str, hemisphere: str) -> float:
+    # NMEA gives (d)ddmm.mmmm, degrees and decimal minutes
+    if not value:
+        return None
+    point = value.index('.') if '.' in value else len(value)
+    degrees = int(value[:point - 2]) + float(value[point - 2:]) / 60
+    return -degrees if hemisphere in ('S', 'W') else degrees
+
+def parse_float(value: str, default=None):
+    try:
+        return float(value)
+    except ValueError:
+        return default
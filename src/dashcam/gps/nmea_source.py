@@ -0,0 +1,77 @@
+from threading import Event
+import termios
+import os
+
+class NmeaSerial():
+    '''
+    NMEA sentences from a GPS receiver on a serial port, the Pi's UART is /dev/serial0.
+    '''
+    def __init__(self, device: str, baudrate: int) -> None:
+        self.device = device
+        self.baudrate = baudrate
+        self.file = self._open()
+
+    def _open(self):
+        fd = os.open(self.device, os.O_RDONLY | os.O_NOCTTY)
+        attributes = termios.tcgetattr(fd)
+        speed = getattr(termios, f'B{self.baudrate}')
+        attributes[0] = termios.IGNPAR  # iflag
+        attributes[1] = 0  # oflag
+        attributes[2] = termios.CS8 | termios.CLOCAL | termios.CREAD  # cflag
+        attributes[3] = termios.ICANON  # lflag, the driver hands us whole lines
+        attributes[4] = attributes[5] = speed
+        termios.tcsetattr(fd, termios.TCSANOW, attributes)
+        return os.fdopen(fd, 'rb')
+
+    def readline(self) -> bytes:
+        # b'' once closed or the device hangs up, a read error is raised
+        try:
+            return self.file.readline()
+        except ValueError:
+            return b''
+
+    def reopen(self) -> bool:
+        # Opens the device again after it went away, raises OSError while it is still gone
+        self.close()
+        self.file = self._open()
+        return True
+
+    def close(self) -> None:
+        try:
+            self.file.close()
+        except OSError:
+            pass
+
+class NmeaReplay():
+    '''
+    Plays back a logged NMEA file as if it were a receiver, one fix (RMC sentence) per interval,
+    looping at the end so a short log can drive a long test run.
+    '''
+    def __init__(self, path: str, interval: float = 1, loop: bool = True) -> None:
+        with open(path, 'rb') as f:
+            self.lines = [line for line in f.read().splitlines(keepends=True) if line.strip()]
+        if not any(b'RMC,' in line for line in self.lines):
+            raise ValueError(f"No RMC sentences in {path}")
+        self.interval = interval
+        self.loop = loop
+        self.position = 0
+        self.closed = Event()
+
+    def readline(self) -> bytes:
+        if self.position >= len(self.lines):
+            if not self.loop:
+                return b''
+            self.position = 0
+        line = self.lines[self.position]
+        self.position += 1
+        # Each fix ends with its RMC sentence, wait before starting on the next one
+        if b'RMC,' in line and self.closed.wait(self.interval):
+            return b''
+        return b'' if self.closed.is_set() else line
+
+    def reopen(self) -> bool:
+        # A replay doesn't go away, it has only ended, or been closed
+        return False
+
+    def close(self) -> None:
+        self.closed.set()
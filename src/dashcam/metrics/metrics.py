@@ -0,0 +1,136 @@
+from bisect import bisect_left
+import math
+
+class Counter():
+    def __init__(self, name: str, help: str, labels: dict = None) -> None:
+        self.name = name
+        self.help = help
+        self.labels = _labels(labels)
+        self.value = 0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def render(self) -> list:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter", f"{self.name}{_braces(self.labels)} {_format(self.value)}"]
+
+class CallbackMetric():
+    # A counter or gauge read from wherever the value already lives when /metrics is scraped,
+    # so the hot path pays nothing for it. The callback returns None when there's nothing to report
+    def __init__(self, name: str, help: str, kind: str, callback, labels: dict = None) -> None:
+        self.name = name
+        self.help = help
+        self.labels = _labels(labels)
+        self.kind = kind
+        self.callback = callback
+
+    def render(self) -> list:
+        try:
+            value = self.callback()
+        except Exception:
+            value = None
+        if value is None:
+            return []
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", f"{self.name}{_braces(self.labels)} {_format(value)}"]
+
+class Histogram():
+    def __init__(self, name: str, help: str, buckets: tuple, labels: dict = None) -> None:
+        self.name = name
+        self.help = help
+        self.labels = _labels(labels)
+        self.buckets = tuple(sorted(buckets))
+        # One slot per bucket plus +Inf, counts are per bucket and only made cumulative when rendered
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def render(self) -> list:
+        counts = list(self.counts)
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        total = 0
+        prefix = self.labels + ',' if self.labels else ''
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            total += count
+            lines.append(f'{self.name}_bucket{{{prefix}le="{_format(bound)}"}} {total}')
+        lines.append(f"{self.name}_sum{_braces(self.labels)} {_format(self.sum)}")
+        lines.append(f"{self.name}_count{_braces(self.labels)} {total}")
+        return lines
+
+class MetricsRegistry():
+    '''
+    Counters and fixed bucket histograms for /metrics in the Prometheus text format. Nothing takes
+    a lock: each metric is updated from a single thread (the stream lag histogram is shared by the
+    client threads, where the GIL makes a lost increment rare enough not to matter) and a scrape
+    just reads whatever the numbers are at that moment. The same name can be registered once per
+    set of labels, one camera's metrics from another's, and each name is rendered as one family.
+    '''
+    def __init__(self) -> None:
+        self.metrics = {}
+
+    def counter(self, name: str, help: str, labels: dict = None) -> Counter:
+        return self._add(Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, buckets: tuple, labels: dict = None) -> Histogram:
+        return self._add(Histogram(name, help, buckets, labels))
+
+    def counter_callback(self, name: str, help: str, callback, labels: dict = None) -> None:
+        self._add(CallbackMetric(name, help, 'counter', callback, labels))
+
+    def gauge_callback(self, name: str, help: str, callback, labels: dict = None) -> None:
+        self._add(CallbackMetric(name, help, 'gauge', callback, labels))
+
+    def render(self) -> str:
+        families = {}
+        for metric in list(self.metrics.values()):
+            families.setdefault(metric.name, []).append(metric)
+        lines = []
+        for metrics in families.values():
+            described = False
+            for metric in metrics:
+                rendered = metric.render()
+                # HELP and TYPE once per family, from whichever of its metrics has a value
+                lines.extend(rendered[2:] if described else rendered)
+                described = described or bool(rendered)
+        return "\n".join(lines) + "\n"
+
+    def _add(self, metric):
+        self.metrics[(metric.name, metric.labels)] = metric
+        return metric
+
+def _labels(labels: dict) -> str:
+    # Rendered once up front, the hot path never touches them
+    return ','.join(f'{key}="{value}"' for key, value in sorted((labels or {}).items()))
+
+def _braces(labels: str) -> str:
+    return f"{{{labels}}}" if labels else ""
+
+def _format(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def read_cpu_temperature():
+    # Degrees C from the SoC thermal zone, None off the Pi
+    try:
+        with open('/sys/class/thermal/thermal_zone0/temp') as f:
+            return int(f.read()) / 1000
+    except (OSError, ValueError):
+        return None
+
+def read_throttled(bit: int = None):
+    # The firmware's get_throttled bits (as vcgencmd reports them) without starting vcgencmd, or just
+    # one of them. Bit 0 under-voltage, 1 frequency capped, 2 throttled, 3 soft temperature limit,
+    # the same bits shifted up by 16 record that it has happened since boot
+    try:
+        with open('/sys/devices/platform/soc/soc:firmware/get_throttled') as f:
+            flags = int(f.read(), 16)
+    except (OSError, ValueError):
+        return None
+    return flags if bit is None else (flags >> bit) & 1
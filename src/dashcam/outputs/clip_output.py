@@ -0,0 +1,107 @@
+from dashcam.outputs.output import Output
+from threading import Condition, Event, Lock
+
+class ClipOutput(Output):
+    '''
+    Output that stays attached to a running encoder and forwards frames to one clip output at a time.
+    Calling split() prepares the next clip, the switch happens on the next keyframe so every frame
+    lands in exactly one clip and every clip starts on an IDR frame. Audio goes to the clip its
+    timestamp falls in, the closed clip is kept open for it until finish_audio().
+    '''
+    def __init__(self, output_factory) -> None:
+        super().__init__()
+        self.output_factory = output_factory
+        self.output = None
+        self.pending_output = None
+        self.retired = None
+        self.final = None
+        self.split_event = Event()
+        self.lock = Lock()
+        self.closing = None
+        self.switch_timestamp = None
+        self.audio_timestamp = None
+        self.audio_condition = Condition(self.lock)
+
+        self.clip_frames = 0
+        self.frames_received = 0
+        self.frames_written = 0
+        self.frames_dropped = 0
+
+    def split(self, path: str) -> None:
+        # Starting the next output can be slow (opening files, spawning processes),
+        # so do it on the caller's thread rather than the encoder's
+        output = self.output_factory(path)
+        output.start()
+        with self.lock:
+            self.split_event.clear()
+            if self.pending_output is not None:
+                self.pending_output.stop()
+            self.pending_output = output
+
+    def wait_for_split(self, timeout: float = None):
+        # Returns (output, frames) for the clip that was closed by the last split, the caller is responsible for stopping it
+        if not self.split_event.wait(timeout):
+            return None
+        with self.lock:
+            retired, self.retired = self.retired, None
+            self.split_event.clear()
+        return retired
+
+    def finish_audio(self, timeout: float) -> None:
+        # Audio comes out of its encoder a little behind the video, give it the chance to fill in
+        # the end of the clip that was just closed before it is stopped
+        with self.audio_condition:
+            if self.audio_timestamp is not None and self.switch_timestamp is not None:
+                self.audio_condition.wait_for(lambda: self.audio_timestamp >= self.switch_timestamp, timeout)
+            self.closing = None
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, packet=None, audio=False):
+        if audio:
+            self._output_audio(frame, timestamp)
+            return
+        self.frames_received += 1
+        if keyframe and self.pending_output is not None:
+            with self.lock:
+                if self.output is not None:
+                    self.retired = (self.output, self.clip_frames)
+                    self.closing = self.output
+                    self.switch_timestamp = timestamp
+                self.output = self.pending_output
+                self.pending_output = None
+                self.clip_frames = 0
+                self.split_event.set()
+
+        if self.output is None:
+            # Nothing to write to until the first clip has been opened on a keyframe
+            self.frames_dropped += 1
+            return
+
+        self.output.outputframe(frame, keyframe, timestamp)
+        self.clip_frames += 1
+        self.frames_written += 1
+
+    def _output_audio(self, frame, timestamp: int) -> None:
+        with self.lock:
+            output = self.output
+            if self.closing is not None and timestamp < self.switch_timestamp:
+                output = self.closing
+            self.audio_timestamp = timestamp
+            self.audio_condition.notify_all()
+        if output is not None:
+            output.outputframe(frame, True, timestamp, None, True)
+
+    def stop(self) -> None:
+        super().stop()
+        with self.lock:
+            if self.retired is not None:
+                self.retired[0].stop()
+            for output in (self.output, self.pending_output):
+                if output is not None:
+                    output.stop()
+            # Keep hold of the last clip so whoever started the encoder can still inspect it
+            self.final = (self.output, self.clip_frames) if self.output is not None else None
+            self.output = None
+            self.pending_output = None
+            self.retired = None
+            self.closing = None
+            self.audio_timestamp = None
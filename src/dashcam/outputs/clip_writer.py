@@ -0,0 +1,191 @@
+from threading import Condition, Thread
+from collections import deque
+import ctypes
+import time
+import os
+
+FALLOC_FL_KEEP_SIZE = 0x01
+
+def _load_fallocate():
+    # fallocate(2) from libc, the os module only has posix_fallocate. Where the filesystem can't
+    # allocate (vfat, exfat) that falls back to writing zeros and moves the end of the file
+    try:
+        fallocate = ctypes.CDLL(None, use_errno=True).fallocate64
+    except (OSError, AttributeError):
+        return None
+    fallocate.argtypes = (ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64)
+    fallocate.restype = ctypes.c_int
+    return fallocate
+
+_fallocate = _load_fallocate()
+
+def reserve(fd: int, size: int) -> bool:
+    # Reserves size bytes for the file without changing its length, so what a power cut leaves
+    # ends where the writing stopped. False where it can't be done, nothing is written instead
+    if _fallocate is None:
+        return False
+    return _fallocate(fd, FALLOC_FL_KEEP_SIZE, 0, size) == 0
+
+def sync_directory(path: str) -> None:
+    # A new file's directory entry has to reach the card too or the whole clip can vanish
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class BufferPool():
+    '''
+    A fixed number of equal sized write buffers, allocated once and shared by every clip a
+    FileStreamer writes so rotating never allocates. When the card falls behind they all end up
+    queued for writing, and whoever wants another waits for one to come back.
+    '''
+    def __init__(self, count: int, size: int) -> None:
+        self.size = size
+        self.buffers = [bytearray(size) for _ in range(count)]
+        self.count = count
+        self.condition = Condition()
+        self.peak = 0
+
+    def take(self) -> bytearray:
+        with self.condition:
+            self.condition.wait_for(lambda: self.buffers)
+            self.peak = max(self.peak, self.count - len(self.buffers) + 1)
+            return self.buffers.pop()
+
+    def give(self, buffer: bytearray) -> None:
+        with self.condition:
+            self.buffers.append(buffer)
+            self.condition.notify()
+
+    def in_use(self) -> int:
+        return self.count - len(self.buffers)
+
+class ClipWriter():
+    '''
+    Takes a clip's bytes from Mp4Output and writes them to the card on its own thread, in whole
+    pool buffers at offsets that are multiples of the buffer size, so the card sees a few large
+    aligned writes instead of one small write per box. A sync writes out the part filled buffer,
+    waits for the card and then runs its callback; the buffer stays put and is written again from
+    the same offset once it fills. The file is allocated at its expected size as it opens so it
+    doesn't fragment as it grows, and cut back to what was written as it closes.
+    '''
+    def __init__(self, path: str, pool: BufferPool, preallocate: int = 0) -> None:
+        self.path = path
+        self.pool = pool
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        # Not every filesystem can, the clip is written all the same
+        self.preallocated = reserve(self.fd, preallocate) if preallocate else False
+        # Called with (bytes, seconds) for each write, (seconds) for each wait on the pool and each sync
+        self.on_write = None
+        self.on_stall = None
+        self.on_sync = None
+
+        self.buffer = None
+        self.filled = 0
+        # File offset of the start of the current buffer
+        self.offset = 0
+        self.condition = Condition()
+        self.queue = deque()  # (buffer, offset, length, release) writes, or (None, directory, callback, None) syncs
+        self.closed = False
+        self.error = None
+
+        self.writes = 0
+        self.bytes_written = 0
+        self.stall_seconds = 0.0
+        self.thread = Thread(target=self._run, name=type(self).__name__, daemon=True)
+        self.thread.start()
+
+    def write(self, data) -> None:
+        # On the caller's thread this is only a copy, unless every buffer is waiting on the card
+        data = memoryview(data).cast('B')
+        position = 0
+        while position < len(data):
+            if self.buffer is None:
+                started = time.perf_counter()
+                self.buffer = self.pool.take()
+                stalled = time.perf_counter() - started
+                self.stall_seconds += stalled
+                if self.on_stall is not None:
+                    self.on_stall(stalled)
+            count = min(len(data) - position, self.pool.size - self.filled)
+            self.buffer[self.filled:self.filled + count] = data[position:position + count]
+            self.filled += count
+            position += count
+            if self.filled == self.pool.size:
+                self._queue((self.buffer, self.offset, self.filled, True))
+                self.offset += self.filled
+                self.buffer = None
+                self.filled = 0
+
+    def sync(self, directory: bool = False, callback=None) -> None:
+        # Everything written so far reaches the card, then callback runs on the writer's thread
+        if self.filled:
+            self._queue((self.buffer, self.offset, self.filled, False))
+        self._queue((None, directory, callback, None))
+
+    def close(self) -> None:
+        # Waits for the last writes, the clip is complete on return
+        if self.filled:
+            self._queue((self.buffer, self.offset, self.filled, True))
+        elif self.buffer is not None:
+            self.pool.give(self.buffer)
+        size = self.offset + self.filled
+        self.buffer = None
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+        # Gives back whatever of the allocation wasn't used, it is past the end of the file
+        os.ftruncate(self.fd, size)
+        os.close(self.fd)
+        if self.error is not None:
+            raise self.error
+
+    def _queue(self, item: tuple) -> None:
+        with self.condition:
+            self.queue.append(item)
+            self.condition.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.queue or self.closed)
+                if not self.queue:
+                    return
+                buffer, offset, length, release = self.queue.popleft()
+            try:
+                # After a failed write the clip is only good up to the last sync before it, nothing
+                # more is written or reported as synced
+                if self.error is not None:
+                    pass
+                elif buffer is None:
+                    self._sync(offset, length)
+                else:
+                    self._write(buffer, offset, length)
+            except OSError as e:
+                # Kept for close(), a full or failing card shouldn't take the encoder thread down with it
+                self.error = e
+            if release:
+                self.pool.give(buffer)
+
+    def _write(self, buffer: bytearray, offset: int, length: int) -> None:
+        started = time.perf_counter()
+        view = memoryview(buffer)
+        written = 0
+        while written < length:
+            written += os.pwrite(self.fd, view[written:length], offset + written)
+        self.writes += 1
+        self.bytes_written += length
+        if self.on_write is not None:
+            self.on_write(length, time.perf_counter() - started)
+
+    def _sync(self, directory: bool, callback) -> None:
+        started = time.perf_counter()
+        os.fdatasync(self.fd)
+        if directory:
+            sync_directory(self.path)
+        if self.on_sync is not None:
+            self.on_sync(time.perf_counter() - started)
+        if callback is not None:
+            callback()
@@ -0,0 +1,112 @@
+import struct
+import os
+
+INDEX_EXTENSION = '.idx'
+INDEX_MAGIC = b'DIDX'
+INDEX_VERSION = 1
+
+HEADER = struct.Struct('>4sHI')  # magic, version, init segment size
+ENTRY = struct.Struct('>QIQI')  # decode time, duration (both in the clip timescale), file offset, moof + mdat size
+
+class FragmentIndex():
+    '''
+    Sidecar file listing where each fragment of a clip starts, so a clip can be cut on keyframes
+    without reading it. Every fragment starts with a keyframe, one small entry is appended as each
+    one is written and the file never holds more than the clip does.
+    '''
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.file = None
+        self.entries = 0
+
+    def open(self, init_size: int) -> None:
+        self.file = open(self.path, 'wb')
+        self.file.write(HEADER.pack(INDEX_MAGIC, INDEX_VERSION, init_size))
+
+    def add(self, decode_time: int, duration: int, offset: int, size: int) -> None:
+        if self.file is None:
+            return
+        self.file.write(ENTRY.pack(decode_time, duration, offset, size))
+        # One small write per second of video, keeps the index in step with the clip if we lose power
+        self.file.flush()
+        self.entries += 1
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+def read_fragment_index(path: str) -> tuple:
+    # Returns (init size, [(decode time, duration, offset, size), ...]) or None without a usable index
+    try:
+        with open(path + INDEX_EXTENSION, 'rb') as f:
+            data = f.read()
+        clip_size = os.path.getsize(path)
+    except OSError:
+        return None
+    if len(data) < HEADER.size:
+        return None
+    magic, version, init_size = HEADER.unpack_from(data)
+    if magic != INDEX_MAGIC or version != INDEX_VERSION:
+        return None
+
+    # A partial trailing entry or a fragment the clip doesn't fully hold means we stopped mid write
+    count = (len(data) - HEADER.size) // ENTRY.size
+    entries = [entry for entry in ENTRY.iter_unpack(data[HEADER.size:HEADER.size + count * ENTRY.size])
+               if entry[2] + entry[3] <= clip_size]
+    return init_size, entries
+
+def scan_fragments(path: str) -> tuple:
+    # Builds the same list by hopping between top level boxes, for clips that have no index.
+    # Only box headers and the small moof boxes are read, never the media data
+    init_size = None
+    entries = []
+    fragment = None
+    with open(path, 'rb') as f:
+        clip_size = os.fstat(f.fileno()).st_size
+        offset = 0
+        while offset + 8 <= clip_size:
+            size, kind = struct.unpack('>I4s', os.pread(f.fileno(), 8, offset))
+            if size < 8 or offset + size > clip_size:
+                break
+            if kind == b'moof':
+                if init_size is None:
+                    init_size = offset
+                fragment = (offset,) + parse_moof(os.pread(f.fileno(), size, offset))[:2]
+            elif kind == b'mdat' and fragment is not None:
+                start, decode_time, duration = fragment
+                entries.append((decode_time, duration, start, offset + size - start))
+                fragment = None
+            offset += size
+    if init_size is None:
+        return None
+    return init_size, entries
+
+def child_boxes(data, start: int, end: int):
+    while start + 8 <= end:
+        size, kind = struct.unpack_from('>I4s', data, start)
+        if size < 8:
+            return
+        yield kind, start, size
+        start += size
+
+def parse_moof(moof) -> tuple:
+    # (base decode time, total duration, sample count) of the first track fragment
+    decode_time = duration = count = 0
+    for kind, position, size in child_boxes(moof, 8, len(moof)):
+        if kind != b'traf':
+            continue
+        for kind, child, _ in child_boxes(moof, position + 8, position + size):
+            if kind == b'tfdt':
+                version = moof[child + 8]
+                decode_time = struct.unpack_from('>Q' if version == 1 else '>I', moof, child + 12)[0]
+            elif kind == b'trun':
+                flags = struct.unpack_from('>I', moof, child + 8)[0] & 0xFFFFFF
+                count = struct.unpack_from('>I', moof, child + 12)[0]
+                entry = child + 16 + (4 if flags & 0x1 else 0) + (4 if flags & 0x4 else 0)
+                # Only the durations are needed, the entry layout depends on which fields are present
+                stride = 4 * bin(flags & 0xF00).count('1')
+                if flags & 0x100:
+                    duration = sum(struct.unpack_from('>I', moof, entry + i * stride)[0] for i in range(count))
+        break
+    return decode_time, duration, count
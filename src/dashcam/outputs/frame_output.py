@@ -0,0 +1,72 @@
+from dashcam.outputs.output import Output
+from threading import Condition
+import time
+
+class FrameOutput(Output):
+    '''
+    Holds only the latest encoded frame. Every client waits on the same condition and reads the same
+    bytes, so a frame is encoded once no matter how many viewers there are and a slow client simply
+    skips the frames it missed.
+    '''
+    def __init__(self) -> None:
+        super().__init__()
+        self.frame = None
+        self.frame_time = None
+        self.sequence = 0
+        self.condition = Condition()
+        # One future per event loop, however many async clients are waiting on it
+        self.async_waiters = {}
+
+    def stop(self) -> None:
+        super().stop()
+        with self.condition:
+            self.condition.notify_all()
+            self._wake_async_waiters()
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, packet=None, audio=False):
+        with self.condition:
+            self.frame = frame
+            self.frame_time = time.monotonic()
+            self.sequence += 1
+            self.condition.notify_all()
+            self._wake_async_waiters()
+
+    def _wake_async_waiters(self) -> None:
+        waiters, self.async_waiters = self.async_waiters, {}
+        for loop, future in waiters.items():
+            loop.call_soon_threadsafe(_resolve, future)
+
+    def wait_for_frame(self, sequence: int, timeout: float = None):
+        # Returns (frame, sequence) for the first frame newer than sequence, or None on timeout/stop
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.sequence > sequence or not self.recording, timeout):
+                return None
+            if self.sequence <= sequence:
+                return None
+            return self.frame, self.sequence
+
+    async def wait_for_frame_async(self, sequence: int, timeout: float = None):
+        # Same as wait_for_frame but suspends the calling coroutine instead of blocking a thread.
+        # asyncio is only imported by the async server, recording shouldn't wait for it at boot
+        import asyncio
+        loop = asyncio.get_running_loop()
+        with self.condition:
+            if self.sequence <= sequence and self.recording:
+                future = self.async_waiters.get(loop)
+                if future is None:
+                    future = self.async_waiters[loop] = loop.create_future()
+            else:
+                future = None
+        if future is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(future), timeout)
+            except asyncio.TimeoutError:
+                return None
+        with self.condition:
+            if self.sequence <= sequence:
+                return None
+            return self.frame, self.sequence
+
+def _resolve(future) -> None:
+    if not future.done():
+        future.set_result(None)
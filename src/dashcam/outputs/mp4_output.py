@@ -0,0 +1,399 @@
+from dashcam.outputs.fragment_index import FragmentIndex, INDEX_EXTENSION
+from dashcam.outputs.clip_writer import ClipWriter, sync_directory
+from dashcam.outputs.output import Output
+from threading import Lock
+import struct
+import zlib
+import time
+import re
+import os
+
+NAL_SLICE = 1
+NAL_IDR = 5
+NAL_SPS = 7
+NAL_PPS = 8
+NAL_AUD = 9
+
+TIMESCALE = 90000
+
+# Longest a finished GOP is held back waiting for the audio that goes with it, in the video timescale
+AUDIO_WAIT = TIMESCALE // 2
+
+# trun sample flags, keyframes don't depend on other samples, everything else is a non-sync sample
+SAMPLE_FLAGS_SYNC = 0x02000000
+SAMPLE_FLAGS_NON_SYNC = 0x01010000
+
+IDENTITY_MATRIX = struct.pack('>9I', 0x00010000, 0, 0, 0, 0x00010000, 0, 0, 0, 0x40000000)
+
+START_CODE = re.compile(b'\x00\x00\x01')
+
+def split_nal_units(frame) -> list:
+    # Splits an Annex B byte stream into memoryview slices of each NAL unit, without the start codes.
+    # re works on any buffer so frames that are views into a larger buffer are never copied
+    data = memoryview(frame)
+    starts = [match.end() for match in START_CODE.finditer(frame)]
+    units = []
+    for i, start in enumerate(starts):
+        end = starts[i + 1] - 3 if i + 1 < len(starts) else len(data)
+        # A four byte start code leaves a trailing zero on the previous unit
+        if end > start and i + 1 < len(starts) and data[end - 1] == 0:
+            end -= 1
+        units.append(data[start:end])
+    return units
+
+def box(kind: bytes, *payload) -> bytes:
+    data = b''.join(payload)
+    return struct.pack('>I4s', 8 + len(data), kind) + data
+
+def full_box(kind: bytes, version: int, flags: int, *payload) -> bytes:
+    return box(kind, struct.pack('>I', (version << 24) | flags), *payload)
+
+def descriptor(tag: int, *payload) -> bytes:
+    # MPEG-4 descriptors in esds, the size is always written in four bytes of seven bits each
+    data = b''.join(payload)
+    size = len(data)
+    return bytes([tag, 0x80 | (size >> 21) & 0x7F, 0x80 | (size >> 14) & 0x7F, 0x80 | (size >> 7) & 0x7F, size & 0x7F]) + data
+
+class Mp4Output(Output):
+    '''
+    Writes H264 encoder output straight to a fragmented MP4 file, one fragment per GOP.
+    The moov box is written up front so a clip is playable up to its last complete fragment.
+    Each fragment is also recorded in a FragmentIndex next to the clip for keyframe exact exports.
+    With sync_fragments set the file is flushed to the card every that many fragments, so a power
+    cut loses at most the fragments since and the clip can be trimmed back to its last whole one.
+    Given an audio track (as AudioRecorder describes it) the clip gets a second track, and each
+    fragment carries the audio for the same stretch of time as its video. Given a BufferPool the
+    writing and syncing is left to a ClipWriter, preallocating the file at preallocate bytes.
+    '''
+    def __init__(self, path: str, resolution: tuple, fps: int, sync_fragments: int = 0, audio: dict = None,
+                 pool=None, preallocate: int = 0) -> None:
+        super().__init__()
+        self.path = path
+        self.pool = pool
+        self.preallocate = preallocate
+        self.width, self.height = resolution
+        self.fps = fps
+        self.sync_fragments = sync_fragments
+        self.file = None
+        self.sps = None
+        self.pps = None
+        self.sequence_number = 0
+        self.samples = []
+        self.first_timestamp = None
+        self.last_duration = TIMESCALE // fps
+        self.frame_count = 0
+        self.bytes_written = 0
+        self.checksum = 0
+        self.duration = 0
+        # What the card failed with under the ClipWriter, the clip is only good up to its last sync
+        self.error = None
+        self.fragment_index = FragmentIndex(path + INDEX_EXTENSION)
+        # Called with (bytes, seconds) after each fragment is written, for metrics. The ClipWriter's
+        # (bytes, seconds) per write, and seconds per wait for a buffer and per sync, the same way
+        self.on_fragment = None
+        self.on_write = None
+        self.on_stall = None
+        self.on_sync = None
+        # Fragments written since the last sync, indexed once they are on the card
+        self.unindexed = []
+        # Finished GOPs waiting for their audio, as (samples, decode time of the next GOP)
+        self.ready = []
+
+        # Audio arrives on its own thread, anything it touches is under audio_lock
+        self.audio = audio
+        self.audio_lock = Lock()
+        self.audio_samples = []  # (packet, decode time) in the audio timescale, waiting for their fragment
+        self.audio_decode_time = None
+        self.audio_frames = 0
+        self.closing = False
+
+    def start(self) -> None:
+        super().start()
+        if self.pool is None:
+            self.file = open(self.path, 'wb')
+            return
+        self.file = ClipWriter(self.path, self.pool, self.preallocate)
+        self.file.on_write, self.file.on_stall, self.file.on_sync = self.on_write, self.on_stall, self.on_sync
+
+    def stop(self) -> None:
+        super().stop()
+        if self.file is None:
+            return
+        with self.audio_lock:
+            self.closing = True
+        if self.samples:
+            self.ready.append((self.samples, None))
+            self.samples = []
+        self._write_ready(final=True)
+        try:
+            self.file.close()
+        except OSError as e:
+            # Kept rather than raised, a full or failing card ends this clip and recording goes on with the next
+            print(f"Writing {self.path} failed: {e}")
+            self.error = e
+        else:
+            self._index(self.unindexed)
+        self.file = None
+        self.unindexed = []
+        self.fragment_index.close()
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, packet=None, audio=False):
+        if audio:
+            self._add_audio(frame, timestamp)
+            return
+        if self.file is None:
+            return
+
+        nal_units = []
+        sample_size = 0
+        for unit in split_nal_units(frame):
+            nal_type = unit[0] & 0x1F
+            if nal_type == NAL_SPS:
+                self.sps = bytes(unit)
+            elif nal_type == NAL_PPS:
+                self.pps = bytes(unit)
+            elif nal_type != NAL_AUD:
+                # Parameter sets live in the avcC box, everything else becomes part of the sample
+                nal_units.append(struct.pack('>I', len(unit)))
+                nal_units.append(unit)
+                sample_size += 4 + len(unit)
+
+        if self.sequence_number == 0 and not self.samples:
+            # Clips have to start on a keyframe that carries the parameter sets
+            if not keyframe or self.sps is None or self.pps is None:
+                return
+            self._write(self._init_segment())
+            self.fragment_index.open(self.bytes_written)
+            if self.sync_fragments:
+                self._sync(directory=True)
+
+        if timestamp is None:
+            timestamp = self.frame_count * 1000000 // self.fps
+        if self.first_timestamp is None:
+            self.first_timestamp = timestamp
+        decode_time = (timestamp - self.first_timestamp) * TIMESCALE // 1000000
+
+        if keyframe and self.samples:
+            self.ready.append((self.samples, decode_time))
+            self.samples = []
+        self.samples.append((nal_units, sample_size, keyframe, decode_time))
+        self.frame_count += 1
+        if self.ready:
+            self._write_ready()
+
+    def _add_audio(self, packet, timestamp: int) -> None:
+        # Audio is placed against the first video frame and runs on packet by packet from there
+        with self.audio_lock:
+            if self.audio is None or self.closing or self.first_timestamp is None:
+                return
+            if self.audio_decode_time is None:
+                start = (timestamp - self.first_timestamp) * self.audio['sample_rate'] // 1000000
+                if start < 0:
+                    # From before this clip's first frame, the clip before has it
+                    return
+                self.audio_decode_time = start
+            self.audio_samples.append((bytes(packet), self.audio_decode_time))
+            self.audio_decode_time += self.audio['frame_size']
+            self.audio_frames += 1
+
+    def _write_ready(self, final: bool = False) -> None:
+        # A GOP is written once the audio has caught up with its end. Audio comes out of its
+        # encoder a little behind the video, so that is usually the next frame or two
+        while self.ready:
+            samples, next_decode_time = self.ready[0]
+            if not final and self.audio is not None:
+                with self.audio_lock:
+                    audio_time = self.audio_decode_time
+                reached = audio_time * TIMESCALE // self.audio['sample_rate'] if audio_time is not None else -1
+                if reached < next_decode_time and self.samples[-1][3] - next_decode_time < AUDIO_WAIT:
+                    return
+            self.ready.pop(0)
+            self._write_fragment(samples, next_decode_time)
+
+    def _write(self, data) -> None:
+        self.file.write(data)
+        self.bytes_written += len(data)
+        self.checksum = zlib.crc32(data, self.checksum)
+
+    def _write_fragment(self, samples: list, next_decode_time) -> None:
+        # Durations come from the gap to the following sample, the final sample of a clip reuses the previous duration
+        entries = []
+        fragment_duration = 0
+        for i, (_, size, keyframe, decode_time) in enumerate(samples):
+            following = samples[i + 1][3] if i + 1 < len(samples) else next_decode_time
+            if following is not None and following > decode_time:
+                self.last_duration = following - decode_time
+            flags = SAMPLE_FLAGS_SYNC if keyframe else SAMPLE_FLAGS_NON_SYNC
+            entries.append(struct.pack('>III', self.last_duration, size, flags))
+            fragment_duration += self.last_duration
+
+        audio = self._take_audio(next_decode_time)
+        video_size = sum(size for _, size, _, _ in samples)
+        audio_entries = [struct.pack('>II', self.audio['frame_size'], len(packet)) for packet, _ in audio]
+        self.sequence_number += 1
+        moof = self._moof(samples[0][3], entries, 0, audio, audio_entries, 0)
+        moof = self._moof(samples[0][3], entries, len(moof) + 8, audio, audio_entries, len(moof) + 8 + video_size)
+        mdat_size = video_size + sum(len(packet) for packet, _ in audio)
+        offset = self.bytes_written
+        started = time.perf_counter()
+
+        self._write(moof)
+        self._write(struct.pack('>I4s', 8 + mdat_size, b'mdat'))
+        for nal_units, _, _, _ in samples:
+            for data in nal_units:
+                self._write(data)
+        for packet, _ in audio:
+            self._write(packet)
+        self.unindexed.append((samples[0][3], fragment_duration, offset, self.bytes_written - offset))
+        if self.sync_fragments and self.sequence_number % self.sync_fragments == 0:
+            self._sync()
+        elif not self.sync_fragments:
+            self._index(self.unindexed)
+            self.unindexed = []
+        if self.on_fragment is not None:
+            self.on_fragment(self.bytes_written - offset, time.perf_counter() - started)
+        self.duration = (samples[-1][3] + self.last_duration) / TIMESCALE
+
+    def _take_audio(self, next_decode_time) -> list:
+        # The audio packets that start before the next GOP does, all of them for the last fragment
+        with self.audio_lock:
+            if next_decode_time is None:
+                audio, self.audio_samples = self.audio_samples, []
+                return audio
+            count = 0
+            for _, decode_time in self.audio_samples:
+                if decode_time * TIMESCALE // self.audio['sample_rate'] >= next_decode_time:
+                    break
+                count += 1
+            audio, self.audio_samples = self.audio_samples[:count], self.audio_samples[count:]
+            return audio
+
+    def _sync(self, directory: bool = False) -> None:
+        # Index entries only go in after the data is on the card so the index never points past what survives a power cut
+        entries, self.unindexed = self.unindexed, []
+        if self.pool is not None:
+            # Done by the writer's thread once everything before it is written
+            self.file.sync(directory, lambda: self._index(entries))
+            return
+        self.file.flush()
+        os.fdatasync(self.file.fileno())
+        if directory:
+            sync_directory(self.path)
+        self._index(entries)
+
+    def _index(self, entries: list) -> None:
+        for entry in entries:
+            self.fragment_index.add(*entry)
+
+    def _moof(self, base_decode_time: int, entries: list, data_offset: int, audio: list, audio_entries: list, audio_offset: int) -> bytes:
+        trun_flags = 0x000001 | 0x000100 | 0x000200 | 0x000400  # data offset, duration, size, flags
+        trafs = [self._traf(1, base_decode_time, trun_flags, entries, data_offset)]
+        if audio:
+            # Every audio sample is a sync sample, which is what the trex default flags say
+            trafs.append(self._traf(2, audio[0][1], 0x000001 | 0x000100 | 0x000200, audio_entries, audio_offset))
+        return box(b'moof', full_box(b'mfhd', 0, 0, struct.pack('>I', self.sequence_number)), *trafs)
+
+    def _traf(self, track_id: int, base_decode_time: int, trun_flags: int, entries: list, data_offset: int) -> bytes:
+        return box(b'traf',
+            full_box(b'tfhd', 0, 0x020000, struct.pack('>I', track_id)),  # default-base-is-moof
+            full_box(b'tfdt', 1, 0, struct.pack('>Q', base_decode_time)),
+            full_box(b'trun', 0, trun_flags, struct.pack('>Ii', len(entries), data_offset), *entries),
+        )
+
+    def _init_segment(self) -> bytes:
+        ftyp = box(b'ftyp', b'iso5', struct.pack('>I', 512), b'iso5', b'iso6', b'avc1', b'mp41')
+        mvhd = full_box(b'mvhd', 0, 0,
+            struct.pack('>IIII', 0, 0, 1000, 0),
+            struct.pack('>IH10x', 0x00010000, 0x0100),
+            IDENTITY_MATRIX,
+            bytes(24),
+            struct.pack('>I', 3 if self.audio is not None else 2),  # next track id
+        )
+        tkhd = full_box(b'tkhd', 0, 0x000003,
+            struct.pack('>IIIII', 0, 0, 1, 0, 0),
+            bytes(8),
+            struct.pack('>hhhH', 0, 0, 0, 0),
+            IDENTITY_MATRIX,
+            struct.pack('>II', self.width << 16, self.height << 16),
+        )
+        mdhd = full_box(b'mdhd', 0, 0, struct.pack('>IIIIHH', 0, 0, TIMESCALE, 0, 0x55C4, 0))  # language 'und'
+        hdlr = full_box(b'hdlr', 0, 0, struct.pack('>I4s12x', 0, b'vide'), b'VideoHandler\x00')
+        vmhd = full_box(b'vmhd', 0, 1, bytes(8))
+        dinf = box(b'dinf', full_box(b'dref', 0, 0, struct.pack('>I', 1), full_box(b'url ', 0, 1)))
+        stbl = box(b'stbl',
+            full_box(b'stsd', 0, 0, struct.pack('>I', 1), self._avc1()),
+            full_box(b'stts', 0, 0, struct.pack('>I', 0)),
+            full_box(b'stsc', 0, 0, struct.pack('>I', 0)),
+            full_box(b'stsz', 0, 0, struct.pack('>II', 0, 0)),
+            full_box(b'stco', 0, 0, struct.pack('>I', 0)),
+        )
+        trak = box(b'trak', tkhd, box(b'mdia', mdhd, hdlr, box(b'minf', vmhd, dinf, stbl)))
+        if self.audio is None:
+            mvex = box(b'mvex', full_box(b'trex', 0, 0, struct.pack('>IIIII', 1, 1, 0, 0, 0)))
+            return ftyp + box(b'moov', mvhd, trak, mvex)
+        mvex = box(b'mvex',
+            full_box(b'trex', 0, 0, struct.pack('>IIIII', 1, 1, 0, 0, 0)),
+            full_box(b'trex', 0, 0, struct.pack('>IIIII', 2, 1, self.audio['frame_size'], 0, 0)),
+        )
+        return ftyp + box(b'moov', mvhd, trak, self._audio_trak(dinf), mvex)
+
+    def _audio_trak(self, dinf: bytes) -> bytes:
+        audio = self.audio
+        tkhd = full_box(b'tkhd', 0, 0x000003,
+            struct.pack('>IIIII', 0, 0, 2, 0, 0),
+            bytes(8),
+            struct.pack('>hhhH', 0, 1, 0x0100, 0),  # alternate group 1, full volume
+            IDENTITY_MATRIX,
+            struct.pack('>II', 0, 0),
+        )
+        mdhd = full_box(b'mdhd', 0, 0, struct.pack('>IIIIHH', 0, 0, audio['sample_rate'], 0, 0x55C4, 0))
+        hdlr = full_box(b'hdlr', 0, 0, struct.pack('>I4s12x', 0, b'soun'), b'SoundHandler\x00')
+        smhd = full_box(b'smhd', 0, 0, struct.pack('>hH', 0, 0))
+        stbl = box(b'stbl',
+            full_box(b'stsd', 0, 0, struct.pack('>I', 1), self._audio_sample_entry()),
+            full_box(b'stts', 0, 0, struct.pack('>I', 0)),
+            full_box(b'stsc', 0, 0, struct.pack('>I', 0)),
+            full_box(b'stsz', 0, 0, struct.pack('>II', 0, 0)),
+            full_box(b'stco', 0, 0, struct.pack('>I', 0)),
+        )
+        return box(b'trak', tkhd, box(b'mdia', mdhd, hdlr, box(b'minf', smhd, dinf, stbl)))
+
+    def _audio_sample_entry(self) -> bytes:
+        audio = self.audio
+        entry = (bytes(6) + struct.pack('>H', 1)  # data reference index
+                 + bytes(8)
+                 + struct.pack('>HHHH', audio['channels'], 16, 0, 0)
+                 + struct.pack('>I', audio['sample_rate'] << 16))
+        if audio['codec'] == 'opus':
+            # dOps is OpusHead from the encoder with its little endian fields turned big endian
+            head = audio['extradata']
+            pre_skip, input_rate, gain = struct.unpack_from('<HIh', head, 10)
+            return box(b'Opus', entry, box(b'dOps', struct.pack('>BBHIhB', 0, head[9], pre_skip, input_rate, gain, 0)))
+        # AAC, the encoder's AudioSpecificConfig goes in the decoder config of an ES descriptor
+        decoder_config = descriptor(0x04,
+            struct.pack('>BB', 0x40, 0x15),  # MPEG-4 audio, audio stream
+            bytes(3),  # buffer size
+            struct.pack('>II', audio['bitrate'], audio['bitrate']),
+            descriptor(0x05, audio['extradata']),
+        )
+        es = descriptor(0x03, struct.pack('>HB', 2, 0), decoder_config, descriptor(0x06, b'\x02'))
+        return box(b'mp4a', entry, full_box(b'esds', 0, 0, es))
+
+    def _avc1(self) -> bytes:
+        profile, compatibility, level = self.sps[1], self.sps[2], self.sps[3]
+        avcc = struct.pack('>BBBBBB', 1, profile, compatibility, level, 0xFF, 0xE1)
+        avcc += struct.pack('>H', len(self.sps)) + self.sps
+        avcc += struct.pack('>BH', 1, len(self.pps)) + self.pps
+        if profile in (100, 110, 122, 144):
+            # High profiles also carry chroma format and bit depth, 4:2:0 8-bit from the Pi encoder
+            avcc += struct.pack('>BBBB', 0xFD, 0xF8, 0xF8, 0)
+        return box(b'avc1',
+            bytes(6), struct.pack('>H', 1),  # data reference index
+            bytes(16),
+            struct.pack('>HH', self.width, self.height),
+            struct.pack('>II', 0x00480000, 0x00480000),  # 72 dpi
+            bytes(4), struct.pack('>H', 1),
+            bytes(32),
+            struct.pack('>Hh', 0x0018, -1),
+            box(b'avcC', avcc),
+        )
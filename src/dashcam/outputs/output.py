@@ -0,0 +1,16 @@
+try:
+    from picamera2.outputs import Output
+except ImportError:
+    # Without picamera2 (e.g. the synthetic source on a desktop) the encoders only need this much of the interface
+    class Output():
+        def __init__(self, pts=None) -> None:
+            self.recording = False
+
+        def start(self) -> None:
+            self.recording = True
+
+        def stop(self) -> None:
+            self.recording = False
+
+        def outputframe(self, frame, keyframe=True, timestamp=None, packet=None, audio=False):
+            pass
@@ -0,0 +1,156 @@
+from dashcam.outputs.output import Output
+from threading import Condition, Thread
+from collections import deque
+import itertools
+import time
+
+class RingOutput(Output):
+    '''
+    Keeps the most recent encoded frames in one preallocated bytearray so an event clip can include
+    the seconds before it was triggered. Frames are handed to snapshot outputs as memoryview slices
+    of the ring, the region a snapshot still needs is pinned until it has been written out. A snapshot
+    can be extended while it runs, for clips that last as long as whatever triggered them.
+    '''
+    def __init__(self, size: int) -> None:
+        super().__init__()
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.frames = deque()  # (sequence, offset, length, keyframe, timestamp), oldest first
+        self.position = 0
+        self.sequence = 0
+        self.cursors = {}
+        # Snapshot output -> timestamp it stops at
+        self.ends = {}
+        self.resync = False
+        self.frames_dropped = 0
+        self.condition = Condition()
+
+    def start(self) -> None:
+        # Parking and recording stop and start the encoder under snapshots that are still writing out of
+        # the ring. It is only emptied once they have finished, one that takes too long keeps its frames
+        # pinned and the ring carries on from where it was rather than overwriting them
+        with self.condition:
+            if self.condition.wait_for(lambda: not self.cursors, 5):
+                self.frames.clear()
+                self.position = 0
+        super().start()
+
+    def stop(self) -> None:
+        super().stop()
+        with self.condition:
+            self.condition.notify_all()
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, packet=None, audio=False):
+        length = len(frame)
+        if timestamp is None:
+            timestamp = time.monotonic_ns() // 1000
+
+        with self.condition:
+            # After a drop the following frames reference something we don't have, wait for a keyframe
+            if self.resync and not keyframe:
+                self.frames_dropped += 1
+                return
+            if not self._store(frame, length, keyframe, timestamp):
+                self.frames_dropped += 1
+                self.resync = True
+                return
+            self.resync = False
+            self.condition.notify_all()
+
+    def _store(self, frame, length: int, keyframe: bool, timestamp: int) -> bool:
+        if length > len(self.buffer):
+            return False
+
+        position = self.position
+        if position + length > len(self.buffer):
+            # Wrap around, anything left in the unused tail is older than what sits at the start
+            if not self._evict(lambda record: record[1] >= position):
+                return False
+            position = 0
+        if not self._evict(lambda record: record[1] < position + length and record[1] + record[2] > position):
+            return False
+
+        self.buffer[position:position + length] = frame
+        self.frames.append((self.sequence, position, length, keyframe, timestamp))
+        self.sequence += 1
+        self.position = position + length
+        return True
+
+    def _evict(self, overlaps) -> bool:
+        pinned = min(self.cursors.values(), default=None)
+        while self.frames and overlaps(self.frames[0]):
+            if pinned is not None and self.frames[0][0] >= pinned:
+                return False
+            self.frames.popleft()
+        return True
+
+    def snapshot(self, output, pre_seconds: float, post_seconds: float, on_finished=None) -> Thread:
+        # Writes from the last keyframe at least pre_seconds old up to post_seconds after now into output
+        with self.condition:
+            if not self.frames:
+                return None
+            trigger = self.frames[-1][4]
+            start = None
+            for sequence, _, _, keyframe, timestamp in reversed(self.frames):
+                if keyframe:
+                    start = sequence
+                    if timestamp <= trigger - pre_seconds * 1000000:
+                        break
+            if start is None:
+                return None
+            token = object()
+            self.cursors[token] = start
+            self.ends[output] = trigger + post_seconds * 1000000
+
+        thread = Thread(target=self._drain, args=(output, token, on_finished))
+        thread.start()
+        return thread
+
+    def extend(self, output, post_seconds: float) -> bool:
+        # Moves the end of output's snapshot to post_seconds after the newest frame, False if it has already finished
+        with self.condition:
+            if output not in self.ends:
+                return False
+            if self.frames:
+                self.ends[output] = self.frames[-1][4] + post_seconds * 1000000
+            return True
+
+    def _finished(self, output, timestamp: int) -> bool:
+        # Checked again under the lock so an extend() can't land just as the snapshot gives up
+        with self.condition:
+            if timestamp <= self.ends[output]:
+                return False
+            del self.ends[output]
+            return True
+
+    def _drain(self, output, token, on_finished) -> None:
+        output.start()
+        cursor = self.cursors[token]
+        try:
+            while True:
+                with self.condition:
+                    while self.recording and (not self.frames or self.frames[-1][0] < cursor):
+                        self.condition.wait(1)
+                    skip = max(cursor - self.frames[0][0], 0) if self.frames else 0
+                    batch = list(itertools.islice(self.frames, skip, None))
+                if not batch:
+                    return
+
+                for sequence, offset, length, keyframe, timestamp in batch:
+                    if timestamp > self.ends[output] and self._finished(output, timestamp):
+                        return
+                    output.outputframe(self.view[offset:offset + length], keyframe, timestamp)
+                    cursor = sequence + 1
+                    if keyframe:
+                        # The output only keeps hold of the current GOP, everything before it has been written
+                        with self.condition:
+                            self.cursors[token] = sequence
+        finally:
+            # Stopping flushes the last GOP, which is still read straight out of the ring
+            output.stop()
+            with self.condition:
+                del self.cursors[token]
+                self.ends.pop(output, None)
+                self.condition.notify_all()
+            if on_finished is not None:
+                on_finished(output)
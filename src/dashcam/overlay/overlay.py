@@ -0,0 +1,127 @@
+import numpy as np
+import time
+
+class Overlay():
+    '''
+    Draws the timestamp, speed and coordinates onto the main stream. The text is rasterised at
+    most once a second into a small patch, each frame only alpha blends that patch into its
+    corner of the frame, so the per-frame cost doesn't depend on the frame size.
+    '''
+    def __init__(self, source, settings: dict) -> None:
+        self.source = source
+        self.settings = settings
+        self.speed = None
+        self.coordinates = None
+
+        self.second = None
+        self.text = None
+        self.alpha = None
+        self.colour = None
+        self.inverse_alpha = None
+        self.premultiplied = None
+        self.scratch = None
+
+        self.frames = 0
+        self.last_cost_us = 0
+        self.average_cost_us = 0.0
+        self.max_cost_us = 0
+
+    def set_speed(self, speed: float) -> None:
+        self.speed = speed
+
+    def set_coordinates(self, latitude: float, longitude: float) -> None:
+        self.coordinates = (latitude, longitude)
+
+    def get_stats(self) -> dict:
+        return {
+            "frames": self.frames,
+            "text": self.text,
+            "last_cost_us": self.last_cost_us,
+            "average_cost_us": round(self.average_cost_us, 1),
+            "max_cost_us": self.max_cost_us,
+        }
+
+    def apply(self, request) -> None:
+        # pre_callback, runs on the camera thread for every frame
+        started = time.perf_counter_ns()
+        second = int(time.time())
+        if second != self.second:
+            self.second = second
+            self._update(self._compose_text())
+
+        with self.source.map_array(request, "main") as mapped:
+            frame = mapped.array
+            if frame.ndim == 2:
+                # YUV420, draw on the Y plane only and leave chroma alone
+                frame = frame[:frame.shape[0] * 2 // 3]
+            self._blend(frame)
+
+        cost = (time.perf_counter_ns() - started) // 1000
+        self.frames += 1
+        self.last_cost_us = cost
+        self.average_cost_us += (cost - self.average_cost_us) / min(self.frames, 100)
+        self.max_cost_us = max(self.max_cost_us, cost)
+
+    def _compose_text(self) -> str:
+        fields = self.settings['fields']
+        parts = []
+        if 'timestamp' in fields:
+            parts.append(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.second)))
+        if 'speed' in fields and self.speed is not None:
+            parts.append(f"{self.speed:.0f} km/h")
+        if 'coordinates' in fields and self.coordinates is not None:
+            parts.append(f"{self.coordinates[0]:.5f}, {self.coordinates[1]:.5f}")
+        return "  ".join(parts)
+
+    def _update(self, text: str) -> None:
+        if text == self.text:
+            return
+        self.text = text
+
+        # Only needed when the text changes, keep it off the import path
+        import cv2
+        font, scale, thickness = cv2.FONT_HERSHEY_SIMPLEX, self.settings['scale'], 2
+        (width, height), baseline = cv2.getTextSize(text, font, scale, thickness)
+        padding = 4
+        origin = (padding, padding + height)
+        coverage = np.zeros((height + baseline + padding * 2, width + padding * 2), dtype=np.uint8)
+        fill = np.zeros_like(coverage)
+        # White text with a dark outline so it reads on any background
+        cv2.putText(coverage, text, origin, font, scale, 255, thickness + 3, cv2.LINE_AA)
+        cv2.putText(fill, text, origin, font, scale, 255, thickness, cv2.LINE_AA)
+
+        # Alpha scaled to 0-256 so the blend can shift instead of divide
+        alpha = coverage.astype(np.uint16)
+        alpha += alpha >> 7
+        self.alpha = alpha
+        self.colour = fill.astype(np.uint16)
+        self.inverse_alpha = None
+        self.premultiplied = None
+        self.scratch = None
+
+    def _blend(self, frame) -> None:
+        if self.alpha is None:
+            return
+        x, y = self.settings['position']
+        height = min(self.alpha.shape[0], frame.shape[0] - y)
+        width = min(self.alpha.shape[1], frame.shape[1] - x)
+        if height <= 0 or width <= 0:
+            return
+
+        region = frame[y:y + height, x:x + width]
+        if self.scratch is None or self.scratch.shape != region.shape:
+            # Expanded to the region's exact shape once, broadcasting a channel axis per frame is far slower
+            shape = region.shape
+            alpha = self.alpha[:height, :width]
+            colour = self.colour[:height, :width]
+            if len(shape) == 3:
+                alpha, colour = alpha[..., None], colour[..., None]
+            self.inverse_alpha = np.ascontiguousarray(np.broadcast_to(256 - alpha, shape))
+            self.premultiplied = np.ascontiguousarray(np.broadcast_to(colour * alpha, shape))
+            self.scratch = np.empty(shape, dtype=np.uint16)
+
+        # out = (frame * (256 - alpha) + colour * alpha) / 256, all in place on the patch region
+        np.multiply(region, self.inverse_alpha, out=self.scratch)
+        np.add(self.scratch, self.premultiplied, out=self.scratch)
+        np.right_shift(self.scratch, 8, out=self.scratch)
+        np.copyto(region, self.scratch, casting='unsafe')
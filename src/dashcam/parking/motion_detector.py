@@ -0,0 +1,77 @@
+import numpy as np
+
+def load_frames(path: str):
+    # (n, height, width) uint8 brightness frames saved with write_frames, mapped rather than read in
+    frames = np.load(path, mmap_mode='r')
+    if frames.ndim != 3 or frames.dtype != np.uint8:
+        raise ValueError(f"{path} isn't a sequence of 8-bit frames")
+    return frames
+
+def write_frames(path: str, frames) -> None:
+    np.save(path, np.asarray(frames, dtype=np.uint8))
+
+class MotionDetector():
+    '''
+    Looks for motion in the brightness (Y plane) of the lores stream while parked. Each frame is
+    shrunk to one value per block, the sum of a few pixels spread over the block, which is far
+    cheaper than averaging all of them and still smooths out most sensor noise, and compared with
+    the frame checked before it. Dusk, streetlights and exposure drift barely move between two
+    checks, and a change across the whole frame (headlights, the exposure stepping) is taken off
+    first, so what is left is something moving. Motion is enough of the blocks changing for a few
+    checks running.
+    '''
+    def __init__(self, settings: dict) -> None:
+        self.settings = settings
+        self.shape = None
+        self.blocks = None
+        self.previous = None
+        self.delta = None
+        self.changed = None
+
+        self.checks = 0
+        self.over = 0
+        self.score = 0.0
+        self.peak_score = 0.0
+
+    def check(self, luma) -> bool:
+        # luma is a frame's Y plane, True while there is motion
+        self.previous, self.blocks = self.blocks, self.previous
+        self._shrink(luma)
+        self.checks += 1
+        if self.checks == 1:
+            return False
+
+        # Everything here writes into the arrays made for the first frame, nothing is allocated per check
+        np.subtract(self.blocks, self.previous, out=self.delta)
+        self.delta -= int(round(self.delta.mean()))
+        np.abs(self.delta, out=self.delta)
+        np.greater(self.delta, self.settings['pixel_threshold'] * self.settings['taps'] ** 2, out=self.changed)
+        self.score = int(np.count_nonzero(self.changed)) / self.changed.size
+        self.peak_score = max(self.peak_score, self.score)
+
+        self.over = self.over + 1 if self.score >= self.settings['motion_fraction'] else 0
+        return self.over >= self.settings['motion_checks']
+
+    def reset(self) -> None:
+        # Starts again from the next frame, after the camera has been off or moved
+        self.checks = 0
+        self.over = 0
+
+    def _shrink(self, luma) -> None:
+        scale, taps = self.settings['downscale'], self.settings['taps']
+        height, width = luma.shape[0] // scale, luma.shape[1] // scale
+        if self.shape != (height, width, taps):
+            # The first frame, or the frame or blocks have changed size and the last one can't be compared
+            self.shape = (height, width, taps)
+            # Each block sums taps * taps pixels of at most 255, signed so blocks can be subtracted
+            self.blocks = np.empty((height, width), dtype=np.int16)
+            self.previous = np.empty((height, width), dtype=np.int16)
+            self.delta = np.empty((height, width), dtype=np.int16)
+            self.changed = np.empty((height, width), dtype=bool)
+            self.checks = 0
+        self.blocks.fill(0)
+        # Taps along each side of a block, spaced evenly across it
+        offsets = [scale * tap // taps for tap in range(taps)]
+        for row in offsets:
+            for column in offsets:
+                self.blocks += luma[row:row + height * scale:scale, column:column + width * scale:scale]
@@ -0,0 +1,159 @@
+from dashcam.parking.motion_detector import MotionDetector
+from threading import Event, Thread
+import time
+
+class ParkingMonitor():
+    '''
+    Parking mode. Rather than recording all night, the main camera's encoder only fills the pre-event
+    ring at the parked frame rate and bitrate, and a few times a second a lores frame is checked for
+    motion. Motion starts a parked clip from the ring, reaching back pre_roll seconds, which runs on
+    until there has been none for quiet_seconds. The checks keep to a CPU budget the way the sensor
+    monitor does, checking less often when a second of them costs more than cpu_budget of a core.
+    Only the main camera watches while parked. When parking stops, recording comes back at the frame
+    rate and bitrate it had, if it was running.
+    '''
+    def __init__(self, dashcam, settings: dict) -> None:
+        self.dashcam = dashcam
+        self.settings = settings
+        self.stop_event = Event()
+        self.is_running = False
+        self.thread = None
+        self.detector = MotionDetector(settings)
+        self.interval = 1 / settings['fps']
+
+        self.was_recording = False
+        self.restore = {}
+        self.clip = None
+        self.clip_started = None
+        self.clips = 0
+        self.last_motion = None
+        self.cpu_fraction = 0.0
+        self.over_budget_seconds = 0
+
+        metrics = dashcam.metrics
+        self.checks = metrics.counter('dashcam_parking_checks_total', "Lores frames checked for motion while parked")
+        self.check_seconds = metrics.histogram('dashcam_parking_check_seconds', "Time each motion check took, capture included",
+                                               (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1))
+        self.parked_clips = metrics.counter('dashcam_parking_clips_total', "Clips started by motion while parked")
+        metrics.gauge_callback('dashcam_parked', "1 while in parking mode", lambda: self.is_running)
+        metrics.gauge_callback('dashcam_parking_motion_fraction', "Share of blocks that changed in the last check", lambda: self.detector.score)
+        metrics.gauge_callback('dashcam_parking_cpu_fraction', "Fraction of a core the motion checks used over the last second", lambda: self.cpu_fraction)
+
+    def start(self):
+        if self.is_running:
+            return {"message": "Already parked"}, 400
+        self.stop_event.clear()
+        self.is_running = True
+        # Kept so whoever needs the camera to themselves can wait for recording to be put back
+        self.thread = Thread(target=self._start, name=type(self).__name__, daemon=True)
+        self.thread.start()
+        return {"message": "Started parking mode"}, 200
+
+    def stop(self):
+        if not self.is_running:
+            return {"message": "Not parked"}, 400
+        self.stop_event.set()
+        self.is_running = False
+        return {"message": "Stopped parking mode"}, 200
+
+    def get_status(self) -> dict:
+        return {
+            "running": self.is_running,
+            "check_interval": round(self.interval, 3),
+            "checks": int(self.checks.value),
+            "motion_fraction": round(self.detector.score, 4),
+            "peak_motion_fraction": round(self.detector.peak_score, 4),
+            "clip": self.clip.path if self.clip is not None else None,
+            "clips": self.clips,
+            "last_motion": self.last_motion,
+            "cpu_percent": round(self.cpu_fraction * 100, 3),
+            "cpu_budget_percent": self.settings['cpu_budget'] * 100,
+            "over_budget_seconds": self.over_budget_seconds,
+        }
+
+    def _start(self) -> None:
+        self._park()
+        print("Started ParkingMonitor")
+        wall, cpu = time.monotonic(), time.thread_time()
+        try:
+            while not self.stop_event.wait(self.interval):
+                self._check()
+
+                elapsed = time.monotonic() - wall
+                if elapsed >= 1:
+                    self.cpu_fraction = (time.thread_time() - cpu) / elapsed
+                    self._keep_to_budget()
+                    wall, cpu = time.monotonic(), time.thread_time()
+        finally:
+            self._unpark()
+        print("ParkingMonitor stopped")
+
+    def _park(self) -> None:
+        streamer = self.dashcam.filestreamer
+        self.was_recording = streamer.is_streaming
+        if self.was_recording:
+            self.dashcam.stop_recording()
+            # The encoder is free once the last clip has been closed
+            streamer.thread.join()
+        # Whatever recording was at, including a quality step down, is what it goes back to
+        self.restore = {key: streamer.settings[key] for key in ('fps', 'bitrate')}
+        streamer.queue_settings({'fps': self.settings['recording_fps'], 'bitrate': self.settings['recording_bitrate']})
+        streamer.arm()
+        self.detector.reset()
+        self.interval = 1 / self.settings['fps']
+
+    def _unpark(self) -> None:
+        streamer = self.dashcam.filestreamer
+        # Disarming stops the encoder, which finishes any parked clip with what the ring had. Recording
+        # would start overwriting the ring, so it waits for the clip to be written out
+        streamer.disarm()
+        deadline = time.monotonic() + 5
+        while self.clip is not None and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.clip = None
+        streamer.queue_settings(self.restore)
+        if self.was_recording:
+            self.dashcam.start_recording()
+
+    def _check(self) -> None:
+        started = time.perf_counter()
+        source = self.dashcam.source
+        width, height = source.streams['lores']['size']
+        # The lores stream is YUV420, its first height rows are the brightness
+        motion = self.detector.check(source.capture_array('lores')[:height, :width])
+        self.checks.inc()
+        self.check_seconds.observe(time.perf_counter() - started)
+        if motion:
+            self._motion()
+
+    def _motion(self) -> None:
+        self.last_motion = time.time()
+        streamer = self.dashcam.filestreamer
+        quiet = self.settings['quiet_seconds']
+        pre_roll = self.settings['pre_roll']
+        if self.clip is not None:
+            if time.monotonic() - self.clip_started < streamer.clip_duration:
+                if streamer.extend_parked(self.clip, quiet):
+                    return
+            else:
+                # Cut at the clip duration like any other clip, the next carries straight on from its last keyframe
+                streamer.extend_parked(self.clip, 0)
+                pre_roll = 0
+        self.clip = streamer.save_parked(pre_roll, quiet, self._clip_finished)
+        if self.clip is not None:
+            self.clip_started = time.monotonic()
+            self.clips += 1
+            self.parked_clips.inc()
+
+    def _clip_finished(self, output) -> None:
+        # On the ring's thread, once quiet_seconds have gone by without motion
+        if self.clip is output:
+            self.clip = None
+
+    def _keep_to_budget(self) -> None:
+        budget = self.settings['cpu_budget']
+        if self.cpu_fraction > budget:
+            self.over_budget_seconds += 1
+            self.interval = min(self.interval * 2, 1 / self.settings['min_fps'])
+        elif self.cpu_fraction < budget / 2 and self.interval > 1 / self.settings['fps']:
+            self.interval = max(self.interval / 2, 1 / self.settings['fps'])
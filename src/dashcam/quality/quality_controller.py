@@ -0,0 +1,143 @@
+from dashcam.metrics.metrics import read_cpu_temperature, read_throttled
+from threading import Event, Thread
+from collections import deque
+import time
+
+class QualityController():
+    '''
+    Steps recording bitrate, frame rate and the stream's frame rate down a ladder of levels when
+    the Pi runs hot or the card can't keep up, and back up once things have been calm for a while.
+    Stepping down is quick and cuts the current clip short, stepping up waits for the next clip
+    boundary. Recording carries on throughout, only the settings of the next clip change.
+    '''
+    def __init__(self, dashcam, settings: dict, read_temperature=read_cpu_temperature, read_throttled=read_throttled) -> None:
+        self.dashcam = dashcam
+        self.settings = settings
+        self.read_temperature = read_temperature
+        self.read_throttled = read_throttled
+        self.stop_event = Event()
+        self.is_running = False
+
+        self.level = 0
+        self.over_polls = 0
+        self.under_polls = 0
+        self.last_write = (0, 0.0)
+        self.signals = {}
+        # What the last level change queued for the next clip
+        self.queued = {}
+        self.changes = deque(maxlen=10)
+
+    def start(self):
+        if self.is_running:
+            return {"message": "Already running"}, 400
+        self.stop_event.clear()
+        self.is_running = True
+        Thread(target=self._start, name=type(self).__name__, daemon=True).start()
+        return {"message": "Started quality controller"}, 200
+
+    def stop(self):
+        if not self.is_running:
+            return {"message": "Not running"}, 400
+        self.stop_event.set()
+        self.is_running = False
+        return {"message": "Stopped quality controller"}, 200
+
+    def get_status(self) -> dict:
+        return {
+            "running": self.is_running,
+            "level": self.level,
+            "levels": len(self.settings['levels']),
+            "current": self.current_settings(),
+            "signals": self.signals,
+            "changes": list(self.changes),
+        }
+
+    def current_settings(self) -> dict:
+        # What the main camera records and streams at on this level, scaled from the scheduler's allocation
+        return self._level_settings(self.level)
+
+    def levels_changed(self) -> None:
+        # The ladder in the settings was replaced. On a shorter one the level drops to its last step, the
+        # stream skips what the level now says straight away and the recording follows from the next allocation
+        self.level = min(self.level, len(self.settings['levels']) - 1)
+        self.dashcam.mjpegstreamer.set_frame_skip(self.current_settings()['stream_skip'])
+
+    def _start(self) -> None:
+        print("Started QualityController")
+        while not self.stop_event.wait(self.settings['interval']):
+            self._poll()
+        print("QualityController stopped")
+
+    def _poll(self) -> None:
+        self.signals = self._read_signals()
+        if self.dashcam.parking is not None and self.dashcam.parking.is_running:
+            # Parking sets its own frame rate and bitrate and puts back the ones it found
+            return
+        pending = self.dashcam.filestreamer.pending_settings
+        if any(pending.get(key) == value for key, value in self.queued.items()):
+            # Our last change hasn't reached a clip yet, judge it once it has. Anything else waiting
+            # for the next clip (a new clip_duration, say) could keep it waiting for a whole clip
+            return
+
+        over = [name for name, limit in self._limits('high') if self.signals.get(name) is not None and self.signals[name] >= limit]
+        under = all(self.signals.get(name) is None or self.signals[name] <= limit for name, limit in self._limits('low'))
+        if self.signals.get('throttled'):
+            over.append('throttled')
+            under = False
+
+        # Between the high and low marks nothing counts either way, so a signal hovering near one limit can't flap
+        self.over_polls = self.over_polls + 1 if over else 0
+        self.under_polls = self.under_polls + 1 if under else 0
+        if self.over_polls >= self.settings['down_after'] and self.level < len(self.settings['levels']) - 1:
+            self._set_level(self.level + 1, ', '.join(over))
+        elif self.under_polls >= self.settings['up_after'] and self.level > 0:
+            self._set_level(self.level - 1, 'recovered')
+
+    def _limits(self, mark: str) -> list:
+        return [(name, self.settings[f"{name}_{mark}"]) for name in ('temperature', 'write_seconds', 'queue_frames')]
+
+    def _read_signals(self) -> dict:
+        # Mean fragment write time since the last poll, from the histogram FileStreamer keeps for /metrics
+        histogram = self.dashcam.filestreamer.write_seconds
+        count, total = sum(histogram.counts), histogram.sum
+        last_count, last_total = self.last_write
+        self.last_write = (count, total)
+        write_seconds = (total - last_total) / (count - last_count) if count > last_count else None
+        if write_seconds is None and self.dashcam.filestreamer.is_streaming:
+            # A card slow enough finishes fewer fragments than there are polls. Nothing written
+            # since the last poll still counts, as the last write, rather than as all clear
+            write_seconds = self.signals.get('write_seconds')
+        throttled = self.read_throttled(2)
+        return {
+            "temperature": self.read_temperature(),
+            "throttled": bool(throttled) if throttled is not None else None,
+            "write_seconds": round(write_seconds, 4) if write_seconds is not None else None,
+            "queue_frames": self.dashcam.source.encoder_queue_depth(self.dashcam.filestreamer.encoder),
+        }
+
+    def _level_settings(self, level: int) -> dict:
+        # Until levels_changed has caught up the ladder may be shorter than the level
+        levels = self.settings['levels']
+        step = levels[min(level, len(levels) - 1)]
+        recording = self.dashcam.settings['recording']
+        return {
+            "bitrate": int(recording['bitrate'] * step['bitrate']),
+            "fps": max(int(round(recording['fps'] * step['fps'])), 1),
+            "stream_skip": step['stream_skip'],
+        }
+
+    def _set_level(self, level: int, reason: str) -> None:
+        down = level > self.level
+        current, target = self._level_settings(self.level), self._level_settings(level)
+        changes = {key: target[key] for key in ('bitrate', 'fps') if target[key] != current[key]}
+        self.queued = changes
+        if changes:
+            self.dashcam.filestreamer.queue_settings(changes, urgent=down)
+        if target['stream_skip'] != current['stream_skip']:
+            # The stream can change straight away, it doesn't touch what is being recorded
+            self.dashcam.mjpegstreamer.set_frame_skip(target['stream_skip'])
+        self.changes.append({"time": time.time(), "from": self.level, "to": level, "reason": reason})
+        print(f"Quality level {self.level} -> {level} ({reason}): {target}")
+        self.level = level
+        self.over_polls = 0
+        self.under_polls = 0
@@ -0,0 +1,75 @@
+import numpy as np
+
+class CrashDetector():
+    '''
+    Keeps the last few seconds of accelerometer samples in a preallocated NumPy ring and checks
+    each new batch with whole-array operations: the acceleration magnitude is averaged over a short
+    sliding window so a single noisy sample can't trigger it, then tested for peak g (gravity
+    taken off) and for jerk, how fast that magnitude changes.
+    '''
+    def __init__(self, settings: dict, sample_rate: float) -> None:
+        self.settings = settings
+        self.capacity = max(int(settings['history'] * sample_rate), 2)
+        # Every sample is stored twice, capacity apart, so the latest n are always one contiguous slice
+        self.buffer = np.zeros((self.capacity * 2, 4))
+        self.count = 0
+        self.checked = 0
+        self.smoothing = max(int(settings['smoothing'] * sample_rate), 1)
+        self.last_detection = None
+        self.peak_g = 0.0
+        self.peak_jerk = 0.0
+
+    def add(self, samples) -> None:
+        if len(samples) > self.capacity:
+            self.count += len(samples) - self.capacity
+            samples = samples[-self.capacity:]
+        slots = (self.count + np.arange(len(samples))) % self.capacity
+        self.buffer[slots] = samples
+        self.buffer[slots + self.capacity] = samples
+        self.count += len(samples)
+
+    def latest(self, count: int):
+        count = min(count, self.count, self.capacity)
+        end = self.count % self.capacity + self.capacity
+        return self.buffer[end - count:end]
+
+    def detect(self):
+        # Checks everything added since the last call, returns the time of an impact or None
+        new = self.count - self.checked
+        self.checked = self.count
+        # The samples before the new ones are needed to fill the first averaging window and jerk step
+        window = self.latest(new + self.smoothing)
+        if len(window) <= self.smoothing:
+            return None
+
+        magnitude = np.sqrt(np.einsum('ij,ij->i', window[:, 1:], window[:, 1:]))
+        total = np.cumsum(magnitude)
+        total[self.smoothing:] -= total[:-self.smoothing].copy()
+        smoothed = total[self.smoothing - 1:] / self.smoothing
+        times = window[self.smoothing - 1:, 0]
+
+        g = np.abs(smoothed[1:] - 1.0)
+        jerk = np.abs(np.diff(smoothed)) / np.maximum(np.diff(times), 1e-6)
+        self.peak_g = max(self.peak_g, float(g.max()))
+        self.peak_jerk = max(self.peak_jerk, float(jerk.max()))
+
+        hits = np.flatnonzero((g > self.settings['peak_g']) | (jerk > self.settings['jerk']))
+        if not len(hits):
+            return None
+        timestamp = float(times[hits[0] + 1])
+        if self.last_detection is not None and timestamp - self.last_detection < self.settings['cooldown']:
+            return None
+        self.last_detection = timestamp
+        return timestamp
+
+def detect_trace(samples, settings: dict, sample_rate: float, batch: int = 10) -> list:
+    # Runs a whole trace through a detector in batches, as the monitor would, and returns
+    # the detection times. Lets thresholds be tried against recorded drives offline
+    detector = CrashDetector(settings, sample_rate)
+    detections = []
+    for start in range(0, len(samples), batch):
+        detector.add(samples[start:start + batch])
+        timestamp = detector.detect()
+        if timestamp is not None:
+            detections.append(timestamp)
+    return detections
@@ -0,0 +1,18 @@
+class ImuSource():
+    '''
+    Everything the dashcam needs from an accelerometer. Samples are read in batches so a sensor
+    with a hardware FIFO can be drained in one transfer instead of being polled sample by sample.
+    '''
+    def __init__(self, sample_rate: int) -> None:
+        self.sample_rate = sample_rate
+
+    def start(self) -> None:
+        raise NotImplementedError
+
+    def stop(self) -> None:
+        raise NotImplementedError
+
+    def read(self):
+        # Everything sampled since the last read, as an (n, 4) float array of
+        # monotonic seconds and acceleration along x, y and z in g
+        raise NotImplementedError
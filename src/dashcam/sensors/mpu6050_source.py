@@ -0,0 +1,77 @@
+from dashcam.sensors.imu_source import ImuSource
+import numpy as np
+import time
+
+# MPU-6050 registers
+SMPLRT_DIV = 0x19
+CONFIG = 0x1A
+ACCEL_CONFIG = 0x1C
+FIFO_EN = 0x23
+USER_CTRL = 0x6A
+PWR_MGMT_1 = 0x6B
+FIFO_COUNT_H = 0x72
+FIFO_R_W = 0x74
+
+ACCEL_16G = 0x18  # +-16g, a crash can go well past the default +-2g
+LSB_PER_G = 2048
+SAMPLE_BYTES = 6  # x, y, z as big endian int16
+FIFO_SIZE = 1024
+
+class Mpu6050Source(ImuSource):
+    '''
+    MPU-6050 on the Pi's I2C bus. The sensor samples into its own FIFO at sample_rate and each
+    read drains it in a single I2C transfer, so the CPU only wakes up when the monitor asks.
+    '''
+    def __init__(self, sample_rate: int, bus: int = 1, address: int = 0x68) -> None:
+        super().__init__(sample_rate)
+        self.bus_number = bus
+        self.address = address
+        self.bus = None
+        self.overflows = 0
+
+    def start(self) -> None:
+        # Only needed (and only available) on the Pi
+        from smbus2 import SMBus
+        self.bus = SMBus(self.bus_number)
+        self.bus.write_byte_data(self.address, PWR_MGMT_1, 0x01)  # wake, clocked from the gyro PLL
+        self.bus.write_byte_data(self.address, CONFIG, 0x01)  # 184Hz low pass, 1kHz internal rate
+        self.bus.write_byte_data(self.address, SMPLRT_DIV, max(1000 // self.sample_rate - 1, 0))
+        self.bus.write_byte_data(self.address, ACCEL_CONFIG, ACCEL_16G)
+        self.bus.write_byte_data(self.address, USER_CTRL, 0x04)  # reset the FIFO
+        self.bus.write_byte_data(self.address, USER_CTRL, 0x40)  # and enable it
+        self.bus.write_byte_data(self.address, FIFO_EN, 0x08)  # accelerometer only
+        # What the divider actually gives us
+        self.sample_rate = 1000 / (max(1000 // self.sample_rate - 1, 0) + 1)
+
+    def stop(self) -> None:
+        if self.bus is not None:
+            # Closed even when the sensor has stopped answering, it is opened again on restart
+            try:
+                self.bus.write_byte_data(self.address, FIFO_EN, 0)
+            finally:
+                self.bus.close()
+                self.bus = None
+
+    def read(self):
+        from smbus2 import i2c_msg
+        high, low = self.bus.read_i2c_block_data(self.address, FIFO_COUNT_H, 2)
+        count = (high << 8 | low) // SAMPLE_BYTES
+        now = time.monotonic()
+        if count * SAMPLE_BYTES >= FIFO_SIZE - SAMPLE_BYTES:
+            # Full, samples were lost and the FIFO may be misaligned, start again from empty
+            self.overflows += 1
+            self.bus.write_byte_data(self.address, USER_CTRL, 0x44)
+            return np.empty((0, 4))
+        if count == 0:
+            return np.empty((0, 4))
+
+        write = i2c_msg.write(self.address, [FIFO_R_W])
+        read = i2c_msg.read(self.address, count * SAMPLE_BYTES)
+        self.bus.i2c_rdwr(write, read)
+        raw = np.frombuffer(bytes(read), dtype='>i2').reshape(count, 3)
+
+        samples = np.empty((count, 4))
+        # The FIFO carries no timestamps, the newest sample is the one taken just before the read
+        samples[:, 0] = now - np.arange(count - 1, -1, -1) / self.sample_rate
+        samples[:, 1:] = raw / LSB_PER_G
+        return samples
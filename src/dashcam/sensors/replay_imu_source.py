@@ -0,0 +1,63 @@
+from dashcam.sensors.imu_source import ImuSource
+import numpy as np
+import time
+
+# Binary traces are packed records of seconds plus acceleration in g
+TRACE_DTYPE = np.dtype([('t', '<f8'), ('x', '<f4'), ('y', '<f4'), ('z', '<f4')])
+
+def load_trace(path: str):
+    # (n, 4) array of seconds, x, y, z from a CSV (t,x,y,z with an optional header) or a binary trace
+    if path.endswith('.csv'):
+        with open(path) as f:
+            header = f.readline()[:1].isalpha()
+        return np.loadtxt(path, delimiter=',', ndmin=2, skiprows=int(header), usecols=(0, 1, 2, 3))
+    records = np.fromfile(path, dtype=TRACE_DTYPE)
+    return np.column_stack([records['t'], records['x'], records['y'], records['z']])
+
+def write_trace(path: str, samples) -> None:
+    records = np.empty(len(samples), dtype=TRACE_DTYPE)
+    records['t'], records['x'], records['y'], records['z'] = samples[:, 0], samples[:, 1], samples[:, 2], samples[:, 3]
+    records.tofile(path)
+
+class ReplayImuSource(ImuSource):
+    '''
+    Plays back a recorded trace in real time, looping at the end, so auto-locking can be driven
+    on a bench or alongside the synthetic camera without an IMU attached.
+    '''
+    def __init__(self, path: str, loop: bool = True) -> None:
+        self.trace = load_trace(path)
+        if len(self.trace) < 2:
+            raise ValueError(f"No samples in {path}")
+        # Relative times from zero, the trace may come from another clock entirely
+        self.trace[:, 0] -= self.trace[0, 0]
+        self.length = self.trace[-1, 0] + (self.trace[-1, 0] / (len(self.trace) - 1))
+        super().__init__(round((len(self.trace) - 1) / self.trace[-1, 0]))
+        self.loop = loop
+        self.started = None
+        self.position = 0
+        self.passes = 0
+
+    def start(self) -> None:
+        self.started = time.monotonic()
+        self.position = 0
+        self.passes = 0
+
+    def stop(self) -> None:
+        self.started = None
+
+    def read(self):
+        elapsed = time.monotonic() - self.started
+        batches = []
+        while True:
+            offset = self.passes * self.length
+            end = np.searchsorted(self.trace[:, 0], elapsed - offset, side='right')
+            if end > self.position:
+                batch = self.trace[self.position:end].copy()
+                batch[:, 0] += self.started + offset
+                batches.append(batch)
+            self.position = end
+            if end < len(self.trace) or not self.loop:
+                break
+            self.passes += 1
+            self.position = 0
+        return np.concatenate(batches) if batches else np.empty((0, 4))
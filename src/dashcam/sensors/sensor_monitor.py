@@ -0,0 +1,135 @@
+from dashcam.sensors.crash_detector import CrashDetector
+from threading import Event, Thread
+import time
+
+# Seconds before the sensor is started again after a failed read, doubling while it keeps failing
+RESTART_INTERVAL = 0.5
+MAX_RESTART_INTERVAL = 30
+
+class SensorMonitor():
+    '''
+    Drains the IMU on its own thread and runs the crash detector over each batch. It shares a
+    core with the encoder so it keeps to a CPU budget: when a second of polling costs more than
+    cpu_budget of a core, the poll interval doubles so the same samples arrive in fewer, larger
+    batches, and it comes back down once there is room again. A read that fails on the bus
+    (a loose connector, interference) is counted and the sensor started again, auto-locking
+    carries on once it answers.
+    '''
+    def __init__(self, source, settings: dict, on_detection) -> None:
+        self.source = source
+        self.settings = settings
+        self.on_detection = on_detection
+        self.stop_event = Event()
+        self.is_running = False
+        self.detector = None
+        self.poll_interval = settings['poll_interval']
+
+        self.samples = 0
+        self.detections = 0
+        self.last_detection = None
+        self.cpu_fraction = 0.0
+        self.over_budget_seconds = 0
+        self.read_errors = 0
+        self.restarts = 0
+
+    def start(self):
+        if self.is_running:
+            return {"message": "Already running"}, 400
+        self.stop_event.clear()
+        self.is_running = True
+        Thread(target=self._start, name=type(self).__name__, daemon=True).start()
+        return {"message": "Started sensor monitor"}, 200
+
+    def stop(self):
+        if not self.is_running:
+            return {"message": "Not running"}, 400
+        self.stop_event.set()
+        self.is_running = False
+        return {"message": "Stopped sensor monitor"}, 200
+
+    def get_status(self) -> dict:
+        return {
+            "running": self.is_running,
+            "sample_rate": self.source.sample_rate,
+            "samples": self.samples,
+            "poll_interval": self.poll_interval,
+            "cpu_percent": round(self.cpu_fraction * 100, 2),
+            "cpu_budget_percent": self.settings['cpu_budget'] * 100,
+            "over_budget_seconds": self.over_budget_seconds,
+            "read_errors": self.read_errors,
+            "restarts": self.restarts,
+            "peak_g": round(self.detector.peak_g, 2) if self.detector else None,
+            "peak_jerk": round(self.detector.peak_jerk, 1) if self.detector else None,
+            "detections": self.detections,
+            "last_detection": self.last_detection,
+        }
+
+    def _start(self) -> None:
+        try:
+            self.source.start()
+        except OSError as e:
+            print(f"SensorMonitor couldn't start the sensor: {e}")
+            self.read_errors += 1
+            self._restart_source()
+        self.detector = CrashDetector(self.settings, self.source.sample_rate)
+        print("Started SensorMonitor")
+        wall, cpu = time.monotonic(), time.thread_time()
+        try:
+            while not self.stop_event.wait(self.poll_interval):
+                try:
+                    samples = self.source.read()
+                except OSError as e:
+                    print(f"SensorMonitor read failed: {e}")
+                    self.read_errors += 1
+                    self._restart_source()
+                    wall, cpu = time.monotonic(), time.thread_time()
+                    continue
+                if len(samples):
+                    self.samples += len(samples)
+                    self.detector.add(samples)
+                    timestamp = self.detector.detect()
+                    if timestamp is not None:
+                        self._detected(timestamp)
+
+                elapsed = time.monotonic() - wall
+                if elapsed >= 1:
+                    self.cpu_fraction = (time.thread_time() - cpu) / elapsed
+                    self._keep_to_budget()
+                    wall, cpu = time.monotonic(), time.thread_time()
+        finally:
+            try:
+                self.source.stop()
+            except OSError:
+                pass
+        print("SensorMonitor stopped")
+
+    def _restart_source(self) -> None:
+        # Stops and starts the sensor until it answers again, further apart each time it doesn't
+        interval = RESTART_INTERVAL
+        while not self.stop_event.wait(interval):
+            self.restarts += 1
+            try:
+                self.source.stop()
+            except OSError:
+                pass
+            try:
+                self.source.start()
+                return
+            except OSError as e:
+                print(f"SensorMonitor couldn't restart the sensor: {e}")
+                self.read_errors += 1
+                interval = min(interval * 2, MAX_RESTART_INTERVAL)
+
+    def _keep_to_budget(self) -> None:
+        budget = self.settings['cpu_budget']
+        if self.cpu_fraction > budget:
+            self.over_budget_seconds += 1
+            self.poll_interval = min(self.poll_interval * 2, self.settings['max_poll_interval'])
+        elif self.cpu_fraction < budget / 2 and self.poll_interval > self.settings['poll_interval']:
+            self.poll_interval = max(self.poll_interval / 2, self.settings['poll_interval'])
+
+    def _detected(self, timestamp: float) -> None:
+        self.detections += 1
+        # Sample times are monotonic, everything else wants wall clock
+        self.last_detection = time.time() - (time.monotonic() - timestamp)
+        self.on_detection(self.last_detection)
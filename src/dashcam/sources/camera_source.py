@@ -0,0 +1,138 @@
+from dashcam.sources.frame_source import FrameSource
+from picamera2.encoders import H264Encoder, MJPEGEncoder
+from libcamera import Transform
+from picamera2 import MappedArray, Picamera2
+import time
+
+class CameraSource(FrameSource):
+    def __init__(self, camera_num: int = 0) -> None:
+        self.camera_num = camera_num
+        self.picam2 = None
+        self.video_config = None
+        self.exposure_timeout = 2
+        self.exposure_settle_time = None
+        super().__init__()
+
+    @property
+    def pre_callback(self):
+        return self.picam2.pre_callback if self.picam2 is not None else self._pre_callback
+
+    @pre_callback.setter
+    def pre_callback(self, callback) -> None:
+        self._pre_callback = callback
+        if self.picam2 is not None:
+            self.picam2.pre_callback = callback
+
+    def configure(self, recording: dict, streaming: dict) -> None:
+        if self.picam2 is None:
+            self.picam2 = Picamera2(self.camera_num)
+            self.picam2.pre_callback = self._pre_callback
+        # YUV420 main goes to the H264 encoder as-is, RGB888 is twice the size and has to be converted back
+        self.streams = {
+            "main": {"size": tuple(recording['resolution']), "format": recording['format']},
+            "lores": {"size": tuple(streaming['resolution']), "format": "YUV420"},
+        }
+        self.buffer_count = recording['buffer_count']
+        self.exposure_timeout = recording['exposure_timeout']
+        self.video_config = self.picam2.create_video_configuration(
+            main=dict(self.streams['main']),
+            lores=dict(self.streams['lores']),
+            transform=Transform(vflip=True, hflip=True),
+            buffer_count=self.buffer_count,
+        )
+        self.picam2.configure(self.video_config)
+
+    def start(self) -> None:
+        self.picam2.start_preview()
+        self.picam2.start()
+        self._wait_for_exposure()
+
+    def stop(self) -> None:
+        self.picam2.stop()
+
+    def _wait_for_exposure(self) -> None:
+        # Holds off recording until auto exposure has converged rather than for a fixed time, usually
+        # a handful of frames. The IPA reports AeLocked where it can, otherwise exposure and gain have
+        # to hold steady for a few frames. Gives up after exposure_timeout either way
+        started = time.monotonic()
+        previous = None
+        steady = 0
+        while time.monotonic() - started < self.exposure_timeout:
+            metadata = self.picam2.capture_metadata()
+            if 'AeLocked' in metadata:
+                if metadata['AeLocked']:
+                    break
+                continue
+            exposure = metadata.get('ExposureTime', 0) * metadata.get('AnalogueGain', 1)
+            steady = steady + 1 if previous and abs(exposure - previous) <= previous * 0.05 else 0
+            previous = exposure
+            if steady >= 3:
+                break
+        self.exposure_settle_time = time.monotonic() - started
+        print(f"Exposure settled in {self.exposure_settle_time:.2f}s")
+
+    def create_encoder(self, codec: str, bitrate: int, **options):
+        if codec == 'h264':
+            return H264Encoder(bitrate, **options)
+        if codec == 'mjpeg':
+            return MJPEGEncoder(bitrate, **options)
+        raise ValueError(f"Unsupported codec: {codec}")
+
+    def set_frame_rate(self, fps: int) -> None:
+        frame_duration = int(1000000 / fps)
+        self.picam2.set_controls({"FrameDurationLimits": (frame_duration, frame_duration)})
+
+    def set_bitrate(self, encoder, bitrate: int) -> None:
+        encoder.bitrate = bitrate
+        if getattr(encoder, 'vd', None) is None:
+            # Not running, the new bitrate is used when it next starts
+            return
+        # The V4L2 encoder takes a new bitrate while streaming, picamera2 only sets it at start
+        from picamera2.encoders.v4l2_encoder import VIDIOC_S_CTRL, V4L2_CID_MPEG_VIDEO_BITRATE, v4l2_control
+        import fcntl
+        control = v4l2_control()
+        control.id = V4L2_CID_MPEG_VIDEO_BITRATE
+        control.value = bitrate
+        fcntl.ioctl(encoder.vd, VIDIOC_S_CTRL, control)
+
+    def set_frame_skip(self, encoder, skip: int) -> None:
+        # picamera2 encodes every frame_skip_count'th frame
+        if hasattr(encoder, 'frame_skip_count'):
+            encoder.frame_skip_count = skip + 1
+
+    def encoder_queue_depth(self, encoder) -> int:
+        # Frames handed to the V4L2 encoder that haven't come back out yet
+        queue = getattr(encoder, 'buf_frame', None)
+        return queue.qsize() if queue is not None else None
+
+    def sensor_time(self) -> int:
+        # libcamera's SensorTimestamp counts from boot, time spent suspended included
+        return time.clock_gettime_ns(time.CLOCK_BOOTTIME) // 1000
+
+    def encoder_time(self, encoder, sensor_time: int) -> int:
+        # picamera2 timestamps encoded frames in microseconds from the first frame it encoded
+        first = getattr(encoder, 'firsttimestamp', None)
+        return sensor_time - first if first is not None else None
+
+    def start_encoder(self, encoder, output, name: str = None) -> None:
+        if name is None:
+            self.picam2.start_encoder(encoder, output)
+        else:
+            self.picam2.start_encoder(encoder, output, name=name)
+
+    def stop_encoder(self, encoder) -> None:
+        self.picam2.stop_encoder(encoder)
+
+    def map_array(self, request, name: str = "main"):
+        return MappedArray(request, name)
+
+    def frame_bytes(self, name: str) -> int:
+        # Prefer what libcamera actually allocated, rows are padded out to the stride
+        framesize = self.picam2.camera_config[name].get('framesize') if self.picam2.camera_config else None
+        return framesize or super().frame_bytes(name)
+
+    def capture_array(self, name: str = "main"):
+        return self.picam2.capture_array(name)
+
+    def capture_metadata(self) -> dict:
+        return self.picam2.capture_metadata()
@@ -0,0 +1,85 @@
+import time
+
+# Bytes per pixel for the stream formats we use, YUV420 has quarter resolution U and V planes
+BYTES_PER_PIXEL = {
+    "YUV420": 1.5,
+    "RGB888": 3,
+    "BGR888": 3,
+    "XRGB8888": 4,
+    "XBGR8888": 4,
+}
+
+class FrameSource():
+    '''
+    Everything the dashcam needs from a camera. Streamers only talk to the camera through this,
+    so recording, streaming and the API run the same on a Pi camera or a synthetic source.
+    '''
+    def __init__(self) -> None:
+        self.pre_callback = None
+        self.streams = {}
+        self.buffer_count = None
+
+    def configure(self, recording: dict, streaming: dict) -> None:
+        raise NotImplementedError
+
+    def start(self) -> None:
+        raise NotImplementedError
+
+    def stop(self) -> None:
+        raise NotImplementedError
+
+    def create_encoder(self, codec: str, bitrate: int, **options):
+        # codec is 'h264' or 'mjpeg', options are passed on to the encoder (repeat, iperiod, ...)
+        raise NotImplementedError
+
+    def start_encoder(self, encoder, output, name: str = None) -> None:
+        raise NotImplementedError
+
+    def stop_encoder(self, encoder) -> None:
+        raise NotImplementedError
+
+    def set_frame_rate(self, fps: int) -> None:
+        # Changes the sensor frame rate while running, encoders just see frames arrive less often
+        raise NotImplementedError
+
+    def set_bitrate(self, encoder, bitrate: int) -> None:
+        # Changes the target bitrate of a running encoder without restarting it
+        raise NotImplementedError
+
+    def set_frame_skip(self, encoder, skip: int) -> None:
+        # Encode only every (skip + 1)th frame
+        raise NotImplementedError
+
+    def encoder_queue_depth(self, encoder) -> int:
+        # Frames waiting on an encoder, or None if the source can't tell
+        return None
+
+    def sensor_time(self) -> int:
+        # Now, in microseconds on the clock the camera stamps frames with
+        return time.monotonic_ns() // 1000
+
+    def encoder_time(self, encoder, sensor_time: int) -> int:
+        # A sensor_time as the timestamps the encoder gives its outputs, None until it can tell
+        return sensor_time
+
+    def map_array(self, request, name: str = "main"):
+        # Context manager giving writable access to a request's buffer as .array, for pre_callback
+        raise NotImplementedError
+
+    def capture_array(self, name: str = "main"):
+        raise NotImplementedError
+
+    def capture_metadata(self) -> dict:
+        raise NotImplementedError
+
+    def frame_bytes(self, name: str) -> int:
+        width, height = self.streams[name]['size']
+        return int(width * height * BYTES_PER_PIXEL[self.streams[name]['format']])
+
+    def get_buffer_memory(self) -> dict:
+        per_frame = {name: self.frame_bytes(name) for name in self.streams}
+        return {
+            "buffer_count": self.buffer_count,
+            "per_frame_bytes": per_frame,
+            "total_bytes": sum(per_frame.values()) * (self.buffer_count or 1),
+        }
@@ -0,0 +1,96 @@
+from dashcam.outputs.mp4_output import NAL_AUD, NAL_IDR, NAL_SLICE, NAL_SPS, split_nal_units
+import random
+import struct
+import os
+
+class BitWriter():
+    def __init__(self) -> None:
+        self.bits = []
+
+    def u(self, count: int, value: int) -> None:
+        self.bits.extend((value >> i) & 1 for i in reversed(range(count)))
+
+    def ue(self, value: int) -> None:
+        value += 1
+        length = value.bit_length()
+        self.u(length - 1, 0)
+        self.u(length, value)
+
+    def rbsp(self) -> bytes:
+        bits = self.bits + [1]
+        bits += [0] * (-len(bits) % 8)
+        return bytes(int(''.join(map(str, bits[i:i + 8])), 2) for i in range(0, len(bits), 8))
+
+def synthetic_sps(width: int, height: int) -> bytes:
+    # Baseline profile SPS, enough for muxers and probes to learn the stream geometry
+    mbs_wide, mbs_high = (width + 15) // 16, (height + 15) // 16
+    bits = BitWriter()
+    bits.ue(0)  # seq_parameter_set_id
+    bits.ue(0)  # log2_max_frame_num_minus4
+    bits.ue(2)  # pic_order_cnt_type
+    bits.ue(1)  # max_num_ref_frames
+    bits.u(1, 0)
+    bits.ue(mbs_wide - 1)
+    bits.ue(mbs_high - 1)
+    bits.u(1, 1)  # frame_mbs_only_flag
+    bits.u(1, 1)  # direct_8x8_inference_flag
+    crop_right, crop_bottom = (mbs_wide * 16 - width) // 2, (mbs_high * 16 - height) // 2
+    bits.u(1, 1 if crop_right or crop_bottom else 0)
+    if crop_right or crop_bottom:
+        bits.ue(0)
+        bits.ue(crop_right)
+        bits.ue(0)
+        bits.ue(crop_bottom)
+    bits.u(1, 0)  # vui_parameters_present_flag
+    return bytes([0x67, 66, 0xC0, 40]) + bits.rbsp()
+
+def synthetic_frames(width: int, height: int, fps: int, bitrate: int, iperiod: int):
+    # Yields (frame, keyframe) forever, sized to average out around bitrate.
+    # Slice payloads never contain zero bytes so they can't fake a start code
+    header = b'\x00\x00\x00\x01' + synthetic_sps(width, height) + b'\x00\x00\x00\x01\x68\xCE\x38\x80'
+    frame_bytes = bitrate // 8 // fps
+    # Keyframes are three times the average, the rest of the GOP makes up the difference
+    delta_bytes = frame_bytes * max(iperiod - 3, 1) // max(iperiod - 1, 1)
+    no_zeros = bytes([1]) + bytes(range(1, 256))
+    pool = [os.urandom(frame_bytes * 4).translate(no_zeros) for _ in range(4)]
+    index = 0
+    while True:
+        payload = random.choice(pool)
+        if index % iperiod == 0:
+            yield header + b'\x00\x00\x00\x01\x65' + payload[:frame_bytes * 3], True
+        else:
+            yield b'\x00\x00\x00\x01\x41' + payload[:delta_bytes], False
+        index += 1
+
+def replay_frames(path: str):
+    # Yields (frame, keyframe) from a raw H264 file forever, grouping NAL units back into access units
+    with open(path, 'rb') as f:
+        data = f.read()
+    frames = []
+    units = []
+    has_slice = keyframe = False
+    for unit in split_nal_units(data):
+        nal_type = unit[0] & 0x1F
+        starts_frame = nal_type in (NAL_AUD, NAL_SPS, NAL_SLICE, NAL_IDR)
+        if starts_frame and has_slice:
+            frames.append((b''.join(units), keyframe))
+            units = []
+            has_slice = keyframe = False
+        units.append(b'\x00\x00\x00\x01' + bytes(unit))
+        has_slice = has_slice or nal_type in (NAL_SLICE, NAL_IDR)
+        keyframe = keyframe or nal_type == NAL_IDR
+    if has_slice:
+        frames.append((b''.join(units), keyframe))
+    if not frames:
+        raise ValueError(f"No H264 frames in {path}")
+
+    # Start on a keyframe so the first clip is decodable
+    first = next((i for i, (_, keyframe) in enumerate(frames) if keyframe), 0)
+    frames = frames[first:]
+    while True:
+        yield from frames
+
+def synthetic_jpeg(timestamp: int, size: int) -> bytes:
+    # Not a decodable picture, but framed like a JPEG with the capture timestamp in a comment segment
+    comment = b'%d' % timestamp
+    return b'\xff\xd8\xff\xfe' + struct.pack('>H', len(comment) + 2) + comment + bytes(max(size - len(comment) - 8, 0)) + b'\xff\xd9'
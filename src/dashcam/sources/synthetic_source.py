@@ -0,0 +1,190 @@
+from dashcam.sources.synthetic_h264 import replay_frames, synthetic_frames, synthetic_jpeg
+from dashcam.sources.frame_source import FrameSource
+from threading import Event, Lock, Thread
+from types import SimpleNamespace
+from contextlib import nullcontext
+import numpy as np
+import time
+
+class SyntheticRequest():
+    # Stands in for a CompletedRequest in pre_callback, arrays are generated on first use
+    def __init__(self, source, timestamp: int) -> None:
+        self.source = source
+        self.timestamp = timestamp
+        self.arrays = {}
+
+    def make_array(self, name: str = "main"):
+        if name not in self.arrays:
+            self.arrays[name] = self.source._make_array(name)
+        return self.arrays[name]
+
+    def get_metadata(self) -> dict:
+        return {"SensorTimestamp": self.timestamp * 1000}
+
+class SyntheticEncoder():
+    def __init__(self, codec: str, bitrate: int, **options) -> None:
+        self.codec = codec
+        self.bitrate = bitrate
+        self.options = options
+        self.output = []
+        self.frames = None
+        self.frames_encoded = 0
+        self.frame_skip = 0
+        self.skipped = 0
+        self.size = None
+        self.replaying = False
+
+    def start(self, source, name: str) -> None:
+        self.size = source.streams[name]['size']
+        if self.codec == 'h264':
+            self.replaying = source.replay is not None
+            if self.replaying:
+                self.frames = replay_frames(source.replay)
+            else:
+                self._generate(source.fps)
+        for output in self.output:
+            output.start()
+
+    def set_bitrate(self, bitrate: int, fps: int) -> None:
+        self.bitrate = bitrate
+        if self.frames is not None and self.codec == 'h264' and not self.replaying:
+            # A fresh generator starts on a keyframe, changes are made at clip boundaries where one is due anyway
+            self._generate(fps)
+
+    def _generate(self, fps: int) -> None:
+        iperiod = self.options.get('iperiod') or fps
+        self.frames = synthetic_frames(*self.size, fps, self.bitrate, iperiod)
+
+    def stop(self) -> None:
+        for output in self.output:
+            output.stop()
+
+    def encode(self, timestamp: int, fps: int) -> None:
+        if self.frame_skip:
+            self.skipped = (self.skipped + 1) % (self.frame_skip + 1)
+            if self.skipped:
+                return
+        if self.codec == 'h264':
+            frame, keyframe = next(self.frames)
+        else:
+            frame, keyframe = synthetic_jpeg(timestamp, self.bitrate // 8 // fps), True
+        for output in self.output:
+            output.outputframe(frame, keyframe, timestamp)
+        self.frames_encoded += 1
+
+class SyntheticSource(FrameSource):
+    '''
+    A camera that generates frames (or replays a raw H264 file) on a timer, for running and
+    profiling the dashcam on machines without a Pi camera. Resolution and FPS default to the
+    recording settings it is configured with.
+    '''
+    def __init__(self, resolution: tuple = None, fps: int = None, replay: str = None) -> None:
+        super().__init__()
+        self.resolution = resolution
+        # Without one the resolution follows the recording settings each time it is configured
+        self.fixed_resolution = resolution
+        self.fps = fps
+        self.replay = replay
+        self.encoders = {}
+        self.lock = Lock()
+        self.stop_event = Event()
+        self.thread = None
+        self.frame_count = 0
+        self.frames_late = 0
+        self.backlog = 0
+
+    def configure(self, recording: dict, streaming: dict) -> None:
+        if self.fixed_resolution is None:
+            self.resolution = tuple(recording['resolution'])
+        if self.fps is None:
+            self.fps = recording['fps']
+        self.streams = {
+            "main": {"size": self.resolution, "format": recording['format']},
+            "lores": {"size": tuple(streaming['resolution']), "format": "YUV420"},
+        }
+        self.buffer_count = recording['buffer_count']
+
+    def start(self) -> None:
+        self.stop_event.clear()
+        self.thread = Thread(target=self._run, name=type(self).__name__, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def create_encoder(self, codec: str, bitrate: int, **options):
+        if codec not in ('h264', 'mjpeg'):
+            raise ValueError(f"Unsupported codec: {codec}")
+        return SyntheticEncoder(codec, bitrate, **options)
+
+    def start_encoder(self, encoder, output, name: str = None) -> None:
+        encoder.output = output if isinstance(output, list) else [output]
+        encoder.start(self, name or "main")
+        with self.lock:
+            self.encoders[id(encoder)] = encoder
+
+    def stop_encoder(self, encoder) -> None:
+        with self.lock:
+            self.encoders.pop(id(encoder), None)
+        encoder.stop()
+
+    def set_frame_rate(self, fps: int) -> None:
+        self.fps = fps
+
+    def set_bitrate(self, encoder, bitrate: int) -> None:
+        encoder.set_bitrate(bitrate, self.fps)
+
+    def set_frame_skip(self, encoder, skip: int) -> None:
+        encoder.frame_skip = skip
+
+    def encoder_queue_depth(self, encoder) -> int:
+        # Frames can't queue up here, a slow output holds up this loop instead. How far it has fallen behind stands in for the queue
+        return self.backlog
+
+    def map_array(self, request, name: str = "main"):
+        return nullcontext(SimpleNamespace(array=request.make_array(name)))
+
+    def capture_array(self, name: str = "main"):
+        return self._make_array(name)
+
+    def capture_metadata(self) -> dict:
+        return {"SensorTimestamp": time.monotonic_ns(), "FrameDuration": 1000000 // self.fps}
+
+    def _make_array(self, name: str):
+        # A bar that moves across the frame so anything diffing frames sees some change
+        width, height = self.streams[name]['size']
+        if self.streams[name]['format'] == "YUV420":
+            array = np.full((height * 3 // 2, width), 128, dtype=np.uint8)
+        else:
+            array = np.full((height, width, 3), 128, dtype=np.uint8)
+        column = (self.frame_count * 8) % width
+        array[:height, column:column + 16] = 255
+        return array
+
+    def _run(self) -> None:
+        next_frame = time.monotonic()
+        while not self.stop_event.is_set():
+            # Read every frame so set_frame_rate takes effect straight away
+            interval = 1 / self.fps
+            timestamp = time.monotonic_ns() // 1000
+            if self.pre_callback is not None:
+                self.pre_callback(SyntheticRequest(self, timestamp))
+
+            with self.lock:
+                encoders = list(self.encoders.values())
+            for encoder in encoders:
+                encoder.encode(timestamp, self.fps)
+            self.frame_count += 1
+
+            next_frame += interval
+            delay = next_frame - time.monotonic()
+            if delay > 0:
+                self.backlog = 0
+                self.stop_event.wait(delay)
+            else:
+                # Running behind, count it and don't try to catch up with a burst of frames
+                self.frames_late += 1
+                self.backlog = int(-delay / interval) + 1
+                next_frame = time.monotonic()
@@ -0,0 +1,172 @@
+from dashcam.outputs.fragment_index import FragmentIndex, read_fragment_index, scan_fragments, parse_moof, INDEX_EXTENSION
+from dashcam.storage.recording_index import SIDECAR_EXTENSIONS
+from dashcam.gps.gps_track import read_track, track_bounds
+from dashcam.outputs.mp4_output import TIMESCALE
+from threading import Thread, get_native_id
+import struct
+import time
+import zlib
+import os
+
+READ_SIZE = 1024 * 1024
+
+def recover_clip(path: str) -> dict:
+    # Trims a fragmented MP4 cut off by a power loss back to its last complete fragment and rewrites
+    # its fragment index to match. Returns what was kept, or None if not one fragment made it to disk
+    fragments = scan_fragments(path)
+    if fragments is None or not fragments[1]:
+        return None
+    init_size, entries = fragments
+    indexed = read_fragment_index(path)
+    if indexed is not None:
+        # A fragment goes in the index once a sync has put it on the card. One past those can look
+        # whole and still be zeros or stale blocks where the card never got its data
+        synced = set(indexed[1])
+        count = 0
+        while count < len(entries) and entries[count] in synced:
+            count += 1
+        entries = entries[:count]
+        if not entries:
+            return None
+    original_size = os.path.getsize(path)
+
+    frames = 0
+    # Clips locked while they were written are already read-only
+    mode = os.stat(path).st_mode
+    if not mode & 0o200:
+        os.chmod(path, mode | 0o200)
+    fd = os.open(path, os.O_RDWR)
+    try:
+        for _, _, offset, _ in entries:
+            moof_size = struct.unpack('>I', os.pread(fd, 4, offset))[0]
+            frames += parse_moof(os.pread(fd, moof_size, offset))[2]
+        size = entries[-1][2] + entries[-1][3]
+        os.ftruncate(fd, size)
+
+        # The checksum covers the whole clip so it has to be read once, keep it out of the page cache
+        checksum = 0
+        for offset in range(0, size, READ_SIZE):
+            checksum = zlib.crc32(os.pread(fd, min(READ_SIZE, size - offset), offset), checksum)
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(fd, 0, size, os.POSIX_FADV_DONTNEED)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+        os.chmod(path, mode)
+
+    index = FragmentIndex(path + INDEX_EXTENSION)
+    index.open(init_size)
+    for entry in entries:
+        index.add(*entry)
+    index.close()
+
+    last_time, last_duration = entries[-1][0], entries[-1][1]
+    return {
+        "size": size,
+        "truncated_bytes": original_size - size,
+        "fragments": len(entries),
+        "frames": frames,
+        "duration": (last_time + last_duration) / TIMESCALE,
+        "checksum": f"{checksum:08x}",
+    }
+
+class ClipRecovery():
+    '''
+    Finishes off the clips that were being written when the power went. They are picked from the
+    index as the dashcam starts, before anything new is opened, and repaired on a low priority
+    thread so recording doesn't wait for them. Clips with nothing playable are removed unless locked.
+    '''
+    def __init__(self, index) -> None:
+        self.index = index
+        self.directory = index.directory
+        self.pending = index.unfinished()
+        self.is_running = False
+
+        self.clips = len(self.pending)
+        self.recovered_clips = 0
+        self.removed_clips = 0
+        self.recovered_frames = 0
+        self.truncated_bytes = 0
+        self.started = None
+        self.elapsed = None
+
+    def start(self):
+        if self.is_running:
+            return {"message": "Already running"}, 400
+        if not self.pending:
+            return {"message": "Nothing to recover"}, 200
+        self.is_running = True
+        Thread(target=self._start, name=type(self).__name__, daemon=True).start()
+        return {"message": "Started clip recovery"}, 200
+
+    def get_status(self) -> dict:
+        return {
+            "running": self.is_running,
+            "clips": self.clips,
+            "remaining": len(self.pending),
+            "recovered_clips": self.recovered_clips,
+            "removed_clips": self.removed_clips,
+            "recovered_frames": self.recovered_frames,
+            "truncated_bytes": self.truncated_bytes,
+            "seconds": self.elapsed,
+        }
+
+    def _start(self) -> None:
+        try:
+            os.setpriority(os.PRIO_PROCESS, get_native_id(), 10)
+        except (AttributeError, OSError):
+            pass
+
+        self.started = time.perf_counter()
+        print(f"Recovering {self.clips} unfinished clips")
+        while self.pending:
+            clip = self.pending[0]
+            try:
+                self._recover(clip)
+            except Exception as e:
+                print(f"Couldn't recover {clip['name']}: {e}")
+            self.pending.pop(0)
+        self.elapsed = round(time.perf_counter() - self.started, 3)
+        self.is_running = False
+        print(f"Clip recovery finished in {self.elapsed}s: {self.recovered_clips} recovered, {self.removed_clips} removed")
+
+    def _recover(self, clip: dict) -> None:
+        name = clip['name']
+        path = os.path.join(self.directory, name)
+        if not os.path.exists(path):
+            self.index.remove(name)
+            return
+
+        if name.endswith('.h264'):
+            # A raw stream plays up to wherever it stops, it only needs closing in the index
+            mtime = os.path.getmtime(path)
+            self.index.close_clip(name, mtime, os.path.getsize(path), mtime - clip['start_time'])
+            self.recovered_clips += 1
+            return
+
+        result = recover_clip(path)
+        if result is None:
+            if clip['locked']:
+                # Not ours to throw away, leave it for someone with better tools than us
+                mtime = os.path.getmtime(path)
+                self.index.close_clip(name, mtime, os.path.getsize(path), 0)
+                return
+            for file in [path] + [path + extension for extension in SIDECAR_EXTENSIONS]:
+                try:
+                    os.remove(file)
+                except FileNotFoundError:
+                    pass
+            self.index.remove(name)
+            self.removed_clips += 1
+            print(f"Removed unrecoverable clip: {name}")
+            return
+
+        self.index.close_clip(name, clip['start_time'] + result['duration'], result['size'], result['duration'], result['checksum'])
+        # The GPS reader only updates a clip's bounds every so often, bring them up to date with the whole track
+        track = read_track(path)
+        if track is not None and len(track):
+            self.index.set_track(name, *track_bounds(track))
+        self.recovered_clips += 1
+        self.recovered_frames += result['frames']
+        self.truncated_bytes += result['truncated_bytes']
+        print(f"Recovered {name}: {result['frames']} frames, {result['duration']:.1f}s, trimmed {result['truncated_bytes']} bytes")
@@ -0,0 +1,311 @@
+from dashcam.gps.gps_track import TRACK_EXTENSION, read_track, track_bounds
+from dashcam.thumbnails.thumbnailer import THUMBNAIL_EXTENSION
+from dashcam.outputs.fragment_index import INDEX_EXTENSION
+from threading import Lock
+import sqlite3
+import time
+import os
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS recordings (
+    name TEXT PRIMARY KEY,
+    start_time REAL NOT NULL,
+    end_time REAL,
+    size INTEGER NOT NULL DEFAULT 0,
+    duration REAL,
+    locked INTEGER NOT NULL DEFAULT 0,
+    checksum TEXT,
+    uploaded REAL,
+    camera TEXT
+);
+CREATE INDEX IF NOT EXISTS recordings_start ON recordings (start_time);
+CREATE INDEX IF NOT EXISTS recordings_eviction ON recordings (locked, start_time);
+CREATE INDEX IF NOT EXISTS recordings_duration ON recordings (duration);
+'''
+
+# Bounding box of each clip's GPS track. An R*Tree answers "what passed near here" without
+# touching clips that were nowhere near, a plain table does the same job more slowly without one
+TRACK_SCHEMA = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS track_bounds USING rtree (id, min_latitude, max_latitude, min_longitude, max_longitude);
+'''
+TRACK_SCHEMA_FALLBACK = '''
+CREATE TABLE IF NOT EXISTS track_bounds (
+    id INTEGER PRIMARY KEY, min_latitude REAL, max_latitude REAL, min_longitude REAL, max_longitude REAL
+);
+CREATE INDEX IF NOT EXISTS track_bounds_latitude ON track_bounds (min_latitude, max_latitude);
+'''
+
+# Multipart uploads in progress, one row per part sent, so an upload picks up where it left off after a power cut
+UPLOAD_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS uploads (
+    name TEXT PRIMARY KEY,
+    upload_id TEXT NOT NULL,
+    part_size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS upload_parts (
+    name TEXT NOT NULL,
+    number INTEGER NOT NULL,
+    etag TEXT NOT NULL,
+    PRIMARY KEY (name, number)
+);
+'''
+
+COLUMNS = ('name', 'start_time', 'end_time', 'size', 'duration', 'locked', 'checksum', 'uploaded', 'camera')
+
+CLIP_PREFIXES = ('dashcam_', 'event_', 'parked_')
+CLIP_EXTENSIONS = ('.mp4', '.h264')
+# Files kept next to a clip (clip name + extension) that go when the clip goes
+SIDECAR_EXTENSIONS = (INDEX_EXTENSION, THUMBNAIL_EXTENSION, TRACK_EXTENSION)
+
+class RecordingIndex():
+    '''
+    Keeps track of every clip in the recordings directory so listing, eviction and time lookups
+    never have to scan the directory. Clips are added as FileStreamer opens them and completed as
+    they are closed. If the index file is missing it is rebuilt from the directory once. Every
+    camera's clips go in the same index, each row says which camera it came from.
+    '''
+    def __init__(self, directory: str, main_camera: str = 'front') -> None:
+        self.directory = directory
+        # Whose clips have no camera name of their own
+        self.main_camera = main_camera
+        self.path = os.path.join(directory, 'index.db')
+        self.lock = Lock()
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        rebuild = not os.path.exists(self.path)
+
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        # WAL keeps each update to a single append instead of rewriting pages on the SD card
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+        self.connection.executescript(UPLOAD_SCHEMA)
+        # Indexes from before uploads were tracked, or before there was more than one camera
+        columns = [row['name'] for row in self.connection.execute('PRAGMA table_info(recordings)')]
+        if 'uploaded' not in columns:
+            self.connection.execute('ALTER TABLE recordings ADD COLUMN uploaded REAL')
+        if 'camera' not in columns:
+            with self.connection:
+                self.connection.execute('ALTER TABLE recordings ADD COLUMN camera TEXT')
+                self.connection.execute('UPDATE recordings SET camera = ?', (main_camera,))
+        try:
+            self.connection.executescript(TRACK_SCHEMA)
+        except sqlite3.OperationalError:
+            # SQLite built without the R*Tree module
+            self.connection.executescript(TRACK_SCHEMA_FALLBACK)
+
+        if rebuild:
+            self.rebuild()
+        self.total_size, self.max_duration = self.connection.execute(
+            'SELECT COALESCE(SUM(size), 0), COALESCE(MAX(duration), 0) FROM recordings').fetchone()
+
+    def rebuild(self) -> None:
+        start = time.time()
+        rows = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.name.startswith(CLIP_PREFIXES) or not entry.name.endswith(CLIP_EXTENSIONS):
+                    continue
+                stat = entry.stat()
+                start_time = self._parse_start_time(entry.name, stat.st_mtime)
+                locked = not stat.st_mode & 0o222
+                rows.append((entry.name, start_time, stat.st_mtime, stat.st_size, stat.st_mtime - start_time, int(locked), None, None,
+                             self._parse_camera(entry.name)))
+
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM track_bounds')
+            self.connection.execute('DELETE FROM recordings')
+            self.connection.executemany(
+                f"INSERT INTO recordings ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})", rows)
+        tracks = 0
+        for row in rows:
+            track = read_track(os.path.join(self.directory, row[0]))
+            if track is not None and len(track):
+                self.set_track(row[0], *track_bounds(track))
+                tracks += 1
+        print(f"Rebuilt recording index: {len(rows)} clips, {tracks} tracks in {time.time() - start:.2f}s")
+
+    def _parse_start_time(self, name: str, fallback: float) -> float:
+        try:
+            stamp = os.path.splitext(name)[0].split('_')[1]
+            return time.mktime(time.strptime(stamp, '%Y%m%d-%H%M%S'))
+        except (IndexError, ValueError):
+            return fallback
+
+    def _parse_camera(self, name: str) -> str:
+        # prefix_time.ext from the main camera, prefix_time_camera.ext from any other
+        parts = os.path.splitext(name)[0].split('_', 2)
+        return parts[2] if len(parts) > 2 else self.main_camera
+
+    def open_clip(self, name: str, start_time: float, camera: str = None, locked: bool = False) -> None:
+        with self.lock, self.connection:
+            # A clip opened again under the same name no longer counts the size it had
+            row = self.connection.execute('SELECT size FROM recordings WHERE name = ?', (name,)).fetchone()
+            if row is not None and row['size'] is not None:
+                self.total_size -= row['size']
+            self.connection.execute(
+                'INSERT OR REPLACE INTO recordings (name, start_time, locked, camera) VALUES (?, ?, ?, ?)',
+                (name, start_time, int(locked), camera or self.main_camera))
+
+    def close_clip(self, name: str, end_time: float, size: int, duration: float, checksum: str = None) -> None:
+        with self.lock, self.connection:
+            self.connection.execute(
+                'UPDATE recordings SET end_time = ?, size = ?, duration = ?, checksum = ? WHERE name = ?',
+                (end_time, size, duration, checksum, name))
+            self.total_size += size
+            self.max_duration = max(self.max_duration, duration or 0)
+
+    def set_locked(self, name: str, locked: bool) -> bool:
+        with self.lock, self.connection:
+            cursor = self.connection.execute('UPDATE recordings SET locked = ? WHERE name = ?', (int(locked), name))
+        return cursor.rowcount > 0
+
+    def remove(self, name: str) -> None:
+        with self.lock, self.connection:
+            row = self.connection.execute('SELECT size FROM recordings WHERE name = ?', (name,)).fetchone()
+            if row is None:
+                return
+            self.connection.execute('DELETE FROM track_bounds WHERE id = (SELECT rowid FROM recordings WHERE name = ?)', (name,))
+            self.connection.execute('DELETE FROM recordings WHERE name = ?', (name,))
+            self.total_size -= row['size']
+
+    def get(self, name: str) -> dict:
+        with self.lock:
+            row = self.connection.execute('SELECT * FROM recordings WHERE name = ?', (name,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def list(self, limit: int = None, offset: int = 0, camera: str = None) -> list:
+        # Newest first, which is what anything browsing the recordings wants
+        query, parameters = 'SELECT * FROM recordings', []
+        if camera is not None:
+            query += ' WHERE camera = ?'
+            parameters.append(camera)
+        with self.lock:
+            rows = self.connection.execute(query + ' ORDER BY start_time DESC LIMIT ? OFFSET ?',
+                                           parameters + [-1 if limit is None else limit, offset]).fetchall()
+        return [dict(row) for row in rows]
+
+    def oldest(self, count: int, include_locked: bool = False, uploaded_first: bool = False) -> list:
+        # Only finished clips are returned, the one being written has no end time yet
+        query = 'SELECT * FROM recordings WHERE end_time IS NOT NULL'
+        if not include_locked:
+            query += ' AND locked = 0'
+        # Ordering on uploaded as well would sort every clip, each part of it on its own walks the
+        # eviction index in start order and stops once it has enough
+        parts = [' AND uploaded IS NOT NULL', ' AND uploaded IS NULL'] if uploaded_first else ['']
+        rows = []
+        with self.lock:
+            for part in parts:
+                if len(rows) < count:
+                    rows += self.connection.execute(query + part + ' ORDER BY start_time ASC LIMIT ?', (count - len(rows),)).fetchall()
+        return [dict(row) for row in rows]
+
+    def unfinished(self) -> list:
+        # Clips opened but never closed, which after a restart means the power went while they were written
+        with self.lock:
+            rows = self.connection.execute('SELECT * FROM recordings WHERE end_time IS NULL ORDER BY start_time ASC').fetchall()
+        return [dict(row) for row in rows]
+
+    def pending_uploads(self, count: int) -> list:
+        # Finished clips not backed up yet. Uploads already under way come first, then locked clips
+        # since they matter most, then the oldest as they are the next to be evicted
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT * FROM recordings WHERE end_time IS NOT NULL AND uploaded IS NULL '
+                'ORDER BY name IN (SELECT name FROM uploads) DESC, locked DESC, start_time ASC LIMIT ?',
+                (count,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def set_uploaded(self, name: str, uploaded: float) -> None:
+        with self.lock, self.connection:
+            self.connection.execute('UPDATE recordings SET uploaded = ? WHERE name = ?', (uploaded, name))
+            self.connection.execute('DELETE FROM upload_parts WHERE name = ?', (name,))
+            self.connection.execute('DELETE FROM uploads WHERE name = ?', (name,))
+
+    def start_upload(self, name: str, upload_id: str, part_size: int) -> None:
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM upload_parts WHERE name = ?', (name,))
+            self.connection.execute('INSERT OR REPLACE INTO uploads VALUES (?, ?, ?)', (name, upload_id, part_size))
+
+    def add_upload_part(self, name: str, number: int, etag: str) -> None:
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO upload_parts VALUES (?, ?, ?)', (name, number, etag))
+
+    def get_upload(self, name: str) -> tuple:
+        # (upload id, part size, {part number: etag}) for an upload in progress, or None
+        with self.lock:
+            row = self.connection.execute('SELECT upload_id, part_size FROM uploads WHERE name = ?', (name,)).fetchone()
+            if row is None:
+                return None
+            parts = self.connection.execute('SELECT number, etag FROM upload_parts WHERE name = ?', (name,)).fetchall()
+        return row['upload_id'], row['part_size'], {part['number']: part['etag'] for part in parts}
+
+    def abandoned_uploads(self) -> list:
+        # (name, upload id) of uploads whose clip has since been deleted
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT name, upload_id FROM uploads WHERE name NOT IN (SELECT name FROM recordings)').fetchall()
+        return [(row['name'], row['upload_id']) for row in rows]
+
+    def forget_upload(self, name: str) -> None:
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM upload_parts WHERE name = ?', (name,))
+            self.connection.execute('DELETE FROM uploads WHERE name = ?', (name,))
+
+    def upload_totals(self) -> dict:
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT COUNT(uploaded), COALESCE(SUM(CASE WHEN uploaded IS NOT NULL THEN size END), 0), '
+                'COUNT(*) - COUNT(uploaded) FROM recordings WHERE end_time IS NOT NULL').fetchone()
+        return {"uploaded_clips": row[0], "uploaded_bytes": row[1], "pending_clips": row[2]}
+
+    def between(self, start_time: float, end_time: float, camera: str = None) -> list:
+        # Clips overlapping [start_time, end_time], bounding start_time keeps this on the index
+        query = ('SELECT * FROM recordings WHERE start_time >= ? AND start_time <= ? '
+                 'AND COALESCE(end_time, start_time + ?) >= ?')
+        parameters = [start_time - self.max_duration, end_time, self.max_duration, start_time]
+        if camera is not None:
+            query += ' AND camera = ?'
+            parameters.append(camera)
+        with self.lock:
+            rows = self.connection.execute(query + ' ORDER BY start_time ASC', parameters).fetchall()
+        return [dict(row) for row in rows]
+
+    def alongside(self, name: str) -> list:
+        # The other cameras' clips of the same kind overlapping this one, with how far each starts after it
+        clip = self.get(name)
+        if clip is None:
+            return None
+        prefix = name.split('_', 1)[0] + '_'
+        end_time = clip['end_time'] if clip['end_time'] is not None else time.time()
+        return [dict(other, offset=round(other['start_time'] - clip['start_time'], 3))
+                for other in self.between(clip['start_time'], end_time)
+                if other['camera'] != clip['camera'] and other['name'].startswith(prefix)]
+
+    def set_track(self, name: str, min_latitude: float, max_latitude: float, min_longitude: float, max_longitude: float) -> None:
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO track_bounds SELECT rowid, ?, ?, ?, ? FROM recordings WHERE name = ?',
+                (min_latitude, max_latitude, min_longitude, max_longitude, name))
+
+    def near(self, min_latitude: float, max_latitude: float, min_longitude: float, max_longitude: float,
+             start_time: float = None, end_time: float = None) -> list:
+        # Clips whose track bounding box overlaps the box given, optionally only those overlapping a time range
+        query = ('SELECT recordings.* FROM track_bounds JOIN recordings ON recordings.rowid = track_bounds.id '
+                 'WHERE max_latitude >= ? AND min_latitude <= ? AND max_longitude >= ? AND min_longitude <= ?')
+        parameters = [min_latitude, max_latitude, min_longitude, max_longitude]
+        if start_time is not None:
+            query += ' AND COALESCE(recordings.end_time, ?) >= ?'
+            parameters += [time.time(), start_time]
+        if end_time is not None:
+            query += ' AND recordings.start_time <= ?'
+            parameters.append(end_time)
+        with self.lock:
+            rows = self.connection.execute(query + ' ORDER BY recordings.start_time ASC', parameters).fetchall()
+        return [dict(row) for row in rows]
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,110 @@
+from dashcam.storage.recording_index import SIDECAR_EXTENSIONS
+from threading import Event, Thread, get_native_id
+import time
+import os
+
+class StorageManager():
+    '''
+    Keeps the recordings directory inside its free space and used bytes targets by deleting the
+    oldest unlocked clips, those already backed up by the Uploader first. Runs on its own low priority thread and paces deletions so that large
+    unlinks never hold up clip rotation or compete with the writer for SD card bandwidth.
+    '''
+    def __init__(self, index, settings: dict) -> None:
+        self.index = index
+        self.settings = settings
+        self.directory = index.directory
+        self.stop_event = Event()
+        self.is_running = False
+
+        self.deleted_files = 0
+        self.deleted_bytes = 0
+        self.last_check = None
+        self.last_deleted = None
+        self.evictable = True
+
+    def start(self):
+        if self.is_running:
+            return {"message": "Already running"}, 400
+        self.stop_event.clear()
+        self.is_running = True
+        Thread(target=self._start, name=type(self).__name__, daemon=True).start()
+        return {"message": "Started storage manager"}, 200
+
+    def stop(self):
+        if not self.is_running:
+            return {"message": "Not running"}, 400
+        self.stop_event.set()
+        self.is_running = False
+        return {"message": "Stopped storage manager"}, 200
+
+    def set_settings(self, settings: dict) -> None:
+        self.settings = settings
+
+    def get_status(self) -> dict:
+        return {
+            "running": self.is_running,
+            "free_bytes": self._free_bytes(),
+            "used_bytes": self.index.total_size,
+            "min_free_bytes": self.settings['min_free_bytes'],
+            "max_used_bytes": self.settings['max_used_bytes'],
+            "over_budget": self._over_budget(),
+            "evictable": self.evictable,
+            "deleted_files": self.deleted_files,
+            "deleted_bytes": self.deleted_bytes,
+            "last_check": self.last_check,
+            "last_deleted": self.last_deleted,
+        }
+
+    def _start(self) -> None:
+        # Deleting can wait, recording and streaming can't
+        try:
+            os.setpriority(os.PRIO_PROCESS, get_native_id(), 10)
+        except (AttributeError, OSError):
+            pass
+
+        print("Started StorageManager")
+        while True:
+            self.last_check = time.time()
+            self._enforce()
+            if self.stop_event.wait(self.settings['check_interval']):
+                break
+        print("StorageManager stopped")
+
+    def _free_bytes(self) -> int:
+        stat = os.statvfs(self.directory)
+        return stat.f_bavail * stat.f_frsize
+
+    def _over_budget(self) -> bool:
+        if self._free_bytes() < self.settings['min_free_bytes']:
+            return True
+        max_used_bytes = self.settings['max_used_bytes']
+        return bool(max_used_bytes) and self.index.total_size > max_used_bytes
+
+    def _enforce(self) -> None:
+        while self._over_budget() and not self.stop_event.is_set():
+            batch = self.index.oldest(self.settings['batch_size'], uploaded_first=self.settings['evict_uploaded_first'])
+            self.evictable = bool(batch)
+            if not batch:
+                print("Storage is over budget but every remaining clip is locked")
+                return
+
+            for clip in batch:
+                self._delete(clip)
+                if not self._over_budget():
+                    return
+                # Give the writer some room between unlinks, they can take a while on FAT/exFAT
+                if self.stop_event.wait(self.settings['delete_interval']):
+                    return
+
+    def _delete(self, clip: dict) -> None:
+        path = os.path.join(self.directory, clip['name'])
+        for file in [path] + [path + extension for extension in SIDECAR_EXTENSIONS]:
+            try:
+                os.remove(file)
+            except FileNotFoundError:
+                pass
+        self.index.remove(clip['name'])
+        self.deleted_files += 1
+        self.deleted_bytes += clip['size']
+        self.last_deleted = clip['name']
+        print(f"Removed old clip: {clip['name']}")
@@ -1,19 +1,22 @@
-from picamera2.encoders import Encoder
 from threading import Event, Thread
 
 class BaseStreamer():
-    def __init__(self, dashcam, settings: dict, encoder: Encoder) -> None:
+    def __init__(self, dashcam, settings: dict, encoder, camera) -> None:
         self.dashcam = dashcam
         self.settings = settings
         self.encoder = encoder
+        self.camera = camera
+        self.source = camera.source
         self.stop_event = Event()
         self.is_streaming = False
+        self.thread = None
 
     def start(self):
         if self.is_streaming:
             return {"message": "Already streaming"}, 400
         self.stop_event.clear()
-        Thread(target=self._start).start()
+        self.thread = Thread(target=self._start, name=type(self).__name__)
+        self.thread.start()
         return {"message": "Started streaming"}, 200
 
     def stop(self):
@@ -1,15 +1,68 @@
+from dashcam.storage.recording_index import SIDECAR_EXTENSIONS
+from dashcam.storage.clip_recovery import recover_clip
 from dashcam.streamers.base_streamer import BaseStreamer
-from picamera2.encoders import H264Encoder
-from picamera2.outputs import FfmpegOutput
+from dashcam.outputs.clip_output import ClipOutput
+from dashcam.outputs.clip_writer import BufferPool
+from dashcam.outputs.ring_output import RingOutput
+from dashcam.outputs.mp4_output import Mp4Output
+from threading import Event, Lock
 import time
 import os
 
 class FileStreamer(BaseStreamer):
-    def __init__(self, dashcam, settings: dict) -> None:
-        super().__init__(dashcam, settings, H264Encoder(settings['bitrate']))
+    def __init__(self, dashcam, settings: dict, camera) -> None:
+        # repeat puts SPS/PPS in front of every IDR frame so a new clip can start on any keyframe,
+        # iperiod keeps keyframes one second apart which bounds how late a clip boundary can be
+        encoder = camera.source.create_encoder('h264', settings['bitrate'], repeat=True, iperiod=settings['fps'])
+        # A copy, the recording settings are what was asked for and these are what the clip being written uses
+        super().__init__(dashcam, dict(settings), encoder, camera)
         self.directory = settings['directory']
         self.extension = settings['extension']
         self.clip_duration = settings['clip_duration']
+        self.output = ClipOutput(self._create_output)
+        self.clip_name = None
+        self.clip_start = None
+        self.previous_clip_name = None
+        self.lock_until = 0
+        self.clip_opened = Event()
+        self.rotate_event = Event()
+        # Bitrate and frame rate changes wait here for the next clip boundary
+        self.pending_settings = {}
+        self.pending_lock = Lock()
+        # Events and parked clips are named from more than one thread
+        self.snapshot_lock = Lock()
+        # The main camera's clips keep plain names, any other camera's name goes after the time
+        self.suffix = '' if camera.main else f"_{camera.name}"
+        # Streamers whose clips are cut along with ours, and whether ours are cut by another's
+        self.followers = []
+        self.following = False
+        # Armed, the encoder runs into the ring alone so a parked clip can reach back before it was triggered
+        self.armed = False
+
+        metrics = dashcam.metrics
+        labels = {'camera': camera.name}
+        self.write_bytes = metrics.counter('dashcam_write_bytes_total', "Bytes of video written to clips", labels)
+        self.write_seconds = metrics.histogram('dashcam_fragment_write_seconds', "Time the encoder thread spent writing each fragment, waiting on the card included",
+                                               (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1), labels)
+        self.write_sizes = metrics.histogram('dashcam_write_size_bytes', "Size of each write to the card",
+                                             (4096, 16384, 65536, 131072, 262144, 524288, 1048576, 4194304), labels)
+        self.block_write_seconds = metrics.histogram('dashcam_block_write_seconds', "Time each write to the card took",
+                                                     (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1), labels)
+        self.write_stalls = metrics.histogram('dashcam_write_stall_seconds', "Time the encoder thread waited for a free write buffer",
+                                              (0.0001, 0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1), labels)
+        self.sync_seconds = metrics.histogram('dashcam_sync_seconds', "Time each sync to the card took",
+                                              (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5), labels)
+        self.write_errors = metrics.counter('dashcam_write_errors_total', "Clips the card failed to write, each kept up to its last sync", labels)
+        self.rotation_seconds = metrics.histogram('dashcam_clip_rotation_seconds', "Time spent opening the next clip and closing the last, not counting the wait for a keyframe",
+                                                  (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1), labels)
+        metrics.counter_callback('dashcam_recording_frames_in_total', "Encoded frames reaching the recorder", lambda: self.output.frames_received, labels)
+        metrics.counter_callback('dashcam_recording_frames_out_total', "Frames written to clips", lambda: self.output.frames_written, labels)
+        metrics.counter_callback('dashcam_recording_frames_dropped_total', "Frames dropped before the first clip opened", lambda: self.output.frames_dropped, labels)
+        metrics.gauge_callback('dashcam_encoder_queue_frames', "Encoded frames held in the open fragment waiting to be written", self._queued_frames, labels)
+        metrics.gauge_callback('dashcam_write_buffers_in_use', "Write buffers filling or waiting for the card", lambda: self.pool.in_use() if self.pool is not None else None, labels)
+        # Clips from the native muxer are written through a pool of buffers shared from one clip to the next
+        self.pool = BufferPool(settings['write_buffers'], settings['write_block']) if settings['write_buffers'] else None
+        self.ring = RingOutput(settings['pre_event_buffer'])
 
         if not os.path.exists(self.directory):
             os.makedirs(self.directory)
@@ -18,36 +71,294 @@ class FileStreamer(BaseStreamer):
         return super().start()
 
     def stop(self):
-        return super().stop()
+        result = super().stop()
+        self.rotate_event.set()
+        return result
 
     def set_settings(self, settings: dict) -> None:
         super().set_settings(settings)
 
+    def queue_settings(self, changes: dict, urgent: bool = False) -> None:
+        # Applied when the next clip starts so every clip is encoded one way throughout. An urgent
+        # change cuts the current clip short rather than waiting out the rest of it
+        with self.pending_lock:
+            self.pending_settings.update(changes)
+        if not self.is_streaming:
+            self._apply_pending()
+        elif urgent:
+            self.rotate_event.set()
+
+    def set_bitrate(self, bitrate: int) -> None:
+        # Straight away rather than at the next clip, the encoder takes a new bitrate while it runs
+        with self.pending_lock:
+            self.pending_settings.pop('bitrate', None)
+        self.source.set_bitrate(self.encoder, bitrate)
+        self.settings = dict(self.settings, bitrate=bitrate)
+
+    def _apply_pending(self) -> None:
+        with self.pending_lock:
+            changes, self.pending_settings = self.pending_settings, {}
+        if not changes:
+            return
+        if 'fps' in changes:
+            self.source.set_frame_rate(changes['fps'])
+        if 'bitrate' in changes:
+            self.source.set_bitrate(self.encoder, changes['bitrate'])
+        if 'clip_duration' in changes:
+            self.clip_duration = changes['clip_duration']
+        self.settings = dict(self.settings, **changes)
+        print(f"Recording settings changed: {', '.join(f'{key} {value}' for key, value in changes.items())}")
+
+    def arm(self) -> bool:
+        # Fills the ring without recording, for parking. Recording takes the encoder back over
+        if self.is_streaming or self.armed:
+            return False
+        self._apply_pending()
+        self.source.start_encoder(self.encoder, [self.ring])
+        self.armed = True
+        return True
+
+    def disarm(self) -> None:
+        if self.armed:
+            self.armed = False
+            self.source.stop_encoder(self.encoder)
+
+    def save_event(self, pre_seconds: float, post_seconds: float):
+        if not self.is_streaming and not self.armed:
+            return {"message": "Not recording"}, 400
+
+        output = self._snapshot('event', pre_seconds, post_seconds, True, self._event_finished)
+        if output is None:
+            return {"message": "No frames buffered yet"}, 400
+        file_name = os.path.basename(output.path)
+        print(f"Event started: {file_name}")
+        return {"message": "Saving event", "file": file_name}, 200
+
+    def save_parked(self, pre_seconds: float, post_seconds: float, on_finished=None):
+        # A clip from the ring while armed, kept going with extend_parked for as long as there is motion.
+        # Unlike an event it isn't locked, a busy street would fill the card with them
+        output = self._snapshot('parked', pre_seconds, post_seconds, False,
+                                lambda output: self._parked_finished(output, on_finished))
+        if output is not None:
+            print(f"Parked clip started: {os.path.basename(output.path)}")
+        return output
+
+    def extend_parked(self, output, post_seconds: float) -> bool:
+        return self.ring.extend(output, post_seconds)
+
+    def _snapshot(self, prefix: str, pre_seconds: float, post_seconds: float, locked: bool, on_finished):
+        with self.snapshot_lock:
+            file_name = self._unique_name(prefix, 'mp4')
+            self.dashcam.index.open_clip(file_name, time.time() - pre_seconds, self.camera.name, locked=locked)
+        output = Mp4Output(os.path.join(self.directory, file_name), self.settings['resolution'], self.settings['fps'],
+                           self.settings['sync_fragments'])
+        if self.ring.snapshot(output, pre_seconds, post_seconds, on_finished=on_finished) is None:
+            self.dashcam.index.remove(file_name)
+            return None
+        return output
+
+    def lock_recent(self, post_seconds: float) -> list:
+        # Locks the clip being written and the one before it, plus any clip opened in the next post_seconds
+        self.lock_until = time.time() + post_seconds
+        names = [name for name in (self.previous_clip_name, self.clip_name) if name is not None]
+        for name in names:
+            self.dashcam.lock_recording(name)
+        return names
+
+    def _event_finished(self, output) -> None:
+        # Event clips are read-only so they are kept when old recordings are cleared out
+        os.chmod(output.path, 0o444)
+        self._snapshot_finished(output)
+        print(f"Event finished: {os.path.basename(output.path)} ({output.frame_count} frames)")
+
+    def _parked_finished(self, output, on_finished) -> None:
+        self._snapshot_finished(output)
+        print(f"Parked clip finished: {os.path.basename(output.path)} ({output.frame_count} frames)")
+        if on_finished is not None:
+            on_finished(output)
+
+    def _snapshot_finished(self, output) -> None:
+        checksum = f"{output.checksum:08x}"
+        self.dashcam.index.close_clip(os.path.basename(output.path), time.time(), output.bytes_written, output.duration, checksum)
+
     def _get_next_file_name(self) -> str:
-        return f"dashcam_{time.strftime('%Y%m%d-%H%M%S')}.{self.extension}"
+        return self._unique_name('dashcam', self.extension)
+
+    def _unique_name(self, prefix: str, extension: str) -> str:
+        # Clips opened in the same second are -2, -3 and so on after the time, the way exports are. A name
+        # counts as taken once it is in the index, which can be before its file is created
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        name = f"{prefix}_{stamp}{self.suffix}.{extension}"
+        copy = 1
+        while os.path.exists(os.path.join(self.directory, name)) or self.dashcam.index.get(name) is not None:
+            copy += 1
+            name = f"{prefix}_{stamp}-{copy}{self.suffix}.{extension}"
+        return name
+
+    def _create_output(self, path: str):
+        # The picamera2 outputs are only needed (and only available) on the Pi
+        if self.settings.get('muxer') == 'ffmpeg':
+            from picamera2.outputs import FfmpegOutput
+            return FfmpegOutput(path)
+        if self.extension == 'h264':
+            from picamera2.outputs import FileOutput
+            return FileOutput(path)
+        # Allocated up front at what the clip should come to at this bitrate, the writer gives back what isn't used
+        preallocate = int(self.settings['bitrate'] / 8 * self.clip_duration * self.settings['preallocate'])
+        output = Mp4Output(path, self.settings['resolution'], self.settings['fps'], self.settings['sync_fragments'], self._audio_track(),
+                           self.pool, preallocate)
+        output.on_fragment = self._fragment_written
+        output.on_write = self._block_written
+        output.on_stall = self.write_stalls.observe
+        output.on_sync = self.sync_seconds.observe
+        return output
+
+    def _audio_track(self) -> dict:
+        # Only the native muxer takes audio, and the microphone goes with the main camera
+        recorder = self.dashcam.audiorecorder
+        if recorder is None or not self.camera.main or not recorder.is_running or self.settings.get('muxer') == 'ffmpeg' or self.extension == 'h264':
+            return None
+        return recorder.track
+
+    def _fragment_written(self, size: int, seconds: float) -> None:
+        self.write_bytes.inc(size)
+        self.write_seconds.observe(seconds)
+
+    def _block_written(self, size: int, seconds: float) -> None:
+        # On the writer's thread
+        self.write_sizes.observe(size)
+        self.block_write_seconds.observe(seconds)
+
+    def _queued_frames(self) -> int:
+        output = self.output.output
+        return len(output.samples) if output is not None and hasattr(output, 'samples') else 0
 
     def _start(self) -> None:
         super()._start()
-        while not self.stop_event.is_set():
-            try:
-                file_name = self._get_next_file_name()
-                print(f"Clip started: {file_name}")
-
-                output = FfmpegOutput(os.path.join(self.directory, file_name))
-                self.dashcam.picam2.start_recording(self.encoder, output)
-
-                start_time = time.time()
-                # Wait for clip_duration to be met
-                while time.time() - start_time < self.clip_duration and not self.stop_event.is_set():
-                    time.sleep(1) # CPU friendly sleep
-
-                # Stop the current clip
-                self.dashcam.picam2.stop_recording()
-                print(f"Clip finished: {file_name}")
-
-                # TODO: Improve the logic here, this will cause clips to have a brief gap between them
-                # Not ideal for a dashcam
-            finally:
-                self.dashcam.picam2.stop_recording()
+        self.clip_opened.clear()
+        self.rotate_event.clear()
+        # Parking may have left the encoder running into the ring
+        self.disarm()
+        self._apply_pending()
+        self.clip_name = self._get_next_file_name()
+        self.output.split(os.path.join(self.directory, self.clip_name))
+
+        # The encoder runs for as long as we are recording, clips are cut from its output
+        # on keyframe boundaries so there is no gap between them
+        # The ring sees the same frames so an event clip can reach back before the trigger
+        self.source.start_encoder(self.encoder, [self.output, self.ring])
+        if self._audio_track() is not None:
+            self.dashcam.audiorecorder.add_output(self.output, lambda sensor_time: self.source.encoder_time(self.encoder, sensor_time))
+        self.camera.thumbnailer.start()
+        self._open_clip(time.time())
+        split_at = time.monotonic() + self.clip_duration
+        try:
+            while True:
+                # A follower's clips are cut by the camera it follows, its own timer is only a backstop
+                if self.following:
+                    self.rotate_event.wait(self.clip_duration * 2)
+                else:
+                    self.rotate_event.wait(max(split_at - time.monotonic(), 0))
+                early = self.rotate_event.is_set()
+                self.rotate_event.clear()
+                if self.stop_event.is_set():
+                    break
+                requested = time.monotonic()
+                self._rotate()
+                # The next split is due a clip_duration after this one was, not after the keyframe that made it,
+                # otherwise every clip runs up to a GOP long and that adds up over a drive. One asked for early
+                # (an urgent quality change) starts the count again
+                split_at = (requested if early else split_at) + self.clip_duration
+        finally:
+            self.camera.thumbnailer.stop()
+            if self.dashcam.gpsreader is not None and self.camera.main:
+                self.dashcam.gpsreader.set_clip(None)
+            if self.dashcam.audiorecorder is not None:
+                self.dashcam.audiorecorder.remove_output(self.output)
+            self.source.stop_encoder(self.encoder)
+            if self.output.final is not None:
+                self._close_clip(*self.output.final, time.time())
+            else:
+                self.dashcam.index.remove(self.clip_name)
+                self._discard(os.path.join(self.directory, self.clip_name))
+            self.is_streaming = False
         print("FileStreamer stopped")
-        self.is_streaming = False
\ No newline at end of file
+
+    def _rotate(self) -> None:
+        started = time.perf_counter()
+        self._apply_pending()
+        next_file_name = self._get_next_file_name()
+        next_path = os.path.join(self.directory, next_file_name)
+        self.output.split(next_path)
+        for follower in self.followers:
+            follower.rotate_event.set()
+        preparing = time.perf_counter() - started
+
+        # The switch happens on the encoder thread at the next keyframe, wait for it so the
+        # finished clip can be closed here rather than stalling the encoder
+        retired = None
+        while retired is None and not self.stop_event.is_set():
+            retired = self.output.wait_for_split(timeout=1)
+        if retired is None:
+            # Stopped before the next clip received a frame, don't leave an empty file behind
+            self._discard(next_path)
+            return
+
+        # Taken at the switch so clips from other cameras can be lined up against this one. The end of
+        # the finished clip's audio is still on its way, not counted any more than the keyframe was
+        now = time.time()
+        self.output.finish_audio(timeout=0.5)
+        started = time.perf_counter()
+        output, frames = retired
+        output.stop()
+        self._close_clip(output, frames, now)
+        self.previous_clip_name = self.clip_name
+        self.clip_name = next_file_name
+        self._open_clip(now)
+        self.rotation_seconds.observe(preparing + time.perf_counter() - started)
+
+    def _discard(self, path: str) -> None:
+        if os.path.exists(path) and os.path.getsize(path) == 0:
+            os.remove(path)
+            for extension in SIDECAR_EXTENSIONS:
+                if os.path.exists(path + extension):
+                    os.remove(path + extension)
+
+    def _open_clip(self, start_time: float) -> None:
+        self.clip_start = start_time
+        self.dashcam.index.open_clip(self.clip_name, start_time, self.camera.name)
+        if start_time < self.lock_until:
+            self.dashcam.lock_recording(self.clip_name)
+        self.camera.thumbnailer.set_clip(os.path.join(self.directory, self.clip_name))
+        if self.dashcam.gpsreader is not None and self.camera.main:
+            self.dashcam.gpsreader.set_clip(os.path.join(self.directory, self.clip_name))
+        self.clip_opened.set()
+        print(f"Clip started: {self.clip_name}")
+
+    def _close_clip(self, output, frames: int, end_time: float) -> None:
+        path = os.path.join(self.directory, self.clip_name)
+        if getattr(output, 'error', None) is not None:
+            self._close_failed_clip(path)
+            return
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        # Only the native muxer knows the exact duration and checksum of what it wrote
+        duration = getattr(output, 'duration', end_time - self.clip_start)
+        checksum = f"{output.checksum:08x}" if hasattr(output, 'checksum') else None
+        self.dashcam.index.close_clip(self.clip_name, end_time, size, duration, checksum)
+        print(f"Clip finished: {self.clip_name} ({frames} frames)")
+
+    def _close_failed_clip(self, path: str) -> None:
+        # The card failed part way through, the clip is cut back to what was synced the way a power cut's
+        # would be. If the card can't even manage that it stays open for recovery at the next start
+        self.write_errors.inc()
+        try:
+            recovered = recover_clip(path)
+        except OSError as e:
+            print(f"Clip left for recovery: {self.clip_name} ({e})")
+            return
+        if recovered is None:
+            print(f"Clip left for recovery: {self.clip_name} (nothing synced)")
+            return
+        self.dashcam.index.close_clip(self.clip_name, self.clip_start + recovered['duration'], recovered['size'],
+                                      recovered['duration'], recovered['checksum'])
+        print(f"Clip finished after a write error: {self.clip_name} ({recovered['frames']} frames)")
@@ -1,10 +1,27 @@
 from dashcam.streamers.base_streamer import BaseStreamer
-from picamera2.encoders import MJPEGEncoder
+from dashcam.outputs.frame_output import FrameOutput
+from threading import Condition, Lock
 import time
 
 class MJPEGStreamer(BaseStreamer):
-    def __init__(self, dashcam, settings: dict) -> None:
-        super().__init__(dashcam, settings, MJPEGEncoder(settings['bitrate']))
+    def __init__(self, dashcam, settings: dict, camera) -> None:
+        super().__init__(dashcam, settings, camera.source.create_encoder('mjpeg', settings['bitrate']), camera)
+        self.output = FrameOutput()
+        # Streaming and thumbnail grabs share the encoder, it runs while either of them needs it
+        self.encoder_lock = Lock()
+        self.encoder_released = Condition(self.encoder_lock)
+        self.encoder_users = 0
+        self.frame_skip = 0
+
+        metrics = dashcam.metrics
+        labels = {'camera': camera.name}
+        self.stream_lag = metrics.histogram('dashcam_stream_lag_seconds', "Age of each frame when a stream client picks it up",
+                                            (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1), labels)
+        self.frames_skipped = metrics.counter('dashcam_stream_frames_skipped_total', "Frames stream clients were too slow to send", labels)
+        self.frames_sent = metrics.counter('dashcam_stream_frames_sent_total', "Frames handed to stream clients", labels)
+        self.clients = 0
+        metrics.counter_callback('dashcam_stream_frames_encoded_total', "JPEG frames encoded for streaming and thumbnails", lambda: self.output.sequence, labels)
+        metrics.gauge_callback('dashcam_stream_clients', "Stream clients connected", lambda: self.clients, labels)
 
     def start(self):
         return super().start()
@@ -15,14 +32,80 @@ class MJPEGStreamer(BaseStreamer):
     def set_settings(self, settings: dict) -> None:
         super().set_settings(settings)
 
+    def set_frame_skip(self, skip: int) -> None:
+        # Fewer JPEGs to encode, viewers see a lower frame rate
+        self.source.set_frame_skip(self.encoder, skip)
+        self.frame_skip = skip
+
+    def frames(self):
+        # Yields the latest JPEG for as long as streaming is running, one generator per client
+        sequence = 0
+        self.clients += 1
+        try:
+            while self.is_streaming:
+                result = self.output.wait_for_frame(sequence, timeout=1)
+                if result is None:
+                    continue
+                sequence = self._sent(sequence, result[1])
+                yield result[0]
+        finally:
+            self.clients -= 1
+
+    async def frames_async(self):
+        sequence = 0
+        self.clients += 1
+        try:
+            while self.is_streaming:
+                result = await self.output.wait_for_frame_async(sequence, timeout=1)
+                if result is None:
+                    continue
+                sequence = self._sent(sequence, result[1])
+                yield result[0]
+        finally:
+            self.clients -= 1
+
+    def _sent(self, previous: int, sequence: int) -> int:
+        # Anything between the last frame a client sent and this one went by while it was busy
+        if previous:
+            self.frames_skipped.inc(sequence - previous - 1)
+        self.frames_sent.inc()
+        self.stream_lag.observe(time.monotonic() - self.output.frame_time)
+        return sequence
+
+    def grab_frame(self, timeout: float = 1):
+        # One JPEG from the lores stream, the encoder is only started for it if nobody is streaming
+        self._acquire_encoder()
+        try:
+            result = self.output.wait_for_frame(self.output.sequence, timeout)
+        finally:
+            self._release_encoder()
+        return bytes(result[0]) if result is not None else None
+
+    def _acquire_encoder(self) -> None:
+        with self.encoder_lock:
+            if self.encoder_users == 0:
+                # The hardware encoder works from the lores stream, clients share its output through FrameOutput
+                self.source.start_encoder(self.encoder, self.output, name="lores")
+            self.encoder_users += 1
+
+    def _release_encoder(self) -> None:
+        with self.encoder_lock:
+            self.encoder_users -= 1
+            if self.encoder_users == 0:
+                self.source.stop_encoder(self.encoder)
+                self.encoder_released.notify_all()
+
+    def wait_for_encoder(self, timeout: float) -> bool:
+        # True once nothing is using the encoder, False if something still is after timeout seconds
+        with self.encoder_released:
+            return self.encoder_released.wait_for(lambda: self.encoder_users == 0, timeout)
+
     def _start(self) -> None:
         super()._start()
-        while not self.stop_event.is_set():
-            try:
-                #self.dashcam.picam2.start_recording()
-                while not self.stop_event.is_set():
-                    time.sleep(0.1)
-            finally:
-                self.dashcam.picam2.stop_recording()
-        print("FileStreamer stopped")
-        self.is_streaming = False
\ No newline at end of file
+        self._acquire_encoder()
+        try:
+            self.stop_event.wait()
+        finally:
+            self._release_encoder()
+        print("MJPEGStreamer stopped")
+        self.is_streaming = False
@@ -0,0 +1,103 @@
+from threading import Condition, Thread
+import struct
+import time
+import os
+
+THUMBNAIL_EXTENSION = '.thumbs'
+
+class Thumbnailer():
+    '''
+    Keeps a strip of JPEGs from the lores stream next to each clip, one as the clip opens and one
+    every interval after that, so anything listing recordings never has to decode video. Frames
+    come straight from the hardware MJPEG encoder and are appended to <clip>.thumbs as they are
+    taken, each one prefixed with its length.
+    '''
+    def __init__(self, streamer, settings: dict) -> None:
+        self.streamer = streamer
+        self.settings = settings
+        self.condition = Condition()
+        self.clip_path = None
+        self.clip_start = None
+        self.is_running = False
+        self.thread = None
+
+        self.thumbnails_taken = 0
+        self.thumbnails_missed = 0
+        self.last_grab_seconds = None
+
+    def start(self) -> None:
+        if self.is_running or not self.settings['thumbnail_interval']:
+            return
+        # A grab from before the last stop can still be finishing
+        if self.thread is not None:
+            self.thread.join()
+        self.is_running = True
+        self.thread = Thread(target=self._start, name=type(self).__name__, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        with self.condition:
+            self.is_running = False
+            self.clip_path = None
+            self.condition.notify_all()
+
+    def set_clip(self, path: str) -> None:
+        with self.condition:
+            self.clip_path = path
+            self.clip_start = time.monotonic()
+            self.condition.notify_all()
+
+    def get_stats(self) -> dict:
+        return {
+            "thumbnails_taken": self.thumbnails_taken,
+            "thumbnails_missed": self.thumbnails_missed,
+            "last_grab_ms": round(self.last_grab_seconds * 1000, 1) if self.last_grab_seconds is not None else None,
+        }
+
+    def _start(self) -> None:
+        clip_path = None
+        taken = 0
+        while True:
+            with self.condition:
+                while True:
+                    if not self.is_running:
+                        return
+                    if self.clip_path != clip_path:
+                        clip_path, taken = self.clip_path, 0
+                    if clip_path is not None:
+                        delay = self.clip_start + taken * self.settings['thumbnail_interval'] - time.monotonic()
+                        if delay <= 0:
+                            break
+                    else:
+                        delay = None
+                    self.condition.wait(delay)
+
+            started = time.perf_counter()
+            frame = self.streamer.grab_frame()
+            self.last_grab_seconds = time.perf_counter() - started
+            taken += 1
+            if frame is None:
+                self.thumbnails_missed += 1
+                continue
+            with open(clip_path + THUMBNAIL_EXTENSION, 'ab') as f:
+                f.write(struct.pack('>I', len(frame)) + frame)
+            self.thumbnails_taken += 1
+
+def read_thumbnail(path: str, index: int = 0) -> bytes:
+    # The index'th JPEG kept for the clip at path, or None if there isn't one
+    if index < 0:
+        return None
+    try:
+        with open(path + THUMBNAIL_EXTENSION, 'rb') as f:
+            for position in range(index + 1):
+                header = f.read(4)
+                if len(header) < 4:
+                    return None
+                length = struct.unpack('>I', header)[0]
+                if position < index:
+                    f.seek(length, os.SEEK_CUR)
+            frame = f.read(length)
+    except OSError:
+        return None
+    # A thumbnail cut short by a power loss is no use to anyone
+    return frame if len(frame) == length else None
@@ -0,0 +1,43 @@
+import os
+
+class DirectoryTarget():
+    '''
+    Uploads to a mounted directory, typically a NAS share. Parts are written in place into a
+    .partial file so an interrupted copy resumes like an S3 multipart upload, and the file is
+    renamed into place once every part is there.
+    '''
+    def __init__(self, settings: dict) -> None:
+        self.directory = settings['directory']
+
+    def create(self, name: str) -> str:
+        if not os.path.isdir(self.directory):
+            # Don't recreate a share that isn't mounted, the copies would end up on the SD card
+            raise OSError(f"{self.directory} is not available")
+        partial = f"{name}.partial"
+        open(os.path.join(self.directory, partial), 'wb').close()
+        return partial
+
+    def upload_part(self, upload_id: str, name: str, number: int, offset: int, data, throttle) -> str:
+        fd = os.open(os.path.join(self.directory, upload_id), os.O_WRONLY)
+        try:
+            view = memoryview(data)
+            for start in range(0, len(view), 64 * 1024):
+                chunk = view[start:start + 64 * 1024]
+                throttle.consume(len(chunk))
+                os.pwrite(fd, chunk, offset + start)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        return str(len(data))
+
+    def complete(self, upload_id: str, name: str, parts: dict) -> None:
+        os.replace(os.path.join(self.directory, upload_id), os.path.join(self.directory, name))
+
+    def abort(self, upload_id: str, name: str) -> None:
+        try:
+            os.remove(os.path.join(self.directory, upload_id))
+        except FileNotFoundError:
+            pass
+
+    def close(self) -> None:
+        pass
@@ -0,0 +1,125 @@
+from xml.etree import ElementTree
+from urllib.parse import urlsplit, quote
+import http.client
+import hashlib
+import queue
+import hmac
+import time
+
+CHUNK_SIZE = 64 * 1024
+
+class S3Error(Exception):
+    def __init__(self, status: int, code: str, message: str) -> None:
+        super().__init__(f"{status} {code}: {message}")
+        self.status = status
+        self.code = code
+
+class S3Target():
+    '''
+    Multipart uploads to S3 or anything that speaks its API (MinIO, Garage, a NAS with an S3
+    gateway), signed with AWS Signature V4 and path style addressing. Requests share a small pool
+    of keep-alive connections and part bodies are streamed through the token bucket in chunks.
+    '''
+    def __init__(self, settings: dict) -> None:
+        endpoint = urlsplit(settings['endpoint'])
+        self.secure = endpoint.scheme == 'https'
+        self.host = endpoint.netloc
+        self.bucket = settings['bucket']
+        self.prefix = settings['prefix']
+        self.region = settings['region']
+        self.access_key = settings['access_key']
+        self.secret_key = settings['secret_key']
+        self.timeout = settings['timeout']
+        self.pool = queue.LifoQueue()
+        for _ in range(settings['connections']):
+            self.pool.put(None)
+
+    def create(self, name: str) -> str:
+        body = self._request('POST', name, {'uploads': ''})
+        return ElementTree.fromstring(body).findtext('{*}UploadId')
+
+    def upload_part(self, upload_id: str, name: str, number: int, offset: int, data, throttle) -> str:
+        # offset only matters to targets that write parts in place
+        return self._request('PUT', name, {'partNumber': str(number), 'uploadId': upload_id}, data, throttle, etag=True)
+
+    def complete(self, upload_id: str, name: str, parts: dict) -> None:
+        body = ''.join(f"<Part><PartNumber>{number}</PartNumber><ETag>{etag}</ETag></Part>" for number, etag in sorted(parts.items()))
+        self._request('POST', name, {'uploadId': upload_id}, f"<CompleteMultipartUpload>{body}</CompleteMultipartUpload>".encode())
+
+    def abort(self, upload_id: str, name: str) -> None:
+        try:
+            self._request('DELETE', name, {'uploadId': upload_id})
+        except S3Error as e:
+            if e.status != 404:
+                raise
+
+    def close(self) -> None:
+        while not self.pool.empty():
+            connection = self.pool.get_nowait()
+            if connection is not None:
+                connection.close()
+
+    def _request(self, method: str, name: str, query: dict, body=b'', throttle=None, etag: bool = False):
+        path = quote(f"/{self.bucket}/{self.prefix}{name}", safe='/-_.~')
+        query_string = '&'.join(f"{quote(key, safe='-_.~')}={quote(value, safe='-_.~')}" for key, value in sorted(query.items()))
+        headers = self._sign(method, path, query_string, body)
+        headers['Content-Length'] = str(len(body))
+
+        connection = self.pool.get()
+        try:
+            if connection is None:
+                connection_class = http.client.HTTPSConnection if self.secure else http.client.HTTPConnection
+                connection = connection_class(self.host, timeout=self.timeout)
+            connection.putrequest(method, f"{path}?{query_string}" if query_string else path, skip_host=True, skip_accept_encoding=True)
+            for header, value in headers.items():
+                connection.putheader(header, value)
+            connection.endheaders()
+            view = memoryview(body)
+            for start in range(0, len(view), CHUNK_SIZE):
+                chunk = view[start:start + CHUNK_SIZE]
+                if throttle is not None:
+                    throttle.consume(len(chunk))
+                connection.send(chunk)
+            response = connection.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            # The connection can't be trusted after a failure, the next request opens a new one
+            connection.close()
+            connection = None
+            raise
+        finally:
+            self.pool.put(connection)
+
+        if response.status >= 300:
+            code = message = ''
+            if data:
+                try:
+                    error = ElementTree.fromstring(data)
+                    code, message = error.findtext('Code') or '', error.findtext('Message') or ''
+                except ElementTree.ParseError:
+                    message = data[:200].decode('utf-8', 'replace')
+            raise S3Error(response.status, code, message)
+        return response.getheader('ETag') if etag else data
+
+    def _sign(self, method: str, path: str, query_string: str, body) -> dict:
+        now = time.gmtime()
+        amz_date = time.strftime('%Y%m%dT%H%M%SZ', now)
+        date = amz_date[:8]
+        # Part bodies would have to be read twice to hash them, S3 accepts them unsigned
+        payload_hash = 'UNSIGNED-PAYLOAD' if len(body) > CHUNK_SIZE else hashlib.sha256(body).hexdigest()
+        headers = {'host': self.host, 'x-amz-content-sha256': payload_hash, 'x-amz-date': amz_date}
+        signed_headers = ';'.join(headers)
+        canonical_request = '\n'.join([
+            method, path, query_string,
+            ''.join(f"{header}:{value}\n" for header, value in headers.items()),
+            signed_headers, payload_hash,
+        ])
+        scope = f"{date}/{self.region}/s3/aws4_request"
+        string_to_sign = '\n'.join(['AWS4-HMAC-SHA256', amz_date, scope, hashlib.sha256(canonical_request.encode()).hexdigest()])
+        key = f"AWS4{self.secret_key}".encode()
+        for part in (date, self.region, 's3', 'aws4_request'):
+            key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+        signature = hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+        headers['Authorization'] = (f"AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, "
+                                    f"SignedHeaders={signed_headers}, Signature={signature}")
+        return headers
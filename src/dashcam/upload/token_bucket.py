@@ -0,0 +1,35 @@
+from threading import Lock
+import time
+
+class TokenBucket():
+    '''
+    Shapes upload bandwidth. Senders take tokens (bytes) before each chunk goes out and sleep
+    when the bucket is empty, so every connection together stays under rate bytes per second.
+    A rate of 0 turns shaping off.
+    '''
+    def __init__(self, rate: int, burst: int = None) -> None:
+        self.lock = Lock()
+        self.rate = rate
+        self.burst = burst
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self.waited = 0.0
+
+    def set_rate(self, rate: int) -> None:
+        with self.lock:
+            self.rate = rate
+
+    def consume(self, count: int) -> None:
+        with self.lock:
+            if not self.rate:
+                return
+            now = time.monotonic()
+            # A second's worth by default, enough to keep the link busy without big bursts
+            burst = self.burst or self.rate
+            self.tokens = min(self.tokens + (now - self.updated) * self.rate, burst) - count
+            self.updated = now
+            # Going into debt keeps the sleep outside the lock, the next sender waits for it too
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0
+        if delay:
+            self.waited += delay
+            time.sleep(delay)
@@ -0,0 +1,150 @@
+from dashcam.upload.token_bucket import TokenBucket
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Thread, get_native_id
+import time
+import os
+
+class Uploader():
+    '''
+    Backs finished clips up to an S3 compatible store or a NAS in the background. Clips go up in
+    parts over a few pooled connections, every part is checkpointed in the recording index so an
+    upload survives a power cut, and the whole thing runs at low priority behind a token bucket
+    that drops to streaming_rate while anyone is watching the MJPEG stream. Uploaded clips are
+    the first the storage manager evicts.
+    '''
+    def __init__(self, index, target, settings: dict, is_watched) -> None:
+        self.index = index
+        self.target = target
+        self.settings = settings
+        self.is_watched = is_watched
+        self.throttle = TokenBucket(settings['rate'])
+        self.stop_event = Event()
+        self.is_running = False
+
+        self.uploaded_files = 0
+        self.uploaded_bytes = 0
+        self.failures = 0
+        self.current = None
+        self.last_uploaded = None
+        self.last_error = None
+
+    def start(self):
+        if self.is_running:
+            return {"message": "Already running"}, 400
+        self.stop_event.clear()
+        self.is_running = True
+        Thread(target=self._start, name=type(self).__name__, daemon=True).start()
+        return {"message": "Started uploader"}, 200
+
+    def stop(self):
+        if not self.is_running:
+            return {"message": "Not running"}, 400
+        self.stop_event.set()
+        self.is_running = False
+        return {"message": "Stopped uploader"}, 200
+
+    def get_status(self) -> dict:
+        return dict(self.index.upload_totals(), **{
+            "running": self.is_running,
+            "rate": self.throttle.rate,
+            "throttled_seconds": round(self.throttle.waited, 1),
+            "current": self.current,
+            "session_files": self.uploaded_files,
+            "session_bytes": self.uploaded_bytes,
+            "failures": self.failures,
+            "last_uploaded": self.last_uploaded,
+            "last_error": self.last_error,
+        })
+
+    def _start(self) -> None:
+        # Uploads can wait, recording and streaming can't. The IO scheduler takes its
+        # priority from the nice level too unless told otherwise
+        try:
+            os.setpriority(os.PRIO_PROCESS, get_native_id(), 19)
+        except (AttributeError, OSError):
+            pass
+
+        print("Started Uploader")
+        with ThreadPoolExecutor(self.settings['connections'], thread_name_prefix=type(self).__name__) as pool:
+            self._abort_abandoned()
+            while not self.stop_event.is_set():
+                clips = self.index.pending_uploads(1)
+                if not clips:
+                    self.stop_event.wait(self.settings['check_interval'])
+                    continue
+                try:
+                    self._upload(clips[0], pool)
+                except Exception as e:
+                    if self.stop_event.is_set():
+                        break
+                    if isinstance(e, FileNotFoundError) or getattr(e, 'status', None) == 404:
+                        # The store lost the upload (or the NAS copy went missing), start it again
+                        self.index.forget_upload(clips[0]['name'])
+                    self.failures += 1
+                    self.last_error = f"{clips[0]['name']}: {e}"
+                    print(f"Upload failed, {self.last_error}")
+                    self.stop_event.wait(self.settings['retry_interval'])
+                finally:
+                    self.current = None
+        self.target.close()
+        print("Uploader stopped")
+
+    def _abort_abandoned(self) -> None:
+        # Clips evicted part way through an upload, so the store doesn't keep their parts forever
+        for name, upload_id in self.index.abandoned_uploads():
+            try:
+                self.target.abort(upload_id, name)
+            except Exception as e:
+                print(f"Couldn't abort upload of {name}: {e}")
+            self.index.forget_upload(name)
+
+    def _upload(self, clip: dict, pool) -> None:
+        name = clip['name']
+        path = os.path.join(self.index.directory, name)
+        if not os.path.exists(path):
+            # Deleted from under the index, anything already sent is aborted next time we start
+            self.index.remove(name)
+            return
+        size = os.path.getsize(path)
+        self.current = name
+
+        checkpoint = self.index.get_upload(name)
+        if checkpoint is None:
+            upload_id, part_size, parts = self.target.create(name), self.settings['part_size'], {}
+            self.index.start_upload(name, upload_id, part_size)
+        else:
+            upload_id, part_size, parts = checkpoint
+            print(f"Resuming upload of {name}, {len(parts)} parts already sent")
+
+        numbers = [number for number in range(1, max(-(-size // part_size), 1) + 1) if number not in parts]
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            # Parts go up in order across the pool, results are checkpointed as each one finishes
+            for number, etag in zip(numbers, pool.map(lambda number: self._upload_part(fd, name, upload_id, number, part_size), numbers)):
+                parts[number] = etag
+                self.index.add_upload_part(name, number, etag)
+        finally:
+            os.close(fd)
+
+        self.target.complete(upload_id, name, parts)
+        self.index.set_uploaded(name, time.time())
+        self.uploaded_files += 1
+        self.uploaded_bytes += size
+        self.last_uploaded = name
+        print(f"Uploaded {name} ({size / 1e6:.1f}MB)")
+
+    def _upload_part(self, fd: int, name: str, upload_id: str, number: int, part_size: int) -> str:
+        if self.stop_event.is_set():
+            raise InterruptedError("Uploader stopped")
+        self.throttle.set_rate(self.settings['streaming_rate'] if self.is_watched() else self.settings['rate'])
+        offset = (number - 1) * part_size
+        data = os.pread(fd, part_size, offset)
+        # Clips are read once, keep them from pushing what recording and streaming need out of the page cache
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(fd, offset, len(data), os.POSIX_FADV_DONTNEED)
+        for attempt in range(self.settings['retries'] + 1):
+            try:
+                return self.target.upload_part(upload_id, name, number, offset, data, self.throttle)
+            except OSError:
+                if attempt == self.settings['retries'] or self.stop_event.wait(2 ** attempt):
+                    raise
@@ -3,16 +3,81 @@ Dashcam - Class to manage the dashcam operations, start, stop, etc...
 FileStreamer - Class to manage streaming video to files
 MJPEGStreamer - Class to manage streaming video to MJPEG
 DashcamWebServer - Class to manage the web server for the dashcam, has all of the endpoints
+AsyncDashcamWebServer - The same endpoints served from an asyncio loop, for many concurrent streams and downloads
 StorageManager - Class to manage the storage of the dashcam, deleting old files, etc...
+RecordingIndex - Class to keep track of every clip, its times, size and lock state
+Uploader - Backs finished clips up to S3 (S3Target) or a NAS share (DirectoryTarget) in the background
+Camera - One camera's source, overlay and streamers, CameraScheduler shares the encoder and the card between cameras
+FrameSource - Interface to the camera, implemented by CameraSource (Pi camera) and SyntheticSource (generated frames)
+GpsReader - Reads NMEA (NmeaSerial or NmeaReplay), records a track per clip and indexes where each clip was
+SensorMonitor - Reads the accelerometer (Mpu6050Source or ReplayImuSource) and locks clips when CrashDetector sees an impact
+AudioRecorder - Captures the microphone (AlsaSource or WavSource) and encodes it into the clips alongside the video
+ParkingMonitor - Parking mode, only records once MotionDetector sees motion in the lores stream, reaching back into the pre-event ring
+Config - Loads, validates and saves the settings, changes are applied live, with the next clip or by configuring the camera again
+BootTimer - Times each stage of starting up, logged once the web server is up
 '''
-from dashcam.dashcam import Dashcam
-from dashcam.api.web_server import DashcamWebServer
+from dashcam.boot_timer import BootTimer
 from threading import Thread
+import argparse
 
 if __name__ == "__main__":
-    dashcam = Dashcam()
-    dashcam.start_recording()
+    # Recording comes first after ignition, the web server (and flask or aiohttp) once the first clip is open
+    boot_timer = BootTimer()
+    from dashcam.dashcam import Dashcam
+    boot_timer.mark('imports')
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--synthetic', action='store_true', help="Use generated frames instead of the Pi camera")
+    parser.add_argument('--replay', help="Raw H264 file for the synthetic camera to play back")
+    parser.add_argument('--gps-replay', help="NMEA log to play back instead of the GPS receiver")
+    parser.add_argument('--imu-replay', help="CSV or binary accelerometer trace to use instead of the IMU")
+    parser.add_argument('--audio-replay', help="16-bit WAV file to use instead of the microphone")
+    parser.add_argument('--synthetic-cabin', action='store_true', help="Record generated frames as a cabin camera alongside")
+    parser.add_argument('--parking', action='store_true', help="Start in parking mode, recording only when there is motion")
+    parser.add_argument('--config', default='dashcam.json', help="JSON of settings changed from the defaults, saved to when they are changed")
+    args = parser.parse_args()
+
+    source = None
+    if args.synthetic or args.replay:
+        from dashcam.sources.synthetic_source import SyntheticSource
+        source = SyntheticSource(replay=args.replay)
+
+    imu = None
+    if args.imu_replay:
+        from dashcam.sensors.replay_imu_source import ReplayImuSource
+        imu = ReplayImuSource(args.imu_replay)
+
+    nmea = None
+    if args.gps_replay:
+        from dashcam.gps.nmea_source import NmeaReplay
+        nmea = NmeaReplay(args.gps_replay)
+
+    microphone = None
+    if args.audio_replay:
+        from dashcam.audio.wav_source import WavSource
+        microphone = WavSource(args.audio_replay)
+
+    cameras = None
+    if args.synthetic_cabin:
+        from dashcam.sources.synthetic_source import SyntheticSource
+        cameras = {'cabin': SyntheticSource()}
+
+    dashcam = Dashcam(source, imu, nmea, boot_timer, microphone, cameras, args.config)
+    if args.parking:
+        dashcam.start_parking()
+    else:
+        dashcam.start_recording()
+        if not dashcam.filestreamer.clip_opened.wait(10):
+            print("No clip opened 10s after starting to record")
+        boot_timer.mark('first clip')
     dashcam.start_streaming()
 
-    server = DashcamWebServer(dashcam=dashcam)
-    Thread(target=server.start_server).start()
\ No newline at end of file
+    if dashcam.settings['api']['server'] == 'async':
+        from dashcam.api.async_web_server import AsyncDashcamWebServer
+        server = AsyncDashcamWebServer(dashcam=dashcam)
+    else:
+        from dashcam.api.web_server import DashcamWebServer
+        server = DashcamWebServer(dashcam=dashcam)
+    boot_timer.mark('web server')
+    Thread(target=server.start_server).start()
+    boot_timer.report()
\ No newline at end of file
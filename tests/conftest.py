@@ -0,0 +1,63 @@
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from dashcam.sources.synthetic_source import SyntheticSource
+from dashcam.dashcam import Dashcam
+import pytest
+import json
+import time
+
+# Small frames and nothing running that the test didn't ask for, on top of Dashcam's defaults
+SETTINGS = {
+    'recording': {'resolution': [320, 240], 'bitrate': 1000000, 'pre_event_buffer': 2 * 1024 * 1024},
+    'streaming': {'resolution': [320, 240]},
+    'overlay': {'enabled': False},
+    'quality': {'enabled': False},
+    'storage': {'min_free_bytes': 0},
+}
+
+def merged(settings: dict, changes: dict) -> dict:
+    settings = dict(settings)
+    for key, value in changes.items():
+        settings[key] = merged(settings.get(key, {}), value) if isinstance(value, dict) else value
+    return settings
+
+def wait_for(condition, timeout: float = 10) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
+
+@pytest.fixture
+def make_dashcam(tmp_path, monkeypatch):
+    # Dashcam on a synthetic camera recording into a temporary directory, stopped again after the test
+    monkeypatch.chdir(tmp_path)
+    made = []
+
+    def make(settings: dict = None, source=None, **components):
+        with open('dashcam.json', 'w') as f:
+            json.dump(merged(SETTINGS, settings or {}), f)
+        dashcam = Dashcam(source or SyntheticSource(), config='dashcam.json', **components)
+        made.append(dashcam)
+        return dashcam
+
+    yield make
+    for dashcam in made:
+        if dashcam.parking is not None and dashcam.parking.is_running:
+            dashcam.parking.stop()
+            dashcam.parking.thread.join()
+        for camera in dashcam.cameras.values():
+            for streamer in (camera.filestreamer, camera.mjpegstreamer):
+                streamer.stop()
+                if streamer.thread is not None:
+                    streamer.thread.join()
+        for source in [dashcam.source, *dashcam.sources.values()]:
+            source.stop()
+        dashcam.storagemanager.stop()
+        if dashcam.uploader is not None:
+            dashcam.uploader.stop()
+        if dashcam.quality is not None:
+            dashcam.quality.stop()
@@ -0,0 +1,125 @@
+from dashcam.api.async_web_server import AsyncDashcamWebServer
+from aiohttp.test_utils import TestClient, TestServer
+from dashcam.thumbnails.thumbnailer import THUMBNAIL_EXTENSION
+from dashcam.api.web_server import DashcamWebServer
+import asyncio
+import pytest
+import struct
+import time
+import os
+
+CLIP_BYTES = 2 * 1024 * 1024
+
+def make_clips(count: int) -> dict:
+    # Fake clips in the recordings directory before Dashcam starts, the index is built from them
+    os.makedirs('recordings', exist_ok=True)
+    clips = {}
+    for number in range(count):
+        name = f"dashcam_{time.strftime('%Y%m%d-%H%M%S', time.localtime(time.time() - (count - number) * 180))}.mp4"
+        clips[name] = os.urandom(CLIP_BYTES)
+        with open(os.path.join('recordings', name), 'wb') as f:
+            f.write(clips[name])
+    return clips
+
+def run(dashcam, test) -> None:
+    async def serve():
+        async with TestClient(TestServer(AsyncDashcamWebServer(dashcam).app)) as client:
+            await test(client)
+    asyncio.run(serve())
+
+def test_lists_and_downloads_clips_with_ranges(make_dashcam):
+    clips = make_clips(3)
+    dashcam = make_dashcam()
+    name, data = next(iter(clips.items()))
+
+    async def test(client):
+        response = await client.get('/recordings')
+        assert response.status == 200
+        assert {clip['name'] for clip in (await response.json())['recordings']} == set(clips)
+
+        response = await client.get(f'/recordings/{name}')
+        assert response.status == 200
+        assert response.headers['Accept-Ranges'] == 'bytes'
+        assert await response.read() == data
+
+        # Scrubbing into the middle, and picking a download back up from where it stopped
+        response = await client.get(f'/recordings/{name}', headers={'Range': 'bytes=1000-1999'})
+        assert response.status == 206
+        assert response.headers['Content-Range'] == f'bytes 1000-1999/{CLIP_BYTES}'
+        assert await response.read() == data[1000:2000]
+        response = await client.get(f'/recordings/{name}', headers={'Range': f'bytes={CLIP_BYTES - 4096}-'})
+        assert response.status == 206
+        assert await response.read() == data[-4096:]
+
+        response = await client.get(f'/recordings/{name}', headers={'Range': f'bytes={CLIP_BYTES}-'})
+        assert response.status == 416
+        response = await client.get('/recordings/dashcam_missing.mp4')
+        assert response.status == 404
+    run(dashcam, test)
+
+def test_control_endpoints_answer_during_downloads(make_dashcam):
+    clips = make_clips(2)
+    dashcam = make_dashcam()
+
+    async def test(client):
+        async def download(name: str) -> int:
+            # A phone on a slow link, reading a little at a time
+            response = await client.get(f'/recordings/{name}')
+            received = 0
+            while chunk := await response.content.read(64 * 1024):
+                received += len(chunk)
+                await asyncio.sleep(0.01)
+            return received
+
+        downloads = [asyncio.create_task(download(name)) for name in list(clips) * 10]
+        await asyncio.sleep(0.2)
+        slowest = 0
+        for _ in range(10):
+            started = time.monotonic()
+            response = await client.get('/storage')
+            assert response.status == 200
+            slowest = max(slowest, time.monotonic() - started)
+        assert all(not download.done() for download in downloads)
+        assert slowest < 0.5
+        assert await asyncio.gather(*downloads) == [CLIP_BYTES] * len(downloads)
+    run(dashcam, test)
+
+# Requests with a parameter or body that doesn't parse, and what the Flask server makes of them
+BAD_REQUESTS = [
+    ('get', '/recordings/near?lat=x&lon=1', None, 400),
+    ('get', '/recordings/near?lat=1', None, 400),
+    ('get', '/recordings/near?lat=51.5&lon=-0.1&radius=far&start=soon', None, 200),
+    ('get', '/recordings?start=yesterday&end=now', None, 200),
+    ('get', '/recordings/dashcam_missing.mp4/thumb?index=first', None, 404),
+    ('post', '/save_event', b'{"pre_seconds":', 400),
+    ('post', '/save_event', b'[1, 2]', 400),
+    ('post', '/export', b'"name"', 400),
+    ('post', '/settings', b'{not json', 200),
+]
+
+@pytest.mark.parametrize('method, path, body, status', BAD_REQUESTS)
+def test_bad_input_is_answered_the_same_by_both_servers(make_dashcam, method, path, body, status):
+    dashcam = make_dashcam()
+    flask = getattr(DashcamWebServer(dashcam).app.test_client(), method)(path, data=body, content_type='application/json')
+    assert flask.status_code == status
+
+    async def test(client):
+        response = await getattr(client, method)(path, data=body, headers={'Content-Type': 'application/json'})
+        assert response.status == status
+        assert response.content_type == 'application/json'
+    run(dashcam, test)
+
+@pytest.mark.parametrize('index, status', [(0, 200), (1, 200), (2, 404), (-1, 404)])
+def test_thumbnails_by_index_on_both_servers(make_dashcam, index, status):
+    name = next(iter(make_clips(1)))
+    # Two thumbnails, each a length and then the JPEG
+    with open(os.path.join('recordings', name + THUMBNAIL_EXTENSION), 'wb') as f:
+        for jpeg in (b'\xff\xd8first\xff\xd9', b'\xff\xd8second\xff\xd9'):
+            f.write(struct.pack('>I', len(jpeg)) + jpeg)
+    dashcam = make_dashcam()
+    path = f'/recordings/{name}/thumb?index={index}'
+    assert DashcamWebServer(dashcam).app.test_client().get(path).status_code == status
+
+    async def test(client):
+        assert (await client.get(path)).status == status
+    run(dashcam, test)
@@ -0,0 +1,54 @@
+from dashcam.audio.audio_recorder import AudioRecorder
+from dashcam.audio.wav_source import WavSource
+import pytest
+
+# Dashcam's drift settings, with Opus at a low sample rate so an hour goes through the encoder in seconds
+SAMPLE_RATE = 8000
+PERIOD_FRAMES = 1024
+SETTINGS = {
+    'codec': 'opus', 'bitrate': 16000, 'ring_periods': 16,
+    'drift_tolerance': 0.01, 'drift_step': 0.001, 'drift_window': 50, 'gap': 0.02,
+}
+
+def simulate_drive(hours: float, clock_error_ppm: float, overrun_every: float) -> tuple:
+    # A microphone whose clock runs clock_error_ppm fast, with jittery reads and a period lost every
+    # overrun_every seconds, put through capture, drift correction and the encoder as fast as they go.
+    # Returns the recorder and, at every period, how far the end of the track is from when its last
+    # frame was really captured, leaving out the couple of windows after each overrun
+    source = WavSource(sample_rate=SAMPLE_RATE, period_frames=PERIOD_FRAMES, clock_error_ppm=clock_error_ppm,
+                       jitter=0.005, simulated=True)
+    recorder = AudioRecorder(source, SETTINGS, source.clock)
+    recorder._open_encoder()
+    source.start()
+    periods = int(hours * 3600 * SAMPLE_RATE / PERIOD_FRAMES)
+    overrun_period = int(overrun_every * SAMPLE_RATE / PERIOD_FRAMES)
+    settling = 2 * SETTINGS['drift_window']
+    drifts = []
+    for period in range(periods):
+        if period % overrun_period == overrun_period - 1:
+            # Lost before we got to it, like an ALSA overrun
+            source.read()
+            continue
+        recorder._capture_period()
+        recorder._encode_period(timeout=0)
+        if period >= settling and period % overrun_period >= settling:
+            clock = recorder.audio_clock
+            drifts.append((clock.time_of(clock.frames) - source.captured_time(source.frames)) / 1000000)
+    return recorder, drifts
+
+@pytest.mark.parametrize('clock_error_ppm', [100, -100])
+def test_no_drift_over_an_hour(clock_error_ppm):
+    recorder, drifts = simulate_drive(1, clock_error_ppm, overrun_every=300)
+    clock = recorder.audio_clock
+
+    # Uncorrected, 100ppm is 360ms out by the end of the hour
+    assert recorder.source.frames / SAMPLE_RATE >= 3599
+    bound = SETTINGS['drift_tolerance'] + 2 * SETTINGS['drift_step']
+    assert max(map(abs, drifts)) <= bound
+    assert abs(drifts[-1]) <= bound
+    # Every overrun but the one that ends the run was lined straight back up
+    assert clock.gaps == 11
+    # A fast microphone has frames skipped, a slow one has them repeated
+    assert clock.skipped if clock_error_ppm > 0 else clock.inserted > 11 * PERIOD_FRAMES
+    # Everything placed on the track went through the encoder
+    assert recorder.encoded_frames + recorder.staged == clock.frames
@@ -0,0 +1,90 @@
+from dashcam.sources.synthetic_source import SyntheticSource
+from dashcam.cameras.camera_scheduler import macroblocks
+from conftest import wait_for
+import pytest
+import json
+import time
+
+# Two 320x240 cameras at 30fps and 1Mbps each, with room on the encoder and the card for about half of that
+BUDGET = {
+    'scheduler': {'weight': 1.0, 'encoder_budget': 9000, 'write_budget': 150000, 'min_fps': 5},
+    'cameras': {'rear': {'weight': 0.5, 'recording': {'resolution': [320, 240], 'fps': 30, 'bitrate': 1000000}}},
+}
+
+def test_shares_respect_the_budget_and_weights(make_dashcam):
+    dashcam = make_dashcam(BUDGET, cameras={'rear': SyntheticSource()})
+    assert list(dashcam.cameras) == ['front', 'rear']
+    status = dashcam.get_cameras_status()[0]
+    allocation = {name: (camera['fps'], camera['bitrate']) for name, camera in status['cameras'].items()}
+
+    # Over both budgets the main camera gets twice the rear's share of each
+    blocks = macroblocks((320, 240))
+    assert sum(fps for fps, _ in allocation.values()) * blocks <= 9000
+    assert sum(bitrate for _, bitrate in allocation.values()) / 8 <= 150000
+    assert allocation['front'] == (20, 800000)
+    assert allocation['rear'] == (10, 400000)
+    for name, camera in dashcam.cameras.items():
+        assert camera.filestreamer.settings['fps'] == allocation[name][0]
+        assert camera.filestreamer.settings['bitrate'] == allocation[name][1]
+
+    # Recorded at those rates, side by side in one index
+    dashcam.start_recording()
+    assert wait_for(lambda: all(camera.filestreamer.clip_start is not None for camera in dashcam.cameras.values()))
+    time.sleep(3)
+    dashcam.stop_recording()
+    for camera in dashcam.cameras.values():
+        camera.filestreamer.thread.join()
+    clips = {clip['camera']: clip for clip in dashcam.index.list()}
+    assert set(clips) == {'front', 'rear'}
+    assert abs(clips['front']['start_time'] - clips['rear']['start_time']) < 1.5
+    assert clips['rear']['size'] < clips['front']['size']
+
+def test_within_budget_every_camera_gets_what_it_asked_for(make_dashcam):
+    settings = dict(BUDGET, scheduler=dict(BUDGET['scheduler'], encoder_budget=245760, write_budget=4 * 1024 * 1024))
+    dashcam = make_dashcam(settings, cameras={'rear': SyntheticSource()})
+    cameras = dashcam.get_cameras_status()[0]['cameras']
+    assert {name: (camera['fps'], camera['bitrate']) for name, camera in cameras.items()} == {'front': (30, 1000000), 'rear': (30, 1000000)}
+
+def test_cameras_by_any_name(make_dashcam):
+    # A camera given a source without settings of its own starts from the defaults' first camera
+    dashcam = make_dashcam(cameras={'side': SyntheticSource()})
+    assert dashcam.scheduler.cameras['side'][0] == dashcam.config.defaults['cameras']['cabin']['weight']
+
+    # Settings for a new camera fill in whatever they leave out, and keep what was set before
+    assert dashcam.update_settings({'cameras': {'rear': {'camera_num': 2}}})[1] == 200
+    assert dashcam.update_settings({'cameras': {'rear': {'weight': 2.0}}})[1] == 200
+    rear = dashcam.config.values['cameras']['rear']
+    assert (rear['camera_num'], rear['weight']) == (2, 2.0)
+    assert rear['recording'] == dashcam.config.defaults['cameras']['cabin']['recording']
+    with open('dashcam.json') as f:
+        assert json.load(f)['cameras']['rear']['weight'] == 2.0
+
+@pytest.mark.parametrize('changes', [
+    {'cameras': {'rear': {'lens': 'wide'}}},
+    {'cameras': {'rear': {'recording': {'fps': 'fast'}}}},
+    {'cameras': {'rear': 'on'}},
+    {'cameras': {'rear': {'weight': 0}}},
+])
+def test_camera_settings_are_checked(make_dashcam, changes):
+    dashcam = make_dashcam()
+    message, status = dashcam.update_settings(changes)
+    assert status == 400
+    assert 'cameras.rear' in message['message']
+    assert 'rear' not in dashcam.config.values['cameras']
+
+def test_main_weight_has_to_be_positive(make_dashcam):
+    dashcam = make_dashcam()
+    message, status = dashcam.update_settings({'scheduler': {'weight': 0.0}})
+    assert status == 400
+    assert message['message'].startswith('scheduler.weight')
+
+def test_new_resolution_is_shared_out(make_dashcam):
+    dashcam = make_dashcam(BUDGET, cameras={'rear': SyntheticSource()})
+    assert dashcam.update_settings({'recording': {'resolution': [640, 480]}})[1] == 200
+    assert dashcam.scheduler.cameras['front'][2]['resolution'] == (640, 480)
+
+    # Four times the macroblocks in each frame on the same share of the encoder
+    cameras = dashcam.get_cameras_status()[0]['cameras']
+    assert {name: camera['fps'] for name, camera in cameras.items()} == {'front': 5, 'rear': 10}
+    assert dashcam.filestreamer.settings['resolution'] == (640, 480)
+    assert dashcam.filestreamer.settings['fps'] == 5
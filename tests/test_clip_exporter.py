@@ -0,0 +1,120 @@
+from dashcam.export.clip_exporter import ClipExporter, select_fragments
+from dashcam.outputs.fragment_index import read_fragment_index, child_boxes
+from dashcam.sources.synthetic_h264 import synthetic_frames
+from dashcam.outputs.mp4_output import Mp4Output, TIMESCALE
+import pytest
+import struct
+import os
+
+FPS = 10
+# A one second GOP in each fragment, with AAC at 16kHz alongside
+AUDIO = {'codec': 'aac', 'sample_rate': 16000, 'channels': 1, 'frame_size': 1024, 'bitrate': 32000, 'extradata': b'\x14\x08'}
+
+def record_clip(directory: str, name: str, seconds: int) -> None:
+    output = Mp4Output(os.path.join(directory, name), (320, 240), FPS, 1, AUDIO)
+    output.start()
+    frames = synthetic_frames(320, 240, FPS, 1000000, FPS)
+    audio_time = 0
+    for number in range(seconds * FPS):
+        frame, keyframe = next(frames)
+        timestamp = number * 1000000 // FPS
+        output.outputframe(frame, keyframe, timestamp)
+        # Audio a little ahead of the video, the way it arrives once its encoder is going
+        while audio_time <= timestamp + 200000:
+            output.outputframe(b'\x21' * 64, True, audio_time, None, True)
+            audio_time += AUDIO['frame_size'] * 1000000 // AUDIO['sample_rate']
+    output.stop()
+
+def read_export(path: str) -> list:
+    # (sequence number, {track id: decode time}) for each fragment
+    with open(path, 'rb') as f:
+        data = f.read()
+    fragments = []
+    for kind, position, size in child_boxes(data, 0, len(data)):
+        if kind != b'moof':
+            continue
+        sequence, times = None, {}
+        for kind, child, child_size in child_boxes(data, position + 8, position + size):
+            if kind == b'mfhd':
+                sequence = struct.unpack_from('>I', data, child + 12)[0]
+            elif kind == b'traf':
+                track_id = None
+                for kind, box, _ in child_boxes(data, child + 8, child + child_size):
+                    if kind == b'tfhd':
+                        track_id = struct.unpack_from('>I', data, box + 12)[0]
+                    elif kind == b'tfdt':
+                        times[track_id] = struct.unpack_from('>Q' if data[box + 8] == 1 else '>I', data, box + 12)[0]
+        fragments.append((sequence, times))
+    return fragments
+
+def make_exporter(tmp_path, clips: dict) -> ClipExporter:
+    exporter = ClipExporter(str(tmp_path / 'recordings'), str(tmp_path / 'exports'), 3)
+    os.makedirs(exporter.directory)
+    for name, seconds in clips.items():
+        record_clip(exporter.directory, name, seconds)
+    return exporter
+
+def assert_continuous(path: str, fragments: int) -> None:
+    read = read_export(path)
+    assert [sequence for sequence, _ in read] == list(range(1, fragments + 1))
+    for number, (_, times) in enumerate(read):
+        # Every GOP a second after the one before, the audio alongside it to within one of its frames
+        assert times[1] == number * TIMESCALE
+        assert abs(times[2] - number * AUDIO['sample_rate']) < AUDIO['frame_size']
+
+def make_export(directory: str, name: str, modified: float) -> None:
+    path = os.path.join(directory, name)
+    with open(path, 'wb') as f:
+        f.write(b'export')
+    os.utime(path, (modified, modified))
+
+def test_prune_keeps_the_newest_exports(tmp_path):
+    exporter = ClipExporter(str(tmp_path / 'recordings'), str(tmp_path / 'exports'), 3)
+    directory = exporter.export_directory
+    # Made in this order, the second and third in the same second as the first, and the clock set back before the last
+    made = ['export_20260101-120000.mp4', 'export_20260101-120000-2.mp4', 'export_20260101-120000-3.mp4',
+            'export_20260101-120005.mp4', 'export_20251231-090000.mp4']
+    for number, name in enumerate(made):
+        make_export(directory, name, 1767268800 + [0, 0, 0, 5, 6][number])
+    exporter._prune()
+
+    assert sorted(os.listdir(directory)) == sorted(made[2:])
+
+def test_prune_orders_by_copy_within_a_second(tmp_path):
+    exporter = ClipExporter(str(tmp_path / 'recordings'), str(tmp_path / 'exports'), 1)
+    directory = exporter.export_directory
+    for name in ('export_20260101-120000-10.mp4', 'export_20260101-120000-2.mp4', 'export_20260101-120000.mp4'):
+        make_export(directory, name, 1767268800)
+    exporter._prune()
+
+    assert os.listdir(directory) == ['export_20260101-120000-10.mp4']
+
+def test_trim_widens_to_the_keyframes_around_it(tmp_path):
+    exporter = make_exporter(tmp_path, {'dashcam_20260101-120000.mp4': 6})
+    result = exporter.export([('dashcam_20260101-120000.mp4', 2.5, 4.2)])
+
+    # 2s to 5s, from the keyframe before the start to the end of the GOP holding the end
+    assert (result['fragments'], result['duration']) == (3, 3.0)
+    assert_continuous(os.path.join(exporter.export_directory, result['file']), 3)
+
+def test_join_runs_on_from_one_clip_into_the_next(tmp_path):
+    exporter = make_exporter(tmp_path, {'dashcam_20260101-120000.mp4': 3, 'dashcam_20260101-120003.mp4': 3})
+    result = exporter.export([('dashcam_20260101-120000.mp4', 1, float('inf')), ('dashcam_20260101-120003.mp4', 0, 1.5)])
+
+    assert (result['fragments'], result['duration']) == (4, 4.0)
+    path = os.path.join(exporter.export_directory, result['file'])
+    assert_continuous(path, 4)
+    # The recorded fragments copied whole, only their headers rewritten
+    clip = os.path.join(exporter.directory, 'dashcam_20260101-120000.mp4')
+    init_size, entries = read_fragment_index(clip)
+    assert os.path.getsize(path) == init_size + sum(size for *_, size in entries[1:]) + \
+        sum(size for *_, size in read_fragment_index(os.path.join(exporter.directory, 'dashcam_20260101-120003.mp4'))[1][:2])
+
+def test_range_past_the_end_exports_nothing(tmp_path):
+    exporter = make_exporter(tmp_path, {'dashcam_20260101-120000.mp4': 3})
+    entries = read_fragment_index(os.path.join(exporter.directory, 'dashcam_20260101-120000.mp4'))[1]
+    assert select_fragments(entries, 3 * TIMESCALE, 10 * TIMESCALE) == []
+    assert select_fragments(entries, 2.5 * TIMESCALE, 10 * TIMESCALE) == entries[2:]
+    with pytest.raises(ValueError):
+        exporter.export([('dashcam_20260101-120000.mp4', 5, 10)])
+    assert os.listdir(exporter.export_directory) == []
@@ -0,0 +1,137 @@
+from dashcam.outputs.fragment_index import read_fragment_index, scan_fragments, parse_moof, HEADER, ENTRY, INDEX_EXTENSION
+from dashcam.storage.recording_index import RecordingIndex
+from dashcam.sources.synthetic_h264 import synthetic_frames
+from dashcam.outputs.mp4_output import Mp4Output
+from conftest import wait_for
+import random
+import struct
+import time
+import os
+
+FPS = 10
+
+def write_clip(path: str, seconds: int) -> list:
+    # A whole clip with a fragment a second, returns (end offset, frames) of each fragment
+    output = Mp4Output(path, (320, 240), FPS, 1)
+    output.start()
+    frames = synthetic_frames(320, 240, FPS, 1000000, FPS)
+    for number in range(seconds * FPS):
+        frame, keyframe = next(frames)
+        output.outputframe(frame, keyframe, number * 1000000 // FPS)
+    output.stop()
+    fragments = []
+    with open(path, 'rb') as f:
+        for _, _, offset, size in scan_fragments(path)[1]:
+            moof_size = struct.unpack('>I', os.pread(f.fileno(), 4, offset))[0]
+            fragments.append((offset + size, parse_moof(os.pread(f.fileno(), moof_size, offset))[2]))
+    return fragments
+
+def leave_open(names: list) -> None:
+    # In the index as opened and never closed, the way a power cut leaves them
+    index = RecordingIndex('recordings')
+    for number, name in enumerate(names):
+        index.open_clip(name, time.time() - (len(names) - number) * 60)
+    index.close()
+
+def is_whole(path: str) -> bool:
+    fragments = scan_fragments(path)[1]
+    return fragments[-1][2] + fragments[-1][3] == os.path.getsize(path) and read_fragment_index(path)[1] == fragments
+
+def test_truncated_clips_keep_every_complete_fragment(make_dashcam):
+    os.makedirs('recordings')
+    generator = random.Random(1)
+    expected = {}
+    for number in range(6):
+        name = f"dashcam_20260101-{number:06d}.mp4"
+        path = os.path.join('recordings', name)
+        fragments = write_clip(path, 5)
+        # The first cut off before its first fragment made it to disk, the rest somewhere after
+        cut = generator.randrange(0, fragments[0][0]) if number == 0 else generator.randrange(fragments[0][0], fragments[-1][0])
+        os.truncate(path, cut)
+        expected[name] = sum(frames for end, frames in fragments if end <= cut)
+    leave_open(list(expected))
+
+    dashcam = make_dashcam()
+    assert wait_for(lambda: not dashcam.recovery.is_running)
+    status = dashcam.recovery.get_status()
+
+    assert status['clips'] == 6
+    assert status['removed_clips'] == 1
+    assert status['recovered_clips'] == 5
+    # Everything that was completely on disk comes back, nothing more
+    assert status['recovered_frames'] == sum(expected.values())
+    assert not os.path.exists(os.path.join('recordings', 'dashcam_20260101-000000.mp4'))
+    for name in list(expected)[1:]:
+        path = os.path.join('recordings', name)
+        assert is_whole(path)
+        clip = dashcam.index.get(name)
+        assert clip['end_time'] is not None
+        assert clip['size'] == os.path.getsize(path)
+
+def test_corrupted_fragment_ends_the_clip(make_dashcam):
+    os.makedirs('recordings')
+    path = os.path.join('recordings', 'dashcam_20260101-000000.mp4')
+    fragments = write_clip(path, 5)
+    # A sector of garbage over the header of the fourth fragment
+    with open(path, 'r+b') as f:
+        f.seek(fragments[2][0])
+        f.write(b'\xff' * 512)
+    leave_open([os.path.basename(path)])
+
+    dashcam = make_dashcam()
+    assert wait_for(lambda: not dashcam.recovery.is_running)
+    status = dashcam.recovery.get_status()
+
+    assert status['recovered_frames'] == sum(frames for _, frames in fragments[:3])
+    assert os.path.getsize(path) == fragments[2][0]
+    assert status['truncated_bytes'] == fragments[-1][0] - fragments[2][0]
+    assert is_whole(path)
+
+def test_torn_clip_stops_at_the_last_synced_fragment(make_dashcam):
+    os.makedirs('recordings')
+    path = os.path.join('recordings', 'dashcam_20260101-000000.mp4')
+    fragments = write_clip(path, 5)
+    # Synced up to the end of the second fragment, then 64KB of the third made it to the card before
+    # the power went. The filesystem had already moved the end of the file, the rest reads as zeros
+    torn = fragments[1][0] + 64 * 1024
+    assert torn < fragments[2][0]
+    with open(path, 'r+b') as f:
+        f.seek(torn)
+        f.write(bytes(os.path.getsize(path) - torn))
+    with open(path + INDEX_EXTENSION, 'r+b') as f:
+        f.truncate(HEADER.size + 2 * ENTRY.size)
+    leave_open([os.path.basename(path)])
+
+    dashcam = make_dashcam()
+    assert wait_for(lambda: not dashcam.recovery.is_running)
+    status = dashcam.recovery.get_status()
+
+    assert status['recovered_frames'] == sum(frames for _, frames in fragments[:2])
+    assert os.path.getsize(path) == fragments[1][0]
+    assert is_whole(path)
+
+def test_recording_starts_without_waiting_for_recovery(make_dashcam, monkeypatch):
+    os.makedirs('recordings')
+    names = []
+    for number in range(3):
+        names.append(f"dashcam_20260101-{number:06d}.mp4")
+        path = os.path.join('recordings', names[-1])
+        fragments = write_clip(path, 3)
+        os.truncate(path, fragments[-1][0] - 100)
+    leave_open(names)
+
+    # Recovery on a slow card
+    from dashcam.storage import clip_recovery
+    recover_clip = clip_recovery.recover_clip
+    monkeypatch.setattr(clip_recovery, 'recover_clip', lambda path: time.sleep(1) or recover_clip(path))
+
+    started = time.perf_counter()
+    dashcam = make_dashcam()
+    dashcam.start_recording()
+    assert wait_for(lambda: dashcam.filestreamer.clip_start is not None)
+    first_clip = time.perf_counter() - started
+
+    assert dashcam.recovery.is_running
+    assert first_clip < 2
+    assert wait_for(lambda: not dashcam.recovery.is_running)
+    assert dashcam.recovery.get_status()['recovered_clips'] == 3
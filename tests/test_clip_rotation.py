@@ -0,0 +1,117 @@
+from dashcam.outputs.clip_output import ClipOutput
+from threading import Event, Thread
+import time
+
+class CountingOutput():
+    # Stands in for a clip file, keeps the number of every frame it was given
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.frames = []
+        self.keyframes = []
+        self.stopped = False
+
+    def start(self) -> None:
+        pass
+
+    def stop(self) -> None:
+        self.stopped = True
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, packet=None, audio=False):
+        self.frames.append(frame)
+        self.keyframes.append(keyframe)
+
+class FakeEncoder():
+    # Numbered frames as fast as they can go, a keyframe every gop of them, like an H264 encoder that never restarts
+    def __init__(self, output, frames: int, gop: int) -> None:
+        self.output = output
+        self.frames = frames
+        self.gop = gop
+        self.produced = 0
+        self.done = Event()
+
+    def run(self) -> None:
+        self.output.start()
+        for number in range(self.frames):
+            self.output.outputframe(number, number % self.gop == 0, number * 33333)
+            self.produced += 1
+            if number % 50 == 0:
+                time.sleep(0.001)
+        self.done.set()
+
+def test_clips_add_up_to_every_frame():
+    clips = []
+
+    def create(path: str):
+        clips.append(CountingOutput(path))
+        return clips[-1]
+
+    output = ClipOutput(create)
+    # Opened part way into a GOP, so what comes before the next keyframe has nowhere to go
+    encoder = FakeEncoder(output, 3000, 30)
+    output.split('clip_0')
+    thread = Thread(target=encoder.run)
+    thread.start()
+    closed = []
+    while not encoder.done.is_set():
+        time.sleep(0.002)
+        output.split(f"clip_{len(clips)}")
+        # Rotating the way FileStreamer does, the finished clip is handed back once the next has its keyframe
+        retired = output.wait_for_split(timeout=5)
+        if retired is not None:
+            retired[0].stop()
+            closed.append(retired)
+    thread.join()
+    output.stop()
+    if output.final is not None:
+        closed.append(output.final)
+
+    written = [frame for clip in clips for frame in clip.frames]
+    assert encoder.produced == output.frames_received == 3000
+    assert output.frames_written + output.frames_dropped == encoder.produced
+    assert len(written) == output.frames_written
+    # Every frame after the first keyframe is in exactly one clip, in order, with nothing lost between clips
+    assert written == list(range(output.frames_dropped, encoder.produced))
+    assert sum(frames for _, frames in closed) == output.frames_written
+    used = [clip for clip in clips if clip.frames]
+    assert len(used) > 2
+    for clip in used:
+        assert clip.keyframes[0]
+        assert clip.stopped or clip is clips[-1]
+
+def test_recorded_clips_hold_every_encoded_frame(make_dashcam):
+    dashcam = make_dashcam()
+    filestreamer = dashcam.filestreamer
+    outputs = []
+    create = filestreamer.output.output_factory
+
+    def counted(path: str):
+        outputs.append(create(path))
+        return outputs[-1]
+
+    filestreamer.output.output_factory = counted
+    filestreamer.clip_duration = 2
+    dashcam.start_recording()
+    time.sleep(8.5)
+    dashcam.stop_recording()
+    filestreamer.thread.join()
+
+    clip_output = filestreamer.output
+    assert filestreamer.encoder.frames_encoded == clip_output.frames_received
+    assert clip_output.frames_written + clip_output.frames_dropped == clip_output.frames_received
+    assert sum(output.frame_count for output in outputs) == clip_output.frames_written
+
+def test_clip_lengths_do_not_drift(make_dashcam):
+    # Keyframes come a second apart, each split waits for one. Timed from the keyframe rather than
+    # from when the split was due, every clip would come out a second long
+    dashcam = make_dashcam()
+    filestreamer = dashcam.filestreamer
+    filestreamer.clip_duration = 2
+    dashcam.start_recording()
+    time.sleep(9.5)
+    dashcam.stop_recording()
+    filestreamer.thread.join()
+
+    clips = sorted(dashcam.index.list(), key=lambda clip: clip['start_time'])[:-1]
+    assert len(clips) >= 3
+    # A split can be late by up to a GOP, but that doesn't carry on to the next
+    assert sum(clip['duration'] for clip in clips) <= len(clips) * filestreamer.clip_duration + 1.2
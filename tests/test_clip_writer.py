@@ -0,0 +1,86 @@
+from dashcam.outputs.fragment_index import read_fragment_index, scan_fragments
+from dashcam.outputs.clip_writer import ClipWriter, BufferPool
+from threading import Event
+from conftest import wait_for
+import errno
+import time
+import os
+
+BLOCK = 64 * 1024
+
+def test_preallocating_leaves_the_length_alone(tmp_path):
+    path = str(tmp_path / 'clip.mp4')
+    writer = ClipWriter(path, BufferPool(4, BLOCK), 64 * BLOCK)
+    # Allocated where the filesystem can, and either way a power cut leaves no zeros past what was written
+    assert os.path.getsize(path) == 0
+    writer.write(b'\x01' * (3 * BLOCK + 100))
+    synced = Event()
+    writer.sync(callback=synced.set)
+    assert synced.wait(5)
+    assert os.path.getsize(path) == 3 * BLOCK + 100
+    writer.close()
+
+    assert os.path.getsize(path) == 3 * BLOCK + 100
+    # What wasn't used is given back
+    assert os.stat(path).st_blocks * 512 < 8 * BLOCK
+    with open(path, 'rb') as f:
+        assert f.read() == b'\x01' * (3 * BLOCK + 100)
+
+def test_nothing_is_written_without_fallocate(tmp_path, monkeypatch):
+    monkeypatch.setattr('dashcam.outputs.clip_writer._fallocate', None)
+    path = str(tmp_path / 'clip.mp4')
+    writer = ClipWriter(path, BufferPool(4, BLOCK), 64 * BLOCK)
+    assert not writer.preallocated
+    assert os.path.getsize(path) == 0
+    assert os.stat(path).st_blocks == 0
+    writer.write(b'\x01' * 100)
+    writer.close()
+    assert os.path.getsize(path) == 100
+
+def test_a_failing_card_ends_the_clip_not_the_recording(make_dashcam):
+    dashcam = make_dashcam()
+    filestreamer = dashcam.filestreamer
+    failing = Event()
+    create = filestreamer.output.output_factory
+
+    def create_failing(path: str):
+        output = create(path)
+        start = output.start
+
+        def start_failing() -> None:
+            start()
+            write = output.file._write
+
+            def failing_write(buffer, offset, length) -> None:
+                if failing.is_set():
+                    raise OSError(errno.EIO, 'Input/output error')
+                write(buffer, offset, length)
+            output.file._write = failing_write
+        output.start = start_failing
+        return output
+    filestreamer.output.output_factory = create_failing
+
+    dashcam.start_recording()
+    assert wait_for(lambda: filestreamer.clip_start is not None)
+    first = filestreamer.clip_name
+    path = os.path.join('recordings', first)
+    assert wait_for(lambda: read_fragment_index(path) is not None and len(read_fragment_index(path)[1]) >= 2)
+    failing.set()
+    time.sleep(1.5)
+    failing.clear()
+    filestreamer.rotate_event.set()
+    assert wait_for(lambda: filestreamer.clip_name != first and dashcam.index.get(first)['end_time'] is not None)
+
+    # Cut back to the fragments synced before the card failed, and the next clip is recording
+    assert filestreamer.is_streaming
+    assert filestreamer.write_errors.value == 1
+    fragments = scan_fragments(path)[1]
+    assert fragments == read_fragment_index(path)[1]
+    assert dashcam.index.get(first)['size'] == os.path.getsize(path) == fragments[-1][2] + fragments[-1][3]
+    second = filestreamer.clip_name
+    time.sleep(1.5)
+    dashcam.stop_recording()
+    filestreamer.thread.join()
+    assert not filestreamer.is_streaming
+    assert dashcam.index.get(second)['size'] == os.path.getsize(os.path.join('recordings', second))
+    assert filestreamer.write_errors.value == 1
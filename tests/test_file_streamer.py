@@ -0,0 +1,30 @@
+from conftest import wait_for
+import time
+import os
+
+def test_clips_in_the_same_second_keep_their_own_names(make_dashcam, monkeypatch):
+    dashcam = make_dashcam()
+    filestreamer = dashcam.filestreamer
+    dashcam.start_recording()
+    assert wait_for(lambda: filestreamer.clip_start is not None)
+    time.sleep(1.5)
+
+    # Everything from here on is named in the same second
+    monkeypatch.setattr('dashcam.streamers.file_streamer.time.strftime', lambda format: '20260101-120000')
+    events = [filestreamer.save_event(1, 1)[0]['file'] for _ in range(2)]
+    assert events == ['event_20260101-120000.mp4', 'event_20260101-120000-2.mp4']
+    first = filestreamer.clip_name
+    filestreamer.rotate_event.set()
+    assert wait_for(lambda: filestreamer.clip_name != first)
+    filestreamer.rotate_event.set()
+    assert wait_for(lambda: filestreamer.clip_name == 'dashcam_20260101-120000-2.mp4')
+    assert wait_for(lambda: all(dashcam.index.get(name)['end_time'] is not None for name in events))
+    dashcam.stop_recording()
+    filestreamer.thread.join()
+
+    # Every clip whole under its own name, and the index adds up
+    clips = dashcam.index.list()
+    assert {'dashcam_20260101-120000.mp4', 'dashcam_20260101-120000-2.mp4', *events} <= {clip['name'] for clip in clips}
+    for clip in clips:
+        assert clip['size'] == os.path.getsize(os.path.join('recordings', clip['name'])) > 0
+    assert dashcam.index.total_size == sum(clip['size'] for clip in clips)
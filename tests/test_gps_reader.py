@@ -0,0 +1,81 @@
+from dashcam.storage.recording_index import RecordingIndex
+from dashcam.gps.gps_track import read_track
+from dashcam.gps.gps_reader import GpsReader
+from types import SimpleNamespace
+from threading import Event
+from conftest import wait_for
+import os
+
+def sentence(body: str) -> bytes:
+    checksum = 0
+    for character in body.encode():
+        checksum ^= character
+    return f"${body}*{checksum:02X}\r\n".encode()
+
+FIX = sentence("GPRMC,120000.00,A,5130.0000,N,00007.2000,W,20.0,90.0,010126,,,A")
+# Active, with the position left blank, which some receivers send while they are still settling
+BLANK = sentence("GPRMC,120001.00,A,,,,,,,010126,,,N")
+SATELLITES = sentence("GPGGA,120002.00,5130.0000,N,00007.2000,W,1,,0.9,,M,47.0,M,,")
+
+class FlakyReceiver():
+    '''
+    Hands out a script of lines, where an OSError in the script is raised and b'' is the device
+    hanging up, then the fix on repeat. Reopening fails the first failing_reopens times.
+    '''
+    def __init__(self, script: list, failing_reopens: int = 0) -> None:
+        self.script = list(script)
+        self.failing_reopens = failing_reopens
+        self.reopened = 0
+        self.closed = Event()
+
+    def readline(self) -> bytes:
+        if self.closed.wait(0.005):
+            return b''
+        line = self.script.pop(0) if self.script else FIX
+        if isinstance(line, OSError):
+            raise line
+        return line
+
+    def reopen(self) -> bool:
+        if self.failing_reopens:
+            self.failing_reopens -= 1
+            raise OSError(2, 'No such file or directory')
+        self.reopened += 1
+        return True
+
+    def close(self) -> None:
+        self.closed.set()
+
+def make_reader(tmp_path, receiver) -> GpsReader:
+    index = RecordingIndex(str(tmp_path))
+    overlay = SimpleNamespace(set_speed=lambda speed: None, set_coordinates=lambda latitude, longitude: None)
+    index.open_clip('dashcam_20260101-120000.mp4', 0)
+    reader = GpsReader(receiver, index, overlay, {'index_interval': 30})
+    reader.set_clip(os.path.join(str(tmp_path), 'dashcam_20260101-120000.mp4'))
+    return reader
+
+def test_blank_fields_are_skipped(tmp_path):
+    reader = make_reader(tmp_path, FlakyReceiver([FIX, BLANK, SATELLITES, FIX]))
+    reader.start()
+    try:
+        assert wait_for(lambda: reader.fixes >= 3)
+    finally:
+        reader.stop()
+    assert reader.bad_sentences == 1
+    assert reader.is_running is False
+    track = read_track(os.path.join(str(tmp_path), 'dashcam_20260101-120000.mp4'))
+    assert len(track) == reader.fixes
+    assert abs(track['latitude'][0] / 1e7 - 51.5) < 1e-6
+
+def test_reopens_the_port_when_the_receiver_goes_away(tmp_path, monkeypatch):
+    monkeypatch.setattr('dashcam.gps.gps_reader.REOPEN_INTERVAL', 0.02)
+    # An I/O error, then unplugged for two tries at reopening it, then a hang up
+    receiver = FlakyReceiver([FIX, OSError(5, 'Input/output error'), FIX, b'', FIX], failing_reopens=2)
+    reader = make_reader(tmp_path, receiver)
+    reader.start()
+    try:
+        assert wait_for(lambda: receiver.reopened == 2 and reader.fixes >= 5)
+    finally:
+        reader.stop()
+    assert reader.reopens == 4
+    assert reader.bad_sentences == 0
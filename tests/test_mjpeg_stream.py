@@ -0,0 +1,104 @@
+from dashcam.api.web_server import DashcamWebServer, SERVER_OPTIONS, listen
+from waitress.server import create_server
+from threading import Event, Thread
+import http.client
+import socket
+import time
+
+class Viewer():
+    # Reads /stream.mjpg over its own connection, pausing after each frame to be a slow one
+    def __init__(self, port: int, pause: float = 0) -> None:
+        self.port = int(port)
+        self.pause = pause
+        self.frames = 0
+        self.bad = 0
+        self.stop_event = Event()
+        self.started = time.monotonic()
+        self.seconds = None
+        self.thread = Thread(target=self._read, daemon=True)
+        self.thread.start()
+
+    def _read(self) -> None:
+        connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=5)
+        # A phone on wifi rather than loopback, which would buffer megabytes in the kernel
+        connection.sock = socket.socket()
+        connection.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 64 * 1024)
+        connection.sock.settimeout(5)
+        connection.sock.connect(('127.0.0.1', self.port))
+        connection.request('GET', '/stream.mjpg')
+        response = connection.getresponse()
+        assert response.status == 200
+        while not self.stop_event.is_set():
+            headers = {}
+            line = response.readline()
+            while line.strip() in (b'', b'--FRAME'):
+                line = response.readline()
+            while line.strip():
+                name, value = line.decode().split(':', 1)
+                headers[name.lower()] = value.strip()
+                line = response.readline()
+            frame = response.read(int(headers['content-length']))
+            if not frame.startswith(b'\xff\xd8'):
+                self.bad += 1
+            self.frames += 1
+            if self.pause:
+                time.sleep(self.pause)
+        connection.close()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        self.thread.join()
+        self.seconds = time.monotonic() - self.started
+
+def serve(dashcam):
+    server = create_server(DashcamWebServer(dashcam).app, sockets=[listen('127.0.0.1', 0)], **SERVER_OPTIONS)
+    Thread(target=server.run, daemon=True).start()
+    return server
+
+def watch(dashcam, port: int, viewers: int, seconds: float, pause: float = 0) -> tuple:
+    # JPEGs encoded a second while that many viewers were watching, and the viewers
+    encoder = dashcam.mjpegstreamer.encoder
+    watching = [Viewer(port, pause) for _ in range(viewers)]
+    time.sleep(0.5)
+    encoded, started = encoder.frames_encoded, time.monotonic()
+    time.sleep(seconds)
+    rate = (encoder.frames_encoded - encoded) / (time.monotonic() - started)
+    for viewer in watching:
+        viewer.stop()
+    return rate, watching
+
+def test_one_encode_for_any_number_of_viewers(make_dashcam):
+    dashcam = make_dashcam()
+    dashcam.start_streaming()
+    server = serve(dashcam)
+    port = server.effective_port
+    try:
+        one, _ = watch(dashcam, port, 1, 2)
+        ten, viewers = watch(dashcam, port, 10, 2)
+    finally:
+        server.close()
+
+    fps = dashcam.source.fps
+    # The encoder runs at the camera's rate whoever is watching, never once per viewer
+    assert 0.8 * fps <= one <= 1.1 * fps
+    assert abs(ten - one) <= 0.15 * one
+    for viewer in viewers:
+        assert viewer.frames > 0
+        assert viewer.bad == 0
+        # Nobody is sent more frames than were encoded, there is no per client queue to catch up from
+        assert viewer.frames <= ten * viewer.seconds + 2
+
+def test_slow_viewer_skips_frames(make_dashcam):
+    dashcam = make_dashcam()
+    dashcam.start_streaming()
+    server = serve(dashcam)
+    try:
+        fast, _ = watch(dashcam, server.effective_port, 1, 1)
+        rate, (slow,) = watch(dashcam, server.effective_port, 1, 4, pause=0.25)
+    finally:
+        server.close()
+
+    # It sees the latest frame every time it asks, the ones it was too slow for are dropped rather than queued
+    assert slow.frames <= slow.seconds / 0.25 + 20
+    assert dashcam.mjpegstreamer.frames_skipped.value > 0
+    assert rate >= 0.8 * fast
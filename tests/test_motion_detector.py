@@ -0,0 +1,74 @@
+from dashcam.parking.motion_detector import MotionDetector, load_frames, write_frames
+import numpy as np
+import pytest
+
+# Dashcam's default parking settings, over a 320x240 lores stream
+SETTINGS = {'downscale': 8, 'taps': 2, 'pixel_threshold': 12, 'motion_fraction': 0.01, 'motion_checks': 2}
+WIDTH, HEIGHT = 320, 240
+CHECKS = 40
+
+def record(path, scene) -> list:
+    # Generates a parked camera's frames, one per check, saves them and hands back what was read back
+    # from disk, so every test runs on a recorded sequence the way the benchmark does
+    generator = np.random.default_rng(1)
+    street = np.clip(np.linspace(60, 160, WIDTH)[None, :] + generator.normal(0, 25, (HEIGHT, WIDTH)), 0, 255)
+    frames = []
+    for number in range(CHECKS):
+        frame = street.copy()
+        scene(frame, number)
+        frame += generator.normal(0, 3, frame.shape)
+        frames.append(np.clip(frame, 0, 255))
+    write_frames(str(path), frames)
+    return load_frames(str(path))
+
+def detect(frames) -> list:
+    detector = MotionDetector(SETTINGS)
+    return [number for number, frame in enumerate(frames) if detector.check(frame)]
+
+def still(frame, number) -> None:
+    pass
+
+def exposure_steps(frame, number) -> None:
+    # The exposure stepping up every ten checks, and the street dimming as it goes
+    frame *= 1.1 ** (number // 10) * (1 - 0.005 * number)
+
+def headlights(frame, number) -> None:
+    # The whole frame lit up for one check
+    if number == 20:
+        frame += 40
+
+def streetlight(frame, number) -> None:
+    # A light coming on over part of the frame and staying on, which changes one check and no more
+    if number >= 20:
+        frame[60:180, 80:240] += 60
+
+def walker(frame, number) -> None:
+    # A dark figure crossing the frame from check 10 to 30, a sixteenth of it wide and a third of it tall
+    if 10 <= number < 30:
+        left = (number - 10) * WIDTH // 20
+        frame[HEIGHT // 2:HEIGHT // 2 + HEIGHT // 3, left:left + WIDTH // 16] = 20
+
+@pytest.mark.parametrize('scene', [still, exposure_steps, headlights, streetlight])
+def test_no_motion(tmp_path, scene):
+    frames = record(tmp_path / 'parked.npy', scene)
+    assert frames.shape == (CHECKS, HEIGHT, WIDTH)
+    assert detect(frames) == []
+
+def test_motion(tmp_path):
+    detections = detect(record(tmp_path / 'parked.npy', walker))
+    # From the second check they are in view until the check after they have gone
+    assert detections == list(range(11, 31))
+
+def test_starts_again_after_reset(tmp_path):
+    frames = record(tmp_path / 'parked.npy', walker)
+    detector = MotionDetector(SETTINGS)
+    assert [detector.check(frame) for frame in frames[:13]][-1]
+    # After the camera has been off the first frame only sets what the next is compared with
+    detector.reset()
+    assert [detector.check(frame) for frame in frames[13:16]] == [False, False, True]
+
+def test_only_recorded_frames_load(tmp_path):
+    path = str(tmp_path / 'colour.npy')
+    np.save(path, np.zeros((2, HEIGHT, WIDTH, 3), dtype=np.uint8))
+    with pytest.raises(ValueError):
+        load_frames(path)
@@ -0,0 +1,138 @@
+from dashcam.quality.quality_controller import QualityController
+from conftest import wait_for
+import time
+
+class Conditions():
+    # The card's speed and the SoC's temperature, set by the test as it goes
+    def __init__(self) -> None:
+        self.card_rate = None  # bytes a second, None for as fast as it goes
+        self.temperature = 50.0
+
+def slow_card(filestreamer, conditions: Conditions) -> None:
+    # Every clip FileStreamer opens from here on writes at conditions.card_rate
+    create = filestreamer.output.output_factory
+
+    def create_slow(path: str):
+        output = create(path)
+        write = output._write
+
+        def slow_write(data) -> None:
+            write(data)
+            if conditions.card_rate is not None:
+                time.sleep(len(data) / conditions.card_rate)
+        output._write = slow_write
+        return output
+    filestreamer.output.output_factory = create_slow
+
+def control(dashcam, conditions: Conditions, **settings) -> QualityController:
+    settings = dict(dashcam.settings['quality'], interval=0.2, up_after=5, **settings)
+    quality = QualityController(dashcam, settings, read_temperature=lambda: conditions.temperature, read_throttled=lambda bit: 0)
+    dashcam.quality = quality
+    quality.start()
+    return quality
+
+# Stepping back up waits for the next clip
+SETTINGS = {'recording': {'clip_duration': 5}}
+
+def test_steps_down_when_the_card_falls_behind(make_dashcam):
+    dashcam = make_dashcam(SETTINGS)
+    filestreamer = dashcam.filestreamer
+    conditions = Conditions()
+    slow_card(filestreamer, conditions)
+    bitrate = dashcam.settings['recording']['bitrate']
+    dashcam.start_recording()
+    assert wait_for(lambda: filestreamer.clip_start is not None)
+    quality = control(dashcam, conditions)
+
+    # Around a second of video in each fragment, taking most of another second to write
+    conditions.card_rate = bitrate / 8 / 0.8
+    assert wait_for(lambda: quality.level >= 1, 15)
+    assert 'write_seconds' in quality.changes[0]['reason']
+    # The clip is cut short and the next one is recorded at the lower bitrate
+    assert wait_for(lambda: not filestreamer.pending_settings and filestreamer.settings['bitrate'] < bitrate)
+    assert filestreamer.encoder.bitrate == filestreamer.settings['bitrate']
+
+    # Back up once the card keeps up again
+    conditions.card_rate = None
+    assert wait_for(lambda: quality.level == 0, 20)
+    assert wait_for(lambda: filestreamer.settings['bitrate'] == bitrate)
+    dashcam.stop_recording()
+    filestreamer.thread.join()
+
+    # Recording never stopped for any of it
+    output = filestreamer.output
+    assert output.frames_written + output.frames_dropped == output.frames_received
+    assert output.frames_dropped < dashcam.source.fps
+    clips = dashcam.index.list()
+    # The first cut short by the step down, the next at the lower bitrate, however many more after
+    assert len(clips) >= 2
+    assert all(clip['duration'] for clip in clips)
+
+def test_steps_down_when_hot_with_hysteresis(make_dashcam):
+    dashcam = make_dashcam(SETTINGS)
+    filestreamer = dashcam.filestreamer
+    conditions = Conditions()
+    dashcam.start_recording()
+    assert wait_for(lambda: filestreamer.clip_start is not None)
+    quality = control(dashcam, conditions)
+    settings = quality.settings
+
+    conditions.temperature = settings['temperature_high'] + 5
+    assert wait_for(lambda: quality.level == 1)
+    assert quality.changes[-1]['reason'] == 'temperature'
+    assert wait_for(lambda: quality.level == 2)
+
+    # Between the marks it stays where it is, whichever way it was going
+    conditions.temperature = (settings['temperature_high'] + settings['temperature_low']) / 2
+    time.sleep((settings['up_after'] + settings['down_after'] + 2) * settings['interval'])
+    assert quality.level == 2
+
+    conditions.temperature = settings['temperature_low'] - 5
+    assert wait_for(lambda: quality.level == 0, 20)
+    assert [change['to'] for change in quality.changes] == [1, 2, 1, 0]
+    quality.stop()
+
+def test_settings_changes_keep_the_level(make_dashcam):
+    dashcam = make_dashcam()
+    quality = QualityController(dashcam, dashcam.settings['quality'], read_temperature=lambda: 50.0, read_throttled=lambda bit: 0)
+    dashcam.quality = quality
+    filestreamer = dashcam.filestreamer
+    quality._set_level(2, 'temperature')
+    assert filestreamer.settings['bitrate'] == int(dashcam.settings['recording']['bitrate'] * 0.6)
+
+    # A new bitrate goes out at the level's share of it, not undoing the step down
+    dashcam.start_recording()
+    assert wait_for(lambda: filestreamer.clip_start is not None)
+    assert dashcam.update_settings({'recording': {'bitrate': 3000000}})[1] == 200
+    assert filestreamer.settings['bitrate'] == filestreamer.encoder.bitrate == 1800000
+    dashcam.stop_recording()
+    filestreamer.thread.join()
+
+    # Down to one level, which it is now on, at that level's settings
+    levels = dashcam.settings['quality']['levels']
+    assert dashcam.update_settings({'quality': {'levels': levels[:1]}})[1] == 200
+    assert quality.level == 0
+    assert dashcam.get_quality_status()[0]['current']['bitrate'] == 3000000
+    assert filestreamer.settings['bitrate'] == 3000000
+    assert dashcam.mjpegstreamer.frame_skip == 0
+
+    message, status = dashcam.update_settings({'quality': {'levels': []}})
+    assert status == 400
+    assert message['message'] == "quality.levels can't be empty"
+
+def test_steps_down_past_other_settings_waiting_for_the_next_clip(make_dashcam):
+    dashcam = make_dashcam(SETTINGS)
+    filestreamer = dashcam.filestreamer
+    conditions = Conditions()
+    dashcam.start_recording()
+    assert wait_for(lambda: filestreamer.clip_start is not None)
+    # Waiting for a clip boundary that is most of an hour away
+    filestreamer.clip_duration = 3600
+    filestreamer.queue_settings({'clip_duration': 3000})
+    quality = control(dashcam, conditions)
+
+    conditions.temperature = quality.settings['temperature_high'] + 5
+    assert wait_for(lambda: quality.level == 2, 5)
+    assert filestreamer.settings['bitrate'] == int(dashcam.settings['recording']['bitrate'] * 0.6)
+    assert filestreamer.clip_duration == 3000
+    quality.stop()
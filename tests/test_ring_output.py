@@ -0,0 +1,55 @@
+from dashcam.outputs.ring_output import RingOutput
+import time
+
+class SlowOutput():
+    # A clip on a slow card, frames are only read some time after they are handed over
+    def __init__(self, delay: float) -> None:
+        self.delay = delay
+        self.frames = []
+        self.stopped = False
+
+    def start(self) -> None:
+        pass
+
+    def stop(self) -> None:
+        self.stopped = True
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, packet=None, audio=False):
+        time.sleep(self.delay)
+        self.frames.append(bytes(frame))
+
+def frame(number: int) -> bytes:
+    return bytes([number % 256]) * 1000
+
+def test_snapshot_covers_before_and_after_the_trigger():
+    ring = RingOutput(100000)
+    ring.start()
+    for number in range(30):
+        ring.outputframe(frame(number), number % 10 == 0, number * 100000)
+    output = SlowOutput(0)
+    thread = ring.snapshot(output, 1.5, 0.5)
+    for number in range(30, 60):
+        ring.outputframe(frame(number), number % 10 == 0, number * 100000)
+    ring.stop()
+    thread.join()
+
+    # From the keyframe at least 1.5s before the last frame to 0.5s after it
+    assert output.frames == [frame(number) for number in range(10, 35)]
+    assert output.stopped
+
+def test_restart_leaves_a_draining_snapshot_intact():
+    ring = RingOutput(50000)
+    ring.start()
+    for number in range(40):
+        ring.outputframe(frame(number), number % 10 == 0, number * 100000)
+    output = SlowOutput(0.01)
+    thread = ring.snapshot(output, 3, 0)
+    # The encoder is stopped and started again, parking handing over to recording, while the snapshot is being written
+    ring.stop()
+    ring.start()
+    for number in range(100, 160):
+        ring.outputframe(frame(number), number % 10 == 0, number * 100000)
+    thread.join()
+
+    assert output.frames == [frame(number) for number in range(0, 40)]
+    assert ring.frames[0][4] >= 100 * 100000
@@ -0,0 +1,83 @@
+from dashcam.sensors.sensor_monitor import SensorMonitor
+from dashcam.sensors.imu_source import ImuSource
+from conftest import wait_for
+import numpy as np
+import time
+
+SETTINGS = {'poll_interval': 0.02, 'max_poll_interval': 0.4, 'cpu_budget': 1.0, 'history': 5, 'smoothing': 0.02,
+            'peak_g': 3.0, 'jerk': 200, 'cooldown': 10}
+
+class FlakySource(ImuSource):
+    '''
+    At rest at 1g, with the bus failing on the reads and starts it is told to and an impact on request.
+    '''
+    def __init__(self) -> None:
+        super().__init__(200)
+        self.failing_reads = 0
+        self.failing_starts = 0
+        self.impact = False
+        self.starts = 0
+        self.last = None
+
+    def start(self) -> None:
+        if self.failing_starts:
+            self.failing_starts -= 1
+            raise OSError(121, 'Remote I/O error')
+        self.starts += 1
+        self.last = time.monotonic()
+
+    def stop(self) -> None:
+        self.last = None
+
+    def read(self):
+        if self.last is None:
+            raise OSError(9, 'Bad file descriptor')
+        if self.failing_reads:
+            self.failing_reads -= 1
+            raise OSError(5, 'Input/output error')
+        now = time.monotonic()
+        count = int((now - self.last) * self.sample_rate)
+        self.last += count / self.sample_rate
+        samples = np.zeros((count, 4))
+        samples[:, 0] = self.last - np.arange(count - 1, -1, -1) / self.sample_rate
+        samples[:, 3] = 1.0
+        if self.impact and count:
+            samples[:, 1] = 6.0
+            self.impact = False
+        return samples
+
+def test_keeps_detecting_after_the_bus_fails(monkeypatch):
+    monkeypatch.setattr('dashcam.sensors.sensor_monitor.RESTART_INTERVAL', 0.05)
+    detections = []
+    source = FlakySource()
+    monitor = SensorMonitor(source, dict(SETTINGS), detections.append)
+    monitor.start()
+    try:
+        assert wait_for(lambda: monitor.samples > 100)
+        # A few failed reads, then the sensor doesn't come back on the first two tries either
+        source.failing_reads = 3
+        source.failing_starts = 2
+        assert wait_for(lambda: source.starts == 4 and monitor.samples > 200)
+        source.impact = True
+        assert wait_for(lambda: detections)
+    finally:
+        monitor.stop()
+
+    status = monitor.get_status()
+    # Each failed read restarts the sensor, the first restart takes three goes
+    assert status['read_errors'] == 5
+    assert status['restarts'] == 5
+    assert len(detections) == 1
+
+def test_starts_once_the_sensor_answers(monkeypatch):
+    monkeypatch.setattr('dashcam.sensors.sensor_monitor.RESTART_INTERVAL', 0.05)
+    source = FlakySource()
+    source.failing_starts = 3
+    monitor = SensorMonitor(source, dict(SETTINGS), lambda timestamp: None)
+    monitor.start()
+    try:
+        assert wait_for(lambda: monitor.samples > 0)
+    finally:
+        monitor.stop()
+    assert monitor.read_errors == 3
+    assert source.starts == 1
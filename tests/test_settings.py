@@ -0,0 +1,78 @@
+from dashcam.config.config import Config
+from conftest import wait_for
+import pytest
+import json
+
+SAVED = {
+    'recording': {'bitrate': 99, 'clip_duration': 60},
+    'upload': {'bucket': 'car', 'access_key': 'AKID', 'secret_key': 'SECRET'},
+    'lens': 'wide',
+}
+
+def test_bad_saved_settings_are_left_out_one_by_one(make_dashcam):
+    dashcam = make_dashcam(SAVED)
+    assert dashcam.config.load_errors == ['recording.bitrate should be between 100000 and 25000000', 'lens is not a setting']
+    assert dashcam.settings['recording']['bitrate'] == dashcam.config.defaults['recording']['bitrate']
+    assert dashcam.settings['recording']['clip_duration'] == 60
+    assert dashcam.settings['upload']['bucket'] == 'car'
+
+    # Saving again keeps everything that was set, and only that
+    assert dashcam.update_settings({'recording': {'event_pre_seconds': 3}})[1] == 200
+    with open('dashcam.json') as f:
+        saved = json.load(f)
+    assert saved['recording'] == {'resolution': [320, 240], 'pre_event_buffer': 2 * 1024 * 1024, 'clip_duration': 60, 'event_pre_seconds': 3}
+    assert saved['upload'] == SAVED['upload']
+    assert 'lens' not in saved
+
+def test_unreadable_settings_are_never_saved_over(make_dashcam, tmp_path):
+    defaults = make_dashcam().config.defaults
+    path = str(tmp_path / 'cut_off.json')
+    cut_off = json.dumps(SAVED)[:-10]
+    with open(path, 'w') as f:
+        f.write(cut_off)
+    config = Config(defaults, path)
+    with pytest.raises(ValueError):
+        config.load()
+
+    # Taken on, but the file still has everything that was in it for the next start to try again
+    assert config.set(config.updated({'recording': {'clip_duration': 60}})) is False
+    assert config.values['recording']['clip_duration'] == 60
+    with open(path) as f:
+        assert f.read() == cut_off
+
+def test_masked_secrets_posted_back_are_kept(make_dashcam):
+    dashcam = make_dashcam(SAVED)
+    public = dashcam.get_settings()[0]
+    assert public['upload']['secret_key'] == '********'
+
+    # The whole page of settings sent back with one change
+    public['upload']['bucket'] = 'van'
+    message, status = dashcam.update_settings(public)
+    assert status == 200
+    assert [change['setting'] for change in message['changes']] == ['upload.bucket']
+    with open('dashcam.json') as f:
+        upload = json.load(f)['upload']
+    assert (upload['access_key'], upload['secret_key']) == ('AKID', 'SECRET')
+
+def test_reconfigure_gives_up_on_a_stuck_encoder(make_dashcam, monkeypatch):
+    monkeypatch.setattr('dashcam.dashcam.ENCODER_RELEASE_TIMEOUT', 0.5)
+    dashcam = make_dashcam()
+    filestreamer = dashcam.filestreamer
+    dashcam.start_recording()
+    assert wait_for(lambda: filestreamer.clip_start is not None)
+    # A thumbnail grab that never lets go
+    dashcam.mjpegstreamer._acquire_encoder()
+
+    message, status = dashcam.update_settings({'recording': {'resolution': [640, 480], 'event_pre_seconds': 3}})
+    assert status == 503
+    assert [change['setting'] for change in message['changes']] == ['recording.event_pre_seconds']
+    # Recording again as it was, with only what could be applied saved
+    assert dashcam.settings['recording']['resolution'] == (320, 240)
+    assert wait_for(lambda: filestreamer.is_streaming and filestreamer.clip_start is not None)
+    with open('dashcam.json') as f:
+        saved = json.load(f)['recording']
+    assert (saved['resolution'], saved['event_pre_seconds']) == ([320, 240], 3)
+
+    dashcam.mjpegstreamer._release_encoder()
+    assert dashcam.update_settings({'recording': {'resolution': [640, 480]}})[1] == 200
+    assert dashcam.settings['recording']['resolution'] == (640, 480)
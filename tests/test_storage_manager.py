@@ -0,0 +1,100 @@
+from dashcam.storage.recording_index import RecordingIndex, SIDECAR_EXTENSIONS
+from dashcam.storage.storage_manager import StorageManager
+import tempfile
+import pytest
+import shutil
+import time
+import os
+
+CLIP_BYTES = 256 * 1024
+
+@pytest.fixture
+def directory(tmp_path):
+    # tmpfs, where deleting a clip frees its space straight away the way it would on the card
+    if not os.path.isdir('/dev/shm'):
+        yield str(tmp_path)
+        return
+    path = tempfile.mkdtemp(prefix='dashcam-test-', dir='/dev/shm')
+    yield path
+    shutil.rmtree(path, ignore_errors=True)
+
+def make_clips(directory: str, count: int, locked: tuple = ()) -> list:
+    # A minute apart, oldest first, each with a file of every kind that goes with it
+    started = time.time() - count * 60
+    names = []
+    for number in range(count):
+        name = f"dashcam_{time.strftime('%Y%m%d-%H%M%S', time.localtime(started + number * 60))}.mp4"
+        path = os.path.join(directory, name)
+        with open(path, 'wb') as f:
+            f.write(os.urandom(CLIP_BYTES))
+        for extension in SIDECAR_EXTENSIONS:
+            with open(path + extension, 'wb') as f:
+                f.write(b'sidecar')
+        if number in locked:
+            os.chmod(path, 0o444)
+        names.append(name)
+    return names
+
+def manage(directory: str, **settings) -> tuple:
+    index = RecordingIndex(directory)
+    settings = dict({'min_free_bytes': 0, 'max_used_bytes': 0, 'batch_size': 3, 'delete_interval': 0.02,
+                     'check_interval': 0.05, 'evict_uploaded_first': True}, **settings)
+    return index, StorageManager(index, settings)
+
+def wait_until_within_budget(manager) -> None:
+    deadline = time.monotonic() + 10
+    while manager._over_budget() and manager.evictable and time.monotonic() < deadline:
+        time.sleep(0.02)
+    manager.stop()
+
+def test_evicts_oldest_unlocked_clips_down_to_the_budget(directory):
+    names = make_clips(directory, 12, locked=(0, 2))
+    index, manager = manage(directory, max_used_bytes=6 * CLIP_BYTES)
+    manager.start()
+    wait_until_within_budget(manager)
+
+    remaining = sorted(os.listdir(directory))
+    assert index.total_size <= 6 * CLIP_BYTES
+    assert manager.deleted_files == 6
+    # Locked clips stay however old they are, the oldest of the rest go first, along with their sidecars
+    deleted = [name for name in names if name not in remaining]
+    assert deleted == [names[number] for number in (1, 3, 4, 5, 6, 7)]
+    for name in deleted:
+        assert not any(file.startswith(name) for file in remaining)
+    assert names[0] in remaining and names[2] in remaining
+    assert {clip['name'] for clip in index.list()} == set(names) - set(deleted)
+
+def test_uploaded_clips_go_first(directory):
+    names = make_clips(directory, 8)
+    index, manager = manage(directory, max_used_bytes=6 * CLIP_BYTES)
+    for name in names[5:]:
+        index.set_uploaded(name, time.time())
+    manager.start()
+    wait_until_within_budget(manager)
+
+    assert [name for name in names if index.get(name) is None] == names[5:7]
+
+def test_keeps_free_space_on_the_filesystem(directory):
+    make_clips(directory, 10)
+    index, manager = manage(directory)
+    # Asks for more free space than there is, by three clips and a bit
+    manager.settings['min_free_bytes'] = manager._free_bytes() + 3 * CLIP_BYTES + CLIP_BYTES // 2
+    started = time.monotonic()
+    manager.start()
+    wait_until_within_budget(manager)
+
+    assert manager._free_bytes() >= manager.settings['min_free_bytes']
+    assert manager.deleted_files == 4
+    # Paced rather than all at once, the card has clips to write at the same time
+    assert time.monotonic() - started >= 3 * manager.settings['delete_interval']
+
+def test_stops_at_locked_clips(directory):
+    names = make_clips(directory, 4, locked=(0, 1, 2, 3))
+    index, manager = manage(directory, max_used_bytes=CLIP_BYTES)
+    manager.start()
+    wait_until_within_budget(manager)
+
+    status = manager.get_status()
+    assert status['over_budget'] and not status['evictable']
+    assert status['deleted_files'] == 0
+    assert all(name in os.listdir(directory) for name in names)
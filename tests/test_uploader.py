@@ -0,0 +1,32 @@
+from dashcam.storage.recording_index import RecordingIndex
+from conftest import wait_for
+import time
+import os
+
+def test_throttled_only_while_someone_is_watching(make_dashcam):
+    os.makedirs('nas')
+    dashcam = make_dashcam({'upload': {'enabled': True, 'target': 'directory', 'directory': 'nas'}})
+    dashcam.start_streaming()
+    assert wait_for(lambda: dashcam.mjpegstreamer.is_streaming)
+    # Streaming runs from boot, on its own that doesn't slow uploads down
+    assert not dashcam.uploader.is_watched()
+
+    viewer = dashcam.stream_frames()
+    next(viewer)
+    assert dashcam.uploader.is_watched()
+    viewer.close()
+    assert not dashcam.uploader.is_watched()
+
+def test_oldest_uploaded_first_walks_the_index(tmp_path):
+    index = RecordingIndex(str(tmp_path))
+    for number in range(6):
+        name = f"dashcam_{number:06d}.mp4"
+        index.open_clip(name, number * 180.0)
+        index.close_clip(name, number * 180.0 + 180, 1000, 180)
+        if number in (2, 4):
+            index.set_uploaded(name, time.time())
+
+    names = [clip['name'] for clip in index.oldest(4, uploaded_first=True)]
+    assert names == ['dashcam_000002.mp4', 'dashcam_000004.mp4', 'dashcam_000000.mp4', 'dashcam_000001.mp4']
+    assert [clip['name'] for clip in index.oldest(1, uploaded_first=True)] == ['dashcam_000002.mp4']
+    assert len(index.oldest(10, uploaded_first=True)) == 6